@@ -0,0 +1,65 @@
+""" Benchmark of conditional GETs for a polling monitor
+
+A monitor polls the list of patient ids and the summary of the selected
+patient every cycle, through the gui_client functions, while new uploads
+arrive every few cycles. The ETag cache of gui_client turns unchanged
+responses into empty 304 responses. Images never change and are not
+revalidated, so they are left out.
+
+Run from the repository root:
+    python -m benchmarks.bench_conditional_get
+"""
+import base64
+import json
+import os
+import tempfile
+
+from benchmarks import local_server, mongo_standin
+import blob_store
+import cloud_server
+import gui_client
+
+PATIENTS = 20
+CYCLES = 100
+UPLOAD_EVERY = 10
+IMAGE_BYTES = 30000
+
+
+def upload(patient_id):
+    image = str(base64.b64encode(os.urandom(IMAGE_BYTES)), encoding="utf-8")
+    cloud_server.new_patient_driver({"Rec_No": str(patient_id),
+                                     "Name": "Bench", "ECG": image,
+                                     "Heart_Rate": 72})
+
+
+def poll(patient_id):
+    json.loads(gui_client.retrieve_all_patients())
+    json.loads(
+        gui_client.retrieve_patient_summary_from_server(str(patient_id)))
+
+
+def main():
+    mongo_standin.install()
+    cloud_server.patient_store = cloud_server.mongo_patient_store()
+    cloud_server.image_store = blob_store.FileBlobStore(tempfile.mkdtemp())
+    for patient_id in range(1, PATIENTS + 1):
+        upload(patient_id)
+    url, server = local_server.start(cloud_server.app)
+    gui_client.configure(url)
+    gui_client.reset_cache_stats()
+    for cycle in range(CYCLES):
+        if cycle % UPLOAD_EVERY == 0:
+            upload(1)
+        poll(1)
+    server.shutdown()
+    stats = gui_client.cache_stats
+    requests = stats["hits"] + stats["misses"]
+    print("{} polling cycles of 2 requests, one new upload every {} cycles"
+          .format(CYCLES, UPLOAD_EVERY))
+    print("cache hit rate:         {:.1%}".format(stats["hits"] / requests))
+    print("bytes saved per cycle:  {:.0f}".format(stats["bytes_saved"]
+                                                  / CYCLES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+""" Benchmark of refreshing the dashboard of the patient monitor
+
+A dashboard shows the latest heart rate and ECG image of 200 patients
+with 50 uploads each. Refreshes it through the cloud server on a local
+port, with the pooled client of gui_client, and compares:
+- one /get_patient_info request per patient, as the monitor retrieves
+  a single patient;
+- one /get_patient_summary request per patient;
+- a single /get_patient_summaries request, as the dashboard does, first
+  downloaded and then revalidated with its ETag while nothing changed.
+Reports the time of a refresh and the bytes received, for the memory,
+SQLite and MongoDB patient stores (the MongoDB store runs against the
+mongomock stand-in, much slower than a real server). Then reports the
+time to select the tiles to redraw when 5 of the 200 patients changed.
+
+Run from the repository root:
+    python -m benchmarks.bench_dashboard
+"""
+import base64
+import json
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks import local_server, mongo_standin
+import blob_store
+import cloud_server
+import gui_client
+from monitoring_gui import DASHBOARD_FIELDS, select_changed_summaries
+import record_store
+
+PATIENTS = 200
+UPLOADS = 50
+IMAGE_BYTES = 2000
+REPEATS = 3
+
+
+def load_patients():
+    cloud_server.invalidate_patient_id_cache()
+    image = str(base64.b64encode(os.urandom(IMAGE_BYTES)), encoding="utf-8")
+    for patient_id in range(1, PATIENTS + 1):
+        for upload in range(UPLOADS):
+            cloud_server.new_patient_driver({
+                "Rec_No": str(patient_id), "Name": "Bench",
+                "Heart_Rate": 60 + upload, "ECG": image})
+
+
+def per_patient(route):
+    def refresh():
+        received = 0
+        for patient_id in range(1, PATIENTS + 1):
+            r = gui_client.client.get(route + str(patient_id))
+            received += len(r.content)
+        return received
+    return refresh
+
+
+def batch(revalidate):
+    def refresh():
+        if revalidate is False:
+            gui_client.response_cache.clear()
+        gui_client.reset_cache_stats()
+        summaries = gui_client.retrieve_patient_summaries(
+            list(range(1, PATIENTS + 1)), DASHBOARD_FIELDS)
+        if revalidate:
+            return 0
+        return len(summaries)
+    return refresh
+
+
+def best_time(refresh):
+    refresh()
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        received = refresh()
+        times.append(time.perf_counter() - start)
+    return min(times), received
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    cloud_server.image_store = blob_store.FileBlobStore(tempfile.mkdtemp())
+    url, server = local_server.start(cloud_server.app)
+    gui_client.configure(url)
+    directory = tempfile.mkdtemp()
+    paths = [("get_patient_info x{}".format(PATIENTS),
+              per_patient("/get_patient_info/")),
+             ("get_patient_summary x{}".format(PATIENTS),
+              per_patient("/get_patient_summary/")),
+             ("get_patient_summaries", batch(False)),
+             ("  revalidated (304)", batch(True))]
+    print("{} patients with {} uploads each".format(PATIENTS, UPLOADS))
+    print("{:<20}{:<28}{:>12}{:>14}".format("store", "requests", "refresh ms",
+                                            "KiB received"))
+    for label in ["memory", "sqlite", "mongo (mongomock)"]:
+        if label == "memory":
+            store = record_store.MemoryPatientStore()
+        elif label == "sqlite":
+            store = record_store.SQLitePatientStore(
+                os.path.join(directory, "patients.sqlite"))
+        else:
+            mongo_standin.install()
+            store = cloud_server.mongo_patient_store()
+        cloud_server.patient_store = store
+        load_patients()
+        for path, refresh in paths:
+            elapsed, received = best_time(refresh)
+            print("{:<20}{:<28}{:>12.1f}{:>14.1f}".format(
+                label, path, elapsed * 1000, received / 1024))
+    summaries = json.loads(gui_client.retrieve_patient_summaries(
+        list(range(1, PATIENTS + 1)), DASHBOARD_FIELDS))["patients"]
+    shown_revisions = {}
+    select_changed_summaries(summaries, shown_revisions)
+    for summary in summaries[:5]:
+        summary["Revision"] += 1
+    start = time.perf_counter()
+    changed = select_changed_summaries(summaries, shown_revisions)
+    elapsed = time.perf_counter() - start
+    print()
+    print("tiles to redraw: {} of {}, selected in {:.3f} ms".format(
+        len(changed), len(summaries), elapsed * 1000))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
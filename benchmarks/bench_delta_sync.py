@@ -0,0 +1,62 @@
+""" Benchmark of server egress for monitors polling a patient
+
+Simulates monitors polling a patient with 500 uploads every cycle while
+new uploads arrive every few cycles, and compares the response bytes of
+re-downloading the whole patient with requesting only the changes since
+the last revision seen.
+
+Run from the repository root:
+    python -m benchmarks.bench_delta_sync
+"""
+import tempfile
+
+from benchmarks import mongo_standin
+import blob_store
+import cloud_server
+from gui_client import merge_patient_changes
+
+UPLOADS = 500
+CYCLES = 100
+UPLOAD_EVERY = 10
+
+
+def upload(i):
+    cloud_server.new_patient_driver({"Rec_No": "1", "Name": "Bench",
+                                     "ECG": "RUNH" + str(i % 10) * 4,
+                                     "Heart_Rate": 60 + i % 40})
+
+
+def main():
+    mongo_standin.install()
+    cloud_server.patient_store = cloud_server.mongo_patient_store()
+    cloud_server.image_store = blob_store.FileBlobStore(tempfile.mkdtemp())
+    for i in range(UPLOADS):
+        upload(i)
+    client = cloud_server.app.test_client()
+    full_bytes = 0
+    delta_bytes = 0
+    not_modified = 0
+    patient = client.get("/get_patient_info/1").get_json()
+    for cycle in range(CYCLES):
+        if cycle % UPLOAD_EVERY == 0:
+            upload(cycle)
+        full_bytes += len(client.get("/get_patient_info/1").data)
+        response = client.get("/get_patient_info/1?since={}"
+                              .format(patient["Revision"]))
+        delta_bytes += len(response.data)
+        if response.status_code == 304:
+            not_modified += 1
+        else:
+            patient = merge_patient_changes(patient, response.get_json())
+    full = client.get("/get_patient_info/1").get_json()
+    assert patient == full
+    print("{} polling cycles of a patient with {} uploads, one new upload "
+          "every {} cycles".format(CYCLES, UPLOADS, UPLOAD_EVERY))
+    print("full re-download: {:>10} bytes".format(full_bytes))
+    print("since revision:   {:>10} bytes ({} responses were 304)"
+          .format(delta_bytes, not_modified))
+    print("reduction:        {:>10.0f}x".format(full_bytes / delta_bytes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+""" Benchmark of the batch ECG analysis of ecg.py
+
+Analyzes a directory of synthetic 5-minute recordings with
+ecg.run_batch, first with one worker process and then with twice as many
+each time, up to the number of CPUs, and reports the files per second
+and the speedup over one worker.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_batch
+"""
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.bench_ecg_read import write_recording
+import ecg
+
+FILES = 200
+ROWS = 300 * 360
+
+
+def worker_counts():
+    counts = [1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != os.cpu_count():
+        counts.append(os.cpu_count())
+    return counts
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = []
+        for i in range(FILES):
+            filenames.append(os.path.join(directory, "{}.csv".format(i)))
+            write_recording(filenames[-1], ROWS)
+        output = os.path.join(directory, "metrics.jsonl")
+        print("{} files of {} rows, {} CPUs".format(FILES, ROWS,
+                                                    os.cpu_count()))
+        print("{:<10}{:>12}{:>10}".format("workers", "files/s", "speedup"))
+        single = None
+        for workers in worker_counts():
+            start = time.perf_counter()
+            ecg.run_batch(filenames, output, workers)
+            rate = FILES / (time.perf_counter() - start)
+            single = single or rate
+            print("{:<10}{:>12.1f}{:>10.2f}".format(workers, rate,
+                                                    rate / single))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+""" Benchmark of the accuracy and speed of ecg.when_beats
+
+Generates 10 minutes of synthetic ECG at 250, 500 and 1000 Hz with known
+beat times: the heart rate drifts between 50 and 160 bpm, the R wave
+amplitude between 0.4 and 1.6 mV, each beat has a T wave of a third of
+its R wave, and the signal has baseline wander and noise. The signal is
+filtered with ecg.process_data, then searched for beats with the
+original detector (fixed thresholds of 0.35 mV height and 0.6 mV
+prominence, 150 samples apart) and with ecg.when_beats. A detected beat
+within 50 ms of a true beat is a match.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_beats
+"""
+import time
+
+import numpy as np
+from scipy.signal import find_peaks
+
+import ecg
+
+SECONDS = 600
+SAMPLING_FREQUENCIES = [250, 500, 1000]
+TOLERANCE = 0.05
+
+
+def make_recording(sampling_frequency):
+    rng = np.random.default_rng(0)
+    t = np.arange(SECONDS * sampling_frequency) / sampling_frequency
+    beats = []
+    beat = 0.5
+    while beat < SECONDS - 0.5:
+        beats.append(beat)
+        rate = 105 + 55 * np.sin(2 * np.pi * beat / 240)
+        beat += 60 / rate * rng.uniform(0.95, 1.05)
+    beats = np.array(beats)
+    amplitudes = 1 + 0.6 * np.sin(2 * np.pi * beats / 170)
+    v = 0.3 * np.sin(2 * np.pi * 0.15 * t) \
+        + 0.03 * rng.standard_normal(len(t))
+    half = int(0.4 * sampling_frequency)
+    for beat, amplitude in zip(beats, amplitudes):
+        center = int(round(beat * sampling_frequency))
+        window = slice(max(center - half, 0), center + 2 * half)
+        s = t[window] - beat
+        v[window] += amplitude * (np.exp(-(s / 0.012) ** 2 / 2)
+                                  - 0.2 * np.exp(-((s + 0.03) / 0.01) ** 2)
+                                  - 0.25 * np.exp(-((s - 0.03) / 0.01) ** 2)
+                                  + 0.33 * np.exp(-((s - 0.28) / 0.05) ** 2))
+    return t, v, beats
+
+
+def legacy_when_beats(t, v):
+    """ The original detector, with thresholds in mV and samples """
+    peaks, _ = find_peaks(v, prominence=0.6, distance=150, height=0.35)
+    peak_times = [t[peak] for peak in peaks.tolist()]
+    if v[-1] > 0.35:
+        peak_times.append(t[-1])
+    return np.array(peak_times)
+
+
+def score(detected, expected):
+    index = np.clip(np.searchsorted(expected, detected), 1,
+                    len(expected) - 1)
+    nearest = np.minimum(np.abs(detected - expected[index - 1]),
+                         np.abs(detected - expected[index]))
+    matched = np.count_nonzero(nearest <= TOLERANCE)
+    return matched / len(expected), matched / max(len(detected), 1)
+
+
+def main():
+    print("{} s of signal, {} beats matched within {} ms".format(
+        SECONDS, "detected", int(TOLERANCE * 1000)))
+    print("{:<8}{:<22}{:>10}{:>14}{:>10}{:>10}".format(
+        "Hz", "detector", "beats", "sensitivity", "PPV", "ms"))
+    for sampling_frequency in SAMPLING_FREQUENCIES:
+        t, v, expected = make_recording(sampling_frequency)
+        filtered = ecg.process_data(v, sampling_frequency)
+        for label, detect in [
+                ("fixed (before)", lambda: legacy_when_beats(t, filtered)),
+                ("physiological", lambda: ecg.when_beats(
+                    t, filtered, sampling_frequency))]:
+            start = time.perf_counter()
+            detected = detect()
+            elapsed = time.perf_counter() - start
+            sensitivity, ppv = score(detected, expected)
+            print("{:<8}{:<22}{:>10}{:>14.1%}{:>10.1%}{:>10.1f}".format(
+                sampling_frequency, label, len(detected), sensitivity, ppv,
+                elapsed * 1000))
+        print("{:<8}{:<22}{:>10}".format("", "true beats", len(expected)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+""" Benchmark of the ECG result cache of ecg_cache
+
+Replays 100 selections of 10 synthetic 1-minute recordings in the
+patient portal, the most recent recordings being selected most often.
+Each selection plots the recording to a JPEG image and computes its
+heart rate like patient_gui.ECG_cmd, first without a cache, then with a
+cold ResultCache, then with a new ResultCache on the same directory as
+after a restart of the portal, whose memory tier is empty. Reports the
+mean and p95 time of a selection, and the hit rate and mean hit and
+compute latency of the cache.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_cache
+"""
+import io
+import logging
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from ecg import calc_hr
+from ecg_cache import ResultCache, signal_key
+
+RECORDINGS = 10
+SELECTIONS = 100
+SECONDS = 60
+SAMPLING_FREQUENCY = 360
+
+
+def make_recording(index):
+    t = np.arange(SECONDS * SAMPLING_FREQUENCY) / SAMPLING_FREQUENCY
+    rng = np.random.default_rng(index)
+    v = np.sin(2 * np.pi * 1.2 * t) ** 63 + 0.3 * np.sin(2 * np.pi * 0.2 * t) \
+        + 0.02 * rng.standard_normal(len(t))
+    return list(t), list(v)
+
+
+def render(time, voltage):
+    plt.clf()
+    plt.plot(time, voltage)
+    plt.xlabel('Time (s)')
+    plt.ylabel('Voltage (mV)')
+    image = io.BytesIO()
+    plt.savefig(image, format='jpg')
+    return image.getvalue()
+
+
+def select(recording, cache):
+    t, v = recording
+    if cache is None:
+        return render(t, v), calc_hr(t, v)
+    image = cache.get_or_compute(signal_key(t, v, "plot-jpg"),
+                                 lambda: render(t, v))
+    bpm = cache.get_or_compute_json(signal_key(t, v, "calc_hr"),
+                                    lambda: calc_hr(t, v))
+    return image, bpm
+
+
+def replay(recordings, order, cache):
+    times = []
+    for index in order:
+        start = time.perf_counter()
+        select(recordings[index], cache)
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    recordings = [make_recording(i) for i in range(RECORDINGS)]
+    rng = np.random.default_rng(0)
+    weights = 1 / np.arange(1, RECORDINGS + 1)
+    order = rng.choice(RECORDINGS, SELECTIONS, p=weights / weights.sum())
+    print("{} selections of {} recordings of {} s".format(
+        SELECTIONS, RECORDINGS, SECONDS))
+    print("{:<14}{:>10}{:>10}{:>10}{:>10}{:>12}".format(
+        "cache", "mean ms", "p95 ms", "hit rate", "hit ms", "compute ms"))
+    with tempfile.TemporaryDirectory() as directory:
+        runs = [("none", lambda: None),
+                ("cold", lambda: ResultCache(directory)),
+                ("restarted", lambda: ResultCache(directory))]
+        for label, make_cache in runs:
+            cache = make_cache()
+            times = replay(recordings, order, cache)
+            stats = cache.stats() if cache is not None else {
+                "hit_rate": 0, "hit_seconds": 0,
+                "compute_seconds": times.mean() / 1000}
+            print("{:<14}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.3f}{:>12.1f}"
+                  .format(label, times.mean(), np.percentile(times, 95),
+                          stats["hit_rate"], stats["hit_seconds"] * 1000,
+                          stats["compute_seconds"] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+""" Micro-benchmark of the bandpass filter of ecg.process_data
+
+Measures:
+- designing the filter on every call, as process_data used to, against
+  the cached design of ecg.bandpass_sos;
+- filtering 1M samples with the original filtfilt on (b, a)
+  coefficients, with second-order sections in float64 and in float32,
+  and the largest difference from the original output;
+- the same filters at order 4 with a narrower band at 1000 Hz, where the
+  (b, a) form loses precision and second-order sections do not.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_filter
+"""
+import timeit
+
+import numpy as np
+from scipy.signal import butter, filtfilt, sosfiltfilt
+
+import ecg
+
+SAMPLES = 1000000
+SAMPLING_FREQUENCY = 360
+
+
+def make_signal(samples, sampling_frequency):
+    t = np.arange(samples) / sampling_frequency
+    rng = np.random.default_rng(0)
+    return np.sin(2 * np.pi * 1.2 * t) ** 63 \
+        + 0.3 * np.sin(2 * np.pi * 0.2 * t) \
+        + 0.02 * rng.standard_normal(samples)
+
+
+def best_of(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def main():
+    design = best_of(lambda: butter(1, [1 / SAMPLING_FREQUENCY,
+                                        50 / SAMPLING_FREQUENCY],
+                                    'bandpass'), 1000)
+    cached = best_of(lambda: ecg.bandpass_sos(SAMPLING_FREQUENCY), 100000)
+    print("filter design per call")
+    print("  {:<30}{:>10.2f} us".format("butter (before)", design * 1e6))
+    print("  {:<30}{:>10.2f} us".format("cached", cached * 1e6))
+
+    voltage = make_signal(SAMPLES, SAMPLING_FREQUENCY)
+    voltage32 = voltage.astype(np.float32)
+    expected = ecg.process_data(voltage, SAMPLING_FREQUENCY, method='ba')
+    print("process_data on {} samples".format(SAMPLES))
+    print("  {:<30}{:>10}{:>20}".format("", "ms", "max difference"))
+    for label, method, signal in [("filtfilt (b, a) (before)", 'ba',
+                                   voltage),
+                                  ("sos float64", 'sos', voltage),
+                                  ("sos float32", 'sos', voltage32)]:
+        elapsed = best_of(lambda: ecg.process_data(signal, SAMPLING_FREQUENCY,
+                                                   method), 3)
+        y = ecg.process_data(signal, SAMPLING_FREQUENCY, method)
+        print("  {:<30}{:>10.1f}{:>20.2e}".format(
+            label, elapsed * 1000, np.max(np.abs(y - expected))))
+
+    print("order 4, 0.05-40 Hz at 1000 Hz, compared with sos in float64")
+    voltage = make_signal(SAMPLES // 10, 1000)
+    b, a = ecg.bandpass_coefficients(1000, (0.05, 40), 4)
+    sos, zi = ecg.bandpass_sos(1000, (0.05, 40), 4)
+    reference = sosfiltfilt(sos, voltage)
+    difference = np.max(np.abs(filtfilt(b, a, voltage) - reference))
+    print("  {:<30}{:>20.2e}".format("filtfilt (b, a)", difference))
+
+
+if __name__ == "__main__":
+    main()
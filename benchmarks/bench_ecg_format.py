@@ -0,0 +1,91 @@
+""" Benchmark of the binary ECG container of ecg_format
+
+Writes 6 hours of a synthetic 360 Hz recording as csv and as a binary
+container in each encoding, and reports for each file:
+- its size on disk;
+- the time to read the whole recording, with ecg.readFile for the csv
+  file and ecg.read_recording for the containers;
+- the time to read a 10 second slice from the middle, which needs the
+  whole csv file to be parsed, but only the samples of the slice from a
+  container.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_format
+"""
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import ecg
+import ecg_format
+
+SECONDS = 6 * 60 * 60
+SAMPLING_FREQUENCY = 360
+SLICE_SECONDS = 10
+
+
+def make_signal():
+    t = np.arange(SECONDS * SAMPLING_FREQUENCY) / SAMPLING_FREQUENCY
+    rng = np.random.default_rng(0)
+    v = np.sin(2 * np.pi * 1.2 * t) ** 63 + 0.3 * np.sin(2 * np.pi * 0.2 * t) \
+        + 0.02 * rng.standard_normal(len(t))
+    return t, v
+
+
+def elapsed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def read_csv_slice(filename, start, end):
+    t, v, sampling_frequency = ecg.readFile(filename)
+    selected = (t >= start) & (t <= end)
+    return t[selected], v[selected]
+
+
+def read_container_slice(filename, start, end):
+    with ecg_format.open_recording(filename) as recording:
+        return recording.time_slice(start, end)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    t, v = make_signal()
+    start = SECONDS / 2
+    end = start + SLICE_SECONDS
+    print("{} h at {} Hz, slices of {} s".format(
+        SECONDS // 3600, SAMPLING_FREQUENCY, SLICE_SECONDS))
+    print("{:<14}{:>12}{:>14}{:>14}".format("file", "MiB", "read all s",
+                                            "slice ms"))
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "ecg.csv")
+        with open(filename, "w") as out_file:
+            out_file.writelines("{:.6f},{:.5f}\n".format(ti, vi)
+                                for ti, vi in zip(t, v))
+        rows = [("csv (before)", filename,
+                 lambda: ecg.readFile(filename),
+                 lambda: read_csv_slice(filename, start, end))]
+        for encoding in ecg_format.ENCODINGS:
+            container = os.path.join(directory, encoding + ".ecgb")
+            ecg_format.save_recording(container, v, SAMPLING_FREQUENCY,
+                                      encoding=encoding)
+            rows.append((
+                encoding, container,
+                lambda container=container: np.asarray(
+                    ecg.read_recording(container)[1]).sum(),
+                lambda container=container: read_container_slice(
+                    container, start, end)))
+        for label, path, read_all, read_slice in rows:
+            # Parsing the csv file takes seconds, so it is only timed once
+            repeat = 1 if path == filename else 5
+            print("{:<14}{:>12.1f}{:>14.2f}{:>14.2f}".format(
+                label, os.path.getsize(path) / 2 ** 20, elapsed(read_all),
+                min(elapsed(read_slice) for _ in range(repeat)) * 1000))
+
+
+if __name__ == "__main__":
+    main()
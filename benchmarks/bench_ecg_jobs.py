@@ -0,0 +1,106 @@
+""" Benchmark of the ECG analysis job queue of cloud_server
+
+Uploads 10 synthetic 5-minute recordings, then posts a burst of 200 jobs
+for them to /ecg_jobs at once and waits for the workers to finish, with
+one worker process and then twice as many each time, up to the number of
+CPUs. Reports the jobs per second from the first post to the last
+result, and the queue latency (from queued to started) and total latency
+(from queued to finished) of the jobs.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_jobs
+"""
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_ecg_batch import worker_counts
+import blob_store
+import cloud_server
+import ecg_format
+import ecg_jobs
+import record_store
+
+RECORDINGS = 10
+JOBS = 200
+SECONDS = 300
+SAMPLING_FREQUENCY = 360
+
+
+def make_recording(directory, index):
+    t = np.arange(SECONDS * SAMPLING_FREQUENCY) / SAMPLING_FREQUENCY
+    rng = np.random.default_rng(index)
+    v = np.sin(2 * np.pi * 1.2 * t) ** 63 + 0.3 * np.sin(2 * np.pi * 0.2 * t) \
+        + 0.02 * rng.standard_normal(len(t))
+    filename = os.path.join(directory, "{}.ecgb".format(index))
+    ecg_format.save_recording(filename, v, SAMPLING_FREQUENCY)
+    with open(filename, "rb") as in_file:
+        recording_hash, size = cloud_server.image_store.put(in_file.read())
+    return recording_hash
+
+
+def percentile(values, q):
+    return np.percentile(values, q) * 1000
+
+
+def run_burst(client, queue, recordings, workers):
+    job_workers = ecg_jobs.JobWorkers(queue, cloud_server.load_recording,
+                                      cloud_server.store_ecg_metrics,
+                                      workers)
+    job_workers.start()
+    cloud_server.ecg_job_workers = job_workers
+    # Let the worker processes start before the burst
+    job_workers.notify()
+    time.sleep(1)
+    start = time.time()
+    job_ids = []
+    for i in range(JOBS):
+        response = client.post("/ecg_jobs", json={
+            "Rec_No": i % 50, "recording": {"hash": recordings[i % RECORDINGS]}
+        })
+        job_ids.append(response.get_json()["job_id"])
+    while True:
+        counts = queue.counts()
+        if counts["queued"] + counts["running"] == 0:
+            break
+        time.sleep(0.01)
+    job_workers.stop()
+    cloud_server.ecg_job_workers = None
+    jobs = [queue.get(job_id) for job_id in job_ids]
+    finished = max(job["finished_at"] for job in jobs)
+    waits = [job["started_at"] - job["queued_at"] for job in jobs]
+    totals = [job["finished_at"] - job["queued_at"] for job in jobs]
+    failed = sum(job["state"] != "done" for job in jobs)
+    return JOBS / (finished - start), waits, totals, failed
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as directory:
+        cloud_server.image_store = blob_store.FileBlobStore(
+            os.path.join(directory, "images"))
+        cloud_server.patient_store = record_store.MemoryPatientStore()
+        recordings = [make_recording(directory, i) for i in range(RECORDINGS)]
+        client = cloud_server.app.test_client()
+        print("burst of {} jobs of {} s recordings, {} CPUs".format(
+            JOBS, SECONDS, os.cpu_count()))
+        print("{:<10}{:>10}{:>14}{:>14}{:>14}{:>14}{:>8}".format(
+            "workers", "jobs/s", "wait p50 ms", "wait p95 ms",
+            "total p50 ms", "total p95 ms", "failed"))
+        for workers in worker_counts():
+            queue = ecg_jobs.JobQueue(os.path.join(
+                directory, "jobs-{}.sqlite".format(workers)))
+            cloud_server.ecg_job_queue = queue
+            rate, waits, totals, failed = run_burst(client, queue,
+                                                    recordings, workers)
+            print("{:<10}{:>10.1f}{:>14.0f}{:>14.0f}{:>14.0f}{:>14.0f}{:>8}"
+                  .format(workers, rate, percentile(waits, 50),
+                          percentile(waits, 95), percentile(totals, 50),
+                          percentile(totals, 95), failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+""" Benchmark of the throughput of ecg.OnlineBeatDetector
+
+Pushes one hour of a synthetic 360 Hz ECG signal through one detector in
+blocks of different sizes, the way bedside devices would send it, and
+reports the samples analyzed per second on a single core. Dividing by
+the sampling frequency gives the number of live streams of that block
+size one server process could keep up with.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_online
+"""
+import time
+
+import numpy as np
+
+import ecg
+
+SAMPLING_FREQUENCY = 360
+SECONDS = 3600
+BLOCKS = [1, 9, 36, 360, 3600]
+
+
+def make_signal():
+    t = np.arange(SECONDS * SAMPLING_FREQUENCY) / SAMPLING_FREQUENCY
+    rng = np.random.default_rng(0)
+    v = np.sin(2 * np.pi * 1.2 * t) ** 63 + 0.3 * np.sin(2 * np.pi * 0.2 * t) \
+        + 0.02 * rng.standard_normal(len(t))
+    return t, v
+
+
+def main():
+    t, v = make_signal()
+    print("{} s of signal at {} Hz".format(SECONDS, SAMPLING_FREQUENCY))
+    print("{:<12}{:>16}{:>16}{:>10}".format("block", "samples/s",
+                                            "live streams", "beats"))
+    for block in BLOCKS:
+        detector = ecg.OnlineBeatDetector(SAMPLING_FREQUENCY)
+        beats = 0
+        # Blocks of 1 sample are slow, so they only get a tenth of the signal
+        samples = len(t) // 10 if block == 1 else len(t)
+        start = time.perf_counter()
+        for i in range(0, samples, block):
+            beats += len(detector.push(t[i:i + block], v[i:i + block]))
+        rate = samples / (time.perf_counter() - start)
+        print("{:<12}{:>16.0f}{:>16.0f}{:>10}".format(
+            block, rate, rate / SAMPLING_FREQUENCY, beats))
+
+
+if __name__ == "__main__":
+    main()
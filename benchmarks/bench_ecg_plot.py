@@ -0,0 +1,80 @@
+""" Benchmark of the ECG plots of ecg_plot
+
+Plots synthetic 360 Hz recordings of 1 minute to 6 hours as the patient
+portal shows them: a JPEG plot for upload and a 200x150 thumbnail for
+display. Compares, against the length of the recording:
+- the original path of patient_gui, which plots every sample with
+  pyplot, saves the plot to a file, then reads it again to resize it;
+- ecg_plot.render_ecg and ecg_plot.thumbnail, which draw the min/max
+  envelope of the samples on a reused Agg figure, in memory.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_plot
+"""
+import logging
+import os
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from PIL import Image
+
+from ecg_plot import render_ecg, thumbnail
+
+MINUTES = [1, 10, 60, 360]
+SAMPLING_FREQUENCY = 360
+
+
+def make_signal(minutes):
+    t = np.arange(minutes * 60 * SAMPLING_FREQUENCY) / SAMPLING_FREQUENCY
+    rng = np.random.default_rng(0)
+    v = np.sin(2 * np.pi * 1.2 * t) ** 63 + 0.3 * np.sin(2 * np.pi * 0.2 * t) \
+        + 0.02 * rng.standard_normal(len(t))
+    return t, v
+
+
+def plot_with_pyplot(time, voltage, filename):
+    plt.clf()
+    plt.plot(time, voltage)
+    plt.xlabel('Time (s)')
+    plt.ylabel('Voltage (mV)')
+    plt.savefig(filename)
+    return Image.open(filename).resize((200, 150))
+
+
+def plot_with_ecg_plot(time, voltage):
+    return thumbnail(render_ecg(time, voltage))
+
+
+def elapsed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    # The first plot of each path loads fonts and sets the figure up
+    t, v = make_signal(1)
+    plot_with_ecg_plot(t, v)
+    print("{:<10}{:>12}{:>14}{:>14}{:>10}".format(
+        "minutes", "samples", "pyplot ms", "ecg_plot ms", "speedup"))
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "ecg.jpg")
+        plot_with_pyplot(t, v, filename)
+        for minutes in MINUTES:
+            t, v = make_signal(minutes)
+            # The portal plotted the lists read by pandas
+            t_list, v_list = list(t), list(v)
+            before = elapsed(lambda: plot_with_pyplot(t_list, v_list,
+                                                      filename))
+            after = min(elapsed(lambda: plot_with_ecg_plot(t, v))
+                        for _ in range(3))
+            print("{:<10}{:>12}{:>14.0f}{:>14.1f}{:>10.0f}".format(
+                minutes, len(t), before * 1000, after * 1000,
+                before / after))
+
+
+if __name__ == "__main__":
+    main()
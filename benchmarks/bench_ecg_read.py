@@ -0,0 +1,120 @@
+""" Benchmark of loading ECG csv files with ecg.readFile
+
+Compares the original line-by-line loader, which appends each row to
+Python lists, with the block-wise NumPy loader, in float64 and float32,
+on synthetic recordings of 1M and 10M rows. One row in 10000 is empty,
+non-numeric or NaN, so the validation path is exercised too. Each load
+runs in its own process, so that its peak RSS can be compared with the
+RSS before the load.
+
+Linux only: memory use is read from /proc. The 10M-row file takes about
+250 MB of disk space.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_read
+"""
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_upload import memory_mib
+import ecg
+
+ROWS = [1000000, 10000000]
+SAMPLING_FREQUENCY = 360
+BAD_ROW_EVERY = 10000
+BAD_ROWS = ["\n", "{},abc\n", ",{}\n", "{},nan\n"]
+
+
+def legacy_read_file(filename):
+    """ The original implementation of ecg.readFile """
+    time = []
+    voltage = []
+    f = open(filename, 'r')
+    line_number = 0
+    while True:
+        line_number += 1
+        line = f.readline()
+        if line == "":
+            break
+        line = line.rstrip('\n')
+        row = line.split(',')
+        if row[0] == '' or row[1] == '':
+            logging.error("there is an empty cell in line {}"
+                          .format(line_number))
+            continue
+        if ecg.is_number(row[0]) is False or ecg.is_number(row[1]) is False:
+            logging.error("there was a non-numeric input in line {}"
+                          .format(line_number))
+            continue
+        row = [float(i) for i in row]
+        if math.isnan(row[0]) or math.isnan(row[1]):
+            logging.error("There is a NaN cell in line {}".format(line_number))
+            continue
+        time.append(row[0])
+        voltage.append(row[1])
+    f.close()
+    sampling_frequency = len(time)/time[-1]
+    return time, voltage, sampling_frequency
+
+
+def write_recording(filename, rows):
+    chunk_rows = 1000000
+    with open(filename, "w") as out_file:
+        for start in range(0, rows, chunk_rows):
+            t = np.arange(start, min(start + chunk_rows, rows)) \
+                / SAMPLING_FREQUENCY
+            v = np.sin(2 * np.pi * 1.2 * t) ** 63 - 0.1
+            lines = ["{:.5f},{:.4f}\n".format(a, b) for a, b in zip(t, v)]
+            for i in range(BAD_ROW_EVERY - 1, len(lines), BAD_ROW_EVERY):
+                lines[i] = BAD_ROWS[(i // BAD_ROW_EVERY) % len(BAD_ROWS)] \
+                    .format(t[i])
+            out_file.writelines(lines)
+
+
+def run_loader(read, filename, results):
+    logging.disable(logging.ERROR)
+    before = memory_mib(os.getpid(), "VmRSS")
+    start = time.perf_counter()
+    read(filename)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, memory_mib(os.getpid(), "VmHWM") - before))
+
+
+def measure(read, filename):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_loader,
+                                      args=(read, filename, results))
+    process.start()
+    elapsed, peak = results.get()
+    process.join()
+    return elapsed, peak
+
+
+def read_float32(filename):
+    return ecg.readFile(filename, dtype=np.float32)
+
+
+def main():
+    loaders = [("line by line (before)", legacy_read_file),
+               ("numpy float64", ecg.readFile),
+               ("numpy float32", read_float32)]
+    print("{:<12}{:<26}{:>10}{:>16}".format("rows", "loader", "s",
+                                            "peak MiB"))
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in ROWS:
+            filename = os.path.join(directory, "ecg.csv")
+            write_recording(filename, rows)
+            for label, read in loaders:
+                elapsed, peak = measure(read, filename)
+                print("{:<12}{:<26}{:>10.2f}{:>16.1f}".format(
+                    rows, label, elapsed, peak))
+
+
+if __name__ == "__main__":
+    main()
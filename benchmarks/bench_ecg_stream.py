@@ -0,0 +1,74 @@
+""" Benchmark of analyzing long ECG recordings in blocks
+
+Compares the batch analysis of ecg.main (readFile, process_data and
+make_metrics on the whole recording) with ecg.analyze_stream on synthetic
+recordings of 1M and 10M rows, about 46 minutes and 7.7 hours at 360 Hz.
+Each analysis runs in its own process, so that its peak RSS can be
+compared with the RSS before the analysis, and the metrics of both are
+compared.
+
+Linux only: memory use is read from /proc. The 10M-row file takes about
+250 MB of disk space.
+
+Run from the repository root:
+    python -m benchmarks.bench_ecg_stream
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.bench_ecg_read import write_recording
+from benchmarks.bench_upload import memory_mib
+import ecg
+
+ROWS = [1000000, 10000000]
+
+
+def analyze_batch(filename):
+    time, voltage, sampling_frequency = ecg.readFile(filename)
+    voltage = ecg.process_data(voltage, sampling_frequency)
+    return ecg.make_metrics(time, voltage)
+
+
+def run_analysis(analyze, filename, results):
+    logging.disable(logging.CRITICAL)
+    before = memory_mib(os.getpid(), "VmRSS")
+    start = time.perf_counter()
+    metrics = analyze(filename)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, memory_mib(os.getpid(), "VmHWM") - before,
+                 metrics))
+
+
+def measure(analyze, filename):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_analysis,
+                                      args=(analyze, filename, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    print("{:<12}{:<12}{:>10}{:>14}{:>10}".format("rows", "analysis", "s",
+                                                  "peak MiB", "beats"))
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in ROWS:
+            filename = os.path.join(directory, "ecg.csv")
+            write_recording(filename, rows)
+            results = {}
+            for label, analyze in [("batch", analyze_batch),
+                                   ("stream", ecg.analyze_stream)]:
+                elapsed, peak, metrics = measure(analyze, filename)
+                results[label] = metrics
+                print("{:<12}{:<12}{:>10.2f}{:>14.1f}{:>10}".format(
+                    rows, label, elapsed, peak, metrics["num_beats"]))
+            same = results["batch"]["beats"] == results["stream"]["beats"]
+            print("{:<12}same beats: {}".format("", same))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+""" Benchmark of the responsiveness of a GUI waiting on the server
+
+A monitor refreshes the selected patient every 250 ms for 5 seconds,
+while the server answers after an injected latency of 0 to 2000 ms. The
+event loop of the GUI, a stand-in for Tk's that runs the callbacks
+scheduled with after, also runs a 10 ms frame callback, like a redraw.
+A frame that runs late is a stall of the GUI, during which it neither
+redraws nor answers clicks. Compares:
+- the original monitor, which sends the requests from the event loop;
+- the IOExecutor of gui_io, which sends them from worker threads and
+  shows their results from the event loop.
+Reports the refreshes shown, the worst and p99 frame lateness, and the
+total time frames were more than 50 ms late.
+
+Run from the repository root:
+    python -m benchmarks.bench_gui_io
+"""
+import heapq
+import itertools
+import json
+import logging
+import time
+
+import numpy as np
+
+from benchmarks import local_server
+import cloud_server
+import gui_client
+from gui_io import IOExecutor
+import record_store
+
+LATENCIES_MS = [0, 100, 500, 2000]
+SECONDS = 5
+REFRESH_MS = 250
+FRAME_MS = 10
+STALL_MS = 50
+
+
+class EventLoop:
+    # Runs the callbacks scheduled with after, in order, on this thread
+
+    def __init__(self):
+        self._timers = []
+        self._order = itertools.count()
+
+    def after(self, interval, callback):
+        due = time.perf_counter() + interval / 1000
+        heapq.heappush(self._timers, (due, next(self._order), callback))
+
+    def run(self, seconds):
+        end = time.perf_counter() + seconds
+        while self._timers and self._timers[0][0] < end:
+            due, _, callback = heapq.heappop(self._timers)
+            time.sleep(max(0, due - time.perf_counter()))
+            callback()
+
+
+class DelayedApp:
+    # Answers each request after the latency of the benchmark
+
+    def __init__(self, app):
+        self.app = app
+        self.latency = 0
+
+    def __call__(self, environ, start_response):
+        time.sleep(self.latency)
+        return self.app(environ, start_response)
+
+
+def retrieve_patient(patient_id):
+    return json.loads(gui_client.retrieve_patient_data_from_server(
+        patient_id))
+
+
+def run_monitor(background):
+    loop = EventLoop()
+    lateness = []
+    shown = []
+    executor = IOExecutor() if background else None
+
+    def frame(due):
+        now = time.perf_counter()
+        lateness.append(max(0, now - due))
+        loop.after(FRAME_MS, lambda: frame(now + FRAME_MS / 1000))
+
+    def refresh():
+        if background:
+            executor.submit(retrieve_patient, "1", on_done=shown.append,
+                            key="patient")
+        else:
+            shown.append(retrieve_patient("1"))
+        loop.after(REFRESH_MS, refresh)
+    loop.after(FRAME_MS, lambda: frame(time.perf_counter() + FRAME_MS / 1000))
+    loop.after(0, refresh)
+    if background:
+        executor.attach(loop)
+    loop.run(SECONDS)
+    if background:
+        executor.shutdown()
+    lateness = np.array(lateness) * 1000
+    return (len(shown), lateness.max(), np.percentile(lateness, 99),
+            lateness[lateness > STALL_MS].sum() / 1000)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    cloud_server.patient_store = record_store.MemoryPatientStore()
+    cloud_server.new_patient_driver({"Rec_No": "1", "Name": "Bench",
+                                     "Heart_Rate": 72})
+    app = DelayedApp(cloud_server.app)
+    url, server = local_server.start(app)
+    gui_client.configure(url)
+    print("refresh every {} ms for {} s, {} ms frames".format(
+        REFRESH_MS, SECONDS, FRAME_MS))
+    print("{:<12}{:<12}{:>10}{:>12}{:>12}{:>12}".format(
+        "latency ms", "sent from", "refreshes", "worst ms", "p99 ms",
+        "stalled s"))
+    for latency in LATENCIES_MS:
+        app.latency = latency / 1000
+        for label, background in [("event loop", False),
+                                  ("IOExecutor", True)]:
+            shown, worst, p99, stalled = run_monitor(background)
+            print("{:<12}{:<12}{:>10}{:>12.0f}{:>12.0f}{:>12.2f}".format(
+                latency, label, shown, worst, p99, stalled))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
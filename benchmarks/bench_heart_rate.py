@@ -0,0 +1,102 @@
+""" Benchmark of charting the heart rate of a patient over months
+
+A patient has a heart rate measured every 2 minutes for 180 days. A
+chart of 300 points of the last day, 30 days and 180 days is made:
+- from the parallel "Heart_Rate" and "Timestamp" lists of the patient,
+  read from /get_patient_info, with the timestamp strings parsed,
+  filtered by range and bucketed on the client;
+- from /heart_rate, which reads the range of the time series from its
+  index and returns the min/mean/max buckets aggregated by the store.
+Reports the time and bytes received for each chart, for the memory and
+SQLite patient stores. The MongoDB store is left out: its mongomock
+stand-in neither reads from indexes nor aggregates natively, and takes
+longer than the read timeout of the client on this series.
+
+Run from the repository root:
+    python -m benchmarks.bench_heart_rate
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import local_server
+import cloud_server
+import gui_client
+import record_store
+
+DAYS = 180
+INTERVAL = timedelta(minutes=2)
+RANGES_DAYS = [1, 30, 180]
+POINTS = 300
+END = datetime(2022, 4, 13)
+
+
+def load_patient():
+    start = END - timedelta(days=DAYS)
+    count = int(timedelta(days=DAYS) / INTERVAL)
+    per_day = int(timedelta(days=1) / INTERVAL)
+    for day in range(0, count, per_day):
+        times = [start + INTERVAL * i for i in range(day, day + per_day)]
+        values = [60 + (i * 7919) % 60 for i in range(day, day + per_day)]
+        cloud_server.patient_store.update_patient(
+            1, "Bench", {"heartrate": values, "timestamp": [
+                t.strftime(cloud_server.TIMESTAMP_FORMAT) for t in times]},
+            {}, [(t, float(value)) for t, value in zip(times, values)])
+    return count
+
+
+def chart_from_lists(start, end):
+    r = gui_client.client.get("/get_patient_info/1",
+                              params={"fields": "Heart_Rate,Timestamp"})
+    patient = r.json()
+    bucket = (end - start) / POINTS
+    buckets = {}
+    for value, timestamp in zip(patient["Heart_Rate"], patient["Timestamp"]):
+        measured = datetime.strptime(timestamp,
+                                     cloud_server.TIMESTAMP_FORMAT)
+        if start <= measured < end:
+            buckets.setdefault((measured - start) // bucket, []).append(value)
+    chart = [(index, min(values), sum(values) / len(values), max(values))
+             for index, values in sorted(buckets.items())]
+    return chart, len(r.content)
+
+
+def chart_from_series(start, end):
+    text = gui_client.retrieve_heart_rate(1, start, end)
+    return json.loads(text)["buckets"], len(text)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    url, server = local_server.start(cloud_server.app)
+    gui_client.configure(url)
+    directory = tempfile.mkdtemp()
+    print("{} days of heart rates every {:.0f} minutes".format(
+        DAYS, INTERVAL.total_seconds() / 60))
+    print("{:<10}{:>6}{:<14}{:>10}{:>12}{:>10}".format(
+        "store", "days", " chart from", "points", "ms", "KiB"))
+    for label in ["memory", "sqlite"]:
+        if label == "memory":
+            cloud_server.patient_store = record_store.MemoryPatientStore()
+        else:
+            cloud_server.patient_store = record_store.SQLitePatientStore(
+                os.path.join(directory, "patients.sqlite"))
+        load_patient()
+        for days in RANGES_DAYS:
+            start = END - timedelta(days=days)
+            for path, chart in [("lists", chart_from_lists),
+                                ("/heart_rate", chart_from_series)]:
+                begin = time.perf_counter()
+                points, received = chart(start, END)
+                elapsed = time.perf_counter() - begin
+                print("{:<10}{:>6} {:<13}{:>10}{:>12.0f}{:>10.1f}".format(
+                    label, days, path, len(points), elapsed * 1000,
+                    received / 1024))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
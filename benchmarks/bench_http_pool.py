@@ -0,0 +1,106 @@
+""" Benchmark of the HTTP connections of gui_client
+
+Threads of a GUI send GET requests for the summary of a patient to the
+cloud server on a local port, and the benchmark compares:
+- the original path, which calls requests.get and opens a new connection
+  for every request;
+- the ServerClient of gui_client, which reuses the keep-alive connections
+  of a pool shared by the threads.
+Reports the requests per second and the p50/p99 latency for 1 and 4
+threads. Then a server that answers 10% of the requests with 503 shows
+the requests that fail without retries and with the retries of
+ServerClient.
+
+Run from the repository root:
+    python -m benchmarks.bench_http_pool
+"""
+import logging
+import random
+import statistics
+import threading
+import time
+
+import requests
+
+from benchmarks import local_server
+import cloud_server
+import gui_client
+import record_store
+
+THREADS = [1, 4]
+REQUESTS = 500
+UNAVAILABLE_SHARE = 0.1
+
+
+class FlakyApp:
+    # Answers a share of the requests with 503 Service Unavailable
+
+    def __init__(self, app):
+        self.app = app
+        self.unavailable = 0
+        self.random = random.Random(0)
+
+    def __call__(self, environ, start_response):
+        if self.random.random() < self.unavailable:
+            start_response("503 SERVICE UNAVAILABLE",
+                           [("Content-Length", "0")])
+            return [b""]
+        return self.app(environ, start_response)
+
+
+def run_threads(get, threads):
+    latencies = []
+    failures = []
+
+    def run():
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            if get("/get_patient_summary/1").status_code != 200:
+                failures.append(True)
+            latencies.append(time.perf_counter() - start)
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    p99 = statistics.quantiles(latencies, n=100)[-1]
+    return (len(latencies) / elapsed, statistics.median(latencies), p99,
+            len(failures))
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    cloud_server.patient_store = record_store.MemoryPatientStore()
+    cloud_server.new_patient_driver({"Rec_No": "1", "Name": "Bench",
+                                     "Heart_Rate": list(range(60, 160))})
+    app = FlakyApp(cloud_server.app)
+    url, server = local_server.start(app)
+    client = gui_client.ServerClient(url)
+    paths = [("requests.get", lambda path: requests.get(
+                  url + path, timeout=gui_client.REQUEST_TIMEOUT)),
+             ("ServerClient", client.get)]
+    print("{} GET /get_patient_summary per thread".format(REQUESTS))
+    print("{:<10}{:<16}{:>12}{:>10}{:>10}".format(
+        "threads", "client", "requests/s", "p50 ms", "p99 ms"))
+    for threads in THREADS:
+        for label, get in paths:
+            throughput, p50, p99, _ = run_threads(get, threads)
+            print("{:<10}{:<16}{:>12.0f}{:>10.2f}{:>10.2f}".format(
+                threads, label, throughput, p50 * 1000, p99 * 1000))
+    print()
+    print("{:.0%} of the answers are 503, 1 thread".format(
+        UNAVAILABLE_SHARE))
+    print("{:<16}{:>12}".format("client", "failed"))
+    app.unavailable = UNAVAILABLE_SHARE
+    gui_client.GET_RETRY_BASE_DELAY = 0.001
+    for label, get in paths:
+        *_, failures = run_threads(get, 1)
+        print("{:<16}{:>12}".format(label, failures))
+    server.shutdown()
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+""" Benchmark of live update latency and idle cost of the event stream
+
+Starts the cloud server in its own process and connects 500 monitors to
+/patient_events. It then measures the server's CPU use while idle, and
+the time from posting to /new_patient until a monitor listening through
+gui_client receives the event. With 30 second polling the expected delay
+is 15 seconds on average and up to 30 seconds.
+
+Linux only: the server's CPU time is read from /proc.
+
+Run from the repository root:
+    python -m benchmarks.bench_live_updates
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+import gui_client
+
+MONITORS = 500
+IDLE_SECONDS = 10
+UPLOADS = 50
+
+
+def server_cpu_seconds(pid):
+    with open("/proc/{}/stat".format(pid)) as stat_file:
+        stat = stat_file.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of the stat line
+    return (int(stat[11]) + int(stat[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def idle_cpu_percent(pid):
+    before = server_cpu_seconds(pid)
+    time.sleep(IDLE_SECONDS)
+    return (server_cpu_seconds(pid) - before) / IDLE_SECONDS * 100
+
+
+def connect_monitors(url, count):
+    address = urlparse(url)
+    monitors = []
+    for i in range(count):
+        monitor = socket.create_connection((address.hostname, address.port))
+        monitor.sendall("GET /patient_events HTTP/1.1\r\nHost: {}\r\n\r\n"
+                        .format(address.netloc).encode())
+        monitors.append(monitor)
+    return monitors
+
+
+def measure_latency(url):
+    received = {}
+    connected = threading.Event()
+
+    def on_event(event):
+        received[event["Revision"]] = time.perf_counter()
+
+    def listen():
+        try:
+            gui_client.listen_to_patient_events(on_event, connected.set)
+        except requests.exceptions.RequestException:
+            # The server is stopped at the end of the benchmark
+            pass
+
+    threading.Thread(target=listen, daemon=True).start()
+    connected.wait()
+    latencies = []
+    for revision in range(1, UPLOADS + 1):
+        sent = time.perf_counter()
+        requests.post(url + "/new_patient",
+                      json={"Rec_No": "1", "Heart_Rate": 60})
+        while revision not in received:
+            time.sleep(0.0005)
+        latencies.append((received[revision] - sent) * 1000)
+        time.sleep(0.02)
+    return latencies
+
+
+def main():
+    server = subprocess.Popen([sys.executable, "-m",
+                               "benchmarks.local_server"],
+                              stdout=subprocess.PIPE, text=True)
+    url = server.stdout.readline().strip()
+    gui_client.configure(url)
+    try:
+        print("idle server CPU, no monitors:   {:.2f}%"
+              .format(idle_cpu_percent(server.pid)))
+        monitors = connect_monitors(url, MONITORS)
+        time.sleep(2)
+        print("idle server CPU, {} monitors: {:.2f}%"
+              .format(MONITORS, idle_cpu_percent(server.pid)))
+        latencies = measure_latency(url)
+        latencies.sort()
+        print("upload to event latency over {} uploads: median {:.1f} ms, "
+              "p95 {:.1f} ms, max {:.1f} ms"
+              .format(UPLOADS, statistics.median(latencies),
+                      latencies[int(len(latencies) * 0.95) - 1],
+                      latencies[-1]))
+        print("30 s polling: mean 15000 ms, max 30000 ms")
+        for monitor in monitors:
+            monitor.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+""" Benchmark of the image display of the patient monitor
+
+Displays the latest ECG plot (640x480 JPEG) and medical image (a 12 MP
+JPEG photograph) of a patient, then refreshes them 30 times while the
+patient is unchanged, as monitoring_gui does, and compares:
+- the original path, which writes each image to a file, opens it again
+  and resizes it to 200x150 on every display;
+- the ThumbnailCache of monitoring_gui, which decodes each image once in
+  memory, at a reduced scale, and then reuses its thumbnail.
+The downloads are left out: both paths read the images from memory.
+The Tk images are left out as well, since they need a display.
+
+Run from the repository root:
+    python -m benchmarks.bench_monitor_images
+"""
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from ecg_plot import render_ecg, thumbnail
+import monitoring_gui
+
+REFRESHES = 30
+
+
+def make_images():
+    t = np.arange(60 * 360) / 360
+    ecg_plot = render_ecg(t, np.sin(2 * np.pi * 1.2 * t) ** 63)
+    rng = np.random.default_rng(0)
+    # Noise on a gradient, which compresses like a photograph
+    gradient = np.linspace(0, 200, 4000)[None, :, None]
+    pixels = gradient + rng.integers(0, 55, (3000, 4000, 3))
+    output = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(output, format="JPEG")
+    return {"ecg": ecg_plot, "med": output.getvalue()}
+
+
+def display_from_file(image_bytes, filename):
+    with open(filename, "wb") as out_file:
+        out_file.write(image_bytes)
+    return Image.open(filename).resize((200, 150))
+
+
+def main():
+    images = make_images()
+    print("{} refreshes of an unchanged patient, medical image of {} KiB"
+          .format(REFRESHES, len(images["med"]) // 1024))
+    print("{:<16}{:>16}{:>16}".format("path", "first display ms",
+                                      "refreshes ms"))
+    with tempfile.TemporaryDirectory() as directory:
+        def show_from_files():
+            for name, image_bytes in images.items():
+                display_from_file(image_bytes, os.path.join(
+                    directory, "patient_{}.jpg".format(name)))
+
+        cache = monitoring_gui.ThumbnailCache()
+
+        def show_from_cache():
+            # As show_image does, without the background thread
+            for name in images:
+                if cache.cached({"hash": name}) is None:
+                    cache.add({"hash": name}, thumbnail(images[name]))
+        for label, show in [("files", show_from_files),
+                            ("ThumbnailCache", show_from_cache)]:
+            start = time.perf_counter()
+            show()
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(REFRESHES):
+                show()
+            refreshes = time.perf_counter() - start
+            print("{:<16}{:>16.1f}{:>16.2f}".format(label, first * 1000,
+                                                    refreshes * 1000))
+        print("thumbnail cache: {}".format(cache.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+""" Benchmark of the database cost of /new_patient uploads
+
+Compares the original read-modify-save implementation of
+update_patient_info_driver with the single atomic upsert, against the
+mongomock stand-in from benchmarks/mongo_standin.py.
+
+Run from the repository root:
+    python -m benchmarks.bench_new_patient
+"""
+import base64
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import mongo_standin
+import blob_store
+import cloud_server
+from cloud_server import Patient
+
+UPLOADS = 200
+IMAGE_BYTES = 30000
+
+
+def legacy_upload(in_data):
+    """ The original implementation: check, fetch, append and save """
+    if cloud_server.patient_exist(in_data):
+        patient = Patient.objects.raw({"_id": int(in_data["Rec_No"])}).first()
+    else:
+        patient = Patient(patient_id=in_data["Rec_No"])
+    now = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+    if "Name" in in_data:
+        patient.patient_name = in_data["Name"]
+    if "ECG" in in_data:
+        patient.ecg_images.append(in_data["ECG"])
+        patient.timestamp.append(now)
+    if "Heart_Rate" in in_data:
+        patient.heartrate.append(in_data["Heart_Rate"])
+    patient.save()
+
+
+def upsert_upload(in_data):
+    """ The current implementation: one atomic upsert """
+    cloud_server.new_patient_driver(in_data)
+
+
+def run(upload):
+    counter = mongo_standin.install()
+    cloud_server.patient_store = cloud_server.mongo_patient_store()
+    cloud_server.image_store = blob_store.FileBlobStore(tempfile.mkdtemp())
+    image = str(base64.b64encode(os.urandom(IMAGE_BYTES)), encoding="utf-8")
+    start = time.perf_counter()
+    for i in range(UPLOADS):
+        upload({"Rec_No": "1", "Name": "Bench", "ECG": image,
+                "Heart_Rate": 60 + i % 40})
+    elapsed = time.perf_counter() - start
+    return counter.round_trips, counter.bytes_written, elapsed
+
+
+def main():
+    print("{} uploads of a {} byte image to one patient".format(
+        UPLOADS, IMAGE_BYTES))
+    print("{:<10}{:>16}{:>20}{:>14}".format(
+        "path", "round trips", "bytes written", "seconds"))
+    for name, upload in [("legacy", legacy_upload),
+                         ("upsert", upsert_upload)]:
+        round_trips, bytes_written, elapsed = run(upload)
+        print("{:<10}{:>16}{:>20}{:>14.3f}".format(
+            name, round_trips, bytes_written, elapsed))
+        print("{:<10}{:>16.2f}{:>20.0f}".format(
+            "  /upload", round_trips / UPLOADS, bytes_written / UPLOADS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+""" Benchmark of the patient id list with 100k patients
+
+Compares reading every Patient document to collect its id, the way
+/get_all_patient_id used to, with the "_id"-only query that loads the
+patient id cache and with requests served from the cache, both as pages
+and as the full list. Each patient holds a few uploads so that reading the
+whole documents costs what it does in practice. mongomock copies every
+document a query matches, even with a projection, so both database reads
+are much slower than against MongoDB, where the "_id"-only query is
+answered from the "_id" index. Loading takes a few minutes.
+
+Run from the repository root:
+    python -m benchmarks.bench_patient_ids
+"""
+import time
+import tracemalloc
+
+from benchmarks import mongo_standin
+import cloud_server
+
+PATIENTS = 100000
+UPLOADS = 5
+REQUESTS = 50
+ROUTES = ["/get_all_patient_id?limit=1000",
+          "/get_all_patient_id?after=50000&limit=1000",
+          "/get_all_patient_id"]
+
+
+def load_patients():
+    image = {"hash": "0" * 64, "size": 30000,
+             "timestamp": "04/13/2022, 15:02:45"}
+    patients = []
+    for patient_id in range(1, PATIENTS + 1):
+        patients.append({"_id": patient_id,
+                         "_cls": cloud_server.Patient._mongometa.object_name,
+                         "patient_name": "Bench",
+                         "ecg_images": [image] * UPLOADS,
+                         "medical_images": [image] * UPLOADS,
+                         "timestamp": [image["timestamp"]] * UPLOADS,
+                         "heartrate": [72] * UPLOADS,
+                         "revision": UPLOADS})
+    cloud_server.Patient._mongometa.collection.insert_many(patients)
+
+
+def read_all_documents():
+    patient_id_list = []
+    for patient in cloud_server.Patient.objects.raw({}):
+        patient_id_list.append(patient.patient_id)
+    return patient_id_list
+
+
+def timed(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 2 ** 20
+
+
+def measure(client, url):
+    start = time.perf_counter()
+    for i in range(REQUESTS):
+        response = client.get(url)
+    elapsed = (time.perf_counter() - start) / REQUESTS
+    tracemalloc.start()
+    client.get(url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(response.data), elapsed * 1000, peak / 2 ** 20
+
+
+def main():
+    mongo_standin.install()
+    cloud_server.patient_store = cloud_server.mongo_patient_store()
+    load_patients()
+    print("{} patients with {} uploads each".format(PATIENTS, UPLOADS))
+    print("{:<50}{:>12}{:>10}{:>12}".format("", "bytes", "ms",
+                                            "peak MiB"))
+    for label, function in [
+            ("read whole documents (before)", read_all_documents),
+            ("load the id cache", cloud_server.get_patient_ids)]:
+        elapsed, peak = timed(function)
+        print("{:<50}{:>12}{:>10.1f}{:>12.1f}".format(label, "", elapsed,
+                                                      peak))
+    cache = cloud_server.patient_id_cache
+    print("id cache size: {:.2f} MiB".format(
+        len(cache) * cache.itemsize / 2 ** 20))
+    client = cloud_server.app.test_client()
+    print("requests served from the cache, mean of {}".format(REQUESTS))
+    for url in ROUTES:
+        size, elapsed, peak = measure(client, url)
+        print("  {:<48}{:>12}{:>10.2f}{:>12.2f}".format(url, size, elapsed,
+                                                        peak))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+""" Benchmark of patient information payload size and latency
+
+Loads a patient with 500 uploads and compares the full /get_patient_info
+response with the /get_patient_summary route and a "fields" projection.
+A second patient stores its images inline as b64-strings, the way records
+were kept before the image store, to show the effect of "$slice" on large
+documents.
+
+Run from the repository root:
+    python -m benchmarks.bench_patient_info
+"""
+import base64
+import os
+import tempfile
+import time
+
+from benchmarks import mongo_standin
+import blob_store
+import cloud_server
+
+UPLOADS = 500
+IMAGE_BYTES = 30000
+REQUESTS = 50
+ROUTES = ["/get_patient_info/{}",
+          "/get_patient_summary/{}",
+          "/get_patient_info/{}?fields=Name,Heart_Rate,Timestamp&last=1"]
+
+
+def load_patients():
+    image = os.urandom(IMAGE_BYTES)
+    b64_image = str(base64.b64encode(image), encoding="utf-8")
+    inline = {"_id": 2, "_cls": cloud_server.Patient._mongometa.object_name,
+              "patient_name": "Inline", "ecg_images": [], "timestamp": [],
+              "heartrate": [], "medical_images": []}
+    for i in range(UPLOADS):
+        in_data = {"Rec_No": "1", "Name": "Bench", "ECG": b64_image,
+                   "Heart_Rate": 60 + i % 40}
+        _, now, _ = cloud_server.new_patient_driver(in_data)
+        inline["ecg_images"].append(b64_image)
+        inline["timestamp"].append(now)
+        inline["heartrate"].append(60 + i % 40)
+    cloud_server.Patient._mongometa.collection.insert_one(inline)
+
+
+def measure(client, url):
+    start = time.perf_counter()
+    for i in range(REQUESTS):
+        response = client.get(url)
+    elapsed = (time.perf_counter() - start) / REQUESTS
+    return len(response.data), elapsed
+
+
+def main():
+    mongo_standin.install()
+    cloud_server.patient_store = cloud_server.mongo_patient_store()
+    cloud_server.image_store = blob_store.FileBlobStore(tempfile.mkdtemp())
+    load_patients()
+    client = cloud_server.app.test_client()
+    print("{} uploads per patient, mean of {} requests"
+          .format(UPLOADS, REQUESTS))
+    print("{:<62}{:>12}{:>10}".format("route", "bytes", "ms"))
+    for label, patient_id in [("image references", 1),
+                              ("inline b64 images", 2)]:
+        print(label)
+        for route in ROUTES:
+            url = route.format(patient_id)
+            size, elapsed = measure(client, url)
+            print("  {:<60}{:>12}{:>10.2f}".format(url, size, elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
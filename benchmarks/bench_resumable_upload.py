@@ -0,0 +1,142 @@
+""" Benchmark of uploading a 50 MB image over a connection that drops
+
+The client reaches the server through a proxy that cuts every open
+connection each time 20 MB have gone through it, the way a flaky ward
+Wi-Fi drops long transfers. The image is uploaded once in a single
+request to /image, retried from the start after every drop, and once
+through gui_client.UploadQueue, which resumes its chunked upload from
+the last acknowledged offset.
+
+Run from the repository root:
+    python -m benchmarks.bench_resumable_upload
+"""
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+import gui_client
+
+IMAGE_MEGABYTES = 50
+DROP_EVERY_MEGABYTES = 20
+ATTEMPTS = 5
+
+
+class DroppingProxy:
+    """ Forwards connections to the server and cuts them all whenever
+    DROP_EVERY_MEGABYTES have been sent """
+
+    def __init__(self, target):
+        self.target = target
+        self.sent = 0
+        self.total = 0
+        self.lock = threading.Lock()
+        self.connections = []
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.url = "http://127.0.0.1:{}".format(
+            self.listener.getsockname()[1])
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            client, address = self.listener.accept()
+            server = socket.create_connection(self.target)
+            with self.lock:
+                self.connections += [client, server]
+            threading.Thread(target=self.forward, args=(client, server, True),
+                             daemon=True).start()
+            threading.Thread(target=self.forward, args=(server, client, False),
+                             daemon=True).start()
+
+    def forward(self, source, destination, count):
+        try:
+            for data in iter(lambda: source.recv(65536), b""):
+                destination.sendall(data)
+                if count:
+                    self.count(len(data))
+        except OSError:
+            pass
+        cut(source)
+        cut(destination)
+
+    def count(self, size):
+        with self.lock:
+            self.sent += size
+            self.total += size
+            if self.sent < DROP_EVERY_MEGABYTES * 1024 * 1024:
+                return
+            self.sent = 0
+            connections, self.connections = self.connections, []
+        for sock in connections:
+            cut(sock)
+
+
+def cut(sock):
+    # Reset the connection rather than closing it cleanly, so the peer
+    # fails at once instead of waiting for its data to be read
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                        struct.pack("ii", 1, 0))
+        sock.shutdown(socket.SHUT_RDWR)
+        sock.close()
+    except OSError:
+        pass
+
+
+def upload_single_request(filename):
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            gui_client.upload_patient_data_to_server({"Rec_No": "1",
+                                                      "ECG": filename})
+            return "uploaded after {} attempts".format(attempt)
+        except requests.RequestException:
+            pass
+    return "failed after {} attempts".format(ATTEMPTS)
+
+
+def upload_queued(filename):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        upload_queue = gui_client.UploadQueue(
+            directory, on_result=lambda job, message: results.append(message))
+        upload_queue.add({"Rec_No": "1", "ECG": filename})
+        while upload_queue.drain() is not None and len(results) < ATTEMPTS:
+            pass
+    return "uploaded after {} attempts".format(len(results))
+
+
+def main():
+    gui_client.RETRY_BASE_DELAY = 0
+    server = subprocess.Popen([sys.executable, "-m",
+                               "benchmarks.local_server"],
+                              stdout=subprocess.PIPE, text=True)
+    address = urlparse(server.stdout.readline().strip())
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as image_file:
+            image_file.write(os.urandom(IMAGE_MEGABYTES * 1024 * 1024))
+            image_file.flush()
+            print("{} MB image, connections cut every {} MB"
+                  .format(IMAGE_MEGABYTES, DROP_EVERY_MEGABYTES))
+            for label, upload in [("single request", upload_single_request),
+                                  ("resumable chunks", upload_queued)]:
+                proxy = DroppingProxy((address.hostname, address.port))
+                gui_client.configure(proxy.url)
+                start = time.perf_counter()
+                result = upload(image_file.name)
+                print("{:<20}{:<32}{:>8.1f} s{:>8.0f} MB sent".format(
+                    label, result, time.perf_counter() - start,
+                    proxy.total / 1024 / 1024))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+""" Benchmark of the patient stores under a mixed read and write load
+
+Runs the same load against each backend of record_store: several threads
+send requests through the Flask test client, mostly reads of a patient's
+latest heart rate with a few uploads of a new one in between, the way
+monitors and patient-side clients share the server. The MongoDB backend
+runs against the mongomock stand-in, which is much slower than a real
+MongoDB server, so its numbers only show that the backend works offline.
+
+Run from the repository root:
+    python -m benchmarks.bench_storage
+"""
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmarks import mongo_standin
+import cloud_server
+import record_store
+
+PATIENTS = 200
+UPLOADS = 50
+THREADS = 8
+REQUESTS = 500
+WRITE_SHARE = 0.2
+
+
+def upload(client, patient_id, heartrate):
+    client.post("/new_patient", json={"Rec_No": str(patient_id),
+                                      "Name": "Bench",
+                                      "Heart_Rate": heartrate})
+
+
+def load_patients():
+    client = cloud_server.app.test_client()
+    for patient_id in range(1, PATIENTS + 1):
+        upload(client, patient_id, list(range(60, 60 + UPLOADS)))
+
+
+def run_client(seed, latencies):
+    client = cloud_server.app.test_client()
+    rng = random.Random(seed)
+    for i in range(REQUESTS):
+        patient_id = rng.randint(1, PATIENTS)
+        start = time.perf_counter()
+        if rng.random() < WRITE_SHARE:
+            upload(client, patient_id, rng.randint(60, 100))
+        else:
+            client.get("/get_patient_info/{}?fields=Name,Heart_Rate&last=1"
+                       .format(patient_id))
+        latencies.append(time.perf_counter() - start)
+
+
+def measure():
+    load_patients()
+    latencies = []
+    threads = [threading.Thread(target=run_client, args=(seed, latencies))
+               for seed in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    return len(latencies) / elapsed, statistics.median(latencies), p95
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    print("{} patients with {} heart rates, {} threads sending {} requests "
+          "each, {:.0%} uploads".format(PATIENTS, UPLOADS, THREADS, REQUESTS,
+                                        WRITE_SHARE))
+    print("{:<24}{:>12}{:>12}{:>12}".format("store", "requests/s", "p50 ms",
+                                            "p95 ms"))
+    for label in ["memory", "sqlite", "mongo (mongomock)"]:
+        if label == "memory":
+            store = record_store.MemoryPatientStore()
+        elif label == "sqlite":
+            store = record_store.SQLitePatientStore(
+                os.path.join(directory, "patients.sqlite"))
+        else:
+            mongo_standin.install()
+            store = cloud_server.mongo_patient_store()
+        cloud_server.patient_store = store
+        cloud_server.invalidate_patient_id_cache()
+        throughput, p50, p95 = measure()
+        print("{:<24}{:>12.0f}{:>12.2f}{:>12.2f}".format(
+            label, throughput, p50 * 1000, p95 * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+""" Benchmark of uploading a 50 MB image
+
+Uploads the same image once as a b64-string inside the JSON body of
+/new_patient, the way gui_client used to, and once streamed to the /image
+route by gui_client.upload_patient_data_to_server. Each upload gets a
+fresh server process and runs in its own client process, so the peak RSS
+of both sides can be compared with their RSS before the upload.
+
+Linux only: memory use is read from /proc.
+
+Run from the repository root:
+    python -m benchmarks.bench_upload
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import gui_client
+
+IMAGE_MEGABYTES = 50
+
+
+def memory_mib(pid, key):
+    with open("/proc/{}/status".format(pid)) as status_file:
+        for line in status_file:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) / 1024
+
+
+def upload_json(filename):
+    patient_info = {"Rec_No": "1",
+                    "ECG": gui_client.convert_file_to_b64_string(filename)}
+    requests.post(gui_client.client.url + "/new_patient", json=patient_info)
+
+
+def upload_stream(filename):
+    gui_client.upload_patient_data_to_server({"Rec_No": "1",
+                                              "ECG": filename})
+
+
+def run_client(upload, filename, results):
+    before = memory_mib(os.getpid(), "VmRSS")
+    start = time.perf_counter()
+    upload(filename)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, memory_mib(os.getpid(), "VmHWM") - before))
+
+
+def measure(upload, filename):
+    server = subprocess.Popen([sys.executable, "-m",
+                               "benchmarks.local_server"],
+                              stdout=subprocess.PIPE, text=True)
+    gui_client.configure(server.stdout.readline().strip())
+    try:
+        server_before = memory_mib(server.pid, "VmRSS")
+        results = multiprocessing.Queue()
+        client = multiprocessing.Process(target=run_client,
+                                         args=(upload, filename, results))
+        client.start()
+        elapsed, client_peak = results.get()
+        client.join()
+        server_peak = memory_mib(server.pid, "VmHWM") - server_before
+    finally:
+        server.terminate()
+        server.wait()
+    return elapsed, client_peak, server_peak
+
+
+def main():
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as image_file:
+        image_file.write(os.urandom(IMAGE_MEGABYTES * 1024 * 1024))
+        image_file.flush()
+        print("{} MB image".format(IMAGE_MEGABYTES))
+        print("{:<30}{:>10}{:>20}{:>20}".format(
+            "upload", "MB/s", "client peak MiB", "server peak MiB"))
+        for label, upload in [("b64 in JSON (before)", upload_json),
+                              ("streamed to /image", upload_stream)]:
+            elapsed, client_peak, server_peak = measure(upload,
+                                                        image_file.name)
+            print("{:<30}{:>10.1f}{:>20.1f}{:>20.1f}".format(
+                label, IMAGE_MEGABYTES / elapsed, client_peak, server_peak))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+""" Runs the cloud server on a local port for the benchmarks
+
+Benchmarks that measure the server process on its own run this module as
+a separate process:
+    python -m benchmarks.local_server
+It serves the cloud server backed by the MongoDB stand-in and prints the
+base URL once it accepts connections.
+"""
+import logging
+import sys
+import tempfile
+import threading
+
+from werkzeug.serving import make_server
+
+
+def make_local_server(app):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    return "http://127.0.0.1:{}".format(server.server_port), server
+
+
+def start(app):
+    """ Serves a Flask app from a background thread
+
+    Args:
+        app (Flask): the app to serve
+
+    Returns:
+        str, BaseWSGIServer: the base URL of the server and the server,
+        which can be stopped with its shutdown method
+    """
+    url, server = make_local_server(app)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return url, server
+
+
+def main():
+    from benchmarks import mongo_standin
+    import blob_store
+    import cloud_server
+    mongo_standin.install()
+    cloud_server.patient_store = cloud_server.mongo_patient_store()
+    cloud_server.image_store = blob_store.FileBlobStore(tempfile.mkdtemp())
+    url, server = make_local_server(cloud_server.app)
+    print(url)
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+""" Local MongoDB stand-in used by the benchmarks
+
+The benchmarks cannot reach the Atlas cluster used by cloud_server.py, so
+they register an in-process mongomock database with pymodm instead. The
+database is wrapped so that every collection call that would be a round
+trip to a real server is counted, together with the BSON size of the
+documents sent to the server.
+"""
+import bson
+import mongomock
+import pymodm.connection
+
+WRITE_METHODS = {"insert_one": 0, "replace_one": 1, "update_one": 1,
+                 "update_many": 1, "find_one_and_update": 1}
+READ_METHODS = {"find", "find_one", "aggregate", "count_documents",
+                "distinct"}
+
+
+class Counter:
+    """ Totals of round trips and bytes sent to the database """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.round_trips = 0
+        self.bytes_written = 0
+
+
+class CountingCollection:
+    """ Wraps a mongomock collection and counts its round trips """
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in WRITE_METHODS and name not in READ_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counter.round_trips += 1
+            if name in WRITE_METHODS:
+                document = args[WRITE_METHODS[name]]
+                self._counter.bytes_written += len(bson.encode(document))
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """ Wraps a mongomock database so its collections are counted """
+
+    def __init__(self, database, counter):
+        self._database = database
+        self._counter = counter
+
+    def get_collection(self, name, **kwargs):
+        return CountingCollection(
+            self._database.get_collection(name, **kwargs), self._counter)
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+def install():
+    """ Registers a fresh counting mongomock database with pymodm
+
+    Returns:
+        Counter: the counter that accumulates round trips and bytes
+    """
+    counter = Counter()
+    database = CountingDatabase(mongomock.MongoClient().bench, counter)
+    pymodm.connection._CONNECTIONS[pymodm.connection.DEFAULT_CONNECTION_ALIAS]\
+        = pymodm.connection.ConnectionInfo(parsed_uri=None, conn_string=None,
+                                           database=database)
+    return counter
@@ -0,0 +1,257 @@
+""" Content-addressed storage for patient image bytes
+
+Image bytes are stored once, keyed by the SHA-256 hash of their content, so
+the Patient documents only need to keep small references to them. Two
+backends are provided: a directory on the local filesystem and GridFS in
+the MongoDB database the server is connected to.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+import gridfs
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Number of bytes read at a time from streamed uploads
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data):
+    """ Computes the content hash used as the key of an image
+
+    Args:
+        data (bytes): the image bytes
+
+    Returns:
+        str: the hex SHA-256 digest of the bytes
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_valid_hash(image_hash):
+    """ Checks that a string looks like a key produced by hash_bytes
+
+    Args:
+        image_hash (str): the key to check
+
+    Returns:
+        bool: True if the key is 64 lowercase hex characters
+    """
+    return HASH_PATTERN.match(image_hash) is not None
+
+
+class FileBlobStore:
+    """ Stores blobs as files in a local directory
+
+    Blobs are spread over sub-directories named after the first two
+    characters of their hash so no single directory grows too large.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, image_hash):
+        return os.path.join(self.directory, image_hash[:2], image_hash)
+
+    def put(self, data):
+        """ Stores bytes unless a blob with the same content exists
+
+        Args:
+            data (bytes): the image bytes
+
+        Returns:
+            str, int: the content hash and the size in bytes
+        """
+        image_hash = hash_bytes(data)
+        path = self._path(image_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a
+            # partially written blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as out_file:
+                out_file.write(data)
+            os.replace(tmp_path, path)
+        return image_hash, len(data)
+
+    def put_stream(self, stream, chunk_size=CHUNK_SIZE):
+        """ Stores the bytes read from a stream, one chunk at a time
+
+        The chunks are hashed as they are written to a temporary file, so
+        the content is never held in memory as a whole. The file is then
+        moved to the path of its hash.
+
+        Args:
+            stream (file object): a binary stream, read until it ends
+            chunk_size (int): the number of bytes read at a time
+
+        Returns:
+            str, int: the content hash and the size in bytes
+
+        Raises:
+            ValueError: if the stream is empty, in which case nothing is
+                        stored
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out_file:
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    digest.update(chunk)
+                    out_file.write(chunk)
+                    size += len(chunk)
+            if size == 0:
+                raise ValueError("The stream is empty")
+            path = self._path(digest.hexdigest())
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # An existing blob at this path has the same content
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return digest.hexdigest(), size
+
+    def exists(self, image_hash):
+        return os.path.exists(self._path(image_hash))
+
+    def size(self, image_hash):
+        """ Reads the size of a stored blob
+
+        Args:
+            image_hash (str): the content hash of the blob
+
+        Returns:
+            int or None: the size in bytes, or None if it is not stored
+        """
+        try:
+            return os.path.getsize(self._path(image_hash))
+        except FileNotFoundError:
+            return None
+
+    def open(self, image_hash):
+        """ Opens a stored blob for reading
+
+        Args:
+            image_hash (str): the content hash of the blob
+
+        Returns:
+            file object or None: a binary file object positioned at the
+            start of the blob, or None if it is not stored
+        """
+        try:
+            return open(self._path(image_hash), "rb")
+        except FileNotFoundError:
+            return None
+
+    def local_path(self, image_hash):
+        """ Finds the file of a stored blob, for readers that map it
+
+        Args:
+            image_hash (str): the content hash of the blob
+
+        Returns:
+            str or None: the path of the file, or None if it is not stored
+        """
+        path = self._path(image_hash)
+        return path if os.path.exists(path) else None
+
+
+class GridFSBlobStore:
+    """ Stores blobs in GridFS, using the content hash as the file id """
+
+    def __init__(self, database, collection="images"):
+        self.fs = gridfs.GridFS(database, collection=collection)
+
+    def put(self, data):
+        """ Stores bytes unless a blob with the same content exists
+
+        Args:
+            data (bytes): the image bytes
+
+        Returns:
+            str, int: the content hash and the size in bytes
+        """
+        image_hash = hash_bytes(data)
+        if not self.fs.exists(image_hash):
+            try:
+                self.fs.put(data, _id=image_hash)
+            except gridfs.errors.FileExists:
+                # Another upload stored the same content first
+                pass
+        return image_hash, len(data)
+
+    def put_stream(self, stream, chunk_size=CHUNK_SIZE):
+        """ Stores the bytes read from a stream, one chunk at a time
+
+        GridFS files cannot be renamed once their hash is known, so the
+        chunks are hashed as they are spooled to a temporary file, which
+        is then copied to GridFS in chunks.
+
+        Args:
+            stream (file object): a binary stream, read until it ends
+            chunk_size (int): the number of bytes read at a time
+
+        Returns:
+            str, int: the content hash and the size in bytes
+
+        Raises:
+            ValueError: if the stream is empty, in which case nothing is
+                        stored
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=chunk_size) as spool:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                spool.write(chunk)
+                size += len(chunk)
+            if size == 0:
+                raise ValueError("The stream is empty")
+            image_hash = digest.hexdigest()
+            if not self.fs.exists(image_hash):
+                spool.seek(0)
+                try:
+                    self.fs.put(spool, _id=image_hash)
+                except gridfs.errors.FileExists:
+                    # Another upload stored the same content first
+                    pass
+        return image_hash, size
+
+    def exists(self, image_hash):
+        return self.fs.exists(image_hash)
+
+    def size(self, image_hash):
+        """ Reads the size of a stored blob
+
+        Args:
+            image_hash (str): the content hash of the blob
+
+        Returns:
+            int or None: the size in bytes, or None if it is not stored
+        """
+        grid_file = self.fs.find_one({"_id": image_hash})
+        if grid_file is None:
+            return None
+        return grid_file.length
+
+    def open(self, image_hash):
+        """ Opens a stored blob for reading
+
+        Args:
+            image_hash (str): the content hash of the blob
+
+        Returns:
+            GridOut or None: a file-like object positioned at the start
+            of the blob, or None if it is not stored
+        """
+        try:
+            return self.fs.get(image_hash)
+        except gridfs.errors.NoFile:
+            return None
+
+    def local_path(self, image_hash):
+        # GridFS blobs have no local file
+        return None
@@ -1,13 +1,25 @@
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, make_response
+from flask import Response
 from pymodm import connect
-from pymodm import errors as pymodm_errors
 from pymodm import MongoModel, fields
-from datetime import datetime
+from datetime import datetime, timedelta
 from tkinter import filedialog
+import array
 import base64
+import binascii
+import bisect
+import math
+import os
 import requests
 import ssl
+import threading
+import blob_store
+import ecg_format
+import ecg_jobs
+import record_store
+from patient_events import EventBroadcaster
+from upload_sessions import UploadSessions, is_valid_upload_id
 
 
 class Patient(MongoModel):
@@ -17,24 +29,123 @@ class Patient(MongoModel):
     medical_images = fields.ListField()
     timestamp = fields.ListField()
     heartrate = fields.ListField()
+    ecg_metrics = fields.ListField()
+    revision = fields.IntegerField()
+    changes = fields.ListField()
 
 
 app = Flask(__name__)
+patient_store = record_store.MemoryPatientStore()
+image_store = blob_store.FileBlobStore("image_store")
+upload_sessions = UploadSessions("upload_sessions")
+ecg_job_queue = ecg_jobs.JobQueue("ecg_jobs.sqlite")
+# Started by init_server, so that importing the server starts no process
+ecg_job_workers = None
+patient_events = EventBroadcaster()
+
+# Sorted array of the ids of all patients, None until it is first loaded
+patient_id_cache = None
+patient_id_cache_lock = threading.Lock()
+
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+EVENT_HEARTBEAT = 15
+# Seconds after its last chunk that an unfinished upload session is kept
+UPLOAD_SESSION_MAX_AGE = 7 * 24 * 60 * 60
+
+# Keys of the patient dictionary and the Patient document fields they
+# are read from
+PATIENT_FIELDS = {"Name": "patient_name",
+                  "Rec_No": "_id",
+                  "Med_Img": "medical_images",
+                  "ECG": "ecg_images",
+                  "Heart_Rate": "heartrate",
+                  "Timestamp": "timestamp",
+                  "ECG_Metrics": "ecg_metrics",
+                  "Revision": "revision"}
+LIST_FIELDS = ["Med_Img", "ECG", "Heart_Rate", "Timestamp", "ECG_Metrics"]
+# Metrics of an analyzed ECG recording kept in the "ECG_Metrics" list of
+# the patient, without the times of the beats of the job result
+ECG_METRIC_FIELDS = ["duration", "voltage_extremes", "num_beats",
+                     "mean_hr_bpm"]
+# Largest number of samples of each lead returned by /ecg_recording
+ECG_SLICE_MAX_SAMPLES = 1000000
+# Default and maximum number of ids in a page of /get_all_patient_id
+PATIENT_ID_PAGE_SIZE = 1000
+PATIENT_ID_PAGE_LIMIT = 10000
+# Largest number of patients in a request to /get_patient_summaries
+SUMMARY_IDS_LIMIT = 500
+# Format of the upload times kept in the patient records
+TIMESTAMP_FORMAT = "%m/%d/%Y, %H:%M:%S"
+# Range of the heart rate series returned by /heart_rate when no start
+# is given, in seconds, and number of buckets it is split into when no
+# bucket duration is given
+HEART_RATE_DEFAULT_RANGE = 24 * 60 * 60
+HEART_RATE_DEFAULT_BUCKETS = 300
+# Largest number of buckets of a /heart_rate request
+HEART_RATE_BUCKET_LIMIT = 10000
+# Seconds in each unit of the bucket durations of /heart_rate
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
 
 
 def init_server():
     """ Initializes server conditions
 
-    This function configures the logging functionality and establishes
-    a connection to the specified MongoDB database.
+    This function configures the logging functionality and opens the
+    patient store selected by the PATIENT_PORTAL_STORE environment
+    variable: "mongo" (the default) establishes a connection to the
+    specified MongoDB database, "sqlite" uses the SQLite database file
+    named by PATIENT_PORTAL_SQLITE_PATH ("patients.sqlite" by default) and
+    "memory" keeps the patients in memory until the server stops. Images
+    are stored in the local "image_store" directory unless the
+    PATIENT_PORTAL_IMAGE_STORE environment variable is set to "gridfs",
+    which requires the "mongo" store. Any images still stored inline in
+    patient records are then moved to the image store, heart rates
+    uploaded before the heart rate series existed are added to the
+    series, and upload sessions left unfinished for a week are removed.
+    Finally, the worker processes analyzing uploaded ECG recordings are
+    started, as many as the PATIENT_PORTAL_ECG_WORKERS environment
+    variable or the number of CPUs.
     """
+    global image_store, patient_store, ecg_job_workers
     logging.basicConfig(filename="cloud_server.log", level=logging.DEBUG,
                         filemode='w')
-    print("Connecting to database...")
-    connect("mongodb+srv://bme547classwork:eX8y9F9QFtinXDNU"
-            "@bme547.nkzjd.mongodb.net/myFirstDatabase?"
-            "retryWrites=true&w=majority", ssl_cert_reqs=ssl.CERT_NONE)
-    print("Connection attempt finished")
+    backend = os.environ.get("PATIENT_PORTAL_STORE", "mongo")
+    if backend == "mongo":
+        print("Connecting to database...")
+        connect("mongodb+srv://bme547classwork:eX8y9F9QFtinXDNU"
+                "@bme547.nkzjd.mongodb.net/myFirstDatabase?"
+                "retryWrites=true&w=majority", ssl_cert_reqs=ssl.CERT_NONE)
+        print("Connection attempt finished")
+        patient_store = mongo_patient_store()
+    elif backend == "sqlite":
+        patient_store = record_store.SQLitePatientStore(
+            os.environ.get("PATIENT_PORTAL_SQLITE_PATH", "patients.sqlite"))
+    elif backend == "memory":
+        patient_store = record_store.MemoryPatientStore()
+    else:
+        raise ValueError("Unknown PATIENT_PORTAL_STORE {}".format(backend))
+    if os.environ.get("PATIENT_PORTAL_IMAGE_STORE") == "gridfs":
+        database = Patient._mongometa.collection.database
+        image_store = blob_store.GridFSBlobStore(database)
+    migrate_legacy_images()
+    migrate_heart_rates()
+    upload_sessions.remove_stale(UPLOAD_SESSION_MAX_AGE)
+    workers = os.environ.get("PATIENT_PORTAL_ECG_WORKERS")
+    ecg_job_workers = ecg_jobs.JobWorkers(
+        ecg_job_queue, load_recording, store_ecg_metrics,
+        int(workers) if workers else None)
+    ecg_job_workers.start()
+
+
+def mongo_patient_store():
+    """ Opens the patient store of the MongoDB database connected to with
+    pymodm
+
+    Returns:
+        MongoPatientStore: the store of the Patient collection
+    """
+    return record_store.MongoPatientStore(Patient._mongometa.collection,
+                                          Patient._mongometa.object_name)
 
 
 @app.route("/get_all_patient_id", methods=["GET"])
@@ -42,45 +153,185 @@ def get_all_patient_id():
     """ Handles requests to the /get_all_patient_id route for retrieving
     all the medical record numbers (ids) of patients in the database
 
-    This function calls another function to implement the functionality
-    and receives a dictionary with key "ids" storing a value which is
-    a list of all the patient record numbers, as well as a status code
-    from that function, which it then returns.
+    Without query parameters, all the ids are returned. The ids can also
+    be read in pages, in increasing order: "limit" sets the number of ids
+    in a page and "after" is the last id of the previous page (the "next"
+    value of its response). This function calls another function to
+    implement the functionality and receives a dictionary with key "ids"
+    storing a value which is a list of the patient record numbers, as
+    well as a status code from that function, which it then returns.
+
+    Returns:
+        Response: An error message if the query parameters are not valid
+        or a dictionary containing a list of patient ids, plus a status
+        code. The response is empty with status code 304 if it matches
+        the ETag sent by the client in "If-None-Match".
+    """
+    after, limit, status_code = parse_page_args(request.args)
+    if status_code != 200:
+        return after, status_code
+    patient_id_dict, status_code = get_all_patient_id_driver(after, limit)
+    return conditional_response(patient_id_dict, status_code)
+
+
+def is_decimal(text):
+    """ Checks that a query parameter is a non-negative integer
+
+    str.isdigit also accepts characters such as "²" that int() cannot
+    convert, so only ASCII decimal digits are accepted.
+
+    Args:
+        text (str): the value of the query parameter
 
     Returns:
-        dict/str, str: An error message if no patients were found in the
-        database or a dictionary containing a list of patient ids, plus
-        a status code.
+        bool: True if the text is made of ASCII digits 0 to 9
     """
-    patient_id_dict, status_code = get_all_patient_id_driver()
-    return patient_id_dict, 200
+    return text.isdecimal() and text.isascii()
+
 
+def parse_page_args(args):
+    """ Reads the "after" and "limit" query parameters of a request
+
+    Args:
+        args (dict): the query parameters of the request
 
-def get_all_patient_id_driver():
+    Returns:
+        int or None or str, int or None, int: the id the page starts after
+        and the number of ids in the page (both None if neither is given)
+        with a status code of 200, or an error message, None and 400 if
+        either parameter is not valid
+    """
+    if "after" not in args and "limit" not in args:
+        return None, None, 200
+    after = None
+    if "after" in args:
+        after, status_code = validate_convert_patient_id(args["after"])
+        if status_code != 200:
+            return "after must be a patient id", None, 400
+    limit = PATIENT_ID_PAGE_SIZE
+    if "limit" in args:
+        if is_decimal(args["limit"]) is False or int(args["limit"]) == 0:
+            return "limit must be a positive integer", None, 400
+        limit = min(int(args["limit"]), PATIENT_ID_PAGE_LIMIT)
+    return after, limit, 200
+
+
+def get_all_patient_id_driver(after=None, limit=None):
     """ Implements the /get_all_patient_id route to obtain all patient
     medical record numbers
 
-    This function implements the /get_all_patient_id route. The function
-    retrieves all patients from the database. If patients are found,
-    then the function makes a list of all the patient ids, and stores
-    this list in a dictionary which can be accessed as a value. The
-    dictionary and status are returned. If no patients are found, the
-    function returns an error message with the status.
+    This function implements the /get_all_patient_id route. The ids are
+    read from the in-process cache of patient ids, so the patient
+    documents are not read from the database. If a page is requested, the
+    dictionary also has a key "next" with the id to pass as "after" for
+    the following page, or None on the last page.
+
+    Args:
+        after (int): only return ids greater than this one, or None to
+                     start with the smallest id
+        limit (int): the maximum number of ids to return, or None to
+                     return all ids without paging
 
     Returns:
-        dict or str, str: An error message if no patients were found in the
-        database or a dictionary containing a list of patient ids, plus
-        a status code.
+        dict, int: a dictionary containing a list of patient ids, plus
+        a status code of 200
     """
-    try:
-        patients = Patient.objects.raw({})
-    except pymodm_errors.DoesNotExist:
-        return "No patients were found", 400
-    patient_id_list = []
-    for patient in patients:
-        patient_id_list.append(patient.patient_id)
-    patient_id_dict = {"ids": patient_id_list}
-    return patient_id_dict, 200
+    if limit is None:
+        return {"ids": get_patient_ids()}, 200
+    patient_ids = get_patient_ids(after, limit + 1)
+    next_id = None
+    if len(patient_ids) > limit:
+        patient_ids = patient_ids[:limit]
+        next_id = patient_ids[-1]
+    return {"ids": patient_ids, "next": next_id}, 200
+
+
+def get_patient_ids(after=None, limit=None):
+    """ Reads patient ids in increasing order from the patient id cache
+
+    The cache holds the sorted ids of all patients in a compact array. It
+    is loaded from the patient store on first use and patients created
+    by /new_patient are added to it, so it stays in step with the
+    database as long as all writes go through this server process.
+
+    Args:
+        after (int): only return ids greater than this one, or None to
+                     start with the smallest id
+        limit (int): the maximum number of ids to return, or None for all
+
+    Returns:
+        list: the patient ids
+    """
+    global patient_id_cache
+    with patient_id_cache_lock:
+        if patient_id_cache is None:
+            patient_id_cache = load_patient_ids()
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(patient_id_cache, after)
+        end = len(patient_id_cache)
+        if limit is not None:
+            end = min(end, start + limit)
+        return patient_id_cache[start:end].tolist()
+
+
+def load_patient_ids():
+    """ Reads the ids of all patients from the patient store
+
+    Returns:
+        array.array: the sorted patient ids
+    """
+    return array.array("q", patient_store.list_patient_ids())
+
+
+def add_patient_id(patient_id):
+    """ Adds the id of a new patient to the patient id cache
+
+    Args:
+        patient_id (int): the id of the patient
+    """
+    with patient_id_cache_lock:
+        if patient_id_cache is None:
+            return
+        index = bisect.bisect_left(patient_id_cache, patient_id)
+        if (index == len(patient_id_cache)
+                or patient_id_cache[index] != patient_id):
+            patient_id_cache.insert(index, patient_id)
+
+
+def invalidate_patient_id_cache():
+    """ Empties the patient id cache so it is reloaded on its next use
+
+    Needed after patients are removed from the database, or written to it
+    other than through this server process.
+    """
+    global patient_id_cache
+    with patient_id_cache_lock:
+        patient_id_cache = None
+
+
+def conditional_response(body, status_code):
+    """ Makes a response that can be revalidated with its ETag
+
+    A successful response gets a strong ETag computed from the hash of its
+    content. If the client sent the same ETag in an "If-None-Match"
+    header, it already holds this content and the body is replaced by an
+    empty 304 response. "Cache-Control: no-cache" lets clients keep the
+    response but makes them revalidate it before every use.
+
+    Args:
+        body (dict or str): the content of the response
+        status_code (int): the status code of the response
+
+    Returns:
+        Response: the response to return from the route
+    """
+    response = make_response(body, status_code)
+    if status_code == 200:
+        response.cache_control.no_cache = True
+        response.add_etag()
+        response.make_conditional(request)
+    return response
 
 
 @app.route("/new_patient", methods=["POST"])
@@ -95,6 +346,10 @@ def new_patient_handler():
     Other "keys" and "values" that may be included are "Name" (name of
     patient), "Med_Img" (image filename encoded in b64), "ECG" (image
     filename encoded in 64), and "Heart_Rate" (heart rate measurement).
+    Instead of a b64-string, an image can be a dictionary {"hash": str}
+    holding the hash returned when it was uploaded to the /image route.
+    An ECG dictionary may also hold {"recording": {"hash": str}}, the
+    hash of the raw samples uploaded as a binary ECG container.
 
     The function then calls a driver function that implements the
     functionality of this route and receives an "answer", "time", and
@@ -108,6 +363,8 @@ def new_patient_handler():
     """
     in_data = request.get_json()
     answer, time, status_code = new_patient_driver(in_data)
+    if status_code != 200:
+        return jsonify(answer), status_code
     message = "Entered information uploaded to server @ " + time
     return jsonify(message), status_code
 
@@ -124,20 +381,20 @@ def new_patient_driver(in_data):
     The function first calls a validation function to ensure that the needed
     key/value (patient medical record number) exists in the dictionary, then
     calls a function to add the patient data to the database. The function
-    then returns to the caller the patient (as a MongoDB Patient object), time
-    at which the patient was added or updated, and a status code of 200. If
-    there was a validation problem, the function returns an error message with
-    a status code of 400.
+    then returns to the caller the patient id, time at which the patient was
+    added or updated, and a status code of 200. If there was a validation
+    problem, the function returns an error message with a status code of
+    400.
 
     Args:
         in_data (any type): the input data received by the route. Ideally,
         it is a dictionary.
 
     Returns:
-        Patient, (str), int: If successfully added to the database, the Patient
-                           object, time at which the patient was added/updated,
-                           and status code. If not, an error message followed
-                           by a status code.
+        int, (str), int: If successfully added to the database, the patient
+                         id, time at which the patient was added/updated,
+                         and status code. If not, an error message followed
+                         by a status code.
     """
     answer, status_code = validate_server_input(in_data)
     answer, time, status_code = update_patient_info_driver(in_data, answer)
@@ -171,39 +428,29 @@ def validate_server_input(in_data):
 def update_patient_info_driver(in_data, validated):
     """ Adds a new patient or updates an existing patient in the database
 
-    This function calls another function that checks whether the patient id
-    exists in the database. If the patient id exists, the function returns
-    "True", this function retrieves the Patient object with the specified id
-    and calls another function to update the patient information. If the
-    patient id does not exist, the called function returns "False", a new
-    Patient object is initialized then updated with the provided information.
-    The function then returns the saved patient, the time at which the
+    If the input data was validated, this function calls another function
+    that adds the new information to the patient record in a single
+    atomic upsert, creating the record if the patient id does not exist
+    yet. The function then returns the patient id, the time at which the
     patient was added or updated, and a status code of 200. If there was a
-    validation problem, the function returns the boolean False, followed by
-    the time and status code 400.
+    validation problem, the function returns the validation message,
+    followed by an empty time and status code 400.
 
     Args:
         in_data: the input data received by the route. Ideally,
         it is a dictionary.
+        validated (bool or str): True if the input data was validated,
+        otherwise the validation error message
 
     Returns:
-        Patient or str, str, int: if successfully added to the database,
-                                  the Patient object and if not, an error
-                                  message, followed by the time at which the
-                                  patient was added/updated and status code
+        int or str, str, int: if successfully added to the database,
+                              the patient id and if not, an error
+                              message, followed by the time at which the
+                              patient was added/updated and status code
         """
     if validated is True:
-        if patient_exist(in_data):
-            old_patient = Patient.objects.raw(
-                {"_id": int(in_data["Rec_No"])}).first()
-            answer, time, status_code = \
-                update_patient_info(in_data, old_patient)
-            return answer, time, status_code
-        else:
-            new_patient = Patient(patient_id=in_data["Rec_No"])
-            answer, time, status_code = \
-                update_patient_info(in_data, new_patient)
-            return answer, time, status_code
+        answer, time, status_code = update_patient_info(in_data)
+        return answer, time, status_code
     time = ''
     return validated, time, 400
 
@@ -211,7 +458,7 @@ def update_patient_info_driver(in_data, validated):
 def patient_exist(in_data):
     """ Checks if patient id exists in database
 
-    This function searches the database for a Patient object which matches
+    This function searches the patient store for a patient which matches
     the specified patient id.
 
     Args:
@@ -219,49 +466,340 @@ def patient_exist(in_data):
         it is a dictionary.
 
     Returns:
-        bool: True if patient id exists in database, False if not
+        bool: True if patient id exists in database, False if not or if
+              the patient id is not an integer
     """
-    try:
-        db_item = Patient.objects.raw({"_id": int(in_data["Rec_No"])}).first()
-    except pymodm_errors.DoesNotExist:
+    patient_id, status_code = validate_convert_patient_id(in_data["Rec_No"])
+    if status_code != 200:
         return False
-    return True
+    patient = patient_store.get_patient(patient_id, ["_id"])
+    return patient is not None
 
 
-def update_patient_info(in_data, patient):
-    """ Updates the patient with the specified patient id
+def make_patient_update(in_data, now):
+    """ Builds the changes to a patient record for an upload
 
-    This function updates and saves the Patient object with the new
-    information. If a new name is provided, the name is changed. If a new
-    medical image, ECG image, or heart rate is provided, it is added to the
-    patient record (list). When updating the ECG record with a new image,
-    a timestamp with the current time is added to the patient's timestamp
-    record.
+    A new name replaces the old one. A new medical image, ECG image, or
+    heart rate is appended to the matching list, and an ECG image also
+    appends the upload time to the patient's timestamp record. If a list
+    of values is given, each of them is appended. Only the new entries
+    are passed to the patient store, so the existing images in the record
+    are never rewritten.
+
+    Every upload also increments the patient's revision number and records
+    a change entry holding the new values, keyed like the patient
+    dictionary, from which the entries added after a revision are read.
 
     Args:
         in_data: the input data received by the route. Ideally,
         it is a dictionary.
-        patient: the existing patient (Patient object) with the specified
-        patient id
+        now (str): the upload time, formatted as "%m/%d/%Y, %H:%M:%S"
 
     Returns:
-        Patient, str, int: the Patient object, followed by the time at which
-        the patient was updated and status code 200
+        str or None, dict, dict: the new name (None to keep the old one),
+        the new entries of each list field of the record, and the change
+        entry
     """
-    now = datetime.now()
-    now = now.strftime("%m/%d/%Y, %H:%M:%S")
+    name = None
+    change = {}
     for key in in_data:
         if key == "Name":
-            patient.patient_name = in_data["Name"]
-        elif key == "Med_Img":
-            patient.medical_images.append(in_data["Med_Img"])
-        elif key == "ECG":
-            patient.ecg_images.append(in_data["ECG"])
-            patient.timestamp.append(now)
-        elif key == "Heart_Rate":
-            patient.heartrate.append(in_data["Heart_Rate"])
-    saved_patient = patient.save()
-    return saved_patient, now, 200
+            name = in_data["Name"]
+            change["Name"] = name
+        elif key in ["Med_Img", "ECG", "Heart_Rate"]:
+            change[key] = as_list(in_data[key])
+    if "ECG" in change:
+        change["Timestamp"] = [now] * len(change["ECG"])
+    entries = {PATIENT_FIELDS[key]: change[key] for key in LIST_FIELDS
+               if key in change}
+    return name, entries, change
+
+
+def as_list(value):
+    """ Returns a list of values unchanged, or a single value in a list
+
+    Args:
+        value: a single value or a list of values
+
+    Returns:
+        list: the values
+    """
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def store_image(image, now):
+    """ Stores an uploaded image and returns a reference to it
+
+    An image sent as a b64-string is decoded and the image bytes are
+    written to the image store, which keeps a single copy of any content.
+    An image already uploaded to the /image route is sent as a dictionary
+    with its "hash" instead, and only needs to be found in the store. The
+    reference is what the patient record keeps in place of the image.
+
+    Args:
+        image (str or dict): the image file encoded in b64-format, or a
+                             dictionary with the hash of an uploaded image
+        now (str): the upload time, formatted as "%m/%d/%Y, %H:%M:%S"
+
+    Returns:
+        dict: the image reference with keys "hash", "size" and "timestamp"
+
+    Raises:
+        binascii.Error: if the b64-string is not valid
+        LookupError: if the uploaded image is not in the image store
+    """
+    if isinstance(image, dict):
+        image_hash = image.get("hash")
+        size = None
+        if isinstance(image_hash, str) and blob_store.is_valid_hash(
+                image_hash):
+            size = image_store.size(image_hash)
+        if size is None:
+            raise LookupError("Image {} was not uploaded".format(image_hash))
+        return {"hash": image_hash, "size": size, "timestamp": now}
+    image_bytes = base64.b64decode(image, validate=True)
+    image_hash, size = image_store.put(image_bytes)
+    return {"hash": image_hash, "size": size, "timestamp": now}
+
+
+def store_patient_images(in_data, now):
+    """ Replaces the images in the input data with image references
+
+    Args:
+        in_data: the input data received by the route. Ideally,
+        it is a dictionary.
+        now (str): the upload time, formatted as "%m/%d/%Y, %H:%M:%S"
+
+    Returns:
+        dict: a copy of the input data where "ECG" and "Med_Img" hold the
+        references returned by store_image
+    """
+    stored = dict(in_data)
+    for key in ["ECG", "Med_Img"]:
+        if key not in stored:
+            continue
+        if isinstance(stored[key], list):
+            stored[key] = [store_image(image, now) for image in stored[key]]
+        else:
+            stored[key] = store_image(stored[key], now)
+    for image, reference in zip(as_list(in_data.get("ECG", [])),
+                                as_list(stored.get("ECG", []))):
+        if isinstance(image, dict) and "recording" in image:
+            reference["recording"] = store_recording(image["recording"])
+    return stored
+
+
+def store_recording(recording):
+    """ Finds an uploaded ECG container and describes its samples
+
+    The container must have been uploaded to the /image route or in
+    chunks, like an image. Only its header is read.
+
+    Args:
+        recording (dict): {"hash": str}, the hash returned by the upload
+
+    Returns:
+        dict: the recording reference with keys "hash", "size",
+        "sampling_frequency", "sample_count", "lead_count", "units" and
+        "encoding"
+
+    Raises:
+        LookupError: if the container is not in the image store
+        ValueError: if the uploaded file is not a valid container
+    """
+    recording_hash = recording.get("hash") if isinstance(
+        recording, dict) else None
+    recording_file = None
+    if isinstance(recording_hash, str) and blob_store.is_valid_hash(
+            recording_hash):
+        recording_file = image_store.open(recording_hash)
+    if recording_file is None:
+        raise LookupError("ECG recording {} was not uploaded"
+                          .format(recording_hash))
+    with ecg_format.open_recording(recording_file) as ecg_recording:
+        return {"hash": recording_hash,
+                "size": image_store.size(recording_hash),
+                "sampling_frequency": ecg_recording.sampling_frequency,
+                "sample_count": ecg_recording.sample_count,
+                "lead_count": ecg_recording.lead_count,
+                "units": ecg_recording.units,
+                "encoding": ecg_recording.encoding}
+
+
+def update_patient_info(in_data):
+    """ Updates the patient with the specified patient id
+
+    This function moves any uploaded images to the image store, then
+    applies the changes built by make_patient_update to the patient record
+    in a single atomic operation of the patient store, which creates the
+    record if the patient id does not exist yet. Concurrent uploads for
+    the same patient therefore cannot overwrite each other's entries. A
+    new patient is added to the cache of patient ids. The new revision of
+    the patient is then published to the monitors connected to
+    /patient_events. Each uploaded ECG recording gets a held analysis job,
+    whose id is kept in the recording reference; the jobs are released to
+    the workers once the record is written, and discarded if the write
+    fails, so no job runs for an upload that was not stored. The heart
+    rates are also added to the heart rate series of the patient, with
+    the upload time.
+
+    Args:
+        in_data: the input data received by the route. Ideally,
+        it is a dictionary.
+
+    Returns:
+        int or str, str, int: the patient id, followed by the time at which
+        the patient was updated and status code 200. If the patient id is
+        not an integer, or an uploaded image or ECG recording could not be
+        decoded or found, an error message, an empty time and 400.
+    """
+    patient_id, status_code = validate_convert_patient_id(in_data["Rec_No"])
+    if status_code != 200:
+        return patient_id, "", status_code
+    upload_time = datetime.now()
+    now = upload_time.strftime(TIMESTAMP_FORMAT)
+    try:
+        in_data = store_patient_images(in_data, now)
+    except binascii.Error:
+        return "Uploaded image was not valid base64", '', 400
+    except LookupError as error:
+        return str(error), '', 400
+    except ValueError as error:
+        return "Uploaded ECG recording is not valid: {}".format(error), \
+            '', 400
+    job_ids = []
+    for reference in as_list(in_data.get("ECG", [])):
+        if "recording" in reference:
+            reference["recording"]["job_id"] = ecg_job_queue.enqueue(
+                patient_id, reference["recording"]["hash"], held=True)
+            job_ids.append(reference["recording"]["job_id"])
+    name, entries, change = make_patient_update(in_data, now)
+    try:
+        revision = patient_store.update_patient(
+            patient_id, name, entries, change,
+            make_heart_rate_series(change, upload_time))
+    except BaseException:
+        ecg_job_queue.discard(job_ids)
+        raise
+    if job_ids:
+        release_ecg_jobs(job_ids)
+    if revision == 1:
+        add_patient_id(patient_id)
+    patient_events.publish({"Rec_No": patient_id,
+                            "Revision": revision,
+                            "Timestamp": now})
+    return patient_id, now, 200
+
+
+def make_heart_rate_series(change, time):
+    """ Makes the heart rate series measurements of an upload
+
+    Args:
+        change (dict): the change entry of the upload, as made by
+                       make_patient_update
+        time (datetime): the upload time
+
+    Returns:
+        list: the (datetime, float) time and value of each heart rate of
+        the upload that is a number or a string holding one
+    """
+    heart_rates = []
+    for value in change.get("Heart_Rate", []):
+        if isinstance(value, bool):
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(value):
+            heart_rates.append((time, value))
+    return heart_rates
+
+
+def enqueue_ecg_job(patient_id, recording_hash):
+    """ Queues the analysis of an uploaded ECG recording
+
+    Args:
+        patient_id (int): the patient the metrics are written to
+        recording_hash (str): the content hash of the recording
+
+    Returns:
+        int: the id of the job
+    """
+    job_id = ecg_job_queue.enqueue(patient_id, recording_hash)
+    if ecg_job_workers is not None:
+        ecg_job_workers.notify()
+    return job_id
+
+
+def release_ecg_jobs(job_ids):
+    """ Queues the held analysis jobs of an upload that was written
+
+    Args:
+        job_ids (list): the ids of the jobs
+    """
+    ecg_job_queue.release(job_ids)
+    if ecg_job_workers is not None:
+        ecg_job_workers.notify()
+
+
+def load_recording(recording_hash):
+    """ Finds an ECG recording for a worker process of the job queue
+
+    Args:
+        recording_hash (str): the content hash of the recording
+
+    Returns:
+        str or bytes: the path of the recording, which the worker maps in
+        memory, or its content if the image store has no local files
+
+    Raises:
+        LookupError: if the recording is not in the image store
+    """
+    path = image_store.local_path(recording_hash)
+    if path is not None:
+        return path
+    recording_file = image_store.open(recording_hash)
+    if recording_file is None:
+        raise LookupError("ECG recording {} was not found"
+                          .format(recording_hash))
+    with recording_file:
+        return recording_file.read()
+
+
+def store_ecg_metrics(job, metrics):
+    """ Adds the metrics of an analyzed ECG recording to the patient record
+
+    The scalar metrics in ECG_METRIC_FIELDS are appended to the patient's
+    "ECG_Metrics" list, with the hash of the recording, the id of the job
+    and the time of the analysis, and the new revision is published to the
+    monitors. The times of the beats grow with the recording, so they are
+    only kept in the result of the job, read from /ecg_jobs/<job_id>. The
+    patient is not created: the metrics of a patient that was not found
+    are dropped.
+
+    Args:
+        job (dict): the job of the recording, as returned by
+                    ecg_jobs.JobQueue.get
+        metrics (dict): the metrics computed by ecg.make_metrics
+    """
+    now = datetime.now().strftime(TIMESTAMP_FORMAT)
+    entry = {key: metrics[key] for key in ECG_METRIC_FIELDS}
+    entry.update(recording=job["recording"], job_id=job["job_id"],
+                 timestamp=now)
+    revision = patient_store.update_patient(
+        job["patient_id"], None, {"ecg_metrics": [entry]},
+        {"ECG_Metrics": [entry]}, create=False)
+    if revision is None:
+        logging.warning("Dropped the metrics of ECG job {}: patient {} "
+                        "was not found".format(job["job_id"],
+                                               job["patient_id"]))
+        return
+    patient_events.publish({"Rec_No": job["patient_id"],
+                            "Revision": revision,
+                            "Timestamp": now})
 
 
 @app.route("/get_patient_info/<patient_id>", methods=["GET"])
@@ -270,39 +808,356 @@ def get_patient_info_handler(patient_id):
     retrieving patient information
 
     This function implements a GET route with a variable URL. The
-    desired patient id number is included as part of the URL. The
-    function calls another function to implement the functionality
-    and receives a dictionary and status code from that function,
-    which it then returns.
+    desired patient id number is included as part of the URL. Two
+    optional query parameters limit the response: "fields" is a
+    comma-separated list of the keys to return (for example
+    "fields=Name,Heart_Rate") and "last" returns only the last N entries
+    of each list. A client that already holds the patient at some
+    revision can pass it as "since" to receive only the entries added
+    after it. The function calls another function to implement the
+    functionality and receives a dictionary and status code from that
+    function, which it then returns.
 
     Args:
         patient_id (str): the patient id taken from the variable URL
 
     Returns:
-        dict/str, int: a dictionary containing patient information or
-                       an error message, plus a status code
+        Response: a dictionary containing patient information or an error
+                  message, plus a status code. The response is empty with
+                  status code 304 if it matches the ETag sent by the
+                  client in "If-None-Match".
     """
-    dict, status_code = get_patient_info_driver(patient_id)
-    return dict, status_code
+    fields, last, status_code = parse_projection_args(request.args)
+    if status_code != 200:
+        return fields, status_code
+    since, status_code = parse_since_arg(request.args)
+    if status_code != 200:
+        return since, status_code
+    dict, status_code = get_patient_info_driver(patient_id, fields, last,
+                                                since)
+    return conditional_response(dict, status_code)
+
+
+@app.route("/get_patient_summary/<patient_id>", methods=["GET"])
+def get_patient_summary_handler(patient_id):
+    """ Handles requests to the /get_patient_summary route for
+    retrieving the latest patient information
+
+    This function implements a GET route with a variable URL. It returns
+    the same keys as the /get_patient_info route, but each list only holds
+    its latest entry, so the response stays small however many uploads
+    the patient has.
+
+    Args:
+        patient_id (str): the patient id taken from the variable URL
+
+    Returns:
+        Response: a dictionary containing the latest patient information
+                  or an error message, plus a status code. The response is
+                  empty with status code 304 if it matches the ETag sent
+                  by the client in "If-None-Match".
+    """
+    dict, status_code = get_patient_info_driver(patient_id, last=1)
+    return conditional_response(dict, status_code)
+
+
+@app.route("/get_patient_summaries", methods=["GET"])
+def get_patient_summaries_handler():
+    """ Handles requests to the /get_patient_summaries route for
+    retrieving the latest information of many patients at once
+
+    This function implements a GET route with a required "ids" query
+    parameter, a comma-separated list of up to SUMMARY_IDS_LIMIT patient
+    ids (for example "ids=1,2,3"), and an optional "fields" parameter as
+    in the /get_patient_info route. Each patient is summarized as in the
+    /get_patient_summary route, and all of them are read from the patient
+    store in a single query, so a dashboard of many patients needs a
+    single request to refresh. A summary holds only the last entry of
+    each list, so the "last" parameter is refused.
+
+    Returns:
+        Response: a dictionary with the summaries in "patients", in the
+                  order of the requested ids, and the requested ids that
+                  were not found in "missing", or an error message, plus
+                  a status code. The response is empty with status code
+                  304 if it matches the ETag sent by the client in
+                  "If-None-Match".
+    """
+    patient_ids, status_code = parse_ids_arg(request.args)
+    if status_code != 200:
+        return patient_ids, status_code
+    if "last" in request.args:
+        return "last is not supported by /get_patient_summaries", 400
+    fields, last, status_code = parse_projection_args(request.args)
+    if status_code != 200:
+        return fields, status_code
+    dict, status_code = get_patient_summaries_driver(patient_ids, fields)
+    return conditional_response(dict, status_code)
+
+
+def parse_ids_arg(args):
+    """ Reads the "ids" query parameter of a request
+
+    Args:
+        args (dict): the query parameters of the request
+
+    Returns:
+        list or str, int: the requested patient ids, without duplicates,
+        with a status code of 200, or an error message and 400 if the
+        parameter is missing or not valid
+    """
+    if args.get("ids", "") == "":
+        return "ids must list at least one patient id", 400
+    patient_ids = []
+    for patient_id in args["ids"].split(","):
+        answer, status_code = validate_convert_patient_id(patient_id)
+        if status_code != 200:
+            return answer, status_code
+        patient_ids.append(answer)
+    patient_ids = list(dict.fromkeys(patient_ids))
+    if len(patient_ids) > SUMMARY_IDS_LIMIT:
+        return "ids must list at most {} patient ids".format(
+            SUMMARY_IDS_LIMIT), 400
+    return patient_ids, 200
+
+
+def get_patient_summaries_driver(patient_ids, fields=None):
+    """ Implements the /get_patient_summaries route to obtain the latest
+    information of many patients
+
+    The patients are read from the patient store at once, with only the
+    latest entry of each list, and each of them is stored in a dictionary
+    with the same keys as the /get_patient_summary route. "Rec_No" is
+    always included, so the summaries can be told apart.
+
+    Args:
+        patient_ids (list): the patient ids, as integers
+        fields (list): the keys of the patient dictionaries to return, or
+                       None to return all keys
+
+    Returns:
+        dict, int: the summaries of the patients found in "patients", in
+        the order of patient_ids, and the ids not found in "missing", plus
+        a status code of 200
+    """
+    if fields is not None and "Rec_No" not in fields:
+        fields = ["Rec_No"] + fields
+    patients = patient_store.get_patients(
+        patient_ids, make_document_fields(fields), last=1)
+    return {"patients": [make_patient_into_dict(patients[patient_id], fields)
+                         for patient_id in patient_ids
+                         if patient_id in patients],
+            "missing": [patient_id for patient_id in patient_ids
+                        if patient_id not in patients]}, 200
+
+
+@app.route("/heart_rate/<patient_id>", methods=["GET"])
+def get_heart_rate_handler(patient_id):
+    """ Handles requests to the /heart_rate route for retrieving the
+    heart rates of a patient over a range of time
+
+    This function implements a GET route with a variable URL and three
+    optional query parameters: "start" and "end", the range of the
+    measurements as ISO 8601 times in the server's local time (for
+    example "2022-04-13T15:00:00"), and "bucket", the duration the range
+    is split into, in seconds or with a unit s, m, h or d (for example
+    "300" or "5m"). The range ends now and starts
+    HEART_RATE_DEFAULT_RANGE seconds before its end by default, and is
+    split into HEART_RATE_DEFAULT_BUCKETS buckets by default. The
+    buckets are aggregated by the patient store, so a range of months
+    returns a few hundred values however many measurements it holds.
+
+    Args:
+        patient_id (str): the patient id taken from the variable URL
+
+    Returns:
+        Response: a dictionary with the "Rec_No" of the patient, the
+                  "start", "end" and "bucket" seconds of the range, and
+                  the "buckets" holding measurements, each with its
+                  "start" time, the "min", "mean" and "max" heart rate and
+                  the "count" of measurements, or an error message, plus a
+                  status code. The response is empty with status code 304
+                  if it matches the ETag sent by the client in
+                  "If-None-Match".
+    """
+    answer, status_code = parse_heart_rate_args(request.args,
+                                                datetime.now())
+    if status_code != 200:
+        return answer, status_code
+    start, end, bucket = answer
+    dict, status_code = get_heart_rate_driver(patient_id, start, end, bucket)
+    return conditional_response(dict, status_code)
+
+
+def parse_heart_rate_args(args, now):
+    """ Reads the "start", "end" and "bucket" query parameters of a
+    request to the /heart_rate route
+
+    Args:
+        args (dict): the query parameters of the request
+        now (datetime): the current time, the default end of the range
+
+    Returns:
+        tuple or str, int: the (datetime, datetime, int) start, end and
+        bucket seconds of the range with a status code of 200, or an error
+        message and 400 if a parameter is not valid
+    """
+    times = {"start": None, "end": now}
+    for key in times:
+        if key not in args:
+            continue
+        try:
+            time = datetime.fromisoformat(args[key])
+        except ValueError:
+            return "{} must be an ISO 8601 time".format(key), 400
+        if time.tzinfo is not None:
+            time = time.astimezone().replace(tzinfo=None)
+        times[key] = time
+    start, end = times["start"], times["end"]
+    if start is None:
+        start = end - timedelta(seconds=HEART_RATE_DEFAULT_RANGE)
+    if start >= end:
+        return "start must be before end", 400
+    seconds = (end - start).total_seconds()
+    if "bucket" in args:
+        bucket = parse_duration(args["bucket"])
+        if bucket is None:
+            return "bucket must be a positive number of seconds, " \
+                "optionally followed by s, m, h or d", 400
+    else:
+        bucket = max(1, -int(-seconds // HEART_RATE_DEFAULT_BUCKETS))
+    if seconds / bucket > HEART_RATE_BUCKET_LIMIT:
+        return "The range holds more than {} buckets".format(
+            HEART_RATE_BUCKET_LIMIT), 400
+    return (start, end, bucket), 200
+
+
+def parse_duration(duration):
+    """ Reads a duration such as "300", "30s", "5m", "1h" or "7d"
+
+    Args:
+        duration (str): a positive integer, optionally followed by a unit
+                        of DURATION_UNITS
+
+    Returns:
+        int or None: the duration in seconds, or None if it is not valid
+    """
+    unit = 1
+    if duration[-1:] in DURATION_UNITS:
+        unit = DURATION_UNITS[duration[-1]]
+        duration = duration[:-1]
+    if duration.isdecimal() is False or duration.isascii() is False:
+        return None
+    if int(duration) == 0:
+        return None
+    return int(duration) * unit
+
+
+def get_heart_rate_driver(patient_id, start, end, bucket):
+    """ Implements the /heart_rate route to obtain the heart rates of a
+    patient aggregated over a range of time
+
+    Args:
+        patient_id (str): the patient id taken from the variable URL
+        start (datetime): the start of the range
+        end (datetime): the end of the range, excluded
+        bucket (int): the duration of a bucket, in seconds
+
+    Returns:
+        dict or str, int: the buckets of the range with a status code of
+        200, or an error message and 400 if the patient id is not valid
+        or not found
+    """
+    answer, status_code = validate_convert_patient_id(patient_id)
+    if status_code != 200:
+        return answer, status_code
+    if patient_store.get_patient(answer, ["_id"]) is None:
+        return "Patient_id {} was not found".format(answer), 400
+    buckets = patient_store.get_heart_rate_buckets(answer, start, end,
+                                                   bucket)
+    for entry in buckets:
+        entry["start"] = (start + timedelta(
+            seconds=entry.pop("bucket") * bucket)).isoformat()
+    return {"Rec_No": answer, "start": start.isoformat(),
+            "end": end.isoformat(), "bucket": bucket,
+            "buckets": [{key: entry[key] for key in
+                         ["start", "min", "mean", "max", "count"]}
+                        for entry in buckets]}, 200
+
+
+def parse_projection_args(args):
+    """ Reads the "fields" and "last" query parameters of a request
+
+    Args:
+        args (dict): the query parameters of the request
+
+    Returns:
+        list or None or str, int or None, int: the requested keys (None for
+        all keys) and number of list entries (None for all entries) with a
+        status code of 200, or an error message, None and 400 if either
+        parameter is not valid
+    """
+    fields = None
+    if "fields" in args:
+        fields = args["fields"].split(",")
+        unknown = [key for key in fields if key not in PATIENT_FIELDS]
+        if len(unknown) != 0:
+            return "Unknown fields: {}".format(", ".join(unknown)), None, 400
+    last = None
+    if "last" in args:
+        if is_decimal(args["last"]) is False or int(args["last"]) == 0:
+            return "last must be a positive integer", None, 400
+        last = int(args["last"])
+    return fields, last, 200
+
+
+def parse_since_arg(args):
+    """ Reads the "since" query parameter of a request
+
+    Args:
+        args (dict): the query parameters of the request
+
+    Returns:
+        int or None or str, int: the revision the client already holds
+        (None if not given) with a status code of 200, or an error message
+        and 400 if the parameter is not valid
+    """
+    if "since" not in args:
+        return None, 200
+    if is_decimal(args["since"]) is False:
+        return "since must be a revision number", 400
+    if "last" in args:
+        return "since cannot be combined with last", 400
+    return int(args["since"]), 200
 
 
-def get_patient_info_driver(patient_id):
+def get_patient_info_driver(patient_id, fields=None, last=None,
+                            since=None):
     """ Implements the /get_patient_info route to obtain all patient
     information
 
     This function implements the /get_patient_info route. The function
     first calls a validation function to ensure that the specified patient
     id is a number, then calls another function to retrieve the patient
-    (as a MongoDB Patient object) from the database. Then, another function
-    is called to extract information from the Patient object and store it
-    in a dictionary format.
+    record from the patient store. Only the requested fields, and only the
+    last entries of their lists, are read from the store. Then, another
+    function is called to extract information from the patient record and
+    store it in a dictionary format.
 
     The function then returns to the caller the dictionary containing the
     patient information and a status code of 200. If there was a validation
     problem, the function returns an error message with a status code of 400.
+    If a revision is given in "since", another function is called to
+    return only the changes made after it.
 
     Args:
         patient_id (str): the patient id taken from the variable URL
+        fields (list): the keys of the patient dictionary to return, or
+                       None to return all keys
+        last (int): the number of latest list entries to return, or None
+                    to return every entry
+        since (int): the revision of the patient the client already holds,
+                     or None to return the whole patient
 
     Returns:
         dict or str, str: An error message if there was a validation problem
@@ -311,11 +1166,78 @@ def get_patient_info_driver(patient_id):
     answer, status_code = validate_convert_patient_id(patient_id)
     if status_code != 200:
         return answer, status_code
-    patient, status_code = get_patient_info_from_database(answer)
-    dict = make_patient_into_dict(patient)
+    if since is not None:
+        dict, status_code = get_patient_changes_driver(answer, since, fields)
+        if status_code != 409:
+            return dict, status_code
+    patient, status_code = get_patient_info_from_database(
+        answer, make_document_fields(fields), last)
+    if status_code != 200:
+        return patient, status_code
+    dict = make_patient_into_dict(patient, fields)
     return dict, status_code
 
 
+def get_patient_changes_driver(patient_id, since, fields=None):
+    """ Obtains the patient entries added after a revision
+
+    Only the change entries after the given revision are read from the
+    patient store, and they are merged into a dictionary with the same
+    keys as the full patient information. Its lists hold only the new entries,
+    and it also holds the revision the changes start from in "Since".
+
+    Args:
+        patient_id (int): the patient id
+        since (int): the revision of the patient the client already holds
+        fields (list): the keys of the patient dictionary to return, or
+                       None to return all keys
+
+    Returns:
+        dict or str, int: the changes with a status code of 200, an empty
+        string and 304 if nothing changed since the revision, an error
+        message and 400 if the patient is not found, or an error message
+        and 409 if the revision is newer than the patient's, in which case
+        the whole patient should be returned instead
+    """
+    patient = patient_store.get_changes(patient_id, since)
+    if patient is None:
+        return "Patient_id {} was not found".format(patient_id), 400
+    revision = patient["revision"]
+    if since == revision:
+        return "", 304
+    if since > revision:
+        return "Revision {} is newer than the patient".format(since), 409
+    changes = {"Name": patient["patient_name"],
+               "Rec_No": patient_id,
+               "Revision": revision,
+               "Since": since}
+    for key in LIST_FIELDS:
+        changes[key] = []
+    for change in patient["changes"]:
+        for key in LIST_FIELDS:
+            changes[key].extend(change.get(key, []))
+    if fields is not None:
+        changes = {key: changes[key] for key in changes
+                   if key in fields or key in ["Revision", "Since"]}
+    return changes, 200
+
+
+def make_document_fields(fields):
+    """ Maps the requested keys of the patient dictionary to the fields of
+    the patient record they are read from
+
+    Args:
+        fields (list): the keys of the patient dictionary to return, or
+                       None to return all keys
+
+    Returns:
+        list or None: the record fields, or None to read all fields
+    """
+    if fields is None:
+        return None
+    return [PATIENT_FIELDS[key] for key in fields]
+
+
 def validate_convert_patient_id(patient_id):
     """ Validates that the input patient id is a number
 
@@ -332,58 +1254,479 @@ def validate_convert_patient_id(patient_id):
     """
     try:
         patient_id_int = int(patient_id)
-    except ValueError:
+    except (TypeError, ValueError):
         return "Patient_id was not an integer", 400
     return patient_id_int, 200
 
 
-def get_patient_info_from_database(patient_id):
-    """ Searches for and retrieves Patient object associated with the
+def get_patient_info_from_database(patient_id, fields=None, last=None):
+    """ Searches for and retrieves the record of the patient with the
     specified patient id
 
-    The function retrieves the patient with the specified id. If patient
-    is found, then the function returns the Patient object with a status
-    code of 200. If the patient id is not found, the function returns an
-    error message with a status code of 400.
+    The function retrieves the patient with the specified id from the
+    patient store. If patient is found, then the function returns the
+    patient record with a status code of 200. If the patient id is not
+    found, the function returns an error message with a status code of
+    400.
 
     Args:
-        patient_id (str): the patient id taken from the variable URL
+        patient_id (int): the patient id taken from the variable URL
+        fields (list): the record fields to read, or None to read all
+                       fields
+        last (int): the number of latest list entries to read, or None to
+                    read every entry
 
     Returns:
-        Patient or str, int: returns Patient object with a status code of
-                             200 if patient id is found in the database.
-                             Returns an error message string and 400 if
-                             patient id is not found.
+        dict or str, int: returns the patient record with a status code of
+                          200 if patient id is found in the database.
+                          Returns an error message string and 400 if
+                          patient id is not found.
     """
-    try:
-        patient = Patient.objects.raw({"_id": patient_id}).first()
-    except pymodm_errors.DoesNotExist:
+    patient = patient_store.get_patient(patient_id, fields, last)
+    if patient is None:
         return "Patient_id {} was not found".format(patient_id), 400
     return patient, 200
 
 
-def make_patient_into_dict(patient):
-    """ Extracts and stores information from Patient object in a
+def make_patient_into_dict(patient, fields=None):
+    """ Extracts and stores information from a patient record in a
     dictionary
 
-    The function retrieves the patient (as a Patient object) with the
-    specified id, extracts the information associated with the object,
-    and stores this data in a dictionary format.
+    The function extracts the information of the patient record and
+    stores this data in a dictionary format. Images are returned as
+    references with keys "hash", "size" and "timestamp"; the image bytes
+    are retrieved separately from the /image route.
 
     Args:
-        patient (Patient object): the patient corresponding to
-                                  patient id taken from the variable URL
+        patient (dict): the patient record corresponding to patient id
+                        taken from the variable URL
+        fields (list): the keys to include in the dictionary, or None to
+                       include all keys
 
     Returns:
         dict: returns dictionary containing patient information
     """
-    patient_dict = {"Name": patient.patient_name,
-                    "Rec_No": patient.patient_id,
-                    "Med_Img": patient.medical_images,
-                    "ECG": patient.ecg_images,
-                    "Heart_Rate": patient.heartrate,
-                    "Timestamp": patient.timestamp}
-    return patient_dict
+    if fields is None:
+        fields = list(PATIENT_FIELDS)
+    return {key: patient[PATIENT_FIELDS[key]] for key in fields}
+
+
+@app.route("/patient_events", methods=["GET"])
+def patient_events_handler():
+    """ Handles requests to the /patient_events route for receiving
+    patient updates as they happen
+
+    This function implements a GET route that keeps the connection open
+    and streams Server-Sent Events. Every time a patient is added or
+    updated through the /new_patient route, an event with the keys
+    "Rec_No", "Revision" and "Timestamp" is sent. A comment line is sent
+    every EVENT_HEARTBEAT seconds without events to keep the connection
+    alive.
+
+    Returns:
+        Response: the event stream
+    """
+    response = Response(patient_events.stream(EVENT_HEARTBEAT),
+                        mimetype="text/event-stream")
+    response.cache_control.no_cache = True
+    # Ask reverse proxies not to buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/image", methods=["POST"])
+def upload_image_handler():
+    """ Handles requests to the /image route for uploading image bytes
+
+    The body of the request is the raw image file. It is streamed to the
+    image store in chunks and hashed as it arrives, so large images are
+    neither b64-encoded nor held in memory. The returned hash can then be
+    sent to the /new_patient route as {"hash": str} in place of the image.
+
+    Returns:
+        str, int: the image hash and size as {"hash": str, "size": int}
+                  with a status code of 200, or an error message and 400
+                  if the body is empty
+    """
+    try:
+        image_hash, size = image_store.put_stream(request.stream)
+    except ValueError:
+        return "No image was uploaded", 400
+    return jsonify({"hash": image_hash, "size": size}), 200
+
+
+@app.route("/upload", methods=["POST"])
+def start_upload_handler():
+    """ Handles requests to the /upload route for starting a resumable
+    upload
+
+    An image can be uploaded as a series of chunks instead of a single
+    request. This route opens an upload session; the chunks are then sent
+    to the /upload/<upload_id> route and the session is completed with
+    the /upload/<upload_id>/finish route.
+
+    Returns:
+        str, int: the id of the session and its offset, as
+                  {"upload_id": str, "offset": 0}, with a status code
+                  of 200
+    """
+    upload_id = upload_sessions.create()
+    return jsonify({"upload_id": upload_id, "offset": 0}), 200
+
+
+@app.route("/upload/<upload_id>", methods=["GET"])
+def get_upload_offset_handler(upload_id):
+    """ Handles requests to the /upload/<upload_id> route for reading the
+    number of bytes received by an upload session
+
+    A client resuming an interrupted upload reads this offset and sends
+    the rest of the image from there.
+
+    Args:
+        upload_id (str): the session id taken from the variable URL
+
+    Returns:
+        str, int: the offset as {"offset": int} with a status code of 200,
+                  or an error message and a status code of 400 or 404
+    """
+    if not is_valid_upload_id(upload_id):
+        return "Upload id {} is not valid".format(upload_id), 400
+    offset = upload_sessions.offset(upload_id)
+    if offset is None:
+        return "Upload {} was not found".format(upload_id), 404
+    return jsonify({"offset": offset}), 200
+
+
+@app.route("/upload/<upload_id>", methods=["PUT"])
+def upload_chunk_handler(upload_id):
+    """ Handles requests to the /upload/<upload_id> route for sending a
+    chunk of an image
+
+    The body of the request is the raw chunk and the "offset" query
+    parameter is its position in the image. The chunk is only stored if
+    the offset matches the number of bytes received so far; otherwise the
+    current offset is returned with status code 409 so the client can
+    continue from it.
+
+    Args:
+        upload_id (str): the session id taken from the variable URL
+
+    Returns:
+        str, int: the offset after the chunk as {"offset": int} with a
+                  status code of 200, the current offset with 409, or an
+                  error message and a status code of 400 or 404
+    """
+    if not is_valid_upload_id(upload_id):
+        return "Upload id {} is not valid".format(upload_id), 400
+    offset = request.args.get("offset", "")
+    if is_decimal(offset) is False:
+        return "offset must be a number of bytes", 400
+    current = upload_sessions.offset(upload_id)
+    if current is None:
+        return "Upload {} was not found".format(upload_id), 404
+    if int(offset) != current:
+        return jsonify({"offset": current}), 409
+    new_offset = upload_sessions.append(upload_id, current, request.stream)
+    if new_offset is None:
+        return "Upload {} was not found".format(upload_id), 404
+    return jsonify({"offset": new_offset}), 200
+
+
+@app.route("/upload/<upload_id>/finish", methods=["POST"])
+def finish_upload_handler(upload_id):
+    """ Handles requests to the /upload/<upload_id>/finish route for
+    completing a resumable upload
+
+    The received image is moved to the image store and the session is
+    closed. A session that received no bytes stays open and gets a 400
+    response. The returned hash can be sent to the /new_patient route as
+    {"hash": str} in place of the image.
+
+    Args:
+        upload_id (str): the session id taken from the variable URL
+
+    Returns:
+        str, int: the image hash and size as {"hash": str, "size": int}
+                  with a status code of 200, or an error message and a
+                  status code of 400 or 404
+    """
+    if not is_valid_upload_id(upload_id):
+        return "Upload id {} is not valid".format(upload_id), 400
+    try:
+        image_hash, size = upload_sessions.finish(upload_id, image_store)
+    except ValueError:
+        return "No image was uploaded", 400
+    if image_hash is None:
+        return "Upload {} was not found".format(upload_id), 404
+    return jsonify({"hash": image_hash, "size": size}), 200
+
+
+@app.route("/image/<image_hash>", methods=["GET"])
+def get_image_handler(image_hash):
+    """ Handles requests to the /image route for retrieving image bytes
+
+    This function implements a GET route with a variable URL holding the
+    content hash found in an image reference. The raw image bytes are
+    streamed from the image store. Since the content of a hash can never
+    change, the response may be cached by clients indefinitely.
+
+    Args:
+        image_hash (str): the content hash taken from the variable URL
+
+    Returns:
+        Response or str, int: the streamed image, or an error message and
+                              a status code of 400 or 404
+    """
+    if not blob_store.is_valid_hash(image_hash):
+        return "Image hash {} is not valid".format(image_hash), 400
+    image_file = image_store.open(image_hash)
+    if image_file is None:
+        return "Image {} was not found".format(image_hash), 404
+    response = send_file(image_file, mimetype=guess_image_mimetype(image_file),
+                         etag=image_hash, max_age=IMAGE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route("/ecg_recording/<recording_hash>", methods=["GET"])
+def get_ecg_recording_handler(recording_hash):
+    """ Handles requests to the /ecg_recording route for reading a time
+    range of an uploaded ECG recording
+
+    The optional "start" and "end" query parameters are finite times in
+    seconds; the samples between them, both included, are returned, and
+    times outside the recording are clamped to it. The container is read
+    in place from the image store, and only the samples of the range are
+    read, so zooming into a long recording does not load it whole. Like
+    images, a recording never changes, so the response may be
+    cached by clients indefinitely, and a request whose If-None-Match
+    header holds the ETag of the range gets an empty 304 response.
+
+    Args:
+        recording_hash (str): the content hash taken from the variable URL
+
+    Returns:
+        Response or str, int: {"sampling_frequency": float, "units": str,
+                              "start_time": float, "voltage": list}, where
+                              "start_time" is the time of the first
+                              returned sample and "voltage" holds one list
+                              of samples per lead, or an error message and
+                              a status code of 400 or 404
+    """
+    if not blob_store.is_valid_hash(recording_hash):
+        return "Recording hash {} is not valid".format(recording_hash), 400
+    try:
+        start, end = [float(request.args[key])
+                      if request.args.get(key, "") != "" else None
+                      for key in ["start", "end"]]
+    except ValueError:
+        return "start and end must be times in seconds", 400
+    if not all(math.isfinite(time) for time in [start, end]
+               if time is not None):
+        return "start and end must be finite times in seconds", 400
+    recording_file = image_store.open(recording_hash)
+    if recording_file is None:
+        return "Recording {} was not found".format(recording_hash), 404
+    try:
+        with ecg_format.open_recording(recording_file) as recording:
+            first, stop = recording.sample_range(start, end)
+            if stop - first > ECG_SLICE_MAX_SAMPLES:
+                return "The range holds more than {} samples".format(
+                    ECG_SLICE_MAX_SAMPLES), 400
+            etag = "{}-{}-{}".format(recording_hash, first, stop)
+            if etag in request.if_none_match:
+                return conditional_slice_response(Response(status=304),
+                                                  etag)
+            fs = recording.sampling_frequency
+            body = {"sampling_frequency": fs,
+                    "units": recording.units,
+                    "start_time": recording.start_time + first / fs,
+                    "voltage": recording.samples(first, stop).T.tolist()}
+    except ValueError as error:
+        message = "Recording {} is not valid: {}"
+        return message.format(recording_hash, error), 400
+    return conditional_slice_response(jsonify(body), etag)
+
+
+@app.route("/ecg_jobs", methods=["POST"])
+def new_ecg_job_handler():
+    """ Handles requests to the /ecg_jobs route for queueing the analysis
+    of an uploaded ECG recording
+
+    The POST data should be {"Rec_No": int, "recording": {"hash": str}},
+    where the recording is a binary ECG container uploaded to the /image
+    or /upload routes and the patient already exists. A worker process
+    computes its metrics and appends them, without the times of the
+    beats, to the "ECG_Metrics" list of the patient. ECG recordings sent
+    to /new_patient are queued the same way.
+
+    Returns:
+        str, int: {"job_id": int, "state": "queued"} with a status code of
+                  202, or an error message and 400
+    """
+    in_data = request.get_json(silent=True)
+    if not isinstance(in_data, dict) or "recording" not in in_data:
+        return "Rec_No and recording are required", 400
+    patient_id, status_code = validate_convert_patient_id(
+        str(in_data.get("Rec_No")))
+    if status_code != 200:
+        return patient_id, status_code
+    if patient_store.get_patient(patient_id, ["_id"]) is None:
+        return "Patient_id {} was not found".format(patient_id), 400
+    try:
+        recording = store_recording(in_data["recording"])
+    except LookupError as error:
+        return str(error), 400
+    except ValueError as error:
+        return "Uploaded ECG recording is not valid: {}".format(error), 400
+    job_id = enqueue_ecg_job(patient_id, recording["hash"])
+    return jsonify({"job_id": job_id, "state": "queued"}), 202
+
+
+@app.route("/ecg_jobs", methods=["GET"])
+def get_ecg_job_counts_handler():
+    """ Handles requests to the /ecg_jobs route for reading the number of
+    ECG analysis jobs in each state
+
+    Returns:
+        str, int: {"queued": int, "running": int, "done": int,
+                  "failed": int} with a status code of 200
+    """
+    return jsonify(ecg_job_queue.counts()), 200
+
+
+@app.route("/ecg_jobs/<job_id>", methods=["GET"])
+def get_ecg_job_handler(job_id):
+    """ Handles requests to the /ecg_jobs/<job_id> route for reading the
+    status of an ECG analysis job
+
+    Args:
+        job_id (str): the id of the job taken from the variable URL
+
+    Returns:
+        str, int: the job as {"job_id": int, "Rec_No": int,
+                  "recording": str, "state": str, "queued_at": float,
+                  "started_at": float, "finished_at": float, "result": dict,
+                  "error": str} with a status code of 200, where the times
+                  are seconds since the epoch and "result" holds the
+                  metrics of a job that is "done", or an error message
+                  and a status code of 400 or 404
+    """
+    if not is_decimal(job_id):
+        return "Job id {} is not valid".format(job_id), 400
+    job = ecg_job_queue.get(int(job_id))
+    if job is None:
+        return "Job {} was not found".format(job_id), 404
+    job["Rec_No"] = job.pop("patient_id")
+    return jsonify(job), 200
+
+
+def conditional_slice_response(response, etag):
+    """ Adds the validators of a slice of an ECG recording to a response
+
+    Args:
+        response (Response): the slice, or an empty 304 response
+        etag (str): the hash of the recording and the range of the slice
+
+    Returns:
+        Response: the response, cacheable indefinitely
+    """
+    response.set_etag(etag)
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def guess_image_mimetype(image_file):
+    """ Guesses the content type of an image from its first bytes
+
+    Args:
+        image_file (file object): the opened image, positioned at its start
+
+    Returns:
+        str: the mimetype of the image
+    """
+    head = image_file.read(8)
+    image_file.seek(0)
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    return "application/octet-stream"
+
+
+def migrate_legacy_images():
+    """ Moves images stored inline in patient records to the image store
+
+    Patient records written before the image store existed hold every
+    image as a b64-string. Each such record is rewritten so its image
+    lists hold references instead. ECG references take the timestamp of
+    the matching upload; the upload time of older medical images is
+    unknown and left empty.
+
+    Returns:
+        int: the number of patient records that were migrated
+    """
+    migrated = 0
+    for patient in patient_store.find_inline_images():
+        timestamps = patient["timestamp"]
+        ecg_refs = []
+        for i, image in enumerate(patient["ecg_images"]):
+            if isinstance(image, str):
+                now = timestamps[i] if i < len(timestamps) else ""
+                image = store_image(image, now)
+            ecg_refs.append(image)
+        med_refs = []
+        for image in patient["medical_images"]:
+            if isinstance(image, str):
+                image = store_image(image, "")
+            med_refs.append(image)
+        patient_store.replace_images(patient["_id"], ecg_refs, med_refs)
+        migrated += 1
+    logging.info("Moved the images of {} patients to the image store"
+                 .format(migrated))
+    return migrated
+
+
+def migrate_heart_rates():
+    """ Adds the heart rates uploaded before the heart rate series existed
+    to the series
+
+    These heart rates have no time of their own. The patient portal
+    uploads each heart rate with an ECG image, whose upload time is in the
+    timestamp record, so the heart rates of a patient with as many
+    timestamps are paired with them. The heart rates of other patients
+    cannot be dated and are left out of the series. The server runs this
+    before it receives any upload, so a patient with heart rates in the
+    series was already migrated or uploaded since the series exists, and
+    is left as it is. The patient store selects the other patients in a
+    single query, so a server whose patients were all migrated does not
+    read them again at each start.
+
+    Returns:
+        int: the number of heart rates added to the series
+    """
+    added = 0
+    undated = 0
+    for patient in patient_store.find_unmigrated_heart_rates():
+        if len(patient["timestamp"]) != len(patient["heartrate"]):
+            undated += 1
+            continue
+        heart_rates = []
+        for value, timestamp in zip(patient["heartrate"],
+                                    patient["timestamp"]):
+            try:
+                time = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+            except (TypeError, ValueError):
+                continue
+            heart_rates += make_heart_rate_series({"Heart_Rate": [value]},
+                                                  time)
+        if len(heart_rates) != 0:
+            patient_store.add_heart_rates(patient["_id"], heart_rates)
+            added += len(heart_rates)
+    logging.info("Added {} heart rates to the heart rate series, {} patients "
+                 "had heart rates without timestamps".format(added, undated))
+    return added
 
 
 if __name__ == "__main__":
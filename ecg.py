@@ -1,55 +1,422 @@
+import argparse
+import collections
+import concurrent.futures
+import functools
+import glob
+import itertools
 import logging
+import os
+import sys
+from time import perf_counter
 import matplotlib.pyplot as plt
 import math
 import json
-from scipy.signal import find_peaks, butter, filtfilt
+import warnings
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+from scipy.signal import find_peaks, butter, filtfilt, sosfilt, sosfilt_zi
+import ecg_format
 
+# Number of csv lines parsed at a time by readFile
+READ_BLOCK_LINES = 2 ** 16
+# A block with an invalid line is split in SPLIT_BLOCKS smaller blocks,
+# down to PARSE_LINES_BLOCK lines, which are parsed one at a time
+SPLIT_BLOCKS = 16
+PARSE_LINES_BLOCK = 64
+# Band of the bandpass filter of process_data, in Hz
+BANDPASS_BAND = (0.5, 25)
+# Constant samples added at each end of the signal by process_data
+FILTER_PADLEN = 100
+# Seconds of signal read past each window by analyze_stream, for the
+# backward pass of the filter and for the beats near the window's end
+STREAM_OVERLAP_SECONDS = 10
+# Shortest time between two heartbeats, so at most 240 beats per minute
+REFRACTORY_SECONDS = 0.25
+# A beat is a peak at least BEAT_HEIGHT_FRACTION of the local amplitude
+# high and BEAT_PROMINENCE_FRACTION of it above its surroundings. The
+# local amplitude is the largest filtered voltage within
+# AMPLITUDE_WINDOW_SECONDS around the peak, and at least
+# MIN_BEAT_AMPLITUDE (mV) so that noise on a flat signal is not a beat
+BEAT_HEIGHT_FRACTION = 0.35
+BEAT_PROMINENCE_FRACTION = 0.6
+AMPLITUDE_WINDOW_SECONDS = 4
+MIN_BEAT_AMPLITUDE = 0.3
+# Seconds of filtered signal kept by OnlineBeatDetector, and the delay
+# after which it decides whether a sample is a beat
+DETECTOR_WINDOW_SECONDS = 3
+DETECTOR_LATENCY_SECONDS = 0.5
+# Seconds of beats the rolling heart rate of OnlineBeatDetector spans
+HEART_RATE_SECONDS = 10
+# Tasks of run_batch in flight per worker process, so that workers never
+# wait for a task while the results held stay bounded
+BATCH_TASKS_PER_WORKER = 2
 
-def main():
-    filename = 'test_data/test_data11.csv'
+
+def main(argv=None):
+    """analyzes one recording, or many with the batch command
+
+    Usage::
+
+        python ecg.py [--stream] [filename]
+        python ecg.py batch [--stream] [--workers N] [--output FILE]
+                      directory_or_glob [directory_or_glob ...]
+        python ecg.py convert [--encoding ENCODING] filename [output]
+
+    The first form writes the metrics of one file (by default
+    test_data/test_data11.csv) to a json file next to it. The batch
+    command analyzes every csv file and binary container of the given
+    directories and glob patterns in parallel and writes their metrics
+    to one JSON Lines file. The convert command writes a csv file to a
+    binary container.
+
+    Parameters
+    ----------
+    argv : list, optional
+        command line arguments, sys.argv[1:] by default
+
+    """
+    args = parse_args(argv)
     logging.basicConfig(filename="ecg.log", level=logging.INFO, filemode="w")
-    time, voltage, sampling_frequency = readFile(filename)
-    voltage = process_data(voltage, sampling_frequency)
-    metrics = make_metrics(time, voltage)
-    output_json(filename, metrics)
+    if args.command == "batch":
+        start = perf_counter()
+        total, failed = run_batch(find_recordings(args.inputs), args.output,
+                                  args.workers, args.stream)
+        elapsed = perf_counter() - start
+        print("{} files analyzed ({} failed) in {:.1f} s, {:.1f} files/s"
+              .format(total, failed, elapsed, total / elapsed))
+        return
+    if args.command == "convert":
+        print(convert_recording(args.filename, args.output, args.encoding))
+        return
+    metrics = analyze_recording(args.filename, args.stream)
+    output_json(args.filename, metrics)
     return
 
 
-def readFile(filename):
+def parse_args(argv=None):
+    """parses the command line of main
+
+    Parameters
+    ----------
+    argv : list, optional
+        command line arguments, sys.argv[1:] by default
+
+    Returns
+    -------
+    argparse.Namespace
+        the command ("batch", "convert" or None) and its options
+
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    stream_help = "analyze the files in blocks, with constant memory"
+    if argv[:1] == ["batch"]:
+        parser = argparse.ArgumentParser(
+            prog="ecg.py batch",
+            description="Analyze many ECG recordings in parallel")
+        parser.add_argument("inputs", nargs="+",
+                            help="directories of csv files and binary "
+                                 "containers, or glob patterns")
+        parser.add_argument("--output", default="metrics.jsonl",
+                            help="JSON Lines file written with the metrics "
+                                 "of each file (default: metrics.jsonl)")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="number of worker processes (default: "
+                                 "the number of CPUs)")
+        parser.add_argument("--stream", action="store_true",
+                            help=stream_help)
+        args = parser.parse_args(argv[1:])
+        args.command = "batch"
+        return args
+    if argv[:1] == ["convert"]:
+        parser = argparse.ArgumentParser(
+            prog="ecg.py convert",
+            description="Write an ECG recording to a binary container")
+        parser.add_argument("filename", help="csv file to convert")
+        parser.add_argument("output", nargs="?",
+                            help="container to write (default: the csv "
+                                 "filename with the {} extension)"
+                                 .format(ecg_format.EXTENSION))
+        parser.add_argument("--encoding", default="int16",
+                            choices=ecg_format.ENCODINGS,
+                            help="encoding of the samples (default: int16)")
+        args = parser.parse_args(argv[1:])
+        args.command = "convert"
+        return args
+    parser = argparse.ArgumentParser(
+        description="Analyze an ECG recording")
+    parser.add_argument("filename", nargs="?",
+                        default="test_data/test_data11.csv",
+                        help="csv file or binary container to analyze")
+    parser.add_argument("--stream", action="store_true", help=stream_help)
+    args = parser.parse_args(argv)
+    args.command = None
+    return args
+
+
+def readFile(filename, dtype=np.float64):
     """reads data from a csv file and
-    returns time and voltage as lists,
+    returns time and voltage as arrays,
     and the sampling frequency.
 
+    The file is parsed in blocks of READ_BLOCK_LINES lines with
+    numpy.loadtxt instead of one line at a time. Lines with an empty,
+    non-numeric or NaN cell are still skipped and logged with their
+    line numbers, as before. A binary container written by
+    ecg_format.save_recording is read with read_recording instead.
+
     Parameters
     ----------
     filename : string
         directory and the name of the file to read
+    dtype : data-type, optional
+        float type of the returned arrays, numpy.float64 by default.
+        numpy.float32 halves the memory used.
 
     Returns
     -------
-    time : list
+    time : numpy.ndarray
         time array
-    voltage : list
+    voltage : numpy.ndarray
         voltage array
-    sampling_frequency : integer
+    sampling_frequency : float
         sampling frequency of the data
 
     """
+    if ecg_format.is_recording(filename):
+        return read_recording(filename, dtype)
     logging.info("Starting analysis of ECG data...")
-    time = []
-    voltage = []
-    f = open(filename, 'r')
+    time_blocks = []
+    voltage_blocks = []
+    for time, voltage in read_blocks(filename, dtype):
+        time_blocks.append(time)
+        voltage_blocks.append(voltage)
+    time = np.concatenate(time_blocks or [np.array([], dtype)])
+    voltage = np.concatenate(voltage_blocks or [np.array([], dtype)])
+
+    if voltage.max() > 300 or voltage.min() < -300:
+        logging.warning(
+            "In the input file {},voltage exceed the normal range"
+            .format(filename))
+    sampling_frequency = float(len(time)/time[-1])
+    return time, voltage, sampling_frequency
+
+
+def read_blocks(filename, dtype=np.float64):
+    """reads the valid rows of a csv file one block at a time
+
+    Parameters
+    ----------
+    filename : string
+        directory and the name of the file to read
+    dtype : data-type, optional
+        float type of the arrays
+
+    Yields
+    ------
+    time : numpy.ndarray
+        time values of the valid lines of a block of READ_BLOCK_LINES
+        lines
+    voltage : numpy.ndarray
+        voltage values of the same lines
+
+    """
+    if ecg_format.is_recording(filename):
+        yield from recording_blocks(filename, dtype)
+        return
     line_number = 0
-    while(1):
-        line_number += 1
-        line = f.readline()
-        if line == "":
-            break
+    with open(filename, 'r') as f:
+        while True:
+            lines = list(itertools.islice(f, READ_BLOCK_LINES))
+            if not lines:
+                break
+            time, voltage = parse_block(lines, line_number + 1, dtype)
+            line_number += len(lines)
+            if len(time) > 0:
+                yield time, voltage
+
+
+def read_recording(filename, dtype=None):
+    """reads the first lead of a binary ECG container
+
+    The container is mapped in memory with numpy.memmap. With the
+    default dtype, float32 samples are returned without being copied,
+    and int16 samples are scaled to float32.
+
+    Parameters
+    ----------
+    filename : string
+        directory and the name of the container
+    dtype : data-type, optional
+        float type of the returned arrays, by default float64 for the
+        time and float32 for the voltage
+
+    Returns
+    -------
+    time : numpy.ndarray
+        time array
+    voltage : numpy.ndarray
+        voltage array
+    sampling_frequency : float
+        sampling frequency stored in the container
+
+    """
+    logging.info("Starting analysis of ECG data...")
+    with ecg_format.open_recording(filename) as recording:
+        if recording.sample_count == 0:
+            raise ValueError("There is no sample in {}".format(filename))
+        time = recording.time()
+        voltage = recording.samples()[:, 0]
+        sampling_frequency = recording.sampling_frequency
+    if dtype is not None:
+        time = time.astype(dtype, copy=False)
+        voltage = voltage.astype(dtype, copy=False)
+    if voltage.max() > 300 or voltage.min() < -300:
+        logging.warning(
+            "In the input file {},voltage exceed the normal range"
+            .format(filename))
+    return time, voltage, sampling_frequency
+
+
+def recording_blocks(filename, dtype=np.float64):
+    """reads the first lead of a binary ECG container one block at a time
+
+    Parameters
+    ----------
+    filename : string
+        directory and the name of the container
+    dtype : data-type, optional
+        float type of the arrays
+
+    Yields
+    ------
+    time : numpy.ndarray
+        time values of READ_BLOCK_LINES samples
+    voltage : numpy.ndarray
+        voltage values of the same samples
+
+    """
+    with ecg_format.open_recording(filename) as recording:
+        for start in range(0, recording.sample_count, READ_BLOCK_LINES):
+            stop = start + READ_BLOCK_LINES
+            yield (recording.time(start, stop).astype(dtype),
+                   recording.samples(start, stop)[:, 0].astype(dtype))
+
+
+def convert_recording(filename, output=None, encoding="int16"):
+    """writes a csv recording to a binary ECG container
+
+    The samples are assumed to be evenly spaced: the container keeps the
+    time of the first valid line and the sampling frequency that spaces
+    the samples evenly up to the last one.
+
+    Parameters
+    ----------
+    filename : string
+        csv file to convert
+    output : string, optional
+        container to write, by default the csv filename with the
+        ecg_format.EXTENSION extension
+    encoding : string, optional
+        one of ecg_format.ENCODINGS
+
+    Returns
+    -------
+    output : string
+        the container written
+
+    """
+    if output is None:
+        output = os.path.splitext(filename)[0] + ecg_format.EXTENSION
+    time, voltage, _ = readFile(filename)
+    if len(time) < 2 or not time[-1] > time[0]:
+        raise ValueError("{} has too few samples to find the sampling "
+                         "frequency".format(filename))
+    sampling_frequency = (len(time) - 1) / float(time[-1] - time[0])
+    ecg_format.save_recording(output, voltage, sampling_frequency,
+                              start_time=float(time[0]), encoding=encoding)
+    return output
+
+
+def parse_block(lines, first_line_number, dtype=np.float64):
+    """parses a block of csv lines in bulk
+
+    If the block holds an empty or non-numeric cell, it is split into
+    smaller blocks, so that only the few lines around each invalid line
+    are parsed one at a time by parse_lines.
+
+    Parameters
+    ----------
+    lines : list
+        lines of the file, each ending with a newline
+    first_line_number : integer
+        line number of the first line in the file
+    dtype : data-type, optional
+        float type of the returned arrays
+
+    Returns
+    -------
+    time : numpy.ndarray
+        time values of the valid lines
+    voltage : numpy.ndarray
+        voltage values of the valid lines
 
+    """
+    try:
+        with warnings.catch_warnings():
+            # loadtxt warns about a block of blank lines, which is
+            # parsed again below
+            warnings.simplefilter("ignore", UserWarning)
+            data = np.loadtxt(lines, delimiter=',', usecols=(0, 1),
+                              dtype=dtype, comments=None, ndmin=2)
+    except ValueError:
+        data = None
+    # loadtxt skips blank lines, which must be logged
+    if data is None or len(data) != len(lines):
+        if len(lines) <= PARSE_LINES_BLOCK:
+            return parse_lines(lines, first_line_number, dtype)
+        step = -(-len(lines) // SPLIT_BLOCKS)
+        parts = [parse_block(lines[i:i + step], first_line_number + i, dtype)
+                 for i in range(0, len(lines), step)]
+        return (np.concatenate([part[0] for part in parts]),
+                np.concatenate([part[1] for part in parts]))
+    nan_rows = np.flatnonzero(np.isnan(data).any(axis=1))
+    for row in nan_rows:
+        logging.error("There is a NaN cell in line {}"
+                      .format(first_line_number + row))
+    if len(nan_rows) > 0:
+        data = np.delete(data, nan_rows, axis=0)
+    return data[:, 0].copy(), data[:, 1].copy()
+
+
+def parse_lines(lines, first_line_number, dtype=np.float64):
+    """parses csv lines one at a time, skipping and logging
+    the lines with an empty, non-numeric or NaN cell
+
+    Parameters
+    ----------
+    lines : list
+        lines of the file
+    first_line_number : integer
+        line number of the first line in the file
+    dtype : data-type, optional
+        float type of the returned arrays
+
+    Returns
+    -------
+    time : numpy.ndarray
+        time values of the valid lines
+    voltage : numpy.ndarray
+        voltage values of the valid lines
+
+    """
+    time = []
+    voltage = []
+    for line_number, line in enumerate(lines, first_line_number):
         line = line.rstrip('\n')
         row = line.split(',')
 
-        if row[0] == '' or row[1] == '':
+        if len(row) < 2 or row[0] == '' or row[1] == '':
             logging.error("there is an empty cell in line {}"
                           .format(line_number))
             continue
@@ -57,54 +424,231 @@ def readFile(filename):
             logging.error("there was a non-numeric input in line {}"
                           .format(line_number))
             continue
-        row = [float(i) for i in row]
+        row = [float(i) for i in row[:2]]
         if math.isnan(row[0]) or math.isnan(row[1]):
             logging.error("There is a NaN cell in line {}".format(line_number))
             continue
         time.append(row[0])
         voltage.append(row[1])
-
-    if max(voltage) > 300 or min(voltage) < -300:
-        logging.warning(
-            "In the input file {},voltage exceed the normal range"
-            .format(filename))
-    sampling_frequency = len(time)/time[-1]
-    return time, voltage, sampling_frequency
+    return np.array(time, dtype=dtype), np.array(voltage, dtype=dtype)
 
 
-def process_data(voltage, sampling_frequency):
+def process_data(voltage, sampling_frequency, method='sos'):
     """Removes low frequency and high frequency noise
     using bandpass filter.
 
+    The filter runs forward and backward, so it does not shift the
+    signal in time. By default it runs as second-order sections, which
+    stay numerically stable at higher filter orders, and a float32
+    voltage array is filtered in float32 throughout, which halves the
+    memory traffic. method='ba' runs the original filtfilt on the
+    transfer function coefficients, in float64.
+
     Parameters
     ----------
-    voltage : list
+    voltage : array_like
         contains voltages per each time
-    sampling_frequency : integer
+    sampling_frequency : float
         sampling frequency of the data
+    method : {'sos', 'ba'}, optional
+        form of the filter
 
     Returns
     -------
-    y : list
+    y : numpy.ndarray
         filtered voltage data
 
     """
-    low = 1/sampling_frequency
-    high = 50/sampling_frequency
-    b, a = butter(1, [low, high], 'bandpass')
-    y = filtfilt(b, a, voltage, method='pad', padlen=100, padtype='constant')
-    return y
+    if method == 'ba':
+        b, a = bandpass_coefficients(sampling_frequency)
+        return filtfilt(b, a, voltage, method='pad', padlen=FILTER_PADLEN,
+                        padtype='constant')
+    voltage = np.asarray(voltage)
+    if voltage.dtype != np.float32:
+        voltage = voltage.astype(np.float64, copy=False)
+    sos, zi = bandpass_sos(sampling_frequency, dtype=voltage.dtype)
+    # Constant padding at both ends, as filtfilt does with method='pad'
+    padded = np.concatenate([np.full(FILTER_PADLEN, voltage[0]), voltage,
+                             np.full(FILTER_PADLEN, voltage[-1])])
+    padded = padded.astype(voltage.dtype, copy=False)
+    y, _ = sosfilt(sos, padded, zi=zi*padded[0])
+    y = backward_filter(sos, zi, y)
+    return y[FILTER_PADLEN:len(y) - FILTER_PADLEN]
+
+
+@functools.lru_cache(maxsize=256)
+def bandpass_coefficients(sampling_frequency, band=BANDPASS_BAND, order=1):
+    """Designs a Butterworth bandpass filter as transfer function
+    coefficients.
 
+    Designs are cached, so the filter of a sampling frequency is only
+    computed once however many recordings or live streams use it. The
+    returned arrays are shared between callers and must not be
+    modified.
 
-def make_metrics(time, voltage):
+    Parameters
+    ----------
+    sampling_frequency : float
+        sampling frequency of the data
+    band : tuple, optional
+        low and high cutoff frequencies in Hz
+    order : integer, optional
+        order of the filter
+
+    Returns
+    -------
+    b, a : numpy.ndarray
+        numerator and denominator of the filter
+
+    """
+    return butter(order, band, 'bandpass', fs=sampling_frequency)
+
+
+@functools.lru_cache(maxsize=256)
+def bandpass_sos(sampling_frequency, band=BANDPASS_BAND, order=1,
+                 dtype=np.float64):
+    """Designs a Butterworth bandpass filter as second-order sections.
+
+    Designs are cached like those of bandpass_coefficients, and the
+    returned arrays must not be modified either.
+
+    Parameters
+    ----------
+    sampling_frequency : float
+        sampling frequency of the data
+    band : tuple, optional
+        low and high cutoff frequencies in Hz
+    order : integer, optional
+        order of the filter
+    dtype : data-type, optional
+        float type of the returned arrays
+
+    Returns
+    -------
+    sos : numpy.ndarray
+        second-order sections of the filter
+    zi : numpy.ndarray
+        state of the filter after a long unit step, to be scaled by the
+        first sample to filter
+
+    """
+    sos = butter(order, band, 'bandpass', fs=sampling_frequency,
+                 output='sos')
+    return sos.astype(dtype), sosfilt_zi(sos).astype(dtype)
+
+
+def filter_blocks(blocks, sampling_frequency, overlap):
+    """Filters a signal given in blocks like process_data does.
+
+    The forward pass of process_data is causal, so it runs block by
+    block with the filter state carried over. The backward pass needs
+    the samples that follow, so each block is only returned once
+    `overlap` more samples have been filtered forward, and the backward
+    pass starts from the end of these samples as if the signal ended
+    there. The error of that start decays below floating point
+    precision well within STREAM_OVERLAP_SECONDS. The last block is
+    padded like process_data pads the signal, so it matches exactly.
+
+    Parameters
+    ----------
+    blocks : iterable
+        (time, voltage) array pairs
+    sampling_frequency : float
+        sampling frequency of the data
+    overlap : integer
+        number of samples filtered ahead of each returned block
+
+    Yields
+    ------
+    time : numpy.ndarray
+        time array of the block
+    voltage : numpy.ndarray
+        filtered voltage of the block
+
+    """
+    sos, zi = bandpass_sos(sampling_frequency)
+    state = None
+    times = np.empty(0)
+    forward = np.empty(0)
+    for time, voltage in blocks:
+        if state is None:
+            pad = np.full(FILTER_PADLEN, voltage[0])
+            _, state = sosfilt(sos, pad, zi=zi*voltage[0])
+        y, state = sosfilt(sos, voltage, zi=state)
+        last = voltage[-1]
+        times = np.concatenate([times, time])
+        forward = np.concatenate([forward, y])
+        ready = len(forward) - overlap
+        if ready > 0:
+            yield times[:ready], backward_filter(sos, zi, forward)[:ready]
+            times = times[ready:]
+            forward = forward[ready:]
+    if state is None:
+        return
+    y, _ = sosfilt(sos, np.full(FILTER_PADLEN, last), zi=state)
+    y = backward_filter(sos, zi, np.concatenate([forward, y]))
+    yield times, y[:len(forward)]
+
+
+def backward_filter(sos, zi, y):
+    """Runs the backward pass of process_data.
+
+    Parameters
+    ----------
+    sos : numpy.ndarray
+        second-order sections of the filter
+    zi : numpy.ndarray
+        state of the filter after a long unit step
+    y : numpy.ndarray
+        output of the forward pass
+
+    Returns
+    -------
+    numpy.ndarray
+        filtered signal
+
+    """
+    out, _ = sosfilt(sos, y[::-1], zi=zi*y[-1])
+    return out[::-1]
+
+
+def make_metrics(time, voltage, sampling_frequency=None):
     """Outputs calculated data into a dictionary
 
     Parameters
     ----------
-    time : list
+    time : array_like
         time vector
-    voltage : list
-        voltage vector
+    voltage : array_like
+        filtered voltage vector
+    sampling_frequency : float, optional
+        sampling frequency of the data, estimated from the time vector
+        by default
+
+    Returns
+    -------
+    metrics : dictionary
+        Contains duration, voltage extremes, beats,
+        number of beats, and bpm
+
+    """
+    duration = float(np.max(time))
+    voltage_extremes = (float(np.min(voltage)), float(np.max(voltage)))
+    beats = when_beats(time, voltage, sampling_frequency).tolist()
+    return summarize_metrics(duration, voltage_extremes, beats)
+
+
+def summarize_metrics(duration, voltage_extremes, beats):
+    """Logs the diagnostics and collects them into a dictionary
+
+    Parameters
+    ----------
+    duration : float
+        duration of the recording
+    voltage_extremes : tuple
+        minimum and maximum filtered voltage
+    beats : list
+        times that heartbeat occurred
 
     Returns
     -------
@@ -113,12 +657,9 @@ def make_metrics(time, voltage):
         number of beats, and bpm
 
     """
-    duration = max(time)
     logging.info("The duration was {} seconds".format(duration))
-    voltage_extremes = (min(voltage), max(voltage))
     logging.info("The voltage max was {}, and the min was {}"
                  .format(voltage_extremes[0], voltage_extremes[1]))
-    beats = when_beats(time, voltage)
     logging.info("The beats occurred at times following {}".format(beats))
     num_beats = len(beats)
     logging.info("Number of beats: {}".format(num_beats))
@@ -134,37 +675,357 @@ def make_metrics(time, voltage):
     return metrics
 
 
-def when_beats(time, voltage):
+def when_beats(time, voltage, sampling_frequency=None):
     """
     Find when the heartbeat occurs
 
     Parameters
     ----------
-    time : list
+    time : array_like
         time vector
-    voltage : list
-        voltage vector
+    voltage : array_like
+        filtered voltage vector
+    sampling_frequency : float, optional
+        sampling frequency of the data, estimated from the time vector
+        by default
 
     Returns
     -------
-    peakTime : list
-        contains times that heartbeat occurred.
+    numpy.ndarray
+        times that heartbeat occurred
 
     """
-    peaks, _ = find_peaks(voltage, prominence=0.6, distance=150, height=0.35)
-    peaks = peaks.tolist()
+    time = np.asarray(time)
+    if sampling_frequency is None:
+        sampling_frequency = estimate_sampling_frequency(time)
+    return time[find_beat_peaks(voltage, sampling_frequency, at_end=True)]
 
-    peakVol = [voltage[peak] for peak in peaks]
-    peakTime = [time[peak] for peak in peaks]
-    if voltage[-1] > 0.35:
-        peakTime.append(time[-1])
-        peakVol.append(voltage[-1])
-    # plt.plot(time, voltage)
-    # plt.plot(peakTime, peakVol, "x")
-    # plt.show()
-    # (peakTime)
-    # print(len(peakTime))
-    return peakTime
+
+def estimate_sampling_frequency(time):
+    """
+    Estimates the sampling frequency from the sample times
+
+    Parameters
+    ----------
+    time : numpy.ndarray
+        time vector
+
+    Returns
+    -------
+    float
+        inverse of the median time between two samples
+
+    """
+    if len(time) < 2:
+        raise ValueError("At least two samples are needed to estimate the "
+                         "sampling frequency")
+    return float(1/np.median(np.diff(time)))
+
+
+def beat_thresholds(voltage, sampling_frequency):
+    """
+    Computes the height and prominence a peak needs to be a beat
+
+    Parameters
+    ----------
+    voltage : numpy.ndarray
+        filtered voltage vector
+    sampling_frequency : float
+        sampling frequency of the data
+
+    Returns
+    -------
+    height : numpy.ndarray
+        minimum height of a peak at each sample
+    prominence : numpy.ndarray
+        minimum prominence of a peak at each sample
+
+    """
+    size = max(int(AMPLITUDE_WINDOW_SECONDS*sampling_frequency), 1)
+    amplitude = maximum_filter1d(voltage, size, mode='nearest')
+    amplitude = np.maximum(amplitude, MIN_BEAT_AMPLITUDE)
+    return (BEAT_HEIGHT_FRACTION*amplitude,
+            BEAT_PROMINENCE_FRACTION*amplitude)
+
+
+def refractory_samples(sampling_frequency):
+    """
+    Converts the refractory period to a number of samples
+
+    Parameters
+    ----------
+    sampling_frequency : float
+        sampling frequency of the data
+
+    Returns
+    -------
+    integer
+        fewest samples between two beats
+
+    """
+    return max(int(round(REFRACTORY_SECONDS*sampling_frequency)), 1)
+
+
+def find_beat_peaks(voltage, sampling_frequency, at_end=False):
+    """
+    Finds the indices of the heartbeat peaks
+
+    Parameters
+    ----------
+    voltage : array_like
+        filtered voltage vector
+    sampling_frequency : float
+        sampling frequency of the data
+    at_end : bool, optional
+        the voltage ends the recording, so its last sample is counted as
+        a beat cut off by the end if it is above the height threshold
+        and a refractory period after the last peak
+
+    Returns
+    -------
+    numpy.ndarray
+        indices of the peaks
+
+    """
+    voltage = np.asarray(voltage, dtype=float)
+    height, prominence = beat_thresholds(voltage, sampling_frequency)
+    distance = refractory_samples(sampling_frequency)
+    peaks, _ = find_peaks(voltage, height=height, prominence=prominence,
+                          distance=distance)
+    last = len(voltage) - 1
+    if at_end and last >= 0 and voltage[last] > height[last] and \
+            (len(peaks) == 0 or last - peaks[-1] >= distance):
+        peaks = np.append(peaks, last)
+    return peaks
+
+
+def find_beats_in_blocks(blocks, context, sampling_frequency):
+    """
+    Finds the heartbeats of a filtered signal given in blocks
+
+    Each block is searched together with `context` samples before and
+    after it, so that a peak near the edge of a block is compared with
+    its neighbours in the next block, as find_peaks does on the whole
+    signal. Only the peaks inside the block itself are kept, so no beat
+    is found twice.
+
+    Parameters
+    ----------
+    blocks : iterable
+        (time, voltage) array pairs of the filtered signal
+    context : integer
+        number of samples searched on each side of a block
+    sampling_frequency : float
+        sampling frequency of the data
+
+    Yields
+    ------
+    time : numpy.ndarray
+        time array of the block
+    voltage : numpy.ndarray
+        voltage array of the block
+    beats : list
+        times of the heartbeats in the block
+
+    """
+    times = np.empty(0)
+    voltages = np.empty(0)
+    start = 0
+    for time, voltage in blocks:
+        times = np.concatenate([times, time])
+        voltages = np.concatenate([voltages, voltage])
+        end = len(voltages) - context
+        if end <= start:
+            continue
+        peaks = find_beat_peaks(voltages, sampling_frequency)
+        peaks = peaks[(peaks >= start) & (peaks < end)]
+        yield times[start:end], voltages[start:end], times[peaks].tolist()
+        drop = max(end - context, 0)
+        times = times[drop:]
+        voltages = voltages[drop:]
+        start = end - drop
+    if start < len(voltages):
+        peaks = find_beat_peaks(voltages, sampling_frequency, at_end=True)
+        peaks = peaks[peaks >= start]
+        yield times[start:], voltages[start:], times[peaks].tolist()
+
+
+def analyze_stream(filename, sampling_frequency=None, dtype=np.float64):
+    """
+    Analyzes a recording too long to be loaded at once
+
+    The csv file is read, filtered and searched for beats one block at a
+    time, keeping STREAM_OVERLAP_SECONDS of signal around each block, so
+    the memory used does not grow with the length of the recording,
+    apart from the list of beats. The metrics match those of readFile,
+    process_data and make_metrics on the same file.
+
+    Parameters
+    ----------
+    filename : string
+        directory and the name of the file to read
+    sampling_frequency : float, optional
+        sampling frequency of the data. By default, it is read from a
+        binary container, or estimated from the first block of a csv
+        file like readFile estimates it from the whole file.
+    dtype : data-type, optional
+        float type the file is parsed to
+
+    Returns
+    -------
+    metrics : dictionary
+        Contains duration, voltage extremes, beats,
+        number of beats, and bpm
+
+    """
+    logging.info("Starting analysis of ECG data...")
+    blocks = read_blocks(filename, dtype)
+    first = next(blocks, None)
+    if first is None:
+        raise ValueError("There is no valid line in {}".format(filename))
+    if sampling_frequency is None and ecg_format.is_recording(filename):
+        with ecg_format.open_recording(filename) as recording:
+            sampling_frequency = recording.sampling_frequency
+    if sampling_frequency is None:
+        sampling_frequency = float(len(first[0])/first[0][-1])
+    raw_extremes = [np.inf, -np.inf]
+
+    def checked_blocks():
+        for time, voltage in itertools.chain([first], blocks):
+            raw_extremes[0] = min(raw_extremes[0], voltage.min())
+            raw_extremes[1] = max(raw_extremes[1], voltage.max())
+            yield time, voltage
+
+    overlap = int(STREAM_OVERLAP_SECONDS * sampling_frequency)
+    filtered = filter_blocks(checked_blocks(), sampling_frequency, overlap)
+    duration = -np.inf
+    voltage_extremes = (np.inf, -np.inf)
+    beats = []
+    for time, voltage, block_beats in find_beats_in_blocks(
+            filtered, overlap, sampling_frequency):
+        duration = max(duration, float(time.max()))
+        voltage_extremes = (min(voltage_extremes[0], float(voltage.min())),
+                            max(voltage_extremes[1], float(voltage.max())))
+        beats.extend(block_beats)
+    if raw_extremes[1] > 300 or raw_extremes[0] < -300:
+        logging.warning(
+            "In the input file {},voltage exceed the normal range"
+            .format(filename))
+    return summarize_metrics(duration, voltage_extremes, beats)
+
+
+class OnlineBeatDetector:
+    """
+    Detects heartbeats in a live ECG signal as its samples arrive
+
+    The samples are filtered with the bandpass filter of process_data,
+    run forward only with its state carried over, and searched for
+    peaks like when_beats does. Only the last `window_seconds` of
+    filtered signal are kept. Whether a sample is a beat is decided once
+    `latency_seconds` of signal have followed it, so that a larger peak
+    shortly after it can still rule it out; a beat is therefore reported
+    at most `latency_seconds` plus the length of a pushed block after
+    it occurred. The causal filter delays the peaks by a few
+    milliseconds compared with process_data, and the local amplitude
+    that sets the beat thresholds only covers the signal received so
+    far.
+
+    Parameters
+    ----------
+    sampling_frequency : float
+        sampling frequency of the signal
+    window_seconds : float, optional
+        seconds of filtered signal kept
+    latency_seconds : float, optional
+        seconds after which a sample is decided to be a beat or not
+    rate_seconds : float, optional
+        seconds of beats the heart rate is averaged over
+
+    Attributes
+    ----------
+    heart_rate : float or None
+        rolling heart rate in beats per minute, None until two beats
+        have been found
+
+    """
+
+    def __init__(self, sampling_frequency,
+                 window_seconds=DETECTOR_WINDOW_SECONDS,
+                 latency_seconds=DETECTOR_LATENCY_SECONDS,
+                 rate_seconds=HEART_RATE_SECONDS):
+        self.sos, self.zi = bandpass_sos(sampling_frequency)
+        self.state = None
+        self.sampling_frequency = sampling_frequency
+        # find_beat_peaks compares peaks up to a refractory period apart
+        self.delay = max(int(latency_seconds*sampling_frequency),
+                         refractory_samples(sampling_frequency))
+        self.window = max(int(window_seconds*sampling_frequency),
+                          3*self.delay)
+        self.rate_seconds = rate_seconds
+        self.times = np.empty(0)
+        self.voltages = np.empty(0)
+        # Number of samples pushed, and of samples decided
+        self.samples = 0
+        self.decided = 0
+        self.recent_beats = collections.deque()
+        self.heart_rate = None
+
+    def push(self, time, voltage):
+        """
+        Adds a block of samples
+
+        Parameters
+        ----------
+        time : array_like
+            times of the samples
+        voltage : array_like
+            voltages of the samples
+
+        Returns
+        -------
+        beats : list
+            times of the beats decided by this block
+
+        """
+        time = np.asarray(time, dtype=float)
+        voltage = np.asarray(voltage, dtype=float)
+        beats = []
+        # Blocks longer than the delay are searched in parts, so that
+        # every sample is decided while it is still in the window
+        for start in range(0, len(voltage), self.delay):
+            end = start + self.delay
+            beats.extend(self._push(time[start:end], voltage[start:end]))
+        return beats
+
+    def _push(self, time, voltage):
+        if self.state is None:
+            self.state = self.zi*voltage[0]
+        y, self.state = sosfilt(self.sos, voltage, zi=self.state)
+        self.times = np.concatenate([self.times, time])[-self.window:]
+        self.voltages = np.concatenate([self.voltages, y])[-self.window:]
+        self.samples += len(voltage)
+        first = self.samples - len(self.voltages)
+        end = self.samples - self.delay
+        if end <= self.decided:
+            return []
+        peaks = find_beat_peaks(self.voltages,
+                                self.sampling_frequency) + first
+        peaks = peaks[(peaks >= self.decided) & (peaks < end)]
+        self.decided = end
+        beats = self.times[peaks - first].tolist()
+        self._update_heart_rate(beats)
+        return beats
+
+    def _update_heart_rate(self, beats):
+        self.recent_beats.extend(beats)
+        if not self.recent_beats:
+            return
+        while self.recent_beats[0] < self.recent_beats[-1] - \
+                self.rate_seconds:
+            self.recent_beats.popleft()
+        if len(self.recent_beats) >= 2:
+            span = self.recent_beats[-1] - self.recent_beats[0]
+            self.heart_rate = (len(self.recent_beats) - 1)/span*60
 
 
 def cal_bpm(num_beats, duration):
@@ -234,6 +1095,171 @@ def output_json(filename, metrics):
     out_file.close()
 
 
+def analyze_recording(filename, stream=False):
+    """
+    Computes the metrics of a recording
+
+    Parameters
+    ----------
+    filename : string
+        csv file or binary container to analyze
+    stream : bool, optional
+        analyze the file in blocks with analyze_stream instead of
+        loading it at once
+
+    Returns
+    -------
+    metrics : dictionary
+        Contains duration, voltage extremes, beats,
+        number of beats, and bpm
+
+    """
+    if stream:
+        return analyze_stream(filename)
+    if ecg_format.is_recording(filename):
+        time, voltage, sampling_frequency = read_recording(filename)
+    else:
+        time, voltage, sampling_frequency = readFile(filename)
+    voltage = process_data(voltage, sampling_frequency)
+    return make_metrics(time, voltage, sampling_frequency)
+
+
+def analyze_file(filename, stream=False):
+    """
+    Computes the metrics of a recording for run_batch
+
+    Parameters
+    ----------
+    filename : string
+        csv file to analyze
+    stream : bool, optional
+        analyze the file in blocks
+
+    Returns
+    -------
+    result : dictionary
+        "file" and the metrics of the recording, or "file" and an
+        "error" message if it could not be analyzed
+
+    """
+    try:
+        metrics = analyze_recording(filename, stream)
+    except Exception as e:
+        logging.error("Could not analyze {}: {!r}".format(filename, e))
+        return {"file": filename, "error": repr(e)}
+    result = {"file": filename}
+    result.update(metrics)
+    return result
+
+
+def analyze_files(filenames, stream=False):
+    """
+    Computes the metrics of several recordings in one task of run_batch
+
+    Parameters
+    ----------
+    filenames : list
+        csv files to analyze
+    stream : bool, optional
+        analyze the files in blocks
+
+    Returns
+    -------
+    results : list
+        the result of analyze_file for each file, in order
+
+    """
+    return [analyze_file(filename, stream) for filename in filenames]
+
+
+def find_recordings(inputs):
+    """
+    Lists the csv files and binary containers to analyze
+
+    Parameters
+    ----------
+    inputs : list
+        directories, whose csv files and containers are all listed, and
+        glob patterns, where "**" matches any number of subdirectories
+
+    Returns
+    -------
+    filenames : list
+        the matching files, in sorted order for each input
+
+    """
+    filenames = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            extensions = [".csv", ecg_format.EXTENSION]
+            filenames.extend(sorted(itertools.chain.from_iterable(
+                glob.glob(os.path.join(pattern, "*" + extension))
+                for extension in extensions)))
+            continue
+        filenames.extend(sorted(glob.glob(pattern, recursive=True)))
+    return filenames
+
+
+def run_batch(filenames, output, workers=None, stream=False):
+    """
+    Analyzes recordings in parallel and writes their metrics
+
+    The files are analyzed by a pool of worker processes, in tasks of
+    several files. At most BATCH_TASKS_PER_WORKER tasks per worker are
+    submitted at a time, and the next one only once the oldest is done.
+    The result of each file is written to the output as one line of
+    JSON, in the order of the files, as soon as it and the files before
+    it are done, so memory does not grow with the number of files. A
+    file that cannot be analyzed gets a line with its "error" and the
+    batch goes on.
+
+    Parameters
+    ----------
+    filenames : list
+        csv files to analyze
+    output : string
+        JSON Lines file to write
+    workers : integer, optional
+        number of worker processes, the number of CPUs by default
+    stream : bool, optional
+        analyze the files in blocks
+
+    Returns
+    -------
+    total : integer
+        number of files analyzed
+    failed : integer
+        number of files that could not be analyzed
+
+    """
+    total = 0
+    failed = 0
+    workers = workers or os.cpu_count()
+    # Several files per task, so small files do not wait on the pool
+    chunksize = max(1, min(64, len(filenames) // (4 * workers)))
+    tasks = (filenames[start:start + chunksize]
+             for start in range(0, len(filenames), chunksize))
+    window = BATCH_TASKS_PER_WORKER * workers
+    pending = collections.deque()
+
+    def results_in_order(executor):
+        for task in tasks:
+            pending.append(executor.submit(analyze_files, task, stream))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor, \
+            open(output, "w") as out_file:
+        for result in results_in_order(executor):
+            total += 1
+            if "error" in result:
+                failed += 1
+            out_file.write(json.dumps(result) + "\n")
+    return total, failed
+
+
 def calc_hr(time, voltage):
     global bpm
     num_beats = len(when_beats(time, voltage))
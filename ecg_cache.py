@@ -0,0 +1,252 @@
+""" Cache of ECG analysis results keyed by the content of the signal
+
+The patient portal analyzes and plots the same recordings again and
+again as they are selected, uploaded and selected again. Results are
+stored under the SHA-256 hash of the samples, of the kind of result and
+of the parameters of ecg.py that change the results, so a recording is
+only analyzed once whatever file it comes from, and results computed
+with other parameters are never returned.
+
+Results are bytes, kept in two tiers: the most recently used ones in
+memory, and all of them in a directory up to a total size, beyond which
+the least recently used files are removed.
+"""
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import ecg
+
+# Bump when a change to ecg.py changes its results without changing one
+# of the parameters below
+ANALYSIS_VERSION = 1
+ANALYSIS_PARAMETERS = ["BANDPASS_BAND", "FILTER_PADLEN",
+                       "REFRACTORY_SECONDS", "BEAT_HEIGHT_FRACTION",
+                       "BEAT_PROMINENCE_FRACTION", "AMPLITUDE_WINDOW_SECONDS",
+                       "MIN_BEAT_AMPLITUDE"]
+MEMORY_ENTRIES = 64
+DISK_BYTES = 256 * 1024 * 1024
+
+
+def parameter_version():
+    """ Describes the version and parameters of the ECG analysis
+
+    Returns:
+        str: the ANALYSIS_VERSION and the value of each parameter
+    """
+    parameters = {name: getattr(ecg, name) for name in ANALYSIS_PARAMETERS}
+    return "{}:{!r}".format(ANALYSIS_VERSION, sorted(parameters.items()))
+
+
+def signal_key(time, voltage, kind):
+    """ Computes the cache key of a result of an ECG signal
+
+    Args:
+        time (list or numpy.ndarray): the times of the samples
+        voltage (list or numpy.ndarray): the voltages of the samples
+        kind (str): the kind of result, with any option it depends on,
+            for example "plot-200x150"
+
+    Returns:
+        str: the hexadecimal SHA-256 hash of the parameter version, the
+        kind and the samples
+    """
+    digest = hashlib.sha256()
+    digest.update(parameter_version().encode())
+    digest.update(b"\0" + kind.encode() + b"\0")
+    for samples in (time, voltage):
+        samples = np.ascontiguousarray(samples, dtype=np.float64)
+        digest.update(len(samples).to_bytes(8, "little"))
+        digest.update(samples.data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """ Keeps results in memory and on disk, least recently used first
+
+    A result read from disk moves to the memory tier. On disk, the
+    modification time of a file is its last use, so the disk tier keeps
+    its order when the program restarts. All methods can be called from
+    any thread.
+
+    Args:
+        directory (str): the directory of the disk tier, created if
+            needed
+        memory_entries (int): the number of results kept in memory
+        disk_bytes (int): the total size of the files kept on disk
+    """
+
+    def __init__(self, directory, memory_entries=MEMORY_ENTRIES,
+                 disk_bytes=DISK_BYTES):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.disk_bytes = disk_bytes
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._files = self._scan()
+        self.reset_stats()
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        files.sort()
+        return collections.OrderedDict((name, size)
+                                       for _, name, size in files)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """ Reads a result
+
+        Args:
+            key (str): the key of the result, from signal_key
+
+        Returns:
+            bytes or None: the result, or None if it is not cached
+        """
+        start = time.perf_counter()
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._count_hit("memory_hits", start)
+                return value
+            if key not in self._files:
+                self._stats["misses"] += 1
+                return None
+        try:
+            with open(self._path(key), "rb") as in_file:
+                value = in_file.read()
+            os.utime(self._path(key))
+        except OSError:
+            # Removed by another program sharing the directory
+            with self._lock:
+                self._files.pop(key, None)
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+            self._remember(key, value)
+            self._count_hit("disk_hits", start)
+        return value
+
+    def put(self, key, value):
+        """ Stores a result in both tiers
+
+        Args:
+            key (str): the key of the result, from signal_key
+            value (bytes): the result
+        """
+        # Written to a temporary file first, so a reader never sees part
+        # of a result
+        handle, temporary = tempfile.mkstemp(dir=self.directory,
+                                             prefix=".")
+        with os.fdopen(handle, "wb") as out_file:
+            out_file.write(value)
+        os.replace(temporary, self._path(key))
+        with self._lock:
+            self._remember(key, value)
+            self._files[key] = len(value)
+            self._files.move_to_end(key)
+            evicted = self._evict()
+        for name in evicted:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def get_or_compute(self, key, compute):
+        """ Reads a result, or computes and stores it if not cached
+
+        Args:
+            key (str): the key of the result, from signal_key
+            compute (callable): returns the result as bytes
+
+        Returns:
+            bytes: the result
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        start = time.perf_counter()
+        value = compute()
+        with self._lock:
+            self._stats["compute_seconds"] += time.perf_counter() - start
+        self.put(key, value)
+        return value
+
+    def get_or_compute_json(self, key, compute):
+        """ Like get_or_compute, for results that are JSON values
+
+        Args:
+            key (str): the key of the result, from signal_key
+            compute (callable): returns the result
+
+        Returns:
+            the result, decoded from JSON
+        """
+        value = self.get_or_compute(
+            key, lambda: json.dumps(compute()).encode())
+        return json.loads(value)
+
+    def stats(self):
+        """ Reports the use of the cache since the last reset_stats
+
+        Returns:
+            dict: the number of "memory_hits", "disk_hits" and "misses",
+            the "hit_rate", the mean seconds to read a result on a hit
+            ("hit_seconds") and to compute it on a miss
+            ("compute_seconds"), and the "memory_entries", "disk_entries"
+            and "disk_bytes" kept
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            hits = stats["memory_hits"] + stats["disk_hits"]
+            lookups = hits + stats["misses"]
+            stats["hit_rate"] = hits / lookups if lookups else 0.0
+            stats["hit_seconds"] = stats["hit_seconds"] / hits if hits \
+                else 0.0
+            if stats["misses"]:
+                stats["compute_seconds"] /= stats["misses"]
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = len(self._files)
+            stats["disk_bytes"] = sum(self._files.values())
+        return stats
+
+    def reset_stats(self):
+        """ Sets the counters of stats back to zero """
+        with self._lock:
+            self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                           "hit_seconds": 0.0, "compute_seconds": 0.0}
+
+    def _count_hit(self, tier, start):
+        self._stats[tier] += 1
+        self._stats["hit_seconds"] += time.perf_counter() - start
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        evicted = []
+        total = sum(self._files.values())
+        # The newest file is kept even if it is larger than the limit
+        while total > self.disk_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            total -= size
+            evicted.append(name)
+        return evicted
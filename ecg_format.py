@@ -0,0 +1,406 @@
+""" Compact binary container for raw ECG samples
+
+An ECG recording is kept as a header followed by its samples, so that it
+can be read back without parsing text and sliced without reading the
+whole file. The header holds the sampling frequency, the time of the
+first sample, the units and the number of leads; the time of every
+other sample follows from them.
+
+The samples of all leads are interleaved, one row per sample, in one of
+three encodings:
+
+- "float32": 4 bytes per value, stored as is.
+- "int16": 2 bytes per value, quantized with the scale of the header.
+- "int16-delta": the int16 values of each block of BLOCK_SAMPLES rows
+  are replaced by their differences and compressed with zlib. A table
+  of the block offsets follows the header, so a slice only decompresses
+  the blocks it overlaps.
+
+Files given by name, or by a file object with a file descriptor, are
+mapped in memory with numpy.memmap: the float32 samples of a slice are
+returned without any copy, and only the pages of the slice are read from
+disk. Other file objects, such as GridFS files, are read with seek and
+read, one slice at a time.
+"""
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"ECGB"
+VERSION = 1
+EXTENSION = ".ecgb"
+# magic, version, encoding, lead count, sampling frequency, start time,
+# scale, sample count, block samples, block count and units, padded to
+# 64 bytes
+HEADER = struct.Struct("<4sHHH2xdddQII8s4x")
+ENCODINGS = ["float32", "int16", "int16-delta"]
+SAMPLE_DTYPES = {"float32": np.dtype("<f4"), "int16": np.dtype("<i2"),
+                 "int16-delta": np.dtype("<i2")}
+OFFSET_DTYPE = np.dtype("<u8")
+# Rows of samples compressed together by the "int16-delta" encoding
+BLOCK_SAMPLES = 4096
+INT16_MAX = 32767
+
+
+def save_recording(filename, voltage, sampling_frequency, start_time=0.0,
+                   units="mV", encoding="int16", scale=None,
+                   block_samples=BLOCK_SAMPLES):
+    """ Writes ECG samples to a binary container
+
+    Args:
+        filename (str): the file to write
+        voltage (array-like): the samples, one value per sample for a
+            single lead or one row of lead values per sample
+        sampling_frequency (float): the sampling frequency in Hz
+        start_time (float): the time of the first sample in seconds
+        units (str): the units of the samples, at most 8 ASCII characters
+        encoding (str): one of ENCODINGS
+        scale (float): the units per step of the int16 encodings. By
+            default, the largest absolute sample is mapped to INT16_MAX.
+        block_samples (int): the rows per compressed block of the
+            "int16-delta" encoding
+
+    Returns:
+        int: the size of the file in bytes
+
+    Raises:
+        ValueError: if an argument is not valid, or if a sample is not
+            finite or out of range of an int16 encoding
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown encoding {!r}, expected one of {}"
+                         .format(encoding, ", ".join(ENCODINGS)))
+    if not sampling_frequency > 0:
+        raise ValueError("The sampling frequency must be positive")
+    units = units.encode("ascii")
+    if len(units) > 8:
+        raise ValueError("Units are limited to 8 characters")
+    voltage = np.asarray(voltage)
+    if voltage.ndim == 1:
+        voltage = voltage[:, np.newaxis]
+    if voltage.ndim != 2 or voltage.shape[1] == 0:
+        raise ValueError("Samples must be a 1D or 2D array")
+    if encoding == "float32":
+        scale = 1.0
+        samples = voltage.astype(SAMPLE_DTYPES[encoding])
+    else:
+        samples, scale = quantize(voltage, scale)
+    sample_count, lead_count = samples.shape
+    block_count = 0
+    if encoding == "int16-delta":
+        block_count = math.ceil(sample_count / block_samples)
+    header = HEADER.pack(MAGIC, VERSION, ENCODINGS.index(encoding),
+                         lead_count, sampling_frequency, start_time, scale,
+                         sample_count, block_samples, block_count, units)
+    with open(filename, "wb") as out_file:
+        out_file.write(header)
+        if encoding != "int16-delta":
+            out_file.write(np.ascontiguousarray(samples).tobytes())
+        else:
+            write_delta_blocks(out_file, samples, block_samples)
+        return out_file.tell()
+
+
+def quantize(voltage, scale=None):
+    """ Converts samples to int16 steps of a scale
+
+    Args:
+        voltage (numpy.ndarray): the samples
+        scale (float): the units per step, or None to map the largest
+            absolute sample to INT16_MAX
+
+    Returns:
+        numpy.ndarray, float: the int16 samples and the scale
+
+    Raises:
+        ValueError: if a sample is not finite or out of range
+    """
+    if not np.all(np.isfinite(voltage)):
+        raise ValueError("Samples must be finite to be stored as int16")
+    largest = float(np.max(np.abs(voltage))) if voltage.size else 0.0
+    if scale is None:
+        scale = largest / INT16_MAX or 1.0
+    if largest / scale > INT16_MAX + 0.5:
+        raise ValueError("Samples exceed the int16 range of scale {}"
+                         .format(scale))
+    steps = np.clip(np.rint(voltage / scale), -INT16_MAX, INT16_MAX)
+    return steps.astype(SAMPLE_DTYPES["int16"]), float(scale)
+
+
+def write_delta_blocks(out_file, samples, block_samples):
+    """ Writes the block offset table and the compressed blocks
+
+    The differences are taken in int16 arithmetic, which wraps around, so
+    a cumulative sum in int16 restores the exact values.
+
+    Args:
+        out_file (file object): the container, positioned after the header
+        samples (numpy.ndarray): the int16 samples, one row per sample
+        block_samples (int): the rows per block
+    """
+    blocks = []
+    for start in range(0, len(samples), block_samples):
+        block = samples[start:start + block_samples]
+        deltas = np.diff(block, axis=0, prepend=np.zeros_like(block[:1]))
+        blocks.append(zlib.compress(deltas.astype("<i2").tobytes()))
+    offsets = np.empty(len(blocks) + 1, OFFSET_DTYPE)
+    offsets[0] = HEADER.size + offsets.nbytes
+    offsets[1:] = offsets[0] + np.cumsum([len(block) for block in blocks])
+    out_file.write(offsets.tobytes())
+    for block in blocks:
+        out_file.write(block)
+
+
+def is_recording(filename):
+    """ Checks whether a file starts like a binary ECG container
+
+    Args:
+        filename (str): the file to check
+
+    Returns:
+        bool: True if the file starts with MAGIC
+    """
+    try:
+        with open(filename, "rb") as in_file:
+            return in_file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def open_recording(source):
+    """ Opens a binary ECG container for reading
+
+    Args:
+        source (str or file object): a filename, or a seekable binary
+            file object, which is closed with the recording
+
+    Returns:
+        ECGRecording: the opened recording, to be closed after use
+
+    Raises:
+        ValueError: if the source is not a valid container
+    """
+    return ECGRecording(source)
+
+
+class ECGRecording:
+    """ Reads the header and slices of the samples of a container
+
+    Attributes:
+        sampling_frequency (float): the sampling frequency in Hz
+        start_time (float): the time of the first sample in seconds
+        units (str): the units of the samples
+        lead_count (int): the number of leads
+        sample_count (int): the number of samples of each lead
+        encoding (str): the encoding of the samples, one of ENCODINGS
+        scale (float): the units per step of the int16 encodings
+    """
+
+    def __init__(self, source):
+        self._map = None
+        if isinstance(source, (str, os.PathLike)):
+            source = open(source, "rb")
+        self._source = source
+        try:
+            self._read_header()
+            self._map_source()
+        except BaseException:
+            self.close()
+            raise
+        self._offsets = None
+        if self.encoding == "int16-delta":
+            offsets = self._read(HEADER.size, self.block_count + 1,
+                                 OFFSET_DTYPE)
+            if len(offsets) != self.block_count + 1:
+                self.close()
+                raise ValueError("The block table of the container is "
+                                 "truncated")
+            self._offsets = offsets
+
+    def _read_header(self):
+        self._source.seek(0)
+        header = self._source.read(HEADER.size)
+        if len(header) < HEADER.size or not header.startswith(MAGIC):
+            raise ValueError("Not a binary ECG container")
+        (_, version, encoding, self.lead_count, self.sampling_frequency,
+         self.start_time, self.scale, self.sample_count, self.block_samples,
+         self.block_count, units) = HEADER.unpack(header)
+        if version != VERSION or encoding >= len(ENCODINGS):
+            raise ValueError("Unsupported container version {} or "
+                             "encoding {}".format(version, encoding))
+        if self.lead_count < 1:
+            raise ValueError("The container has no leads")
+        if not 0 < self.sampling_frequency < math.inf:
+            raise ValueError("Sampling frequency {} is not valid"
+                             .format(self.sampling_frequency))
+        self.encoding = ENCODINGS[encoding]
+        self.units = units.rstrip(b"\0").decode("ascii")
+
+    def _map_source(self):
+        try:
+            self._source.fileno()
+        except (AttributeError, OSError):
+            return
+        self._map = np.memmap(self._source, dtype=np.uint8, mode="r")
+
+    def _read(self, offset, count, dtype):
+        """ Reads an array from the container, without a copy if mapped """
+        if self._map is not None:
+            data = self._map[offset:offset + count * dtype.itemsize]
+        else:
+            self._source.seek(offset)
+            data = self._source.read(count * dtype.itemsize)
+        count = len(data) // dtype.itemsize
+        return np.frombuffer(data, dtype, count)
+
+    @property
+    def duration(self):
+        """ float: the time from the first sample to the last one """
+        return max(self.sample_count - 1, 0) / self.sampling_frequency
+
+    def time(self, start=0, stop=None):
+        """ Computes the times of a range of samples
+
+        Args:
+            start (int): the index of the first sample
+            stop (int): the index after the last sample, by default the
+                end of the recording
+
+        Returns:
+            numpy.ndarray: the times in seconds
+        """
+        start, stop, _ = slice(start, stop).indices(self.sample_count)
+        return self.start_time \
+            + np.arange(start, stop) / self.sampling_frequency
+
+    def samples(self, start=0, stop=None):
+        """ Reads a range of samples of every lead
+
+        Float32 samples of a mapped container are a read-only view of
+        the file. Int16 samples are multiplied by the scale, and only the
+        compressed blocks overlapping the range are decoded.
+
+        Args:
+            start (int): the index of the first sample
+            stop (int): the index after the last sample, by default the
+                end of the recording
+
+        Returns:
+            numpy.ndarray: the samples, one row of lead values per sample
+
+        Raises:
+            ValueError: if the container is truncated
+        """
+        start, stop, _ = slice(start, stop).indices(self.sample_count)
+        stop = max(start, stop)
+        if self.encoding == "int16-delta":
+            steps = self._decode_blocks(start, stop)
+        else:
+            dtype = SAMPLE_DTYPES[self.encoding]
+            steps = self._read(
+                HEADER.size + start * self.lead_count * dtype.itemsize,
+                (stop - start) * self.lead_count, dtype)
+        if len(steps) != (stop - start) * self.lead_count:
+            raise ValueError("The samples of the container are truncated")
+        steps = steps.reshape(stop - start, self.lead_count)
+        if self.encoding == "float32":
+            return steps
+        return steps.astype(np.float32) * np.float32(self.scale)
+
+    def _decode_blocks(self, start, stop):
+        if start == stop:
+            return np.empty(0, SAMPLE_DTYPES["int16"])
+        first = start // self.block_samples
+        last = (stop - 1) // self.block_samples
+        blocks = []
+        for block in range(first, last + 1):
+            begin, end = (int(offset) for offset in
+                          self._offsets[block:block + 2])
+            compressed = self._read(begin, end - begin,
+                                    np.dtype(np.uint8))
+            try:
+                deltas = np.frombuffer(zlib.decompress(compressed),
+                                       SAMPLE_DTYPES["int16"])
+            except zlib.error as error:
+                raise ValueError("Block {} of the container is not "
+                                 "valid: {}".format(block, error))
+            deltas = deltas.reshape(-1, self.lead_count)
+            blocks.append(np.cumsum(deltas, axis=0,
+                                    dtype=SAMPLE_DTYPES["int16"]))
+        steps = np.concatenate(blocks)
+        skip = start - first * self.block_samples
+        return steps[skip:skip + stop - start].ravel()
+
+    def index(self, time):
+        """ Finds the first sample at or after a time
+
+        Args:
+            time (float): the time in seconds
+
+        Returns:
+            int: the sample index, between 0 and sample_count
+
+        Raises:
+            ValueError: if the time is not finite
+        """
+        return max(math.ceil(self._position(time) - 1e-9), 0)
+
+    def _position(self, time):
+        """ Converts a time to a sample position, clamped near the samples """
+        if not math.isfinite(time):
+            raise ValueError("Time {} is not finite".format(time))
+        position = (time - self.start_time) * self.sampling_frequency
+        return min(max(position, -1.0), float(self.sample_count))
+
+    def sample_range(self, start_time=None, end_time=None):
+        """ Finds the samples between two times
+
+        Args:
+            start_time (float): the earliest time in seconds, by default
+                the start of the recording
+            end_time (float): the latest time in seconds, by default the
+                end of the recording
+
+        Returns:
+            int, int: the index of the first sample and the index after
+            the last one
+
+        Raises:
+            ValueError: if a time is not finite
+        """
+        start = 0 if start_time is None else self.index(start_time)
+        stop = self.sample_count
+        if end_time is not None:
+            # The sample at end_time is included
+            last = math.floor(self._position(end_time) + 1e-9)
+            stop = min(max(last + 1, 0), self.sample_count)
+        return start, max(start, stop)
+
+    def time_slice(self, start_time=None, end_time=None):
+        """ Reads the samples between two times
+
+        Args:
+            start_time (float): the earliest time in seconds, by default
+                the start of the recording
+            end_time (float): the latest time in seconds, by default the
+                end of the recording
+
+        Returns:
+            numpy.ndarray, numpy.ndarray: the times of the samples, and
+            the samples with one row of lead values per sample
+        """
+        start, stop = self.sample_range(start_time, end_time)
+        return self.time(start, stop), self.samples(start, stop)
+
+    def close(self):
+        self._map = None
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
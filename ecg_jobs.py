@@ -0,0 +1,300 @@
+""" Queue of ECG analysis jobs run by a pool of worker processes
+
+An uploaded ECG recording is analyzed on the server instead of trusting
+the heart rate computed by the patient portal. Each recording becomes a
+job in a local SQLite database, so jobs survive a restart of the server
+and their status can be read by any server thread. A dispatcher thread
+claims the queued jobs, oldest first, and runs the filtering and beat
+detection of ecg.py in a pool of worker processes, keeping at most one
+job per worker in flight so the others stay "queued".
+
+A job is "queued", then "running", then "done" with the metrics of the
+recording or "failed" with an error message. A job can also be added
+"held", while the upload it belongs to is written, and is then released
+to the queue or discarded. Jobs left "running" by a server that stopped
+are queued again when the workers start, and jobs left "held" are
+discarded, since their upload may never have been written.
+"""
+import concurrent.futures
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+import ecg
+
+JOB_STATES = ["held", "queued", "running", "done", "failed"]
+# Seconds the dispatcher waits for a new job before checking the
+# database, where other server processes may have queued one
+POLL_INTERVAL = 1
+
+
+def analyze_job(source):
+    """ Computes the metrics of a binary ECG container
+
+    This runs in a worker process.
+
+    Args:
+        source (str or bytes): the filename of the container, which is
+            mapped in memory, or its content
+
+    Returns:
+        dict: the metrics of ecg.make_metrics
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    times, voltage, sampling_frequency = ecg.read_recording(source)
+    voltage = ecg.process_data(voltage, sampling_frequency)
+    return ecg.make_metrics(times, voltage, sampling_frequency)
+
+
+class JobQueue:
+    """ Keeps the ECG analysis jobs in a local SQLite database
+
+    The database is in write-ahead logging mode and created on first
+    use. Every thread uses its own connection.
+
+    Args:
+        path (str): the file of the database
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._created = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Every statement is a transaction of its own
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        with self._lock:
+            if not self._created:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                           "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           "patient_id INTEGER NOT NULL, "
+                           "recording TEXT NOT NULL, "
+                           "state TEXT NOT NULL, "
+                           "queued_at REAL NOT NULL, started_at REAL, "
+                           "finished_at REAL, result TEXT, error TEXT)")
+                db.execute("CREATE INDEX IF NOT EXISTS jobs_by_state "
+                           "ON jobs (state, id)")
+                self._created = True
+        return db
+
+    def enqueue(self, patient_id, recording_hash, held=False):
+        """ Adds a job for a recording
+
+        Args:
+            patient_id (int): the patient the metrics are written to
+            recording_hash (str): the content hash of the container
+            held (bool): add the job "held", so that it is not run until
+                         it is released
+
+        Returns:
+            int: the id of the job
+        """
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (patient_id, recording, state, queued_at) "
+            "VALUES (?, ?, ?, ?)",
+            (patient_id, recording_hash, "held" if held else "queued",
+             time.time()))
+        return cursor.lastrowid
+
+    def release(self, job_ids):
+        """ Queues held jobs
+
+        Args:
+            job_ids (list): the ids of the jobs
+        """
+        self._connect().executemany(
+            "UPDATE jobs SET state = 'queued' "
+            "WHERE id = ? AND state = 'held'",
+            [(job_id,) for job_id in job_ids])
+
+    def discard(self, job_ids):
+        """ Removes held jobs
+
+        Args:
+            job_ids (list): the ids of the jobs
+        """
+        self._connect().executemany(
+            "DELETE FROM jobs WHERE id = ? AND state = 'held'",
+            [(job_id,) for job_id in job_ids])
+
+    def claim(self):
+        """ Marks the oldest queued job as running
+
+        Returns:
+            dict or None: the job, as returned by get, or None if no job
+            is queued
+        """
+        row = self._connect().execute(
+            "UPDATE jobs SET state = 'running', started_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE state = 'queued' "
+            "ORDER BY id LIMIT 1) RETURNING id",
+            (time.time(),)).fetchone()
+        if row is None:
+            return None
+        return self.get(row[0])
+
+    def finish(self, job_id, result):
+        """ Marks a running job as done
+
+        Args:
+            job_id (int): the id of the job
+            result (dict): the metrics of the recording
+        """
+        self._connect().execute(
+            "UPDATE jobs SET state = 'done', finished_at = ?, result = ? "
+            "WHERE id = ?", (time.time(), json.dumps(result), job_id))
+
+    def fail(self, job_id, error):
+        """ Marks a job as failed
+
+        Args:
+            job_id (int): the id of the job
+            error (str): the reason it failed
+        """
+        self._connect().execute(
+            "UPDATE jobs SET state = 'failed', finished_at = ?, error = ? "
+            "WHERE id = ?", (time.time(), error, job_id))
+
+    def get(self, job_id):
+        """ Reads a job
+
+        Args:
+            job_id (int): the id of the job
+
+        Returns:
+            dict or None: the job with keys "job_id", "patient_id",
+            "recording", "state", "queued_at", "started_at", "finished_at"
+            (times in seconds since the epoch, or None), "result" and
+            "error", or None if there is no such job
+        """
+        row = self._connect().execute(
+            "SELECT id, patient_id, recording, state, queued_at, "
+            "started_at, finished_at, result, error FROM jobs "
+            "WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ["job_id", "patient_id", "recording", "state", "queued_at",
+                "started_at", "finished_at", "result", "error"]
+        job = dict(zip(keys, row))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def counts(self):
+        """ Counts the jobs in each state
+
+        Returns:
+            dict: the number of jobs keyed by state
+        """
+        counts = dict.fromkeys(JOB_STATES, 0)
+        rows = self._connect().execute(
+            "SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        counts.update(rows)
+        return counts
+
+    def requeue_running(self):
+        """ Queues again the jobs left running by a stopped server, and
+        removes the jobs it left held
+
+        Returns:
+            int: the number of jobs queued again
+        """
+        db = self._connect()
+        db.execute("DELETE FROM jobs WHERE state = 'held'")
+        cursor = db.execute(
+            "UPDATE jobs SET state = 'queued', started_at = NULL "
+            "WHERE state = 'running'")
+        return cursor.rowcount
+
+
+class JobWorkers:
+    """ Runs the queued jobs in a pool of worker processes
+
+    Args:
+        queue (JobQueue): the queue of jobs
+        load_recording (callable): called with the hash of a recording,
+            returns its filename or its content for analyze_job
+        on_result (callable): called with a job and its metrics once it
+            is analyzed, before the job is marked as done. If it raises,
+            the job fails.
+        workers (int): the number of worker processes, by default the
+            number of CPUs
+    """
+
+    def __init__(self, queue, load_recording, on_result, workers=None):
+        self.queue = queue
+        self.load_recording = load_recording
+        self.on_result = on_result
+        self.workers = workers or os.cpu_count()
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._executor = None
+        self._thread = None
+
+    def start(self):
+        """ Starts the worker processes and the dispatcher thread
+
+        The pool starts its processes as jobs are submitted, from the
+        dispatcher thread while the server threads run. They are spawned
+        instead of forked, so that no process inherits a lock held by
+        another thread at the time.
+        """
+        self.queue.requeue_running()
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """ Wakes the dispatcher up after a job was queued """
+        self._wake.set()
+
+    def stop(self):
+        """ Waits for the jobs in flight, then stops the workers """
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self._slots.acquire(timeout=POLL_INTERVAL):
+                continue
+            job = self.queue.claim()
+            if job is None:
+                self._slots.release()
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            try:
+                source = self.load_recording(job["recording"])
+                future = self._executor.submit(analyze_job, source)
+            except Exception as error:
+                self.queue.fail(job["job_id"], repr(error))
+                self._slots.release()
+                continue
+            future.add_done_callback(
+                lambda future, job=job: self._done(job, future))
+
+    def _done(self, job, future):
+        try:
+            metrics = future.result()
+            self.on_result(job, metrics)
+            self.queue.finish(job["job_id"], metrics)
+        except Exception as error:
+            self.queue.fail(job["job_id"], repr(error))
+        finally:
+            self._slots.release()
@@ -0,0 +1,145 @@
+""" Fast rendering of ECG plots to images in memory
+
+A recording of hours has millions of samples, but a plot only has a few
+hundred pixel columns. The samples are reduced to the minimum and the
+maximum of each half of a column before they are drawn, which draws the
+same image, QRS spikes included, from a few points per column.
+
+Plots are drawn by the Agg backend of matplotlib on a figure kept for
+each size and thread, without the global state of pyplot, and encoded
+to JPEG in memory, so no file is written or read.
+"""
+import io
+import threading
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+from PIL import Image
+
+# Size in pixels of the plots, as saved by pyplot by default
+PLOT_SIZE = (640, 480)
+PLOT_DPI = 100
+# Size of the plots shown in the GUIs
+THUMBNAIL_SIZE = (200, 150)
+# Changes the cache keys of ecg_cache when the rendering changes
+PLOT_VERSION = "minmax-1"
+# Columns of samples reduced to their minimum and maximum per pixel of
+# the plot. With one, the columns do not line up with the pixels and a
+# dense plot loses some of its ink; with two, the plot is the same as
+# with all the samples.
+COLUMNS_PER_PIXEL = 2
+
+_figures = threading.local()
+
+
+def minmax_envelope(time, voltage, columns):
+    """ Reduces a signal to the minimum and maximum of each column
+
+    The samples are split into columns of the same number of samples,
+    which are columns of the same duration for a signal sampled at a
+    constant rate. The minimum and the maximum of each column are kept
+    in the order they come in, with the first and the last samples.
+
+    Args:
+        time (list or numpy.ndarray): the times of the samples
+        voltage (list or numpy.ndarray): the voltages of the samples
+        columns (int): the number of columns of the plot
+
+    Returns:
+        numpy.ndarray: the times of the kept samples
+        numpy.ndarray: the voltages of the kept samples, all of them if
+        there are no more than two per column
+    """
+    time = np.asarray(time, dtype=np.float64)
+    voltage = np.asarray(voltage, dtype=np.float64)
+    count = len(voltage)
+    if count <= 2 * columns + 2:
+        return time, voltage
+    per_column = -(-count // columns)
+    # The last column is completed with copies of the last sample
+    padded = np.pad(voltage, (0, per_column * columns - count), mode="edge")
+    padded = padded.reshape(columns, per_column)
+    starts = np.arange(columns) * per_column
+    lowest = starts + padded.argmin(axis=1)
+    highest = starts + padded.argmax(axis=1)
+    indexes = np.empty(2 * columns + 2, dtype=np.intp)
+    indexes[0] = 0
+    indexes[1:-1:2] = np.minimum(lowest, highest)
+    indexes[2:-1:2] = np.maximum(lowest, highest)
+    indexes[-1] = count - 1
+    indexes = np.minimum(indexes, count - 1)
+    return time[indexes], voltage[indexes]
+
+
+def _figure(size):
+    figures = getattr(_figures, "figures", None)
+    if figures is None:
+        figures = _figures.figures = {}
+    if size not in figures:
+        figure = Figure(figsize=(size[0] / PLOT_DPI, size[1] / PLOT_DPI),
+                        dpi=PLOT_DPI)
+        canvas = FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        line, = axes.plot([], [])
+        axes.set_xlabel('Time (s)')
+        axes.set_ylabel('Voltage (mV)')
+        figures[size] = canvas, axes, line
+    return figures[size]
+
+
+def render_ecg_image(time, voltage, size=PLOT_SIZE):
+    """ Draws the plot of an ECG signal
+
+    Args:
+        time (list or numpy.ndarray): the times of the samples
+        voltage (list or numpy.ndarray): the voltages of the samples
+        size (tuple): the width and height of the plot in pixels
+
+    Returns:
+        PIL.Image.Image: the plot, in RGB
+    """
+    canvas, axes, line = _figure(size)
+    columns = max(1, int(axes.bbox.width * COLUMNS_PER_PIXEL))
+    line.set_data(*minmax_envelope(time, voltage, columns))
+    axes.relim()
+    axes.autoscale_view()
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    image = Image.frombuffer("RGBA", (width, height), canvas.buffer_rgba(),
+                             "raw", "RGBA", 0, 1)
+    return image.convert("RGB")
+
+
+def render_ecg(time, voltage, size=PLOT_SIZE):
+    """ Draws the plot of an ECG signal as a JPEG image
+
+    Args:
+        time (list or numpy.ndarray): the times of the samples
+        voltage (list or numpy.ndarray): the voltages of the samples
+        size (tuple): the width and height of the plot in pixels
+
+    Returns:
+        bytes: the JPEG image
+    """
+    output = io.BytesIO()
+    render_ecg_image(time, voltage, size).save(output, format="JPEG")
+    return output.getvalue()
+
+
+def thumbnail(image_bytes, size=THUMBNAIL_SIZE):
+    """ Decodes an image and resizes it for display
+
+    JPEG images are decoded directly at a reduced scale when they are
+    at least twice as large as the thumbnail.
+
+    Args:
+        image_bytes (bytes): the encoded image
+        size (tuple): the width and height of the thumbnail in pixels
+
+    Returns:
+        PIL.Image.Image: the thumbnail, of exactly the given size
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("RGB", size)
+    return image.resize(size)
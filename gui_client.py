@@ -1,20 +1,293 @@
 from tkinter import filedialog
+from collections import OrderedDict
 import base64
+import json
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
 import requests
+from patient_events import parse_event_line
 
-server = "http://vcm-25859.vm.duke.edu:5000"
+# Server of the GUIs, unless the PATIENT_PORTAL_SERVER environment
+# variable names another one
+DEFAULT_SERVER = "http://vcm-25859.vm.duke.edu:5000"
+# Keep-alive connections to the server kept open for reuse
+POOL_SIZE = 8
+# (connect, read) timeouts of requests, in seconds
+REQUEST_TIMEOUT = (5, 30)
+# GET requests are sent again after a connection error or one of these
+# answers, up to GET_RETRIES times, GET_RETRY_BASE_DELAY seconds after
+# the first failure and twice as long after each of the next ones
+GET_RETRIES = 2
+GET_RETRY_BASE_DELAY = 0.25
+RETRY_STATUS_CODES = (502, 503, 504)
+# Latest known information of each retrieved patient, keyed by patient id
+patient_cache = {}
+# Bytes of response bodies kept by the ETag cache
+RESPONSE_CACHE_BYTES = 8 * 1024 * 1024
+PATIENT_ID_PAGE_SIZE = 1000
+# Largest number of patients summarized in one request
+SUMMARY_BATCH_SIZE = 500
+# Seconds without any message after which the event stream is considered
+# dropped; the server sends a heartbeat every 15 seconds
+EVENT_READ_TIMEOUT = 45
+cache_stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+# The GUIs send requests from several threads at once
+cache_lock = threading.Lock()
+# Chunk size and (connect, read) timeouts of resumable uploads
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_TIMEOUT = (10, 60)
+# Seconds before the first retry of a failed upload, doubled after every
+# failure up to the maximum
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 300
+# Keys of the patient information holding files to upload. "ECG_Data" is
+# the binary container of the raw ECG samples, sent to the server as the
+# "recording" of the ECG image
+UPLOAD_FILE_KEYS = ["ECG", "Med_Img", "ECG_Data"]
+
+
+class ServerClient:
+    # Sends requests to the server over a pool of keep-alive connections
+    # shared by all the threads of a GUI, instead of opening a connection
+    # for every request. Requests time out instead of hanging, and GET
+    # requests, which can safely be sent twice, are retried after a
+    # connection error or an answer of an overloaded server, waiting
+    # twice as long after each failure.
+
+    def __init__(self, url, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT,
+                 get_retries=GET_RETRIES):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.get_retries = get_retries
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def get(self, path, retries=None, **kwargs):
+        if retries is None:
+            retries = self.get_retries
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            try:
+                r = self.session.get(self.url + path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                if r.status_code not in RETRY_STATUS_CODES or \
+                        attempt == retries:
+                    return r
+                r.close()
+            time.sleep(retry_delay(attempt, GET_RETRY_BASE_DELAY))
+            attempt += 1
+
+    def post(self, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(self.url + path, **kwargs)
+
+    def put(self, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.put(self.url + path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+client = ServerClient(os.environ.get("PATIENT_PORTAL_SERVER",
+                                     DEFAULT_SERVER))
+
+
+class ResponseCache:
+    # Keeps the responses that carried an ETag, keyed by URL, least
+    # recently used first, so that they can be revalidated. The cache is
+    # bounded by the bytes of the response bodies, and a response larger
+    # than the whole cache is not kept.
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._responses = OrderedDict()
+
+    def get(self, url):
+        r = self._responses.get(url)
+        if r is not None:
+            self._responses.move_to_end(url)
+        return r
+
+    def put(self, url, r):
+        self.discard(url)
+        if len(r.content) > self.max_bytes:
+            return
+        self._responses[url] = r
+        self.size += len(r.content)
+        while self.size > self.max_bytes:
+            _, oldest = self._responses.popitem(last=False)
+            self.size -= len(oldest.content)
+
+    def discard(self, url):
+        r = self._responses.pop(url, None)
+        if r is not None:
+            self.size -= len(r.content)
+
+    def clear(self):
+        self._responses.clear()
+        self.size = 0
+
+    def __contains__(self, url):
+        return url in self._responses
+
+    def __len__(self):
+        return len(self._responses)
+
+
+response_cache = ResponseCache()
+
+
+def configure(url, pool_size=POOL_SIZE):
+    # Sends the next requests to another server
+    global client
+    client.close()
+    client = ServerClient(url, pool_size)
+    return client
+
+
+def get_with_validators(path):
+    url = client.url + path
+    with cache_lock:
+        cached = response_cache.get(url)
+    headers = {}
+    if cached is not None:
+        headers["If-None-Match"] = cached.headers["ETag"]
+    r = client.get(path, headers=headers)
+    with cache_lock:
+        if r.status_code == 304 and cached is not None:
+            cache_stats["hits"] += 1
+            cache_stats["bytes_saved"] += len(cached.content)
+            return cached
+        cache_stats["misses"] += 1
+        if r.status_code == 200 and "ETag" in r.headers:
+            response_cache.put(url, r)
+    return r
+
+
+def reset_cache_stats():
+    for key in cache_stats:
+        cache_stats[key] = 0
 
 
 def retrieve_all_patients():
-    r = requests.get(server + "/get_all_patient_id")
-    return r.text
+    ids = []
+    after = None
+    while True:
+        path = "/get_all_patient_id?limit=" + str(PATIENT_ID_PAGE_SIZE)
+        if after is not None:
+            path += "&after=" + str(after)
+        r = get_with_validators(path)
+        if r.status_code != 200:
+            return r.text
+        page = json.loads(r.text)
+        ids += page["ids"]
+        after = page["next"]
+        if after is None:
+            return json.dumps({"ids": ids})
 
 
 def retrieve_patient_data_from_server(patient_id):
-    r = requests.get(server + "/get_patient_info/" + patient_id)
+    with cache_lock:
+        cached = patient_cache.get(patient_id)
+    params = {}
+    if cached is not None:
+        params["since"] = cached["Revision"]
+    r = client.get("/get_patient_info/" + patient_id, params=params)
+    if r.status_code == 304:
+        return json.dumps(cached)
+    if r.status_code != 200:
+        return r.text
+    patient = merge_patient_changes(cached, r.json())
+    with cache_lock:
+        patient_cache[patient_id] = patient
+    return json.dumps(patient)
+
+
+def merge_patient_changes(patient, changes):
+    if "Since" not in changes:
+        return changes
+    merged = dict(patient)
+    for key in ["Med_Img", "ECG", "Heart_Rate", "Timestamp", "ECG_Metrics"]:
+        # Servers before ECG_Metrics existed do not send it
+        if key in patient or key in changes:
+            merged[key] = patient.get(key, []) + changes.get(key, [])
+    merged["Name"] = changes["Name"]
+    merged["Revision"] = changes["Revision"]
+    return merged
+
+
+def retrieve_patient_summary_from_server(patient_id):
+    r = get_with_validators("/get_patient_summary/" + patient_id)
+    return r.text
+
+
+def retrieve_heart_rate(patient_id, start=None, end=None, bucket=None):
+    # Minimum, mean and maximum heart rate of each bucket of the range,
+    # aggregated by the server; start and end are datetimes and bucket a
+    # number of seconds or a duration such as "5m"
+    params = {}
+    if start is not None:
+        params["start"] = start.isoformat()
+    if end is not None:
+        params["end"] = end.isoformat()
+    if bucket is not None:
+        params["bucket"] = str(bucket)
+    path = "/heart_rate/" + str(patient_id)
+    if len(params) != 0:
+        path += "?" + urlencode(params)
+    r = get_with_validators(path)
     return r.text
 
 
+def retrieve_patient_summaries(patient_ids, fields=None):
+    # One request per SUMMARY_BATCH_SIZE patients, each revalidated with
+    # its ETag, so an unchanged batch costs an empty 304 response
+    summaries = {"patients": [], "missing": []}
+    for start in range(0, len(patient_ids), SUMMARY_BATCH_SIZE):
+        batch = patient_ids[start:start + SUMMARY_BATCH_SIZE]
+        path = "/get_patient_summaries?ids=" + ",".join(
+            str(patient_id) for patient_id in batch)
+        if fields is not None:
+            path += "&fields=" + ",".join(fields)
+        r = get_with_validators(path)
+        if r.status_code != 200:
+            return r.text
+        page = json.loads(r.text)
+        summaries["patients"] += page["patients"]
+        summaries["missing"] += page["missing"]
+    return json.dumps(summaries)
+
+
+def listen_to_patient_events(on_event, on_connect=None):
+    # Not retried here, the caller reconnects after a delay
+    r = client.get("/patient_events", retries=0, stream=True,
+                   timeout=(10, EVENT_READ_TIMEOUT))
+    r.raise_for_status()
+    if on_connect is not None:
+        on_connect()
+    with r:
+        for line in r.iter_lines(decode_unicode=True):
+            event = parse_event_line(line)
+            if event is not None:
+                on_event(event)
+    return
+
+
 def convert_file_to_b64_string(filename):
     with open(filename, "rb") as image_file:
         b64_bytes = base64.b64encode(image_file.read())
@@ -30,5 +303,248 @@ def convert_b64_string_to_file(b64_string, savename):
 
 
 def upload_patient_data_to_server(patient_info):
-    r = requests.post(server + "/new_patient", json=patient_info)
+    patient_info = dict(patient_info)
+    for key in UPLOAD_FILE_KEYS:
+        if key in patient_info:
+            image_hash = upload_image_to_server(patient_info[key])
+            if image_hash is None:
+                return "Image upload failed"
+            patient_info[key] = {"hash": image_hash}
+    r = client.post("/new_patient", json=attach_ecg_recording(patient_info))
     return r.text
+
+
+def attach_ecg_recording(patient_info):
+    # Moves the uploaded "ECG_Data" container into the ECG reference,
+    # where the server expects it
+    patient_info = dict(patient_info)
+    recording = patient_info.pop("ECG_Data", None)
+    if recording is not None and "ECG" in patient_info:
+        patient_info["ECG"] = dict(patient_info["ECG"], recording=recording)
+    return patient_info
+
+
+def upload_image_to_server(filename):
+    with open(filename, "rb") as image_file:
+        r = client.post("/image", data=image_file,
+                        headers={"Content-Type":
+                                 "application/octet-stream"})
+    if r.status_code != 200:
+        return None
+    return r.json()["hash"]
+
+
+def start_chunked_upload():
+    r = client.post("/upload", timeout=UPLOAD_TIMEOUT)
+    r.raise_for_status()
+    return r.json()["upload_id"]
+
+
+def upload_file_in_chunks(filename, upload_id):
+    path = "/upload/" + upload_id
+    r = client.get(path, timeout=UPLOAD_TIMEOUT)
+    r.raise_for_status()
+    offset = r.json()["offset"]
+    with open(filename, "rb") as image_file:
+        size = os.fstat(image_file.fileno()).st_size
+        while offset < size:
+            image_file.seek(offset)
+            chunk = image_file.read(UPLOAD_CHUNK_SIZE)
+            r = client.put(path, params={"offset": offset}, data=chunk,
+                           headers={"Content-Type":
+                                    "application/octet-stream"},
+                           timeout=UPLOAD_TIMEOUT)
+            # 409 means the server holds a different offset, resume there
+            if r.status_code != 409:
+                r.raise_for_status()
+            offset = r.json()["offset"]
+    r = client.post(path + "/finish", timeout=UPLOAD_TIMEOUT)
+    r.raise_for_status()
+    return r.json()["hash"]
+
+
+def is_permanent_error(r):
+    # A client error other than a dropped upload session (404) or a
+    # different upload offset (409) is answered the same way every time
+    return r is not None and 400 <= r.status_code < 500 and \
+        r.status_code not in (404, 409)
+
+
+def retry_delay(attempts, base_delay=None):
+    if base_delay is None:
+        base_delay = RETRY_BASE_DELAY
+    delay = min(base_delay * 2 ** attempts, RETRY_MAX_DELAY)
+    # Spread the retries of clients that failed at the same time
+    return delay * random.uniform(0.5, 1)
+
+
+class UploadQueue:
+    # Uploads patient data through an on-disk queue, so that nothing is
+    # lost when the server cannot be reached. Images are copied into the
+    # queue directory and sent in chunks; an interrupted image resumes
+    # from the last offset acknowledged by the server. Queued uploads are
+    # sent in order by a background thread, which waits longer after
+    # each failure.
+
+    def __init__(self, directory, on_result=None):
+        self.directory = directory
+        self.on_result = on_result
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "queue.sqlite"),
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._execute("CREATE TABLE IF NOT EXISTS uploads ("
+                      "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                      "patient_info TEXT NOT NULL, "
+                      "attempts INTEGER NOT NULL DEFAULT 0, "
+                      "next_attempt REAL NOT NULL DEFAULT 0)")
+
+    def _execute(self, sql, parameters=()):
+        # The connection is shared by the GUI and the background thread
+        with self._lock:
+            cursor = self._db.execute(sql, parameters)
+            return cursor.fetchall(), cursor.lastrowid
+
+    def add(self, patient_info):
+        # Raises ValueError for an empty file, which the server would
+        # reject at every attempt
+        queued = dict(patient_info)
+        for key in UPLOAD_FILE_KEYS:
+            if key in queued:
+                if os.path.getsize(queued[key]) == 0:
+                    raise ValueError("{} is empty".format(queued[key]))
+                copy = os.path.join(self.directory, "{}-{}-{}".format(
+                    key, time.time_ns(), os.path.basename(queued[key])))
+                shutil.copyfile(queued[key], copy)
+                queued[key] = {"file": copy, "upload_id": None,
+                               "hash": None}
+        rows, job_id = self._execute("INSERT INTO uploads (patient_info) "
+                                     "VALUES (?)", (json.dumps(queued),))
+        self._wake.set()
+        return job_id
+
+    def pending(self):
+        rows, _ = self._execute("SELECT COUNT(*) FROM uploads")
+        return rows[0][0]
+
+    def _save(self, job_id, queued):
+        self._execute("UPDATE uploads SET patient_info = ? WHERE id = ?",
+                      (json.dumps(queued), job_id))
+
+    def _remove(self, job_id, queued):
+        for key in UPLOAD_FILE_KEYS:
+            if key in queued and os.path.exists(queued[key]["file"]):
+                os.remove(queued[key]["file"])
+        self._execute("DELETE FROM uploads WHERE id = ?", (job_id,))
+
+    def _send(self, job_id, queued):
+        patient_info = dict(queued)
+        for key in UPLOAD_FILE_KEYS:
+            if key not in queued:
+                continue
+            image = queued[key]
+            if image["hash"] is None:
+                if image["upload_id"] is None:
+                    image["upload_id"] = start_chunked_upload()
+                    self._save(job_id, queued)
+                try:
+                    image["hash"] = upload_file_in_chunks(
+                        image["file"], image["upload_id"])
+                except requests.HTTPError as error:
+                    if error.response.status_code == 404:
+                        # The server dropped the session, start a new one
+                        image["upload_id"] = None
+                        self._save(job_id, queued)
+                    raise
+                self._save(job_id, queued)
+            patient_info[key] = {"hash": image["hash"]}
+        r = client.post("/new_patient",
+                        json=attach_ecg_recording(patient_info),
+                        timeout=UPLOAD_TIMEOUT)
+        if r.status_code >= 500:
+            r.raise_for_status()
+        return r.text
+
+    def drain(self):
+        # Sends the queued uploads that are due, oldest first. Returns the
+        # number of seconds until the next retry, or None if the queue
+        # is empty.
+        while True:
+            rows, _ = self._execute("SELECT id, patient_info, attempts, "
+                                    "next_attempt FROM uploads "
+                                    "ORDER BY id LIMIT 1")
+            if len(rows) == 0:
+                return None
+            job_id, queued, attempts, next_attempt = rows[0]
+            if next_attempt > time.time():
+                return next_attempt - time.time()
+            queued = json.loads(queued)
+            try:
+                message = self._send(job_id, queued)
+            except requests.HTTPError as error:
+                if not is_permanent_error(error.response):
+                    return self._retry_later(job_id, attempts)
+                # The server refused the upload, retrying won't help
+                message = "Upload failed: {} {}".format(
+                    error.response.status_code, error.response.text)
+            except requests.RequestException:
+                return self._retry_later(job_id, attempts)
+            except OSError as error:
+                # A queued image can no longer be read, retrying won't help
+                message = "Upload failed: {}".format(error)
+            self._remove(job_id, queued)
+            self._report(job_id, message)
+
+    def _retry_later(self, job_id, attempts):
+        delay = retry_delay(attempts)
+        self._execute("UPDATE uploads SET attempts = ?, "
+                      "next_attempt = ? WHERE id = ?",
+                      (attempts + 1, time.time() + delay, job_id))
+        self._report(job_id, "Server unreachable, retrying upload "
+                     "in {:.0f} s".format(delay))
+        return delay
+
+    def _report(self, job_id, message):
+        if self.on_result is not None:
+            self.on_result(job_id, message)
+
+    def start(self):
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self):
+        while True:
+            delay = self.drain()
+            self._wake.wait(delay)
+            self._wake.clear()
+
+
+def retrieve_image_from_server(image_hash):
+    # Images are addressed by their content and never change, so they are
+    # neither kept nor revalidated here; the monitor keeps the thumbnails
+    # it shows in its own cache
+    r = client.get("/image/" + image_hash)
+    return r.content
+
+
+def download_image_to_file(image_ref, savename):
+    image_bytes = retrieve_image_from_server(image_ref["hash"])
+    with open(savename, "wb") as out_file:
+        out_file.write(image_bytes)
+    return
+
+
+def retrieve_ecg_recording_slice(recording_hash, start=None, end=None):
+    # Reads the samples of an uploaded ECG recording between two times in
+    # seconds, for zooming into it without downloading the whole file
+    params = {key: value for key, value in [("start", start), ("end", end)]
+              if value is not None}
+    path = "/ecg_recording/" + recording_hash
+    if params:
+        path += "?" + urlencode(params)
+    r = get_with_validators(path)
+    r.raise_for_status()
+    return r.json()
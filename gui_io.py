@@ -0,0 +1,174 @@
+""" Runs the requests of the Tk GUIs on background threads
+
+Tk can only be used from the thread running its event loop, and while a
+request runs on that thread the window neither redraws nor answers
+clicks. An IOExecutor runs functions such as the requests of gui_client
+on a pool of worker threads, and passes their results back through a
+thread-safe queue, which the Tk thread empties every few milliseconds
+with root.after and where it runs the callbacks.
+
+A request can be given a key, for example "selected patient". A new
+request with the same key supersedes the previous one: if the previous
+one has not started yet, it never runs, and otherwise its result is
+dropped, so the GUI never shows an older selection over a newer one. The
+same request submitted again while it is pending is coalesced with it
+instead, so a server slower than the refreshes of the GUI still
+answers them.
+"""
+import concurrent.futures
+import logging
+import queue
+
+# Threads running requests at the same time
+WORKERS = 4
+# Milliseconds between two checks of the Tk thread for results
+POLL_INTERVAL_MS = 50
+
+
+class Task:
+    """ A function submitted to an IOExecutor
+
+    Args:
+        key (str or None): the key of the task, if it supersedes the
+            previous task with the same key
+        request (tuple): the function of the task and its arguments
+    """
+
+    def __init__(self, key=None, request=None):
+        self.key = key
+        self.request = request
+        self.cancelled = False
+        self.future = None
+
+    def cancel(self):
+        """ Cancels the task
+
+        A task that has not started never runs. The callbacks of a task
+        that already started are not called.
+        """
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class IOExecutor:
+    """ Runs functions on worker threads and their callbacks on Tk's
+
+    submit and poll are called from the Tk thread, post from any thread.
+
+    Args:
+        workers (int): the number of worker threads
+    """
+
+    def __init__(self, workers=WORKERS):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix="gui-io")
+        self._callbacks = queue.Queue()
+        # Latest task of each key, only used by the Tk thread
+        self._latest = {}
+
+    def submit(self, function, *args, on_done=None, on_error=None,
+               key=None):
+        """ Runs a function on a worker thread
+
+        Args:
+            function (callable): the function, called with args
+            *args: the arguments of the function
+            on_done (callable): called on the Tk thread with the result of
+                the function
+            on_error (callable): called on the Tk thread with the
+                exception raised by the function. Without it, the
+                exception is logged.
+            key (str): cancels the previous task submitted with this key,
+                unless it is the same function with the same arguments
+
+        Returns:
+            Task: the task, which can be cancelled, or the pending task
+            with the same key and request, whose callbacks are kept
+        """
+        task = Task(key, (function, args))
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                if previous.request == task.request:
+                    return previous
+                previous.cancel()
+            self._latest[key] = task
+        task.future = self._executor.submit(self._run, task, function, args,
+                                            on_done, on_error)
+        return task
+
+    def cancel(self, key):
+        """ Cancels the latest task submitted with a key, if any
+
+        Args:
+            key (str): the key of the task
+        """
+        task = self._latest.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def _run(self, task, function, args, on_done, on_error):
+        if task.cancelled:
+            return
+        try:
+            result = function(*args)
+        except Exception as error:
+            if on_error is None:
+                on_error = log_error
+            self._callbacks.put((task, on_error, (error,)))
+            return
+        self._callbacks.put((task, on_done, (result,)))
+
+    def post(self, callback, *args):
+        """ Runs a callback on the Tk thread
+
+        Args:
+            callback (callable): the callback, called with args
+            *args: the arguments of the callback
+        """
+        self._callbacks.put((None, callback, args))
+
+    def poll(self):
+        """ Runs the callbacks of the finished tasks and posted callbacks
+
+        Returns:
+            int: the number of callbacks run
+        """
+        count = 0
+        while True:
+            try:
+                task, callback, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                return count
+            if task is not None:
+                if self._latest.get(task.key) is task:
+                    del self._latest[task.key]
+                if task.cancelled:
+                    continue
+            if callback is not None:
+                callback(*args)
+                count += 1
+
+    def attach(self, root, interval=POLL_INTERVAL_MS):
+        """ Polls for callbacks from the event loop of a Tk window
+
+        Args:
+            root (tk.Tk): the window
+            interval (int): the milliseconds between two polls
+        """
+        def poll_later():
+            self.poll()
+            root.after(interval, poll_later)
+        root.after(interval, poll_later)
+
+    def shutdown(self):
+        """ Cancels the tasks that have not started and stops the threads
+        """
+        for task in self._latest.values():
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def log_error(error):
+    logging.error("Background request failed: {!r}".format(error))
@@ -3,52 +3,157 @@ from tkinter import ttk, filedialog
 import base64
 import requests
 import json
+import queue
+import threading
+import time
+from collections import OrderedDict
 from PIL import Image, ImageTk
+from ecg_plot import THUMBNAIL_SIZE, thumbnail
 from gui_client import *
+from gui_io import IOExecutor
 
 info_requested = False
+med_requested = False
+EVENT_RETRY_DELAY = 5
+# Number of image thumbnails kept ready for display
+THUMBNAIL_CACHE_SIZE = 64
+# Patients shown at most by the dashboard, and its tiles per row
+DASHBOARD_MAX_TILES = 200
+DASHBOARD_COLUMNS = 8
+# Size of the ECG thumbnails of the dashboard tiles
+DASHBOARD_THUMBNAIL_SIZE = (120, 90)
+# Milliseconds the dashboard waits after an update event, so that a burst
+# of events costs a single refresh
+DASHBOARD_EVENT_DELAY_MS = 500
+# Keys of the patient summaries shown by the dashboard
+DASHBOARD_FIELDS = ["Name", "Heart_Rate", "Timestamp", "ECG", "Revision"]
+
+
+def patient_is_current(latest, patient):
+    """ Checks whether the displayed patient is the latest information
+
+    Every upload to the server increments the revision number of the
+    patient, so the displayed information is up to date if it is for the
+    same patient at the same revision.
 
+    Args:
+        latest: dictionary containing the latest patient information
+        patient: dictionary containing the displayed patient information
+
+    Returns:
+        bool: True if the displayed patient information is up to date
+    """
+    if patient.get("Rec_No") != latest["Rec_No"]:
+        return False
+    return patient.get("Revision") == latest["Revision"]
+
+
+def is_event_for_patient(event, patient_ID):
+    """ Checks whether an update event is for the given patient
+
+    Args:
+        event: dictionary received from the server's event stream
+        patient_ID (str): patient id selected in the GUI
+
+    Returns:
+        bool: True if the event is about the patient
+    """
+    return str(event["Rec_No"]) == patient_ID
+
+
+class ThumbnailCache:
+    """ Keeps the thumbnails of the most recently displayed images
+
+    Images never change once stored on the server, so thumbnails are
+    keyed by the hash of their image and are never out of date. The GUI
+    only downloads and decodes an image that is not cached, which happens
+    the first time it is displayed, and again once it is the least
+    recently displayed of more than `size` images.
+
+    Args:
+        size (int): number of thumbnails kept
+    """
+
+    def __init__(self, size=THUMBNAIL_CACHE_SIZE):
+        self.size = size
+        self.thumbnails = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def cached(self, image_ref):
+        """ Gets the thumbnail of an image if it is cached
+
+        Args:
+            image_ref: reference to the image, with key "hash"
+
+        Returns:
+            the thumbnail, or None if it is not cached
+        """
+        image_hash = image_ref["hash"]
+        cached = self.thumbnails.get(image_hash)
+        if cached is None:
+            self.stats["misses"] += 1
+            return None
+        self.thumbnails.move_to_end(image_hash)
+        self.stats["hits"] += 1
+        return cached
+
+    def add(self, image_ref, image):
+        """ Adds the thumbnail of an image
+
+        Args:
+            image_ref: reference to the image, with key "hash"
+            image: the thumbnail
+        """
+        self.thumbnails[image_ref["hash"]] = image
+        self.thumbnails.move_to_end(image_ref["hash"])
+        if len(self.thumbnails) > self.size:
+            self.thumbnails.popitem(last=False)
 
-def get_selected_med_64(med_of_interest_timestamp, patient):
-    """ Gets the medical associated with the selected timestamp
 
-    This function finds the medical image associated with the
-    selected timestamp from the medical image data dropdown menu.
-    The index of the timestamp in the list of medical image
-    timestamps is used to retrieve the corresponding medical
-    image from the medical image record.
+def make_tile_text(summary):
+    """ Makes the text of the dashboard tile of a patient
 
     Args:
-        med_of_interest_timestamp: selected timestamp from dropdown
-        patient: dictionary containing patient information
+        summary: dictionary containing the latest patient information
 
     Returns:
-        str: medical image file encoded in b64-format
+        str, str: the medical record number and name of the patient, and
+                  its latest heart rate with the time of the measurement
     """
-    time_idx = patient["Timestamp"].index(med_of_interest_timestamp)
-    selected_med_file_64 = patient["Med_Img"][time_idx]
-    return selected_med_file_64
+    title = str(summary["Rec_No"])
+    if summary.get("Name"):
+        title += " {}".format(summary["Name"])
+    if len(summary["Heart_Rate"]) == 0:
+        return title, "No heart rate"
+    measurement = "{} bpm".format(summary["Heart_Rate"][-1])
+    if len(summary["Timestamp"]) != 0:
+        measurement += " at {}".format(summary["Timestamp"][-1])
+    return title, measurement
 
 
-def get_selected_ecg_64(ecg_of_interest_timestamp, patient):
-    """ Gets the medical associated with the selected timestamp
+def select_changed_summaries(summaries, shown_revisions):
+    """ Selects the patients whose dashboard tiles are out of date
 
-    This function finds the ECG image associated with the
-    selected timestamp from the ECG data dropdown menu. The
-    index of the timestamp in the list of ECG image timestamps
-    is used to retrieve the corresponding ECG image from the
-    ECG data record.
+    Only these tiles are redrawn, so refreshing a dashboard where few
+    patients changed costs little however many tiles it has.
 
     Args:
-        ecg_of_interest_timestamp: selected timestamp from dropdown
-        patient: dictionary containing patient information
+        summaries: list of dictionaries containing the latest information
+                   of each patient
+        shown_revisions: dictionary of the revision shown in each tile,
+                         keyed by medical record number, updated to the
+                         revisions of the summaries
 
     Returns:
-        str: ECG image file encoded in b64-format
+        list: the summaries of the patients not shown yet or shown at
+              another revision
     """
-    time_idx = patient["Timestamp"].index(ecg_of_interest_timestamp)
-    selected_ecg_file_64 = patient["ECG"][time_idx]
-    return selected_ecg_file_64
+    changed = []
+    for summary in summaries:
+        if shown_revisions.get(summary["Rec_No"]) != summary["Revision"]:
+            shown_revisions[summary["Rec_No"]] = summary["Revision"]
+            changed.append(summary)
+    return changed
 
 
 def main_window():
@@ -100,6 +205,9 @@ def main_window():
         patient_dropdown.set('')
         med_dropdown.set('')
         ecg_dropdown.set('')
+        # Images still loading are not displayed in the cleared labels
+        for label in [ecg_latest_label, med_img_label, ecg_selected_label]:
+            io_executor.cancel("image {}".format(label))
         return
 
     def patient_record_driver():
@@ -150,49 +258,147 @@ def main_window():
         selected patient id upon click of "Request info" button
 
         When the user clicks on the "Request info" button, this
-        function is run which displays latest patient information.
+        function is run which displays latest patient information,
+        with the latest medical image, once it is retrieved.
         """
         global info_requested
+        global med_requested
+        global patient
         clear_cmd()
         info_requested = True
+        med_requested = True
+        # Nothing is displayed, so the retrieved patient is shown even
+        # if it is the one displayed before
+        patient = {}
         refresh_fields()
-        update_latest_med_img_driver()
 
     def refresher():
         """ Makes periodic requests every 30 seconds to the server
         to check for any updated information of the currently selected
         patient
 
+        While the GUI is connected to the server's event stream, updates
+        are received as they happen and no requests are made. If the
+        stream is not connected, this function falls back to polling the
+        server.
+        """
+        if stream_connected.is_set() is False:
+            poll_server()
+        root.after(30000, refresher)
+
+    def poll_server():
+        """ Checks the server for updated patient information
+
         This function calls other functions to update the displayed
         patient information. If the "Request Info" button is clicked,
         the GUI displays the information of the selected patient. If
         the button is not clicked, the patient information currently
         displayed is automatically refreshed to provide the most
-        up-to-date information.
+        up-to-date information. Only the entries added since the
+        displayed revision are retrieved, and the displayed fields are
+        refreshed only if there are any.
         """
         global info_requested
         update_patient_record()
         if info_requested is True:
             refresh_fields()
-        root.after(30000, refresher)
+        refresh_dashboard()
+
+    def listen_for_events():
+        """ Receives patient update events from the server
+
+        This function runs on a background thread. It stays connected to
+        the server's event stream and puts every received event in a
+        queue for the GUI thread. When the stream drops, it reconnects
+        after EVENT_RETRY_DELAY seconds; in the meantime the refresher
+        polls the server.
+        """
+        def on_connect():
+            stream_connected.set()
+            # Catch up on any update missed while disconnected
+            received_events.put(None)
+
+        while True:
+            try:
+                listen_to_patient_events(received_events.put, on_connect)
+            except requests.exceptions.RequestException:
+                pass
+            stream_connected.clear()
+            time.sleep(EVENT_RETRY_DELAY)
+
+    def process_events():
+        """ Updates the GUI for the events received from the server
+
+        Tk can only be used from the GUI thread, so the events received
+        by the background thread are taken from the queue here. An event
+        for a patient that is not in the dropdown menu updates the list
+        of patients, and an event for the displayed patient refreshes
+        the displayed information.
+        """
+        global info_requested
+        while True:
+            try:
+                event = received_events.get_nowait()
+            except queue.Empty:
+                break
+            if event is None:
+                poll_server()
+                continue
+            if event["Rec_No"] not in known_patient_IDs:
+                update_patient_record()
+            elif event["Rec_No"] in dashboard["revisions"]:
+                schedule_dashboard_refresh()
+            if info_requested is True and \
+                    is_event_for_patient(event, selected_patientID.get()):
+                refresh_fields()
+        root.after(200, process_events)
 
     def refresh_fields():
         """ Updates to show information for the selected patient
 
-        This function calls other functions to retrieve information of
-        the currently selected patient and update the medical record
-        number, name, the latest heart rate, and timestamp corresponding
-        to this heart rate. The latest ECG image and medical image are
-        also displayed.
+        This function retrieves the information of the currently
+        selected patient on a background thread, so the GUI keeps
+        responding while the server answers. show_patient displays it
+        once it is retrieved. A newer call supersedes a retrieval that
+        has not finished yet.
+        """
+        io_executor.submit(retrieve_patient, selected_patientID.get(),
+                           on_done=show_patient, key="patient")
+
+    def retrieve_patient(patient_ID):
+        """ Retrieves the information of a patient from the server
+
+        This function runs on a background thread.
+
+        Args:
+            patient_ID (str): patient id selected in the GUI
+
+        Returns:
+            dict: the patient information
+        """
+        return json.loads(retrieve_patient_data_from_server(patient_ID))
+
+    def show_patient(latest):
+        """ Shows the retrieved information of the selected patient
+
+        This function updates the medical record number, name, the
+        latest heart rate, and timestamp corresponding to this heart
+        rate, and displays the latest ECG image, unless the displayed
+        information is already up to date. The latest medical image is
+        also displayed after the "Request info" button is clicked.
 
         Note: The information displayed depends on which types of
         information were uploaded for the patient (the minimum
         requirement for uploading a patient is the medical record number).
+
+        Args:
+            latest: dictionary containing the latest patient information
         """
         global patient
-        current_patient_ID = selected_patientID.get()
-        patient = json.loads(
-            retrieve_patient_data_from_server(current_patient_ID))
+        global med_requested
+        if patient_is_current(latest, patient):
+            return
+        patient = latest
         mrn_label.configure(text="Patient medical record number: {}"
                             .format(patient["Rec_No"]))
         if patient["Name"] != "":
@@ -210,6 +416,9 @@ def main_window():
             drop_list = list(range(len(patient["Med_Img"])))
             drop_list = [i+1 for i in drop_list]
             med_dropdown["values"] = drop_list
+        if med_requested is True:
+            med_requested = False
+            update_latest_med_img_driver()
         return
 
     def update_latest_med_img_driver():
@@ -222,21 +431,17 @@ def main_window():
     def update_latest_med_img(med_64):
         """ Configures the latest medical image
 
-        This function calls another function to decode a b64-string.
-        The decoded image file is opened, resized, and assigned to
-        the medical image label.
+        This function gets the thumbnail of the image from the
+        thumbnail cache, or downloads the image from the server and
+        decodes it in memory on a background thread if it is not cached,
+        and assigns it to the medical image label.
 
         Args:
-            med_64: medical image file encoded in b64-format
+            med_64: reference to the medical image
         """
         if med_64 == "":
             return
-        convert_b64_string_to_file(med_64, "patient_med.jpg")
-        pil_image_raw = Image.open("patient_med.jpg")
-        pil_image = pil_image_raw.resize((200, 150))
-        new_image = ImageTk.PhotoImage(pil_image)
-        med_img_label.configure(image=new_image)
-        med_img_label.x123 = new_image
+        show_image(med_64, med_img_label)
         return
 
     def load_med_cmd():
@@ -256,21 +461,17 @@ def main_window():
     def update_selected_med_img(med_filename):
         """ Configures the selected medical image
 
-        This function calls another function to decode a b64-string.
-        The decoded image file is opened, resized, and assigned to
-        the medical image label.
+        This function gets the thumbnail of the image from the
+        thumbnail cache, or downloads the image from the server and
+        decodes it in memory on a background thread if it is not cached,
+        and assigns it to the medical image label.
 
         Args:
-            med_filename: medical image file encoded in b64-format
+            med_filename: reference to the medical image
         """
         if med_filename == "":
             return
-        convert_b64_string_to_file(med_filename, "patient_med.jpg")
-        pil_image_raw = Image.open("patient_med.jpg")
-        pil_image = pil_image_raw.resize((200, 150))
-        new_image = ImageTk.PhotoImage(pil_image)
-        med_img_label.configure(image=new_image)
-        med_img_label.x123 = new_image
+        show_image(med_filename, med_img_label)
         return
 
     def load_ecg_cmd():
@@ -282,50 +483,44 @@ def main_window():
         """
         global patient
         global selected_ecg_file_64
-        ecg_of_interest_timestamp = selected_ecg.get()
-        selected_ecg_file_64 = get_selected_ecg_64(
-            ecg_of_interest_timestamp, patient)
+        # The dropdown lists the timestamps of the ECG images in order
+        ecg_idx = ecg_dropdown.current()
+        if ecg_idx < 0:
+            return
+        selected_ecg_file_64 = patient["ECG"][ecg_idx]
         update_selected_ecg_img(selected_ecg_file_64)
         return
 
     def update_selected_ecg_img(ecg_filename):
         """ Configures the selected ECG image
 
-        This function calls another function to decode a b64-string.
-        The decoded image file is opened, resized, and assigned to
-        the medical image label.
+        This function gets the thumbnail of the image from the
+        thumbnail cache, or downloads the image from the server and
+        decodes it in memory on a background thread if it is not cached,
+        and assigns it to the selected ECG image label.
 
         Args:
-            ecg_filename: ECG image file encoded in b64-format
+            ecg_filename: reference to the ECG image
         """
         if ecg_filename == "":
             return
-        convert_b64_string_to_file(ecg_filename, "patient_ecg.jpg")
-        pil_image_raw = Image.open("patient_ecg.jpg")
-        pil_image = pil_image_raw.resize((200, 150))
-        new_image = ImageTk.PhotoImage(pil_image)
-        ecg_selected_label.configure(image=new_image)
-        ecg_selected_label.x123 = new_image
+        show_image(ecg_filename, ecg_selected_label)
         return
 
     def update_latest_ecg_img(ecg_filename):
         """ Configures the latest medical image
 
-        This function calls another function to decode a b64-string.
-        The decoded image file is opened, resized, and assigned to
-        the medical image label.
+        This function gets the thumbnail of the image from the
+        thumbnail cache, or downloads the image from the server and
+        decodes it in memory on a background thread if it is not cached,
+        and assigns it to the latest ECG image label.
 
         Args:
-            ecg_filename: ECG image file encoded in b64-format
+            ecg_filename: reference to the ECG image
         """
         if ecg_filename == "":
             return
-        convert_b64_string_to_file(ecg_filename, "patient_ecg.jpg")
-        pil_image_raw = Image.open("patient_ecg.jpg")
-        pil_image = pil_image_raw.resize((200, 150))
-        new_image = ImageTk.PhotoImage(pil_image)
-        ecg_latest_label.configure(image=new_image)
-        ecg_latest_label.x123 = new_image
+        show_image(ecg_filename, ecg_latest_label)
         return
 
     def save_med_img_cmd():
@@ -336,9 +531,8 @@ def main_window():
         """
         global selected_med_file_64
         filename = filedialog.asksaveasfilename()
-        image_bytes = base64.b64decode(selected_med_file_64)
-        with open(filename, "wb") as out_file:
-            out_file.write(image_bytes)
+        io_executor.submit(download_image_to_file, selected_med_file_64,
+                           filename)
         return
 
     def save_ecg_img_cmd():
@@ -349,9 +543,8 @@ def main_window():
         """
         global selected_ecg_file_64
         filename = filedialog.asksaveasfilename()
-        image_bytes = base64.b64decode(selected_ecg_file_64)
-        with open(filename, "wb") as out_file:
-            out_file.write(image_bytes)
+        io_executor.submit(download_image_to_file, selected_ecg_file_64,
+                           filename)
         return
 
     def update_patient_record():
@@ -362,7 +555,217 @@ def main_window():
         check for any updated information of the currently selected
         patient.
         """
-        patient_dropdown["values"] = patient_record_driver()
+        io_executor.submit(patient_record_driver,
+                           on_done=show_patient_record, key="patient ids")
+
+    def show_patient_record(all_patient_IDs):
+        """ Shows the retrieved ids of all patients in the dropdown menu
+
+        Args:
+            all_patient_IDs: a list of all patient ids
+        """
+        known_patient_IDs[:] = all_patient_IDs
+        patient_dropdown["values"] = known_patient_IDs
+        schedule_dashboard_refresh()
+
+    def show_image(image_ref, label, cache=None, size=THUMBNAIL_SIZE):
+        """ Displays the thumbnail of an image in a label
+
+        A cached thumbnail is displayed at once. Otherwise the image is
+        downloaded and decoded on a background thread, and displayed
+        unless another image was displayed in the label in the meantime.
+
+        Args:
+            image_ref: reference to the image
+            label: the label displaying the image
+            cache: the ThumbnailCache of thumbnails of this size, the
+                   cache of the patient images by default
+            size: the size of the thumbnail
+        """
+        if cache is None:
+            cache = thumbnails
+        key = "image {}".format(label)
+        cached = cache.cached(image_ref)
+        if cached is not None:
+            io_executor.cancel(key)
+            set_label_image(label, cached)
+            return
+
+        def show_thumbnail(pil_image):
+            new_image = ImageTk.PhotoImage(pil_image)
+            cache.add(image_ref, new_image)
+            set_label_image(label, new_image)
+        io_executor.submit(load_thumbnail, image_ref, size,
+                           on_done=show_thumbnail, key=key)
+
+    def load_thumbnail(image_ref, size=THUMBNAIL_SIZE):
+        """ Downloads an image and decodes its thumbnail in memory
+
+        This function runs on a background thread.
+
+        Args:
+            image_ref: reference to the image, with key "hash"
+            size: the size of the thumbnail
+
+        Returns:
+            PIL.Image.Image: the thumbnail
+        """
+        return thumbnail(retrieve_image_from_server(image_ref["hash"]), size)
+
+    def set_label_image(label, new_image):
+        label.configure(image=new_image)
+        label.x123 = new_image
+
+    def open_dashboard_cmd():
+        """ Opens the dashboard of all patients upon click of the
+        "Dashboard" button
+
+        The dashboard is a window showing a grid of tiles, one for each
+        of the first DASHBOARD_MAX_TILES patients, with the latest heart
+        rate, the time of its measurement and the thumbnail of the latest
+        ECG image of the patient. Clicking a tile requests the
+        information of its patient in the main window.
+        """
+        if dashboard["window"] is not None:
+            dashboard["window"].lift()
+            return
+        window = tk.Toplevel(root)
+        window.title("Patient Dashboard")
+        window.geometry("1200x700")
+        window.protocol("WM_DELETE_WINDOW", close_dashboard)
+        canvas = tk.Canvas(window, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL,
+                                  command=canvas.yview)
+        canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        grid = ttk.Frame(canvas)
+        canvas.create_window((0, 0), window=grid, anchor="nw")
+        grid.bind("<Configure>", lambda event: canvas.configure(
+            scrollregion=canvas.bbox("all")))
+        dashboard["window"] = window
+        dashboard["grid"] = grid
+        refresh_dashboard()
+
+    def close_dashboard():
+        """ Closes the dashboard and drops its pending requests
+        """
+        io_executor.cancel("dashboard")
+        for tile in dashboard["tiles"].values():
+            io_executor.cancel("image {}".format(tile["image"]))
+        dashboard["window"].destroy()
+        dashboard.update(window=None, grid=None, tiles={}, revisions={})
+
+    def schedule_dashboard_refresh():
+        """ Refreshes the dashboard, if it is open, after
+        DASHBOARD_EVENT_DELAY_MS
+
+        Calls made in the meantime are merged into this refresh.
+        """
+        if dashboard["window"] is None or dashboard["refresh_pending"]:
+            return
+        dashboard["refresh_pending"] = True
+
+        def refresh():
+            dashboard["refresh_pending"] = False
+            refresh_dashboard()
+        root.after(DASHBOARD_EVENT_DELAY_MS, refresh)
+
+    def refresh_dashboard():
+        """ Retrieves the summaries of the dashboard patients
+
+        The summaries of all the patients are retrieved in a single
+        request, on a background thread, and show_dashboard displays
+        them once they are retrieved.
+        """
+        if dashboard["window"] is None:
+            return
+        patient_IDs = tuple(known_patient_IDs[:DASHBOARD_MAX_TILES])
+        io_executor.submit(retrieve_dashboard, patient_IDs,
+                           on_done=show_dashboard, key="dashboard")
+
+    def retrieve_dashboard(patient_IDs):
+        """ Retrieves the summaries of the dashboard patients
+
+        This function runs on a background thread.
+
+        Args:
+            patient_IDs (tuple): the ids of the patients
+
+        Returns:
+            list: the summaries of the patients, in the order of their ids
+        """
+        summaries = json.loads(retrieve_patient_summaries(
+            list(patient_IDs), DASHBOARD_FIELDS))
+        return summaries["patients"]
+
+    def show_dashboard(summaries):
+        """ Updates the dashboard tiles to the retrieved summaries
+
+        Only the tiles of the patients whose revision changed are
+        redrawn, and their ECG thumbnails are loaded on background
+        threads. The tiles are laid out again only when patients were
+        added or removed.
+
+        Args:
+            summaries: list of the summaries of the dashboard patients
+        """
+        if dashboard["window"] is None:
+            return
+        tiles = dashboard["tiles"]
+        shown_IDs = [summary["Rec_No"] for summary in summaries]
+        layout_changed = list(tiles) != shown_IDs
+        for patient_ID in set(tiles) - set(shown_IDs):
+            tile = tiles.pop(patient_ID)
+            io_executor.cancel("image {}".format(tile["image"]))
+            tile["frame"].destroy()
+            dashboard["revisions"].pop(patient_ID, None)
+        for summary in select_changed_summaries(summaries,
+                                                dashboard["revisions"]):
+            tile = tiles.get(summary["Rec_No"])
+            if tile is None:
+                tile = tiles[summary["Rec_No"]] = make_tile(
+                    summary["Rec_No"])
+            title, measurement = make_tile_text(summary)
+            tile["title"].configure(text=title)
+            tile["measurement"].configure(text=measurement)
+            if len(summary["ECG"]) != 0:
+                show_image(summary["ECG"][-1], tile["image"],
+                           tile_thumbnails, DASHBOARD_THUMBNAIL_SIZE)
+        if layout_changed:
+            dashboard["tiles"] = {patient_ID: tiles[patient_ID]
+                                  for patient_ID in shown_IDs}
+            for index, patient_ID in enumerate(shown_IDs):
+                tiles[patient_ID]["frame"].grid(
+                    row=index // DASHBOARD_COLUMNS,
+                    column=index % DASHBOARD_COLUMNS, padx=2, pady=2)
+
+    def make_tile(patient_ID):
+        """ Makes the dashboard tile of a patient
+
+        Args:
+            patient_ID: the medical record number of the patient
+
+        Returns:
+            dict: the frame of the tile and its "title", "measurement"
+                  and "image" labels
+        """
+        frame = ttk.Frame(dashboard["grid"], padding=4, relief="groove")
+        tile = {"frame": frame,
+                "title": ttk.Label(frame),
+                "measurement": ttk.Label(frame),
+                "image": ttk.Label(frame, image=blank_tile_image)}
+        for row, widget in enumerate([tile["title"], tile["measurement"],
+                                      tile["image"]]):
+            widget.grid(column=0, row=row, sticky=tk.W)
+
+        def select_patient(event):
+            selected_patientID.set(patient_ID)
+            request_info_cmd()
+        for widget in [frame, tile["title"], tile["measurement"],
+                       tile["image"]]:
+            widget.bind("<Button-1>", select_patient)
+        return tile
 
     root = tk.Tk()
     root.title("Patient Monitor")
@@ -376,7 +779,8 @@ def main_window():
     selected_patientID = tk.StringVar()
     patient_dropdown = ttk.Combobox(root, textvariable=selected_patientID)
     patient_dropdown.grid(column=1, row=1, sticky=tk.W)
-    patient_dropdown["values"] = patient_record_driver()
+    # Filled in by update_patient_record once the server answers
+    known_patient_IDs = []
     patient_dropdown.state(['readonly'])
 
     # Select ECG image from record
@@ -423,6 +827,8 @@ def main_window():
     # Buttons
     ttk.Button(root, text="Request info", command=request_info_cmd).grid(
         column=3, row=1)
+    ttk.Button(root, text="Dashboard", command=open_dashboard_cmd).grid(
+        column=3, row=2)
     ttk.Button(root, text="Clear All", command=manual_clear_cmd)\
         .grid(column=2, row=20)
     ttk.Button(root, text="Exit Program", command=cancel_cmd).grid(
@@ -437,6 +843,26 @@ def main_window():
     ttk.Button(root, text="Save Selected ECG Image",
                command=save_ecg_img_cmd).grid(column=5, row=20)
 
+    # Thumbnails of the displayed images, decoded once per image
+    thumbnails = ThumbnailCache()
+    tile_thumbnails = ThumbnailCache(2 * DASHBOARD_MAX_TILES)
+    blank_tile_image = ImageTk.PhotoImage(
+        pil_image_raw.resize(DASHBOARD_THUMBNAIL_SIZE))
+    # Window, tiles and revisions shown by the dashboard, while it is open
+    dashboard = {"window": None, "grid": None, "tiles": {}, "revisions": {},
+                 "refresh_pending": False}
+
+    # Requests to the server run on background threads
+    io_executor = IOExecutor()
+    io_executor.attach(root)
+    update_patient_record()
+
+    # Live updates from the server's event stream
+    received_events = queue.Queue()
+    stream_connected = threading.Event()
+    threading.Thread(target=listen_for_events, daemon=True).start()
+    root.after(200, process_events)
+
     root.after(30000, refresher)
     root.mainloop()
 
@@ -0,0 +1,111 @@
+""" Broadcasting of patient update events to connected monitors
+
+The server publishes a small event whenever a patient record is written,
+and every monitor connected to the /patient_events route receives it as a
+Server-Sent Event. Each connection has its own bounded queue, so a slow
+monitor cannot hold up the writers or the other monitors.
+"""
+import json
+import queue
+import threading
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class EventBroadcaster:
+    """ Delivers published events to every subscribed queue """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        """ Registers a new subscriber
+
+        Returns:
+            queue.Queue: the queue the subscriber's events are put in
+        """
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event):
+        """ Sends an event to every subscriber
+
+        A subscriber whose queue is full misses the event; its monitor
+        still catches up on its next incremental update of the patient.
+
+        Args:
+            event (dict): the event, which must be JSON serializable
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def stream(self, heartbeat):
+        """ Generates the Server-Sent Events text for one subscriber
+
+        A comment line is sent when no event was published for
+        `heartbeat` seconds, so that both ends notice a dropped
+        connection. The subscriber is removed when the client disconnects
+        and the generator is closed.
+
+        Args:
+            heartbeat (float): the maximum number of seconds between
+                               two messages
+
+        Yields:
+            str: Server-Sent Events messages
+        """
+        subscriber = self.subscribe()
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def format_event(event):
+    """ Formats an event as a Server-Sent Events message
+
+    Args:
+        event (dict): the event, which must be JSON serializable
+
+    Returns:
+        str: the message with the event as JSON in its "data" line
+    """
+    return "data: {}\n\n".format(json.dumps(event))
+
+
+def parse_event_line(line):
+    """ Reads an event from a line of a Server-Sent Events stream
+
+    Args:
+        line (str): one line of the stream, without the line ending
+
+    Returns:
+        dict or None: the event of a "data" line, or None for comments
+                      and blank lines
+    """
+    if line.startswith("data:") is False:
+        return None
+    return json.loads(line[len("data:"):])
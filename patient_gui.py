@@ -6,10 +6,12 @@ from tkinter import ttk
 from tkinter import filedialog
 
 from PIL import Image, ImageTk
-from ecg import calc_hr
+from ecg import calc_hr, convert_recording
+from ecg_cache import ResultCache, signal_key
+from ecg_plot import PLOT_VERSION, render_ecg, thumbnail
 import pandas as pd
-import matplotlib.pyplot as plt
 from gui_client import *
+from gui_io import IOExecutor
 
 bpm = 'N/A'
 ecg_filename = 'N/A'
@@ -25,7 +27,11 @@ def create_info_dict(entered_name, entered_id, ecg_is_uploaded,
 
     create_info_dict accepts patient name, id, ecg string, medical
     image string, and creates a python dictionary that contains
-    the input patient information
+    the input patient information. The images are given by their
+    filenames, and the UploadQueue of gui_client copies the files into
+    its queue and sends them to the server in chunks. An ECG comes with
+    "ecg.ecgb", the binary container of its raw samples, which the server
+    keeps alongside the plot.
 
     Args:
         entered_name (str): patient name
@@ -46,13 +52,12 @@ def create_info_dict(entered_name, entered_id, ecg_is_uploaded,
     if entered_name != "":
         patient_info.update({"Name": entered_name})
     if ecg_is_uploaded is False:
-        selected_ECG_image = convert_file_to_b64_string('ecg.jpg')
-        patient_info.update({"ECG": selected_ECG_image})
+        patient_info.update({"ECG": 'ecg.jpg'})
+        patient_info.update({"ECG_Data": 'ecg.ecgb'})
         patient_info.update({"Heart_Rate": bpm})
         ecg_is_uploaded = True
     if med_img_is_uploaded is False:
-        selected_medical_image = convert_file_to_b64_string(med_filename)
-        patient_info.update({"Med_Img": selected_medical_image})
+        patient_info.update({"Med_Img": med_filename})
         med_img_is_uploaded = True
     return patient_info
 
@@ -129,8 +134,8 @@ def main_window():
         """ Obtains data from window and uploads to server
 
         This function runs when the user clicks on the "Upload" button.
-        It gets the entered data from the interface and uploads it
-        to the server.
+        It gets the entered data from the interface and adds it to the
+        upload queue, which keeps it on disk until the server has received it.
         """
         global ecg_is_uploaded
         global med_img_is_uploaded
@@ -151,8 +156,25 @@ def main_window():
                                         ecg_is_uploaded, med_img_is_uploaded,
                                         med_filename)
 
-        # upload patient data to server and updatae status label
-        message = upload_patient_data_to_server(patient_info)
+        # queue patient data for upload; the status label is updated by
+        # show_upload_result once the server answers
+        try:
+            upload_queue.add(patient_info)
+        except (OSError, ValueError) as error:
+            status_label.configure(text="Upload failed: {}".format(error))
+            return
+        status_label.configure(text="Uploading...")
+
+    def show_upload_result(message):
+        """ Shows the server answer to a queued upload in the status label
+
+        The upload queue sends patient data from a background thread,
+        which posts each answer to the I/O executor; this function runs
+        in the GUI thread to display it.
+
+        args:
+            message (str): the answer of the server
+        """
         status_label.configure(text=message)
 
     def image_cmd():
@@ -178,9 +200,11 @@ def main_window():
         """ displays the selected ecg image
 
         image_cmd reads the ecg file selected by the user, analyzes it,
-        and make it into a plot. Then it resizes the plot to fit the display
+        and make it into a plot. The samples are also saved in a binary
+        container for upload. Then it resizes the plot to fit the display
         window, and displays it in GUI. It also displays the calculated bpm
-        in GUI.
+        in GUI. The plot and the bpm of a recording selected before are
+        read from the result cache instead of computed again.
 
         returns:
             int: beats per minute
@@ -190,9 +214,13 @@ def main_window():
         global ecg_filename
         ecg_filename = filedialog.askopenfilename()
         time, voltage = read_ECG(ecg_filename)
-        plot_ECG(time, voltage)
-        bpm = calc_hr(time, voltage)
-        replace_ECG()
+        image = plot_ECG(time, voltage)
+        # keep the raw samples, so the server can re-analyze and zoom
+        convert_recording(ecg_filename, 'ecg.ecgb')
+        bpm = result_cache.get_or_compute_json(
+            signal_key(time, voltage, "calc_hr"),
+            lambda: calc_hr(time, voltage))
+        replace_ECG(image)
         # Display Heart Rate
         hr_label.configure(text="Patient heart rate (bpm): {}".format(bpm))
         hr_label.grid(column=3, row=19)
@@ -203,47 +231,53 @@ def main_window():
         """ reads the input ecg file in csv format
 
         read_ECG is called when ECG_cmd is running. It reads the csv file
-        selected by the user and returns time and volate in list format.
+        selected by the user and returns time and volate as numpy arrays.
 
         args:
             filename (str): the user selected filename
 
         returns:
-            list: the time array
-            list: the voltage array
+            numpy.ndarray: the time array
+            numpy.ndarray: the voltage array
         """
         data = pd.read_csv(filename, header=None, names=['time', 'voltage'])
-        time = list(data['time'])
-        voltage = list(data['voltage'])
+        time = data['time'].to_numpy()
+        voltage = data['voltage'].to_numpy()
         return time, voltage
 
     def plot_ECG(time, voltage):
         ''' plots the ECG data
 
         plot_ECG receives time and voltage arrays and plot them
-        using matplotlib.pyplot functions. Then it saves the plot
-        with the name "ecg.jpg".
+        with ecg_plot.render_ecg, unless the plot of the same
+        samples is in the result cache. Then it saves the plot
+        with the name "ecg.jpg" for upload.
 
         args:
-            time (list): time array
-            voltage (list): voltage array
-        '''
-        plt.clf()
-        plt.plot(time, voltage)
-        plt.xlabel('Time (s)')
-        plt.ylabel('Voltage (mV)')
-        plt.savefig('ecg.jpg')
+            time (numpy.ndarray): time array
+            voltage (numpy.ndarray): voltage array
 
-    def replace_ECG():
+        returns:
+            bytes: the plot as a JPEG image
+        '''
+        image = result_cache.get_or_compute(
+            signal_key(time, voltage, "plot-" + PLOT_VERSION),
+            lambda: render_ecg(time, voltage))
+        with open('ecg.jpg', 'wb') as out_file:
+            out_file.write(image)
+        return image
+
+    def replace_ECG(image):
         ''' replaces the ecg image in GUI with the selected image
 
         replace_ECG is called when the user wants to replace the ecg
-        image shown in GUI already. It searches for the filename "ecg.jpg"
-        then resizes it, and displays it in GUI.
+        image shown in GUI already. It decodes the plot from memory
+        at the size of the display, and displays it in GUI.
+
+        args:
+            image (bytes): the plot as a JPEG image
         '''
-        filename = 'ecg.jpg'
-        pil_image_raw = Image.open(filename)
-        pil_image = pil_image_raw.resize((200, 150))
+        pil_image = thumbnail(image)
         new_image = ImageTk.PhotoImage(pil_image)
         ecg_label.configure(image=new_image)
         ecg_label.x123 = new_image
@@ -295,6 +329,20 @@ def main_window():
     ttk.Button(root, text="Exit Program", command=cancel_cmd).grid(
         column=3, row=20)
 
+    # Plots and heart rates of the recordings analyzed before
+    result_cache = ResultCache("ecg_cache")
+
+    # Results of the background threads are shown by the GUI thread
+    io_executor = IOExecutor()
+    io_executor.attach(root)
+
+    # Upload queue, which also resumes uploads left from a previous run
+    upload_queue = UploadQueue(
+        "upload_queue",
+        on_result=lambda job_id, message: io_executor.post(
+            show_upload_result, message))
+    upload_queue.start()
+
     root.mainloop()
 
 
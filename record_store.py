@@ -0,0 +1,986 @@
+""" Storage backends for patient records
+
+The server only needs a handful of operations on patient records: apply
+an upload to a patient (creating it if needed), read a patient or many
+patients at once, possibly limited to some fields and to the latest list
+entries, read the changes made after a revision, and list the patient
+ids. Each backend below
+implements these operations:
+
+- MongoPatientStore keeps each patient as one MongoDB document.
+- MemoryPatientStore keeps the patients in a dictionary of the server
+  process, for tests and benchmarks.
+- SQLitePatientStore keeps the patients in a local SQLite database in
+  write-ahead logging mode, for a server without access to MongoDB.
+
+Patients are exchanged as dictionaries keyed by the MongoDB document
+field names ("_id", "patient_name", "medical_images", "ecg_images",
+"heartrate", "timestamp", "ecg_metrics" and "revision").
+
+Heart rates are also kept as a time series, one record per measurement
+with its time as a datetime, indexed by patient and time apart from the
+patient records. A range of the series is read aggregated into buckets
+of equal duration, each with the minimum, mean and maximum heart rate of
+its measurements, so a chart of months of measurements only reads a few
+hundred values.
+"""
+import bisect
+import datetime
+import json
+import sqlite3
+import threading
+
+from pymongo import ASCENDING, ReturnDocument
+
+LIST_FIELDS = ["medical_images", "ecg_images", "heartrate", "timestamp",
+               "ecg_metrics"]
+FIELDS = ["_id", "patient_name"] + LIST_FIELDS + ["revision"]
+# Upper bound passed to "$slice" to read every change after a revision
+CHANGES_LIMIT = 2 ** 31 - 1
+IMAGE_FIELDS = ["ecg_images", "medical_images"]
+# Fields read by the migration of heart rates to the heart rate series
+HEART_RATE_FIELDS = ["_id", "heartrate", "timestamp"]
+# Origin of the times of the SQLite heart rate series
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def empty_patient(patient_id):
+    """ Makes the record of a patient without any upload
+
+    Args:
+        patient_id (int): the patient id
+
+    Returns:
+        dict: the patient with no name, empty lists and revision 0
+    """
+    patient = {"_id": patient_id, "patient_name": None, "revision": 0}
+    for field in LIST_FIELDS:
+        patient[field] = []
+    return patient
+
+
+def select_fields(patient, fields, last):
+    """ Limits a complete patient record to the requested information
+
+    Args:
+        patient (dict): the complete patient record
+        fields (list): the fields to keep, or None to keep all fields
+        last (int): the number of latest list entries to keep, or None to
+                    keep every entry
+
+    Returns:
+        dict: a new dictionary with the requested fields
+    """
+    if fields is None:
+        fields = FIELDS
+    selected = {}
+    for field in fields:
+        value = patient.get(field, empty_patient(None)[field])
+        if field in LIST_FIELDS:
+            value = list(value[-last:] if last is not None else value)
+        selected[field] = value
+    return selected
+
+
+def has_inline_images(patient):
+    """ Checks if a patient still holds images as b64-strings
+
+    Args:
+        patient (dict): the patient record
+
+    Returns:
+        bool: True if any ECG or medical image is a string
+    """
+    return any(isinstance(image, str) for field in IMAGE_FIELDS
+               for image in patient.get(field, []))
+
+
+def make_projection(fields, last):
+    """ Builds the MongoDB projection for the requested patient fields
+
+    When only the last entries are requested, list fields are projected
+    with "$slice", so the database only returns those entries. The change
+    entries used for incremental updates are never read.
+
+    Args:
+        fields (list): the fields to return, or None to return all fields
+        last (int): the number of latest list entries to return, or None
+                    to return every entry
+
+    Returns:
+        dict: the projection document
+    """
+    if fields is None and last is None:
+        return {"changes": 0}
+    if fields is None:
+        fields = FIELDS
+    projection = {}
+    for field in fields:
+        if field in LIST_FIELDS and last is not None:
+            projection[field] = {"$slice": -last}
+        else:
+            projection[field] = 1
+    return projection
+
+
+def make_bucket(index, heart_rates):
+    """ Aggregates the heart rates of a bucket of the time series
+
+    Args:
+        index (int): the number of the bucket, counted from the start of
+                     the range
+        heart_rates (list): the heart rates measured in the bucket
+
+    Returns:
+        dict: the "bucket" number with the "min", "mean" and "max" heart
+        rate and the "count" of measurements
+    """
+    return {"bucket": index, "min": min(heart_rates),
+            "mean": sum(heart_rates) / len(heart_rates),
+            "max": max(heart_rates), "count": len(heart_rates)}
+
+
+def make_update(name, entries, change):
+    """ Builds the MongoDB update document for a patient upload
+
+    A new name is written with "$set" and new list entries are appended
+    with "$push", so the existing entries of the record are never
+    rewritten. The revision is incremented and the change entry appended
+    to the "changes" list, where the entry for revision N is always at
+    index N - 1.
+
+    Args:
+        name (str): the new name of the patient, or None to keep it
+        entries (dict): the new entries of each list field
+        change (dict): the change entry recorded for this revision
+
+    Returns:
+        dict: the update document
+    """
+    update = {"$inc": {"revision": 1}, "$push": {"changes": change}}
+    if name is not None:
+        update["$set"] = {"patient_name": name}
+    for field in entries:
+        update["$push"][field] = {"$each": entries[field]}
+    return update
+
+
+class MongoPatientStore:
+    """ Keeps each patient as a document of a MongoDB collection
+
+    Heart rates are also kept in a second collection, one document
+    {"patient_id": int, "time": datetime, "heart_rate": float} per
+    measurement, with an index on the patient id and time.
+
+    Args:
+        collection (Collection): the collection of patient documents
+        document_class (str): the "_cls" value that pymodm gives to the
+                              documents of its model, so the documents
+                              written here match its queries
+        heart_rate_collection (Collection): the collection of heart
+                                            rates, "heart_rates" of the
+                                            same database by default
+    """
+
+    def __init__(self, collection, document_class=None,
+                 heart_rate_collection=None):
+        self.collection = collection
+        self.document_class = document_class
+        if heart_rate_collection is None:
+            heart_rate_collection = collection.database["heart_rates"]
+        self.heart_rates = heart_rate_collection
+        self.heart_rates.create_index([("patient_id", ASCENDING),
+                                       ("time", ASCENDING)])
+
+    def update_patient(self, patient_id, name, entries, change,
+                       heart_rates=None, create=True):
+        """ Applies an upload to a patient, creating it if needed
+
+        The whole upload is a single atomic upsert, so concurrent uploads
+        for the same patient cannot overwrite each other's entries. The
+        heart rates are then added to the time series.
+
+        Args:
+            patient_id (int): the patient id
+            name (str): the new name of the patient, or None to keep it
+            entries (dict): the new entries to append to each list field
+            change (dict): the change entry recorded for this revision
+            heart_rates (list): the (datetime, float) time and value of
+                                each new heart rate measurement
+            create (bool): whether a missing patient is created
+
+        Returns:
+            int: the new revision of the patient, or None if the patient
+            was not found and create is False
+        """
+        update = make_update(name, entries, change)
+        if self.document_class is not None:
+            update.setdefault("$set", {})["_cls"] = self.document_class
+        updated = self.collection.find_one_and_update(
+            {"_id": patient_id}, update, projection={"revision": True},
+            upsert=create, return_document=ReturnDocument.AFTER)
+        if updated is None:
+            return None
+        if heart_rates:
+            self.add_heart_rates(patient_id, heart_rates)
+        return updated["revision"]
+
+    def add_heart_rates(self, patient_id, heart_rates):
+        """ Adds measurements to the heart rate series of a patient
+
+        Args:
+            patient_id (int): the patient id
+            heart_rates (list): the (datetime, float) time and value of
+                                each measurement
+        """
+        self.heart_rates.insert_many(
+            [{"patient_id": patient_id, "time": time, "heart_rate": value}
+             for time, value in heart_rates])
+
+    def count_heart_rates(self, patient_id):
+        """ Counts the measurements in the heart rate series of a patient
+
+        Args:
+            patient_id (int): the patient id
+
+        Returns:
+            int: the number of measurements
+        """
+        return self.heart_rates.count_documents({"patient_id": patient_id})
+
+    def get_heart_rate_buckets(self, patient_id, start, end, bucket):
+        """ Reads a range of the heart rate series of a patient,
+        aggregated into buckets
+
+        The buckets are computed by the database, with a single
+        aggregation reading the range from the index.
+
+        Args:
+            patient_id (int): the patient id
+            start (datetime): the start of the range
+            end (datetime): the end of the range, excluded
+            bucket (float): the duration of a bucket, in seconds; bucket
+                            N starts N * bucket seconds after start
+
+        Returns:
+            list: the buckets holding measurements, in time order, as made
+            by make_bucket
+        """
+        buckets = self.heart_rates.aggregate([
+            {"$match": {"patient_id": patient_id,
+                        "time": {"$gte": start, "$lt": end}}},
+            # Subtracting two dates gives milliseconds
+            {"$group": {"_id": {"$floor": {"$divide": [
+                            {"$subtract": ["$time", start]},
+                            bucket * 1000]}},
+                        "min": {"$min": "$heart_rate"},
+                        "mean": {"$avg": "$heart_rate"},
+                        "max": {"$max": "$heart_rate"},
+                        "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}}])
+        return [{"bucket": int(result.pop("_id")), **result}
+                for result in buckets]
+
+    def get_patient(self, patient_id, fields=None, last=None):
+        """ Reads a patient
+
+        Args:
+            patient_id (int): the patient id
+            fields (list): the fields to read, or None to read all fields
+            last (int): the number of latest list entries to read, or None
+                        to read every entry
+
+        Returns:
+            dict or None: the patient, or None if it does not exist
+        """
+        patient = self.collection.find_one({"_id": patient_id},
+                                           make_projection(fields, last))
+        if patient is None:
+            return None
+        return select_fields(patient, fields, None)
+
+    def get_patients(self, patient_ids, fields=None, last=None):
+        """ Reads many patients with a single "$in" query
+
+        Args:
+            patient_ids (list): the patient ids
+            fields (list): the fields to read, or None to read all fields
+            last (int): the number of latest list entries to read, or None
+                        to read every entry
+
+        Returns:
+            dict: the patients that exist, keyed by patient id
+        """
+        patients = self.collection.find({"_id": {"$in": list(patient_ids)}},
+                                        make_projection(fields, last))
+        return {patient["_id"]: select_fields(patient, fields, None)
+                for patient in patients}
+
+    def get_changes(self, patient_id, since):
+        """ Reads the change entries added after a revision
+
+        Args:
+            patient_id (int): the patient id
+            since (int): the revision the changes start after
+
+        Returns:
+            dict or None: the patient's "patient_name", "revision" and the
+            list of "changes" after the revision, or None if the patient
+            does not exist
+        """
+        patient = self.collection.find_one(
+            {"_id": patient_id},
+            {"patient_name": 1, "revision": 1,
+             "changes": {"$slice": [since, CHANGES_LIMIT]}})
+        if patient is None:
+            return None
+        return {"patient_name": patient.get("patient_name"),
+                "revision": patient.get("revision") or 0,
+                "changes": patient.get("changes", [])}
+
+    def list_patient_ids(self):
+        """ Lists the ids of all patients, read from the "_id" index
+
+        Returns:
+            list: the patient ids in increasing order
+        """
+        patients = self.collection.find({}, {"_id": 1}).sort("_id", 1)
+        return [patient["_id"] for patient in patients]
+
+    def delete_patient(self, patient_id):
+        """ Removes a patient and its heart rate series
+
+        Args:
+            patient_id (int): the patient id
+        """
+        self.collection.delete_one({"_id": patient_id})
+        self.heart_rates.delete_many({"patient_id": patient_id})
+
+    def find_inline_images(self):
+        """ Finds the patients that still hold images as b64-strings
+
+        Returns:
+            iterable of dict: the complete records of these patients
+        """
+        return self.collection.find(
+            {"$or": [{field: {"$type": "string"}} for field in IMAGE_FIELDS]},
+            {"changes": 0})
+
+    def find_unmigrated_heart_rates(self):
+        """ Finds the patients with heart rates and an empty heart rate
+        series
+
+        Returns:
+            list of dict: the "_id", "heartrate" and "timestamp" fields of
+            these patients
+        """
+        migrated = self.heart_rates.distinct("patient_id")
+        patients = self.collection.find(
+            {"heartrate.0": {"$exists": True}, "_id": {"$nin": migrated}},
+            make_projection(HEART_RATE_FIELDS, None))
+        return [select_fields(patient, HEART_RATE_FIELDS, None)
+                for patient in patients]
+
+    def replace_images(self, patient_id, ecg_images, medical_images):
+        """ Replaces the image lists of a patient, as the migration of
+        inline images does
+
+        The other fields, the revision and the change entries are kept.
+
+        Args:
+            patient_id (int): the patient id
+            ecg_images (list): the new ECG image references
+            medical_images (list): the new medical image references
+        """
+        self.collection.update_one({"_id": patient_id},
+                                   {"$set": {"ecg_images": ecg_images,
+                                             "medical_images": medical_images}
+                                    })
+
+
+class MemoryPatientStore:
+    """ Keeps the patients in a dictionary of the server process
+
+    The patients are lost when the process ends. A lock makes each
+    operation atomic across the threads of the server.
+    """
+
+    def __init__(self):
+        self._patients = {}
+        self._changes = {}
+        # Sorted times and their heart rates, keyed by patient id
+        self._heart_rates = {}
+        self._lock = threading.Lock()
+
+    def update_patient(self, patient_id, name, entries, change,
+                       heart_rates=None, create=True):
+        """ Applies an upload to a patient, creating it if needed
+
+        The patient, its change entry and its heart rates are updated
+        under the lock, so concurrent uploads are applied one at a time.
+
+        Args:
+            patient_id (int): the patient id
+            name (str): the new name of the patient, or None to keep it
+            entries (dict): the new entries to append to each list field
+            change (dict): the change entry recorded for this revision
+            heart_rates (list): the (datetime, float) time and value of
+                                each new heart rate measurement
+            create (bool): whether a missing patient is created
+
+        Returns:
+            int: the new revision of the patient, or None if the patient
+            was not found and create is False
+        """
+        with self._lock:
+            patient = self._patients.get(patient_id)
+            if patient is None and not create:
+                return None
+            if heart_rates:
+                self._add_heart_rates(patient_id, heart_rates)
+            if patient is None:
+                patient = self._patients[patient_id] = \
+                    empty_patient(patient_id)
+                self._changes[patient_id] = []
+            if name is not None:
+                patient["patient_name"] = name
+            for field in entries:
+                patient[field].extend(entries[field])
+            patient["revision"] += 1
+            self._changes[patient_id].append(change)
+            return patient["revision"]
+
+    def _add_heart_rates(self, patient_id, heart_rates):
+        """ Inserts measurements in time order; the lock must be held """
+        times, values = self._heart_rates.setdefault(patient_id, ([], []))
+        for time, value in heart_rates:
+            index = bisect.bisect_right(times, time)
+            times.insert(index, time)
+            values.insert(index, value)
+
+    def add_heart_rates(self, patient_id, heart_rates):
+        """ Adds measurements to the heart rate series of a patient
+
+        Args:
+            patient_id (int): the patient id
+            heart_rates (list): the (datetime, float) time and value of
+                                each measurement
+        """
+        with self._lock:
+            self._add_heart_rates(patient_id, heart_rates)
+
+    def count_heart_rates(self, patient_id):
+        """ Counts the measurements in the heart rate series of a patient
+
+        Args:
+            patient_id (int): the patient id
+
+        Returns:
+            int: the number of measurements
+        """
+        with self._lock:
+            return len(self._heart_rates.get(patient_id, ([], []))[0])
+
+    def get_heart_rate_buckets(self, patient_id, start, end, bucket):
+        """ Reads a range of the heart rate series of a patient,
+        aggregated into buckets
+
+        The range is found by bisecting the sorted times, and the
+        measurements in it are grouped in a single pass.
+
+        Args:
+            patient_id (int): the patient id
+            start (datetime): the start of the range
+            end (datetime): the end of the range, excluded
+            bucket (float): the duration of a bucket, in seconds; bucket
+                            N starts N * bucket seconds after start
+
+        Returns:
+            list: the buckets holding measurements, in time order, as made
+            by make_bucket
+        """
+        with self._lock:
+            times, values = self._heart_rates.get(patient_id, ([], []))
+            first = bisect.bisect_left(times, start)
+            last = bisect.bisect_left(times, end)
+            buckets = []
+            bucket_values = []
+            index = None
+            for i in range(first, last):
+                i_bucket = int((times[i] - start).total_seconds() // bucket)
+                if i_bucket != index and bucket_values:
+                    buckets.append(make_bucket(index, bucket_values))
+                    bucket_values = []
+                index = i_bucket
+                bucket_values.append(values[i])
+            if bucket_values:
+                buckets.append(make_bucket(index, bucket_values))
+            return buckets
+
+    def get_patient(self, patient_id, fields=None, last=None):
+        """ Reads a patient
+
+        Args:
+            patient_id (int): the patient id
+            fields (list): the fields to read, or None to read all fields
+            last (int): the number of latest list entries to read, or None
+                        to read every entry
+
+        Returns:
+            dict or None: the patient, or None if it does not exist
+        """
+        with self._lock:
+            patient = self._patients.get(patient_id)
+            if patient is None:
+                return None
+            return select_fields(patient, fields, last)
+
+    def get_patients(self, patient_ids, fields=None, last=None):
+        """ Reads many patients under a single hold of the lock
+
+        Args:
+            patient_ids (list): the patient ids
+            fields (list): the fields to read, or None to read all fields
+            last (int): the number of latest list entries to read, or None
+                        to read every entry
+
+        Returns:
+            dict: the patients that exist, keyed by patient id
+        """
+        with self._lock:
+            return {patient_id: select_fields(self._patients[patient_id],
+                                              fields, last)
+                    for patient_id in patient_ids
+                    if patient_id in self._patients}
+
+    def get_changes(self, patient_id, since):
+        """ Reads the change entries added after a revision
+
+        Args:
+            patient_id (int): the patient id
+            since (int): the revision the changes start after
+
+        Returns:
+            dict or None: the patient's "patient_name", "revision" and the
+            list of "changes" after the revision, or None if the patient
+            does not exist
+        """
+        with self._lock:
+            patient = self._patients.get(patient_id)
+            if patient is None:
+                return None
+            return {"patient_name": patient["patient_name"],
+                    "revision": patient["revision"],
+                    "changes": self._changes[patient_id][since:]}
+
+    def list_patient_ids(self):
+        """ Lists the ids of all patients
+
+        Returns:
+            list: the patient ids in increasing order
+        """
+        with self._lock:
+            return sorted(self._patients)
+
+    def delete_patient(self, patient_id):
+        """ Removes a patient, its change entries and its heart rates
+
+        Args:
+            patient_id (int): the patient id
+        """
+        with self._lock:
+            self._patients.pop(patient_id, None)
+            self._changes.pop(patient_id, None)
+            self._heart_rates.pop(patient_id, None)
+
+    def find_inline_images(self):
+        """ Finds the patients that still hold images as b64-strings
+
+        Returns:
+            list of dict: the complete records of these patients
+        """
+        with self._lock:
+            return [select_fields(patient, None, None)
+                    for patient in self._patients.values()
+                    if has_inline_images(patient)]
+
+    def find_unmigrated_heart_rates(self):
+        """ Finds the patients with heart rates and an empty heart rate
+        series
+
+        Returns:
+            list of dict: the "_id", "heartrate" and "timestamp" fields of
+            these patients
+        """
+        with self._lock:
+            return [select_fields(patient, HEART_RATE_FIELDS, None)
+                    for patient_id, patient in self._patients.items()
+                    if patient["heartrate"] and
+                    not self._heart_rates.get(patient_id, ([], []))[0]]
+
+    def replace_images(self, patient_id, ecg_images, medical_images):
+        """ Replaces the image lists of a patient, as the migration of
+        inline images does
+
+        The lists are copied, so the caller may keep changing its own.
+
+        Args:
+            patient_id (int): the patient id
+            ecg_images (list): the new ECG image references
+            medical_images (list): the new medical image references
+        """
+        with self._lock:
+            patient = self._patients[patient_id]
+            patient["ecg_images"] = list(ecg_images)
+            patient["medical_images"] = list(medical_images)
+
+
+class SQLitePatientStore:
+    """ Keeps the patients in a local SQLite database
+
+    Each list entry is a row of its own, so an upload only inserts the new
+    entries and the latest entries of a list are read from an index. Heart
+    rates are also rows of a table of their own, with their time in
+    seconds since EPOCH, under an index covering the patient id, time and
+    value. The database is in write-ahead logging mode, so reads are not
+    blocked by a write in progress. Every thread uses its own connection.
+
+    Args:
+        path (str): the file of the database, created if needed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS patients ("
+                   "id INTEGER PRIMARY KEY, name TEXT, "
+                   "revision INTEGER NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                   "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                   "patient_id INTEGER NOT NULL, field TEXT NOT NULL, "
+                   "value TEXT NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_by_field "
+                   "ON entries (patient_id, field, seq)")
+        db.execute("CREATE TABLE IF NOT EXISTS changes ("
+                   "patient_id INTEGER NOT NULL, revision INTEGER NOT NULL, "
+                   "change TEXT NOT NULL, PRIMARY KEY (patient_id, revision))")
+        db.execute("CREATE TABLE IF NOT EXISTS heart_rates ("
+                   "patient_id INTEGER NOT NULL, time REAL NOT NULL, "
+                   "heart_rate REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS heart_rates_by_time "
+                   "ON heart_rates (patient_id, time, heart_rate)")
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Transactions are started explicitly with BEGIN
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def update_patient(self, patient_id, name, entries, change,
+                       heart_rates=None, create=True):
+        """ Applies an upload to a patient, creating it if needed
+
+        The revision, the new entries, the change entry and the heart
+        rates are written in a single transaction.
+
+        Args:
+            patient_id (int): the patient id
+            name (str): the new name of the patient, or None to keep it
+            entries (dict): the new entries to append to each list field
+            change (dict): the change entry recorded for this revision
+            heart_rates (list): the (datetime, float) time and value of
+                                each new heart rate measurement
+            create (bool): whether a missing patient is created
+
+        Returns:
+            int: the new revision of the patient, or None if the patient
+            was not found and create is False
+        """
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if create:
+                db.execute("INSERT INTO patients (id, name, revision) "
+                           "VALUES (?, ?, 1) ON CONFLICT (id) DO UPDATE SET "
+                           "revision = revision + 1, "
+                           "name = COALESCE(excluded.name, name)",
+                           (patient_id, name))
+            else:
+                db.execute("UPDATE patients SET revision = revision + 1, "
+                           "name = COALESCE(?, name) WHERE id = ?",
+                           (name, patient_id))
+            row = db.execute("SELECT revision FROM patients "
+                             "WHERE id = ?", (patient_id,)).fetchone()
+            if row is None:
+                db.execute("ROLLBACK")
+                return None
+            revision = row[0]
+            db.executemany("INSERT INTO entries (patient_id, field, value) "
+                           "VALUES (?, ?, ?)",
+                           [(patient_id, field, json.dumps(value))
+                            for field in entries
+                            for value in entries[field]])
+            db.execute("INSERT INTO changes (patient_id, revision, change) "
+                       "VALUES (?, ?, ?)",
+                       (patient_id, revision, json.dumps(change)))
+            if heart_rates:
+                self._insert_heart_rates(db, patient_id, heart_rates)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return revision
+
+    def _insert_heart_rates(self, db, patient_id, heart_rates):
+        """ Inserts measurements in the transaction of a connection """
+        db.executemany("INSERT INTO heart_rates (patient_id, time, "
+                       "heart_rate) VALUES (?, ?, ?)",
+                       [(patient_id, (time - EPOCH).total_seconds(), value)
+                        for time, value in heart_rates])
+
+    def add_heart_rates(self, patient_id, heart_rates):
+        """ Adds measurements to the heart rate series of a patient
+
+        Args:
+            patient_id (int): the patient id
+            heart_rates (list): the (datetime, float) time and value of
+                                each measurement
+        """
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert_heart_rates(db, patient_id, heart_rates)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def count_heart_rates(self, patient_id):
+        """ Counts the measurements in the heart rate series of a patient
+
+        Args:
+            patient_id (int): the patient id
+
+        Returns:
+            int: the number of measurements
+        """
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM heart_rates WHERE patient_id = ?",
+            (patient_id,)).fetchone()[0]
+
+    def get_heart_rate_buckets(self, patient_id, start, end, bucket):
+        """ Reads a range of the heart rate series of a patient,
+        aggregated into buckets
+
+        The buckets are computed by a single query, reading the range
+        from the covering index.
+
+        Args:
+            patient_id (int): the patient id
+            start (datetime): the start of the range
+            end (datetime): the end of the range, excluded
+            bucket (float): the duration of a bucket, in seconds; bucket
+                            N starts N * bucket seconds after start
+
+        Returns:
+            list: the buckets holding measurements, in time order, as made
+            by make_bucket
+        """
+        start = (start - EPOCH).total_seconds()
+        end = (end - EPOCH).total_seconds()
+        # Times are never before start, so CAST rounds down
+        rows = self._connect().execute(
+            "SELECT CAST((time - ?) / ? AS INTEGER) AS bucket, "
+            "MIN(heart_rate), AVG(heart_rate), MAX(heart_rate), COUNT(*) "
+            "FROM heart_rates WHERE patient_id = ? AND time >= ? "
+            "AND time < ? GROUP BY bucket ORDER BY bucket",
+            (start, bucket, patient_id, start, end))
+        return [{"bucket": index, "min": low, "mean": mean, "max": high,
+                 "count": count} for index, low, mean, high, count in rows]
+
+    def _read_list(self, db, patient_id, field, last):
+        """ Reads the entries of a list field, oldest first """
+        if last is None:
+            rows = db.execute("SELECT value FROM entries WHERE "
+                              "patient_id = ? AND field = ? ORDER BY seq",
+                              (patient_id, field)).fetchall()
+        else:
+            rows = db.execute("SELECT value FROM entries WHERE "
+                              "patient_id = ? AND field = ? "
+                              "ORDER BY seq DESC LIMIT ?",
+                              (patient_id, field, last)).fetchall()
+            rows.reverse()
+        return [json.loads(row[0]) for row in rows]
+
+    def _read_patient(self, db, patient_id, name, revision, fields, last):
+        """ Builds a patient record from its row and its list entries """
+        patient = {"_id": patient_id, "patient_name": name,
+                   "revision": revision}
+        for field in LIST_FIELDS:
+            if fields is None or field in fields:
+                patient[field] = self._read_list(db, patient_id, field, last)
+        return select_fields(patient, fields, None)
+
+    def get_patient(self, patient_id, fields=None, last=None):
+        """ Reads a patient
+
+        Args:
+            patient_id (int): the patient id
+            fields (list): the fields to read, or None to read all fields
+            last (int): the number of latest list entries to read, or None
+                        to read every entry
+
+        Returns:
+            dict or None: the patient, or None if it does not exist
+        """
+        db = self._connect()
+        # One read transaction, so the lists match the revision
+        db.execute("BEGIN")
+        try:
+            row = db.execute("SELECT name, revision FROM patients "
+                             "WHERE id = ?", (patient_id,)).fetchone()
+            if row is None:
+                return None
+            return self._read_patient(db, patient_id, row[0], row[1],
+                                      fields, last)
+        finally:
+            db.execute("COMMIT")
+
+    def get_patients(self, patient_ids, fields=None, last=None):
+        """ Reads many patients in a single read transaction
+
+        Args:
+            patient_ids (list): the patient ids
+            fields (list): the fields to read, or None to read all fields
+            last (int): the number of latest list entries to read, or None
+                        to read every entry
+
+        Returns:
+            dict: the patients that exist, keyed by patient id
+        """
+        db = self._connect()
+        db.execute("BEGIN")
+        try:
+            # The ids are passed as one JSON array, however many there are
+            rows = db.execute("SELECT id, name, revision FROM patients "
+                              "WHERE id IN (SELECT value FROM json_each(?))",
+                              (json.dumps(list(patient_ids)),)).fetchall()
+            return {patient_id: self._read_patient(db, patient_id, name,
+                                                   revision, fields, last)
+                    for patient_id, name, revision in rows}
+        finally:
+            db.execute("COMMIT")
+
+    def get_changes(self, patient_id, since):
+        """ Reads the change entries added after a revision
+
+        Args:
+            patient_id (int): the patient id
+            since (int): the revision the changes start after
+
+        Returns:
+            dict or None: the patient's "patient_name", "revision" and the
+            list of "changes" after the revision, or None if the patient
+            does not exist
+        """
+        db = self._connect()
+        db.execute("BEGIN")
+        try:
+            row = db.execute("SELECT name, revision FROM patients "
+                             "WHERE id = ?", (patient_id,)).fetchone()
+            if row is None:
+                return None
+            rows = db.execute("SELECT change FROM changes WHERE "
+                              "patient_id = ? AND revision > ? "
+                              "ORDER BY revision",
+                              (patient_id, since)).fetchall()
+        finally:
+            db.execute("COMMIT")
+        return {"patient_name": row[0], "revision": row[1],
+                "changes": [json.loads(change) for change, in rows]}
+
+    def list_patient_ids(self):
+        """ Lists the ids of all patients, read from the primary key
+
+        Returns:
+            list: the patient ids in increasing order
+        """
+        rows = self._connect().execute("SELECT id FROM patients ORDER BY id")
+        return [row[0] for row in rows]
+
+    def delete_patient(self, patient_id):
+        """ Removes a patient, its entries, change entries and heart
+        rates in a single transaction
+
+        Args:
+            patient_id (int): the patient id
+        """
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        for table, column in [("patients", "id"), ("entries", "patient_id"),
+                              ("changes", "patient_id"),
+                              ("heart_rates", "patient_id")]:
+            db.execute("DELETE FROM {} WHERE {} = ?".format(table, column),
+                       (patient_id,))
+        db.execute("COMMIT")
+
+    def find_inline_images(self):
+        """ Finds the patients that still hold images as b64-strings
+
+        Returns:
+            list of dict: the complete records of these patients
+        """
+        # Images are stored as JSON, where only strings start with a quote
+        rows = self._connect().execute(
+            "SELECT DISTINCT patient_id FROM entries WHERE field IN "
+            "('ecg_images', 'medical_images') AND value LIKE '\"%'")
+        return [self.get_patient(patient_id) for patient_id, in rows]
+
+    def find_unmigrated_heart_rates(self):
+        """ Finds the patients with heart rates and an empty heart rate
+        series
+
+        Returns:
+            list of dict: the "_id", "heartrate" and "timestamp" fields of
+            these patients
+        """
+        rows = self._connect().execute(
+            "SELECT DISTINCT patient_id FROM entries WHERE field = "
+            "'heartrate' AND patient_id NOT IN "
+            "(SELECT patient_id FROM heart_rates)")
+        patient_ids = [patient_id for patient_id, in rows]
+        return list(self.get_patients(patient_ids,
+                                      HEART_RATE_FIELDS).values())
+
+    def replace_images(self, patient_id, ecg_images, medical_images):
+        """ Replaces the image lists of a patient, as the migration of
+        inline images does
+
+        The old entries of both lists are deleted and the new ones
+        inserted in a single transaction.
+
+        Args:
+            patient_id (int): the patient id
+            ecg_images (list): the new ECG image references
+            medical_images (list): the new medical image references
+        """
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for field, images in [("ecg_images", ecg_images),
+                                  ("medical_images", medical_images)]:
+                db.execute("DELETE FROM entries WHERE patient_id = ? "
+                           "AND field = ?", (patient_id, field))
+                db.executemany("INSERT INTO entries (patient_id, field, "
+                               "value) VALUES (?, ?, ?)",
+                               [(patient_id, field, json.dumps(image))
+                                for image in images])
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
@@ -0,0 +1,81 @@
+import pytest
+
+
+def test_hash_bytes():
+    from blob_store import hash_bytes
+    answer = hash_bytes(b"hello")
+    expected = "2cf24dba5fb0a30e26e83b2ac5b9e29e" \
+               "1b161e5c1fa7425e73043362938b9824"
+    assert answer == expected
+
+
+@pytest.mark.parametrize("image_hash, expected", [
+    ["2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824",
+     True],
+    ["2CF24DBA5FB0A30E26E83B2AC5B9E29E1B161E5C1FA7425E73043362938B9824",
+     False],
+    ["../../etc/passwd", False],
+    ["", False]
+])
+def test_is_valid_hash(image_hash, expected):
+    from blob_store import is_valid_hash
+    assert is_valid_hash(image_hash) == expected
+
+
+def test_file_blob_store_put_and_open(tmp_path):
+    from blob_store import FileBlobStore, hash_bytes
+    store = FileBlobStore(str(tmp_path))
+    image_hash, size = store.put(b"image bytes")
+    assert image_hash == hash_bytes(b"image bytes")
+    assert size == 11
+    assert store.exists(image_hash) is True
+    with store.open(image_hash) as image_file:
+        assert image_file.read() == b"image bytes"
+
+
+def test_file_blob_store_stores_content_once(tmp_path):
+    from blob_store import FileBlobStore
+    store = FileBlobStore(str(tmp_path))
+    first_hash, size = store.put(b"image bytes")
+    second_hash, size = store.put(b"image bytes")
+    assert first_hash == second_hash
+    assert len(list(tmp_path.rglob("*"))) == 2
+
+
+def test_file_blob_store_missing(tmp_path):
+    from blob_store import FileBlobStore, hash_bytes
+    store = FileBlobStore(str(tmp_path))
+    assert store.exists(hash_bytes(b"missing")) is False
+    assert store.open(hash_bytes(b"missing")) is None
+
+
+def test_file_blob_store_put_stream(tmp_path):
+    import io
+    from blob_store import FileBlobStore, hash_bytes
+    store = FileBlobStore(str(tmp_path))
+    image_hash, size = store.put_stream(io.BytesIO(b"image bytes"),
+                                        chunk_size=4)
+    second_hash, size = store.put_stream(io.BytesIO(b"image bytes"))
+    assert image_hash == second_hash == hash_bytes(b"image bytes")
+    assert size == 11
+    assert store.size(image_hash) == 11
+    with store.open(image_hash) as image_file:
+        assert image_file.read() == b"image bytes"
+    # No temporary files are left next to the blob
+    assert len(list(tmp_path.rglob("*"))) == 2
+
+
+def test_file_blob_store_put_stream_empty(tmp_path):
+    import io
+    from blob_store import FileBlobStore, hash_bytes
+    store = FileBlobStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.put_stream(io.BytesIO(b""))
+    assert store.exists(hash_bytes(b"")) is False
+    assert list(tmp_path.rglob("*")) == []
+
+
+def test_file_blob_store_size_missing(tmp_path):
+    from blob_store import FileBlobStore, hash_bytes
+    store = FileBlobStore(str(tmp_path))
+    assert store.size(hash_bytes(b"missing")) is None
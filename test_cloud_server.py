@@ -1,24 +1,69 @@
 import pytest
 import logging
-from pymodm import connect
-from pymodm import errors as pymodm_errors
-from pymodm import MongoModel, fields
 from freezegun import freeze_time
 import datetime
-import ssl
+import io
+import time
+import base64
+import mongomock
+from blob_store import FileBlobStore, hash_bytes
+from record_store import MongoPatientStore, MemoryPatientStore
+from record_store import SQLitePatientStore
+from upload_sessions import UploadSessions
+from ecg_jobs import JobQueue
+import ecg_format
+import numpy as np
 
-connect("mongodb+srv://bme547classwork:eX8y9F9QFtinXDNU"
-        "@bme547.nkzjd.mongodb.net/myTestDatabase?"
-        "retryWrites=true&w=majority", ssl_cert_reqs=ssl.CERT_NONE)
 
+@pytest.fixture(autouse=True, params=["memory", "sqlite", "mongo"])
+def patient_store(request, tmp_path, monkeypatch):
+    import cloud_server
+    # Every test runs against each backend, starting from an empty store
+    if request.param == "memory":
+        store = MemoryPatientStore()
+    elif request.param == "sqlite":
+        store = SQLitePatientStore(str(tmp_path / "patients.sqlite"))
+    else:
+        store = MongoPatientStore(mongomock.MongoClient().db.patient)
+    monkeypatch.setattr(cloud_server, "patient_store", store)
+    return store
 
-class Patient(MongoModel):
-    patient_name = fields.CharField()
-    patient_id = fields.IntegerField(primary_key=True)
-    ecg_images = fields.ListField()
-    medical_images = fields.ListField()
-    timestamp = fields.ListField()
-    heartrate = fields.ListField()
+
+@pytest.fixture(autouse=True)
+def image_store(tmp_path, monkeypatch):
+    import cloud_server
+    store = FileBlobStore(str(tmp_path))
+    monkeypatch.setattr(cloud_server, "image_store", store)
+    return store
+
+
+@pytest.fixture(autouse=True)
+def patient_id_cache():
+    import cloud_server
+    # The cache would otherwise keep the ids of the previous test's store
+    cloud_server.invalidate_patient_id_cache()
+
+
+@pytest.fixture(autouse=True)
+def upload_sessions(tmp_path, monkeypatch):
+    import cloud_server
+    sessions = UploadSessions(str(tmp_path / "upload_sessions"))
+    monkeypatch.setattr(cloud_server, "upload_sessions", sessions)
+    return sessions
+
+
+@pytest.fixture(autouse=True)
+def ecg_job_queue(tmp_path, monkeypatch):
+    import cloud_server
+    queue = JobQueue(str(tmp_path / "ecg_jobs.sqlite"))
+    monkeypatch.setattr(cloud_server, "ecg_job_queue", queue)
+    return queue
+
+
+def image_ref(b64_string, timestamp):
+    image_bytes = base64.b64decode(b64_string)
+    return {"hash": hash_bytes(image_bytes), "size": len(image_bytes),
+            "timestamp": timestamp}
 
 
 @pytest.mark.parametrize("in_data, expected", [
@@ -31,32 +76,68 @@ def test_get_all_patient_id_driver(in_data, expected):
     for patient in in_data:
         new_patient_driver(patient)
     (patients, status_code) = get_all_patient_id_driver()
-    # print(patients)
-    patient1 = Patient.objects.raw({"_id": 12345})
-    patient1.delete()
-    patient2 = Patient.objects.raw({"_id": 54321})
-    patient2.delete()
     assert sorted(patients["ids"]) == expected
 
 
+def test_get_all_patient_id_driver_pages():
+    from cloud_server import get_all_patient_id_driver, new_patient_driver
+    from cloud_server import get_patient_info_from_database
+    for patient_id in ["30", "10", "20"]:
+        new_patient_driver({"Name": "Phil", "Rec_No": patient_id})
+    first, status_code = get_all_patient_id_driver(None, 2)
+    second, status_code = get_all_patient_id_driver(20, 2)
+    assert first == {"ids": [10, 20], "next": 20}
+    assert second == {"ids": [30], "next": None}
+
+
+def test_get_all_patient_id_driver_new_patient():
+    from cloud_server import get_all_patient_id_driver, new_patient_driver
+    from cloud_server import get_patient_info_from_database
+    new_patient_driver({"Name": "Phil", "Rec_No": "12345"})
+    before, status_code = get_all_patient_id_driver()
+    new_patient_driver({"Name": "Diana", "Rec_No": "54321"})
+    new_patient_driver({"Name": "Phil", "Rec_No": "12345"})
+    after, status_code = get_all_patient_id_driver()
+    assert 54321 not in before["ids"]
+    assert after["ids"].count(12345) == 1
+    assert after["ids"].count(54321) == 1
+
+
+@pytest.mark.parametrize("args, expected", [
+    [{}, (None, None, 200)],
+    [{"limit": "5"}, (None, 5, 200)],
+    [{"after": "12345"}, (12345, 1000, 200)],
+    [{"after": "12345", "limit": "99999"}, (12345, 10000, 200)],
+    [{"after": "one"}, ("after must be a patient id", None, 400)],
+    [{"limit": "0"}, ("limit must be a positive integer", None, 400)],
+    [{"limit": "\u00b2"}, ("limit must be a positive integer", None, 400)]
+])
+def test_parse_page_args(args, expected):
+    from cloud_server import parse_page_args
+    assert parse_page_args(args) == expected
+
+
 @pytest.mark.parametrize("in_data, expected", [
                             [{"Name": "Phil", "Rec_No": "12345",
                               "Med_Img": "Img3", "ECG": "Img4",
                               "Heart_Rate": "123"},
-                             Patient(patient_name="Phil", patient_id="12345",
-                                     ecg_images=["Img4"],
-                                     medical_images=["Img3"],
-                                     heartrate=["123"])]])
+                             {"patient_name": "Phil", "_id": 12345,
+                              "ecg_images": ["Img4"],
+                              "medical_images": ["Img3"],
+                              "heartrate": ["123"]}]])
 def test_new_patient_driver(in_data, expected):
     from cloud_server import new_patient_driver
-    saved_patient, time, status_code = new_patient_driver(in_data)
-    patient1 = Patient.objects.raw({"_id": 12345})
-    patient1.delete()
-    assert saved_patient.patient_name == expected.patient_name
-    assert saved_patient.patient_id == expected.patient_id
-    assert saved_patient.ecg_images[0] == expected.ecg_images[0]
-    assert saved_patient.medical_images[0] == expected.medical_images[0]
-    assert saved_patient.heartrate[0] == expected.heartrate[0]
+    from cloud_server import get_patient_info_from_database
+    patient_id, time, status_code = new_patient_driver(in_data)
+    saved_patient, status_code = get_patient_info_from_database(12345)
+    assert patient_id == 12345
+    assert saved_patient["patient_name"] == expected["patient_name"]
+    assert saved_patient["_id"] == expected["_id"]
+    assert saved_patient["ecg_images"][0] == \
+        image_ref(expected["ecg_images"][0], time)
+    assert saved_patient["medical_images"][0] == \
+        image_ref(expected["medical_images"][0], time)
+    assert saved_patient["heartrate"][0] == expected["heartrate"][0]
 
 
 def test_get_patient_info_driver():
@@ -71,20 +152,30 @@ def test_get_patient_info_driver():
                 "Med_Img": "Img3",
                 "ECG": "Img4",
                 "Heart_Rate": "123",
-                "Timestamp": "04/13/2022, 15:02:45"}
+                "Timestamp": "04/13/2022, 15:02:45",
+                "ECG_Metrics": [],
+                "Revision": 1}
     initial_datetime = datetime.datetime(year=2022, month=4, day=13,
                                          hour=15, minute=2, second=45)
     freezer = freeze_time(initial_datetime)
     new_patient_driver(in_data)
     dict, status_code = get_patient_info_driver(12345)
-    patient1 = Patient.objects.raw({"_id": 12345})
-    patient1.delete()
     assert sorted(dict) == sorted(expected)
 
 
+@pytest.mark.parametrize("text, expected", [
+    ["0", True], ["120", True], ["", False], ["-1", False],
+    ["\u00b2", False], ["\u0663", False], ["1.5", False]
+])
+def test_is_decimal(text, expected):
+    from cloud_server import is_decimal
+    assert is_decimal(text) is expected
+
+
 @pytest.mark.parametrize("patient_id, expected", [
     ["12345", 200],
-    ["two", 400]
+    ["two", 400],
+    [None, 400]
 ])
 def test_validate_convert_patient_id(patient_id, expected):
     from cloud_server import validate_convert_patient_id
@@ -100,20 +191,20 @@ def test_get_patient_info_from_database_1():
                "Med_Img": "Img3",
                "ECG": "Img4",
                "Heart_Rate": "123"}
-    expected = Patient(patient_name="Phil",
-                       patient_id="12345",
-                       ecg_images=["Img4"],
-                       medical_images=["Img3"],
-                       heartrate=["123"])
-    new_patient_driver(in_data)
+    expected = {"patient_name": "Phil",
+                "_id": 12345,
+                "ecg_images": ["Img4"],
+                "medical_images": ["Img3"],
+                "heartrate": ["123"]}
+    patient_id, time, status_code = new_patient_driver(in_data)
     saved_patient, status_code = get_patient_info_from_database(12345)
-    patient1 = Patient.objects.raw({"_id": 12345})
-    patient1.delete()
-    assert saved_patient.patient_name == expected.patient_name
-    assert saved_patient.patient_id == expected.patient_id
-    assert saved_patient.ecg_images[0] == expected.ecg_images[0]
-    assert saved_patient.medical_images[0] == expected.medical_images[0]
-    assert saved_patient.heartrate[0] == expected.heartrate[0]
+    assert saved_patient["patient_name"] == expected["patient_name"]
+    assert saved_patient["_id"] == expected["_id"]
+    assert saved_patient["ecg_images"][0] == \
+        image_ref(expected["ecg_images"][0], time)
+    assert saved_patient["medical_images"][0] == \
+        image_ref(expected["medical_images"][0], time)
+    assert saved_patient["heartrate"][0] == expected["heartrate"][0]
 
 
 # testing for cases when the patient does not exist in database
@@ -127,25 +218,27 @@ def test_get_patient_info_from_database_2():
     expected = 400
     new_patient_driver(in_data)
     saved_patient, status_code = get_patient_info_from_database(12346)
-    patient1 = Patient.objects.raw({"_id": 12345})
-    patient1.delete()
     assert status_code == expected
 
 
 def test_make_patient_info_dict():
     from cloud_server import make_patient_into_dict
-    patient = Patient(patient_name="Phil",
-                      patient_id="12345",
-                      ecg_images=["Img4"],
-                      medical_images=["Img3"],
-                      timestamp=["04/13/2022, 15:02:45"],
-                      heartrate=["123"])
+    patient = {"patient_name": "Phil",
+               "_id": 12345,
+               "ecg_images": ["Img4"],
+               "medical_images": ["Img3"],
+               "timestamp": ["04/13/2022, 15:02:45"],
+               "heartrate": ["123"],
+               "ecg_metrics": [],
+               "revision": 0}
     expected = {"Name": "Phil",
                 "Rec_No": "12345",
                 "Med_Img": ["Img3"],
                 "ECG": ["Img4"],
                 "Heart_Rate": ["123"],
-                "Timestamp": ["04/13/2022, 15:02:45"]}
+                "Timestamp": ["04/13/2022, 15:02:45"],
+                "ECG_Metrics": [],
+                "Revision": 0}
     dict = make_patient_into_dict(patient)
     assert sorted(dict) == sorted(expected)
 
@@ -161,8 +254,6 @@ def test_update_patient_info_driver(in_data, validated, expected):
                "Heart_Rate": ["150"]}
     new_patient_driver(patient)
     hello, time, status_code = update_patient_info_driver(in_data, validated)
-    patient1 = Patient.objects.raw({"_id": 12345})
-    patient1.delete()
     assert status_code == expected
 
 
@@ -174,13 +265,14 @@ def test_update_patient_info_driver(in_data, validated, expected):
                           ({"Name": "Phil", "Rec_No": "12345",
                             "Heart_Rate": "123"},
                            {"Name": "Diana", "Rec_No": "54321"},
+                           False),
+                          ({"Name": "Phil", "Rec_No": "12345"},
+                           {"Rec_No": "abc"},
                            False)])
 def test_patient_exist(in_data, query, expected):
     from cloud_server import patient_exist, new_patient_driver
     new_patient_driver(in_data)
     patient_status = patient_exist(query)
-    patient1 = Patient.objects.raw({"_id": 12345})
-    patient1.delete()
     assert patient_status == expected
 
 
@@ -195,32 +287,707 @@ def test_validate_server_input(in_data, expected):
     assert status_code == expected
 
 
-@pytest.mark.parametrize("in_data, patient, expected",
-                         [(Patient(patient_name="Phil",
-                                   patient_id="12345",
-                                   ecg_images=["Img3"],
-                                   medical_images=["Img4"],
-                                   heartrate=["123"]),
-                           Patient(patient_name="Phil",
-                                   patient_id="12345",
-                                   ecg_images=["Img1"],
-                                   medical_images=["Img2"],
-                                   timestamp=["01/14/2012, 03:21:34"],
-                                   heartrate=["150"]),
-                           Patient(patient_name="Phil", patient_id="12345",
-                                   ecg_images=["Img1", "Img3"],
-                                   medical_images=["Img2", "Img4"],
-                                   timestamp=["01/14/2012, 03:21:34",
-                                              "04/12/2022, 17:17:15"],
-                                   heartrate=["150", "123"]))])
-def test_update_patient_info(in_data, patient, expected):
+@pytest.mark.parametrize("in_data, expected", [
+    ({"Rec_No": "12345"}, (None, {}, {})),
+    ({"Name": "Phil", "Rec_No": "12345"}, ("Phil", {}, {"Name": "Phil"})),
+    ({"Rec_No": "12345", "Med_Img": "Img3", "ECG": "Img4",
+      "Heart_Rate": "123"},
+     (None,
+      {"medical_images": ["Img3"], "ecg_images": ["Img4"],
+       "heartrate": ["123"], "timestamp": ["04/12/2022, 17:17:15"]},
+      {"Med_Img": ["Img3"], "ECG": ["Img4"],
+       "Timestamp": ["04/12/2022, 17:17:15"], "Heart_Rate": ["123"]})),
+    ({"Rec_No": "12345", "ECG": ["Img1", "Img2"], "Heart_Rate": [98, 99]},
+     (None,
+      {"ecg_images": ["Img1", "Img2"], "heartrate": [98, 99],
+       "timestamp": ["04/12/2022, 17:17:15", "04/12/2022, 17:17:15"]},
+      {"ECG": ["Img1", "Img2"],
+       "Timestamp": ["04/12/2022, 17:17:15", "04/12/2022, 17:17:15"],
+       "Heart_Rate": [98, 99]}))
+])
+def test_make_patient_update(in_data, expected):
+    from cloud_server import make_patient_update
+    update = make_patient_update(in_data, "04/12/2022, 17:17:15")
+    assert update == expected
+
+
+@freeze_time("2022-04-12 17:17:15")
+def test_update_patient_info():
     from cloud_server import update_patient_info, new_patient_driver
-    # set time
-    initial_datetime = datetime.datetime(year=2022, month=4, day=12,
-                                         hour=17, minute=17, second=15)
-    freezer = freeze_time(initial_datetime)
+    from cloud_server import get_patient_info_from_database
+    patient = {"Name": "Phil", "Rec_No": "12345", "Med_Img": "Img2",
+               "ECG": "Img1", "Heart_Rate": "150"}
+    in_data = {"Rec_No": "12345", "Med_Img": "Img4", "ECG": "Img3",
+               "Heart_Rate": "123"}
+    now = "04/12/2022, 17:17:15"
+    expected = {"patient_name": "Phil",
+                "ecg_images": [image_ref("Img1", now),
+                               image_ref("Img3", now)],
+                "medical_images": [image_ref("Img2", now),
+                                   image_ref("Img4", now)],
+                "timestamp": [now, now],
+                "heartrate": ["150", "123"]}
     new_patient_driver(patient)
-    saved_patient, now, status_code = update_patient_info(in_data, patient)
-    patient1 = Patient.objects.raw({"_id": 12345}).first()
-    patient1.delete()
-    assert saved_patient == expected
+    patient_id, time, status_code = update_patient_info(in_data)
+    saved_patient, status_code = get_patient_info_from_database(12345)
+    assert time == now
+    for field in expected:
+        assert saved_patient[field] == expected[field]
+
+
+@pytest.mark.parametrize("rec_no", ["abc", None, [1]])
+def test_new_patient_handler_invalid_id(rec_no):
+    from cloud_server import app, get_patient_ids
+    response = app.test_client().post("/new_patient",
+                                      json={"Rec_No": rec_no})
+    assert response.status_code == 400
+    assert response.get_json() == "Patient_id was not an integer"
+    assert list(get_patient_ids()) == []
+
+
+def test_update_patient_info_invalid_image():
+    from cloud_server import update_patient_info
+    in_data = {"Rec_No": "12345", "Med_Img": "not base64!"}
+    answer, time, status_code = update_patient_info(in_data)
+    assert status_code == 400
+
+
+@pytest.mark.parametrize("image", [
+    {"hash": hash_bytes(b"missing")},
+    {"hash": "../../etc/passwd"},
+    {}
+])
+def test_update_patient_info_missing_upload(image):
+    from cloud_server import update_patient_info
+    in_data = {"Rec_No": "12345", "ECG": image}
+    answer, time, status_code = update_patient_info(in_data)
+    assert status_code == 400
+    assert answer.endswith("was not uploaded")
+
+
+def test_upload_image_handler(image_store):
+    from cloud_server import app
+    client = app.test_client()
+    response = client.post("/image", data=b"image bytes",
+                           content_type="application/octet-stream")
+    empty = client.post("/image", data=b"",
+                        content_type="application/octet-stream")
+    assert response.get_json() == {"hash": hash_bytes(b"image bytes"),
+                                   "size": 11}
+    assert image_store.size(hash_bytes(b"image bytes")) == 11
+    assert empty.status_code == 400
+    assert image_store.exists(hash_bytes(b"")) is False
+
+
+def test_chunked_upload_finish_empty(image_store):
+    from cloud_server import app
+    client = app.test_client()
+    upload_id = client.post("/upload").get_json()["upload_id"]
+    url = "/upload/" + upload_id
+    empty = client.post(url + "/finish")
+    assert empty.status_code == 400
+    assert image_store.exists(hash_bytes(b"")) is False
+    assert client.get(url).get_json() == {"offset": 0}
+
+
+def test_chunked_upload_routes(image_store):
+    from cloud_server import app
+    client = app.test_client()
+    upload_id = client.post("/upload").get_json()["upload_id"]
+    url = "/upload/" + upload_id
+    first = client.put(url + "?offset=0", data=b"image ")
+    stale = client.put(url + "?offset=0", data=b"image ")
+    offset = client.get(url)
+    second = client.put(url + "?offset=6", data=b"bytes")
+    finished = client.post(url + "/finish")
+    assert first.get_json() == {"offset": 6}
+    assert stale.status_code == 409
+    assert stale.get_json() == {"offset": 6}
+    assert offset.get_json() == {"offset": 6}
+    assert second.get_json() == {"offset": 11}
+    assert finished.get_json() == {"hash": hash_bytes(b"image bytes"),
+                                   "size": 11}
+    assert client.get(url).status_code == 404
+
+
+@pytest.mark.parametrize("method, url, expected", [
+    ["GET", "/upload/not-an-id", 400],
+    ["GET", "/upload/0123456789abcdef0123456789abcdef", 404],
+    ["PUT", "/upload/0123456789abcdef0123456789abcdef?offset=0", 404],
+    ["PUT", "/upload/0123456789abcdef0123456789abcdef?offset=x", 400],
+    ["PUT", "/upload/0123456789abcdef0123456789abcdef?offset=\u00b2", 400],
+    ["POST", "/upload/0123456789abcdef0123456789abcdef/finish", 404]
+])
+def test_chunked_upload_routes_errors(method, url, expected):
+    from cloud_server import app
+    response = app.test_client().open(url, method=method, data=b"image")
+    assert response.status_code == expected
+
+
+def test_store_image_uploaded(image_store):
+    from cloud_server import store_image
+    image_hash, size = image_store.put(b"image bytes")
+    ref = store_image({"hash": image_hash}, "04/12/2022, 17:17:15")
+    assert ref == {"hash": image_hash, "size": 11,
+                   "timestamp": "04/12/2022, 17:17:15"}
+
+
+def test_store_image(image_store):
+    from cloud_server import store_image
+    b64_string = base64.b64encode(b"image bytes").decode()
+    ref = store_image(b64_string, "04/12/2022, 17:17:15")
+    assert ref == {"hash": hash_bytes(b"image bytes"), "size": 11,
+                   "timestamp": "04/12/2022, 17:17:15"}
+    assert image_store.open(ref["hash"]).read() == b"image bytes"
+
+
+def put_recording(image_store, tmp_path, encoding="int16-delta"):
+    filename = str(tmp_path / "ecg.ecgb")
+    voltage = np.stack([np.arange(3600) / 3600, -np.arange(3600) / 3600],
+                       axis=1)
+    ecg_format.save_recording(filename, voltage, 360, start_time=1,
+                              encoding=encoding, block_samples=1000)
+    with open(filename, "rb") as in_file:
+        recording_hash, size = image_store.put(in_file.read())
+    return recording_hash, size
+
+
+def test_update_patient_info_ecg_recording(image_store, tmp_path,
+                                           ecg_job_queue):
+    from cloud_server import update_patient_info
+    from cloud_server import get_patient_info_from_database
+    recording_hash, size = put_recording(image_store, tmp_path)
+    image_hash, _ = image_store.put(b"\xff\xd8\xff image")
+    in_data = {"Rec_No": "12345",
+               "ECG": {"hash": image_hash,
+                       "recording": {"hash": recording_hash}}}
+    answer, time, status_code = update_patient_info(in_data)
+    patient, status = get_patient_info_from_database(12345)
+    assert status_code == 200
+    assert patient["ecg_images"][0]["hash"] == image_hash
+    assert patient["ecg_images"][0]["recording"] == {
+        "hash": recording_hash, "size": size, "sampling_frequency": 360,
+        "sample_count": 3600, "lead_count": 2, "units": "mV",
+        "encoding": "int16-delta", "job_id": 1}
+    assert ecg_job_queue.get(1)["state"] == "queued"
+
+
+def test_update_patient_info_failed_write_discards_job(
+        image_store, tmp_path, ecg_job_queue, monkeypatch):
+    import cloud_server
+    recording_hash, size = put_recording(image_store, tmp_path)
+    image_hash, _ = image_store.put(b"\xff\xd8\xff image")
+
+    def fail_update(*args, **kwargs):
+        raise OSError("database is down")
+
+    monkeypatch.setattr(cloud_server.patient_store, "update_patient",
+                        fail_update)
+    with pytest.raises(OSError):
+        cloud_server.update_patient_info(
+            {"Rec_No": "12345",
+             "ECG": {"hash": image_hash,
+                     "recording": {"hash": recording_hash}}})
+    assert ecg_job_queue.get(1) is None
+    assert ecg_job_queue.claim() is None
+
+
+@pytest.mark.parametrize("recording, expected", [
+    [{"hash": hash_bytes(b"missing")}, "was not uploaded"],
+    [{}, "was not uploaded"],
+    ["abc", "was not uploaded"],
+    [{"hash": hash_bytes(b"\xff\xd8\xff image")}, "is not valid"]
+])
+def test_update_patient_info_invalid_recording(image_store, recording,
+                                               expected):
+    from cloud_server import update_patient_info
+    image_hash, _ = image_store.put(b"\xff\xd8\xff image")
+    in_data = {"Rec_No": "12345",
+               "ECG": {"hash": image_hash, "recording": recording}}
+    answer, time, status_code = update_patient_info(in_data)
+    assert status_code == 400
+    assert expected in answer
+
+
+@pytest.mark.parametrize("encoding", ["float32", "int16", "int16-delta"])
+def test_get_ecg_recording_handler(image_store, tmp_path, encoding):
+    from cloud_server import app
+    recording_hash, size = put_recording(image_store, tmp_path, encoding)
+    client = app.test_client()
+    response = client.get("/ecg_recording/{}?start=2&end=2.01"
+                          .format(recording_hash))
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["sampling_frequency"] == 360
+    assert body["units"] == "mV"
+    assert body["start_time"] == 2
+    assert np.allclose(body["voltage"], [[0.1, 0.1 + 1 / 3600,
+                                          0.1 + 2 / 3600, 0.1 + 3 / 3600],
+                                         [-0.1, -0.1 - 1 / 3600,
+                                          -0.1 - 2 / 3600,
+                                          -0.1 - 3 / 3600]], atol=1e-4)
+    assert "immutable" in response.headers["Cache-Control"]
+    unchanged = client.get(
+        "/ecg_recording/{}?start=2&end=2.01".format(recording_hash),
+        headers={"If-None-Match": response.headers["ETag"]})
+    whole = client.get("/ecg_recording/" + recording_hash).get_json()
+    assert unchanged.status_code == 304
+    assert len(whole["voltage"][0]) == 3600
+    assert whole["start_time"] == 1
+
+
+@pytest.mark.parametrize("url, expected", [
+    ["/ecg_recording/not-a-hash", 400],
+    ["/ecg_recording/" + hash_bytes(b"missing"), 404],
+    ["/ecg_recording/{}?start=two", 400],
+    ["/ecg_recording/{}?start=inf", 400],
+    ["/ecg_recording/{}?start=-inf", 400],
+    ["/ecg_recording/{}?end=inf", 400],
+    ["/ecg_recording/{}?start=nan", 400],
+    ["/ecg_recording/{}?start=1e308", 200],
+    ["/ecg_recording/{}?start=1&end=20", 400],
+    ["/ecg_recording/" + hash_bytes(b"\xff\xd8\xff image"), 400]
+])
+def test_get_ecg_recording_handler_errors(image_store, tmp_path,
+                                          monkeypatch, url, expected):
+    import cloud_server
+    monkeypatch.setattr(cloud_server, "ECG_SLICE_MAX_SAMPLES", 1000)
+    recording_hash, size = put_recording(image_store, tmp_path)
+    image_store.put(b"\xff\xd8\xff image")
+    response = cloud_server.app.test_client().get(url.format(recording_hash))
+    assert response.status_code == expected
+
+
+def test_new_ecg_job_handler(image_store, tmp_path, ecg_job_queue):
+    from cloud_server import app, new_patient_driver
+    recording_hash, size = put_recording(image_store, tmp_path)
+    new_patient_driver({"Name": "Phil", "Rec_No": "12345"})
+    client = app.test_client()
+    response = client.post("/ecg_jobs", json={
+        "Rec_No": "12345", "recording": {"hash": recording_hash}})
+    status = client.get("/ecg_jobs/{}".format(
+        response.get_json()["job_id"])).get_json()
+    assert response.status_code == 202
+    assert response.get_json() == {"job_id": 1, "state": "queued"}
+    assert status["Rec_No"] == 12345
+    assert status["recording"] == recording_hash
+    assert status["state"] == "queued"
+    assert status["result"] is None
+    assert client.get("/ecg_jobs").get_json() == {
+        "held": 0, "queued": 1, "running": 0, "done": 0, "failed": 0}
+
+
+@pytest.mark.parametrize("in_data, expected", [
+    [{"Rec_No": "12345"}, "Rec_No and recording are required"],
+    [{"Rec_No": "abc", "recording": {}}, "Patient_id was not an integer"],
+    [{"Rec_No": "2", "recording": {"hash": hash_bytes(b"image")}},
+     "Patient_id 2 was not found"],
+    [{"Rec_No": "1", "recording": {"hash": hash_bytes(b"missing")}},
+     "was not uploaded"],
+    [{"Rec_No": "1", "recording": {"hash": hash_bytes(b"image")}},
+     "is not valid"]
+])
+def test_new_ecg_job_handler_errors(image_store, in_data, expected):
+    from cloud_server import app, new_patient_driver, get_patient_ids
+    image_store.put(b"image")
+    new_patient_driver({"Name": "Phil", "Rec_No": "1"})
+    response = app.test_client().post("/ecg_jobs", json=in_data)
+    assert response.status_code == 400
+    assert expected in response.get_data(as_text=True)
+    assert list(get_patient_ids()) == [1]
+
+
+@pytest.mark.parametrize("job_id, expected", [
+    ["1", 404], ["x", 400], ["\u00b2", 400]
+])
+def test_get_ecg_job_handler_errors(job_id, expected):
+    from cloud_server import app
+    response = app.test_client().get("/ecg_jobs/" + job_id)
+    assert response.status_code == expected
+
+
+class RemoteBlobStore:
+    # An image store without local files, like GridFSBlobStore
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def local_path(self, image_hash):
+        return None
+
+    def open(self, image_hash):
+        if image_hash not in self.blobs:
+            return None
+        return io.BytesIO(self.blobs[image_hash])
+
+
+def test_load_recording(image_store, monkeypatch):
+    import cloud_server
+    recording_hash, size = image_store.put(b"ECGB bytes")
+    assert cloud_server.load_recording(recording_hash) == \
+        image_store.local_path(recording_hash)
+    monkeypatch.setattr(cloud_server, "image_store",
+                        RemoteBlobStore({recording_hash: b"ECGB bytes"}))
+    assert cloud_server.load_recording(recording_hash) == b"ECGB bytes"
+    with pytest.raises(LookupError):
+        cloud_server.load_recording(hash_bytes(b"missing"))
+
+
+def test_ecg_jobs_write_metrics(image_store, tmp_path, ecg_job_queue):
+    import cloud_server
+    from ecg_jobs import JobWorkers
+    recording_hash, size = put_recording(image_store, tmp_path)
+    image_hash, _ = image_store.put(b"\xff\xd8\xff image")
+    cloud_server.update_patient_info(
+        {"Rec_No": "12345", "ECG": {"hash": image_hash,
+                                    "recording": {"hash": recording_hash}}})
+    subscriber = cloud_server.patient_events.subscribe()
+    workers = JobWorkers(ecg_job_queue, cloud_server.load_recording,
+                         cloud_server.store_ecg_metrics, workers=1)
+    workers.start()
+    for _ in range(300):
+        if ecg_job_queue.get(1)["state"] in ["done", "failed"]:
+            break
+        time.sleep(0.1)
+    workers.stop()
+    cloud_server.patient_events.unsubscribe(subscriber)
+    job = ecg_job_queue.get(1)
+    patient, status = cloud_server.get_patient_info_driver(12345)
+    assert job["state"] == "done"
+    assert subscriber.get_nowait()["Revision"] == 2
+    assert patient["Revision"] == 2
+    assert len(patient["ECG_Metrics"]) == 1
+    metrics = patient["ECG_Metrics"][0]
+    assert metrics["recording"] == recording_hash
+    assert metrics["job_id"] == 1
+    for key in ["duration", "num_beats", "mean_hr_bpm"]:
+        assert metrics[key] == job["result"][key]
+    assert "beats" not in metrics
+    assert len(job["result"]["beats"]) == metrics["num_beats"]
+    assert metrics["duration"] == pytest.approx(1 + 3599 / 360)
+
+
+@pytest.mark.parametrize("image_hash, expected", [
+    [hash_bytes(b"\xff\xd8\xff image"), 200],
+    [hash_bytes(b"missing image"), 404],
+    ["not-a-hash", 400]
+])
+def test_get_image_handler(image_store, image_hash, expected):
+    from cloud_server import app
+    image_store.put(b"\xff\xd8\xff image")
+    response = app.test_client().get("/image/" + image_hash)
+    assert response.status_code == expected
+    if expected == 200:
+        assert response.data == b"\xff\xd8\xff image"
+        assert response.mimetype == "image/jpeg"
+        assert "immutable" in response.headers["Cache-Control"]
+    response.close()
+
+
+@pytest.mark.parametrize("fields, expected", [
+    [None, None],
+    [["Name", "Heart_Rate"], ["patient_name", "heartrate"]],
+    [["Rec_No", "Timestamp", "Revision"], ["_id", "timestamp", "revision"]]
+])
+def test_make_document_fields(fields, expected):
+    from cloud_server import make_document_fields
+    assert make_document_fields(fields) == expected
+
+
+@pytest.mark.parametrize("args, expected", [
+    [{}, (None, None, 200)],
+    [{"fields": "Name,Heart_Rate", "last": "3"},
+     (["Name", "Heart_Rate"], 3, 200)],
+    [{"fields": "Name,Password"}, ("Unknown fields: Password", None, 400)],
+    [{"last": "0"}, ("last must be a positive integer", None, 400)],
+    [{"last": "two"}, ("last must be a positive integer", None, 400)],
+    [{"last": "\u00b2"}, ("last must be a positive integer", None, 400)]
+])
+def test_parse_projection_args(args, expected):
+    from cloud_server import parse_projection_args
+    assert parse_projection_args(args) == expected
+
+
+def test_get_patient_info_driver_projection():
+    from cloud_server import get_patient_info_driver, new_patient_driver
+    from cloud_server import get_patient_info_from_database
+    for heart_rate in [60, 70, 80]:
+        new_patient_driver({"Name": "Phil", "Rec_No": "12345",
+                            "Heart_Rate": heart_rate})
+    dict, status_code = get_patient_info_driver("12345",
+                                                ["Name", "Heart_Rate"], 2)
+    patient, status = get_patient_info_from_database(12345)
+    assert status_code == 200
+    assert dict == {"Name": "Phil", "Heart_Rate": [70, 80]}
+
+
+def test_get_patient_info_driver_not_found():
+    from cloud_server import get_patient_info_driver
+    answer, status_code = get_patient_info_driver("12399")
+    assert status_code == 400
+
+
+def test_get_patient_summary_handler():
+    from cloud_server import app, new_patient_driver
+    from cloud_server import get_patient_info_from_database
+    for heart_rate in [60, 70]:
+        new_patient_driver({"Name": "Phil", "Rec_No": "12345",
+                            "ECG": "Img4", "Heart_Rate": heart_rate})
+    response = app.test_client().get("/get_patient_summary/12345")
+    patient, status = get_patient_info_from_database(12345)
+    summary = response.get_json()
+    assert response.status_code == 200
+    assert summary["Name"] == "Phil"
+    assert summary["Heart_Rate"] == [70]
+    assert len(summary["ECG"]) == 1
+    assert len(summary["Timestamp"]) == 1
+    assert summary["Med_Img"] == []
+
+
+def test_get_patient_summaries_handler():
+    from cloud_server import app, new_patient_driver
+    for patient_id, heart_rate in [("1", 60), ("1", 70), ("3", 80)]:
+        new_patient_driver({"Name": "Phil", "Rec_No": patient_id,
+                            "ECG": "Img4", "Heart_Rate": heart_rate})
+    client = app.test_client()
+    response = client.get("/get_patient_summaries?ids=3,2,1,3")
+    summaries = response.get_json()
+    assert response.status_code == 200
+    assert [summary["Rec_No"] for summary in summaries["patients"]] == [3, 1]
+    assert summaries["missing"] == [2]
+    assert summaries["patients"][1]["Heart_Rate"] == [70]
+    assert len(summaries["patients"][1]["ECG"]) == 1
+    assert summaries["patients"][1]["Revision"] == 2
+    unchanged = client.get("/get_patient_summaries?ids=3,2,1,3",
+                           headers={"If-None-Match":
+                                    response.headers["ETag"]})
+    assert unchanged.status_code == 304
+    projected = client.get("/get_patient_summaries?ids=1&fields=Heart_Rate")
+    assert projected.get_json() == {"patients": [{"Rec_No": 1,
+                                                  "Heart_Rate": [70]}],
+                                    "missing": []}
+    refused = client.get("/get_patient_summaries?ids=1&last=2")
+    assert refused.status_code == 400
+    assert "last is not supported" in refused.get_data(as_text=True)
+
+
+@pytest.mark.parametrize("change, expected", [
+    [{}, []],
+    [{"Heart_Rate": [72, "80", 90.5]}, [72.0, 80.0, 90.5]],
+    [{"Heart_Rate": ["fast", None, True, "nan", [1]]}, []]
+])
+def test_make_heart_rate_series(change, expected):
+    from cloud_server import make_heart_rate_series
+    time = datetime.datetime(2022, 4, 13, 15, 2, 45)
+    assert make_heart_rate_series(change, time) == \
+        [(time, value) for value in expected]
+
+
+def test_get_heart_rate_handler():
+    from cloud_server import app, new_patient_driver
+    for minute, heart_rate in [(0, 60), (1, "70"), (2, 80), (10, 100)]:
+        with freeze_time(datetime.datetime(2022, 4, 13, 15, minute, 30)):
+            new_patient_driver({"Rec_No": "12345", "Heart_Rate": heart_rate})
+    client = app.test_client()
+    response = client.get("/heart_rate/12345?start=2022-04-13T15:00:00"
+                          "&end=2022-04-13T16:00:00&bucket=5m")
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "Rec_No": 12345, "start": "2022-04-13T15:00:00",
+        "end": "2022-04-13T16:00:00", "bucket": 300,
+        "buckets": [{"start": "2022-04-13T15:00:00", "min": 60.0,
+                     "mean": 70.0, "max": 80.0, "count": 3},
+                    {"start": "2022-04-13T15:10:00", "min": 100.0,
+                     "mean": 100.0, "max": 100.0, "count": 1}]}
+    with freeze_time(datetime.datetime(2022, 4, 13, 16, 0, 0)):
+        default = client.get("/heart_rate/12345").get_json()
+    assert default["start"] == "2022-04-12T16:00:00"
+    assert default["bucket"] == 288
+    assert sum(bucket["count"] for bucket in default["buckets"]) == 4
+    assert client.get("/heart_rate/12399").status_code == 400
+    assert client.get("/heart_rate/12345?bucket=0").status_code == 400
+    assert client.get("/heart_rate/12345?bucket=\u00b2").status_code == 400
+
+
+@pytest.mark.parametrize("args, expected", [
+    [{"start": "2022-04-13T15:00:00", "end": "2022-04-13T16:00:00",
+      "bucket": "30"},
+     ((datetime.datetime(2022, 4, 13, 15), datetime.datetime(2022, 4, 13, 16),
+       30), 200)],
+    [{"start": "2022-04-13", "bucket": "1d"},
+     ((datetime.datetime(2022, 4, 13), datetime.datetime(2022, 4, 20), 86400),
+      200)],
+    [{}, ((datetime.datetime(2022, 4, 19), datetime.datetime(2022, 4, 20),
+           288), 200)],
+    [{"start": "04/13/2022"}, ("start must be an ISO 8601 time", 400)],
+    [{"start": "2022-04-21"}, ("start must be before end", 400)],
+    [{"bucket": "5x"}, ("bucket must be a positive number of seconds, "
+                        "optionally followed by s, m, h or d", 400)],
+    [{"start": "2021-04-20", "bucket": "1s"},
+     ("The range holds more than 10000 buckets", 400)]
+])
+def test_parse_heart_rate_args(args, expected):
+    from cloud_server import parse_heart_rate_args
+    now = datetime.datetime(2022, 4, 20)
+    assert parse_heart_rate_args(args, now) == expected
+
+
+@pytest.mark.parametrize("duration, expected", [
+    ["300", 300], ["30s", 30], ["5m", 300], ["2h", 7200], ["7d", 604800],
+    ["0", None], ["m", None], ["", None], ["-5", None], ["1.5h", None],
+    ["\u00b2", None], ["5\u00b2m", None], ["\u0663m", None]
+])
+def test_parse_duration(duration, expected):
+    from cloud_server import parse_duration
+    assert parse_duration(duration) == expected
+
+
+def test_migrate_heart_rates(patient_store):
+    from cloud_server import migrate_heart_rates, get_heart_rate_driver
+    times = ["04/13/2022, 15:02:45", "04/13/2022, 15:07:10"]
+    patient_store.update_patient(1, None, {"heartrate": [60, "70"],
+                                           "timestamp": times}, {})
+    # Heart rates that cannot be dated
+    patient_store.update_patient(2, None, {"heartrate": [60]}, {})
+    patient_store.update_patient(3, None, {"heartrate": [60, "fast"],
+                                           "timestamp": times}, {})
+    assert migrate_heart_rates() == 3
+    # Only the patient whose heart rates cannot be dated is read again
+    assert [patient["_id"] for patient in
+            patient_store.find_unmigrated_heart_rates()] == [2]
+    assert migrate_heart_rates() == 0
+    start = datetime.datetime(2022, 4, 13, 15)
+    series, status_code = get_heart_rate_driver(
+        "1", start, start + datetime.timedelta(hours=1), 300)
+    assert [(bucket["start"], bucket["mean"])
+            for bucket in series["buckets"]] == \
+        [("2022-04-13T15:00:00", 60.0), ("2022-04-13T15:05:00", 70.0)]
+    assert patient_store.count_heart_rates(2) == 0
+    assert patient_store.count_heart_rates(3) == 1
+
+
+@pytest.mark.parametrize("args, expected", [
+    [{"ids": "1,2,1"}, ([1, 2], 200)],
+    [{}, ("ids must list at least one patient id", 400)],
+    [{"ids": ""}, ("ids must list at least one patient id", 400)],
+    [{"ids": "1,x"}, ("Patient_id was not an integer", 400)],
+    [{"ids": ",".join(str(i) for i in range(501))},
+     ("ids must list at most 500 patient ids", 400)]
+])
+def test_parse_ids_arg(args, expected):
+    from cloud_server import parse_ids_arg
+    assert parse_ids_arg(args) == expected
+
+
+@pytest.mark.parametrize("args, expected", [
+    [{}, (None, 200)],
+    [{"since": "4"}, (4, 200)],
+    [{"since": "four"}, ("since must be a revision number", 400)],
+    [{"since": "\u00b2"}, ("since must be a revision number", 400)],
+    [{"since": "4", "last": "1"}, ("since cannot be combined with last",
+                                   400)]
+])
+def test_parse_since_arg(args, expected):
+    from cloud_server import parse_since_arg
+    assert parse_since_arg(args) == expected
+
+
+def test_get_patient_info_driver_since():
+    from cloud_server import get_patient_info_driver, new_patient_driver
+    from cloud_server import get_patient_info_from_database
+    new_patient_driver({"Name": "Phil", "Rec_No": "12345",
+                        "Heart_Rate": 60})
+    full, status_code = get_patient_info_driver("12345")
+    new_patient_driver({"Rec_No": "12345", "Heart_Rate": 70})
+    new_patient_driver({"Rec_No": "12345", "Name": "Philjae",
+                        "Heart_Rate": [80, 90]})
+    changes, changes_status = get_patient_info_driver("12345", since=1)
+    current, current_status = get_patient_info_driver("12345", since=3)
+    newer, newer_status = get_patient_info_driver("12345", since=7)
+    patient, status = get_patient_info_from_database(12345)
+    assert full["Revision"] == 1
+    assert changes_status == 200
+    assert changes == {"Name": "Philjae", "Rec_No": 12345, "Revision": 3,
+                       "Since": 1, "Med_Img": [], "ECG": [],
+                       "Heart_Rate": [70, 80, 90], "Timestamp": [],
+                       "ECG_Metrics": []}
+    assert current_status == 304
+    assert newer_status == 200
+    assert newer["Heart_Rate"] == [60, 70, 80, 90]
+    assert "Since" not in newer
+
+
+def test_get_patient_info_handler_since():
+    from cloud_server import app, new_patient_driver
+    from cloud_server import get_patient_info_from_database
+    new_patient_driver({"Name": "Phil", "Rec_No": "12345",
+                        "Heart_Rate": 60})
+    new_patient_driver({"Rec_No": "12345", "Heart_Rate": 70})
+    client = app.test_client()
+    changed = client.get("/get_patient_info/12345?since=1&fields=Heart_Rate")
+    unchanged = client.get("/get_patient_info/12345?since=2")
+    patient, status = get_patient_info_from_database(12345)
+    assert changed.get_json() == {"Heart_Rate": [70], "Revision": 2,
+                                  "Since": 1}
+    assert unchanged.status_code == 304
+    assert unchanged.data == b""
+
+
+def test_get_all_patient_id_conditional():
+    from cloud_server import app
+    client = app.test_client()
+    first = client.get("/get_all_patient_id")
+    etag = first.headers["ETag"]
+    second = client.get("/get_all_patient_id",
+                        headers={"If-None-Match": etag})
+    stale = client.get("/get_all_patient_id",
+                       headers={"If-None-Match": '"stale"'})
+    assert first.status_code == 200
+    assert "no-cache" in first.headers["Cache-Control"]
+    assert second.status_code == 304
+    assert second.data == b""
+    assert stale.status_code == 200
+
+
+def test_get_patient_info_handler_conditional():
+    from cloud_server import app, new_patient_driver
+    from cloud_server import get_patient_info_from_database
+    new_patient_driver({"Name": "Phil", "Rec_No": "12345",
+                        "Heart_Rate": 60})
+    client = app.test_client()
+    first = client.get("/get_patient_info/12345")
+    etag = first.headers["ETag"]
+    unchanged = client.get("/get_patient_info/12345",
+                           headers={"If-None-Match": etag})
+    new_patient_driver({"Rec_No": "12345", "Heart_Rate": 70})
+    changed = client.get("/get_patient_info/12345",
+                         headers={"If-None-Match": etag})
+    patient, status = get_patient_info_from_database(12345)
+    assert unchanged.status_code == 304
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_update_patient_info_publishes_event():
+    from cloud_server import update_patient_info, patient_events
+    from cloud_server import get_patient_info_from_database
+    subscriber = patient_events.subscribe()
+    update_patient_info({"Rec_No": "12345", "Heart_Rate": 60})
+    update_patient_info({"Rec_No": "12345", "Heart_Rate": 70})
+    patient_events.unsubscribe(subscriber)
+    patient, status = get_patient_info_from_database(12345)
+    first = subscriber.get_nowait()
+    second = subscriber.get_nowait()
+    assert first["Rec_No"] == 12345
+    assert second["Revision"] == first["Revision"] + 1
+
+
+def test_store_ecg_metrics_missing_patient(ecg_job_queue):
+    import cloud_server
+    subscriber = cloud_server.patient_events.subscribe()
+    job_id = ecg_job_queue.enqueue(12345, "a" * 64)
+    metrics = {key: 1 for key in cloud_server.ECG_METRIC_FIELDS}
+    cloud_server.store_ecg_metrics(ecg_job_queue.get(job_id), metrics)
+    cloud_server.patient_events.unsubscribe(subscriber)
+    assert cloud_server.get_patient_info_from_database(12345)[1] != 200
+    assert list(cloud_server.get_patient_ids()) == []
+    assert subscriber.empty()
@@ -0,0 +1,359 @@
+import pytest
+import logging
+import numpy as np
+
+CSV = "0,1.0\n0.5,2.0\n\n1,abc\n,3\n1.5,nan\n2,1.5\n3\n2.5,1.0\n"
+LOGGED = [(logging.ERROR, "there is an empty cell in line 3"),
+          (logging.ERROR, "there was a non-numeric input in line 4"),
+          (logging.ERROR, "there is an empty cell in line 5"),
+          (logging.ERROR, "There is a NaN cell in line 6"),
+          (logging.ERROR, "there is an empty cell in line 8")]
+
+
+@pytest.mark.parametrize("block_lines", [1, 2, 3, 65536])
+def test_readFile(tmp_path, caplog, monkeypatch, block_lines):
+    import ecg
+    monkeypatch.setattr(ecg, "READ_BLOCK_LINES", block_lines)
+    filename = tmp_path / "ecg.csv"
+    filename.write_text(CSV)
+    with caplog.at_level(logging.INFO):
+        time, voltage, sampling_frequency = ecg.readFile(str(filename))
+    assert time.tolist() == [0, 0.5, 2, 2.5]
+    assert voltage.tolist() == [1, 2, 1.5, 1]
+    assert time.dtype == np.float64
+    assert sampling_frequency == 1.6
+    errors = [(record.levelno, record.getMessage())
+              for record in caplog.records if record.levelno >= logging.ERROR]
+    assert errors == LOGGED
+
+
+def test_readFile_float32(tmp_path):
+    from ecg import readFile
+    filename = tmp_path / "ecg.csv"
+    filename.write_text("0.5,0.1\n1,0.2\n")
+    time, voltage, sampling_frequency = readFile(str(filename),
+                                                 dtype=np.float32)
+    assert voltage.dtype == np.float32
+    assert voltage.tolist() == pytest.approx([0.1, 0.2])
+    assert sampling_frequency == 2
+
+
+def test_readFile_nan_in_bulk(tmp_path, caplog):
+    from ecg import readFile
+    filename = tmp_path / "ecg.csv"
+    filename.write_text("0.5,0.1\n1,NaN\n1.5,0.3\n")
+    with caplog.at_level(logging.ERROR):
+        time, voltage, sampling_frequency = readFile(str(filename))
+    assert voltage.tolist() == [0.1, 0.3]
+    assert caplog.messages == ["There is a NaN cell in line 2"]
+
+
+def test_readFile_voltage_range(tmp_path, caplog):
+    from ecg import readFile
+    filename = tmp_path / "ecg.csv"
+    filename.write_text("0.5,0.1\n1,301\n")
+    with caplog.at_level(logging.WARNING):
+        readFile(str(filename))
+    assert caplog.messages == ["In the input file {},voltage exceed the "
+                               "normal range".format(filename)]
+
+
+def make_signal(seconds, sampling_frequency=360):
+    time = np.arange(int(seconds * sampling_frequency)) / sampling_frequency
+    rng = np.random.default_rng(0)
+    voltage = np.sin(2 * np.pi * 1.1 * time) ** 63 \
+        + 0.3 * np.sin(2 * np.pi * 0.2 * time) \
+        + 0.02 * rng.standard_normal(len(time))
+    return time, voltage
+
+
+def write_recording(filename, seconds):
+    time, voltage = make_signal(seconds)
+    with open(filename, "w") as out_file:
+        out_file.writelines("{:.6f},{:.5f}\n".format(t, v)
+                            for t, v in zip(time, voltage))
+
+
+@pytest.mark.parametrize("block_lines", [500, 4000])
+def test_filter_blocks(tmp_path, monkeypatch, block_lines):
+    import ecg
+    filename = str(tmp_path / "ecg.csv")
+    write_recording(filename, 40)
+    time, voltage, sampling_frequency = ecg.readFile(filename)
+    expected = ecg.process_data(voltage, sampling_frequency)
+    monkeypatch.setattr(ecg, "READ_BLOCK_LINES", block_lines)
+    blocks = list(ecg.filter_blocks(ecg.read_blocks(filename),
+                                    sampling_frequency, 3600))
+    assert np.concatenate([block[0] for block in blocks]).tolist() == \
+        time.tolist()
+    assert np.allclose(np.concatenate([block[1] for block in blocks]),
+                       expected, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("block_lines", [700, 65536])
+def test_analyze_stream(tmp_path, monkeypatch, block_lines):
+    import ecg
+    filename = str(tmp_path / "ecg.csv")
+    write_recording(filename, 60)
+    time, voltage, sampling_frequency = ecg.readFile(filename)
+    expected = ecg.make_metrics(time, ecg.process_data(voltage,
+                                                       sampling_frequency))
+    monkeypatch.setattr(ecg, "READ_BLOCK_LINES", block_lines)
+    metrics = ecg.analyze_stream(filename, sampling_frequency)
+    assert metrics["beats"] == expected["beats"]
+    assert metrics["num_beats"] == expected["num_beats"]
+    assert metrics["mean_hr_bpm"] == expected["mean_hr_bpm"]
+    assert metrics["duration"] == expected["duration"]
+    assert metrics["voltage_extremes"] == \
+        pytest.approx(expected["voltage_extremes"], abs=1e-9)
+
+
+def test_analyze_stream_no_valid_line(tmp_path):
+    from ecg import analyze_stream
+    filename = tmp_path / "ecg.csv"
+    filename.write_text("time,voltage\n")
+    with pytest.raises(ValueError):
+        analyze_stream(str(filename))
+
+
+@pytest.mark.parametrize("block", [1, 36, 5000])
+def test_online_beat_detector(block):
+    from ecg import OnlineBeatDetector, when_beats, process_data
+    time, voltage = make_signal(60)
+    expected = when_beats(time, process_data(voltage, 360))
+    detector = OnlineBeatDetector(360)
+    beats = []
+    for start in range(0, len(time), block):
+        new_beats = detector.push(time[start:start + block],
+                                  voltage[start:start + block])
+        latest = time[min(start + block, len(time)) - 1]
+        for beat in new_beats:
+            assert latest - beat <= 0.5 + block / 360
+        beats += new_beats
+    assert len(beats) == len(expected)
+    assert beats == pytest.approx(expected, abs=0.02)
+    assert detector.heart_rate == pytest.approx(66)
+    assert len(detector.voltages) <= detector.window
+
+
+def test_online_beat_detector_no_beats():
+    from ecg import OnlineBeatDetector
+    detector = OnlineBeatDetector(360)
+    assert detector.push([], []) == []
+    assert detector.push(np.arange(720) / 360, np.zeros(720)) == []
+    assert detector.heart_rate is None
+
+
+def test_find_recordings(tmp_path):
+    from ecg import find_recordings
+    (tmp_path / "a").mkdir()
+    for name in ["a/2.csv", "a/1.csv", "a/1a.ecgb", "a/notes.txt",
+                 "b.csv"]:
+        (tmp_path / name).write_text("")
+    answer = find_recordings([str(tmp_path / "a"),
+                              str(tmp_path / "**" / "b.csv")])
+    assert answer == [str(tmp_path / "a" / "1.csv"),
+                      str(tmp_path / "a" / "1a.ecgb"),
+                      str(tmp_path / "a" / "2.csv"),
+                      str(tmp_path / "b.csv")]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_run_batch(tmp_path, stream):
+    import json
+    from ecg import run_batch
+    filenames = []
+    for i in range(3):
+        filenames.append(str(tmp_path / "{}.csv".format(i)))
+        write_recording(filenames[-1], 20 + i)
+    filenames.insert(1, str(tmp_path / "bad.csv"))
+    (tmp_path / "bad.csv").write_text("time,voltage\n")
+    output = str(tmp_path / "metrics.jsonl")
+    total, failed = run_batch(filenames, output, workers=2, stream=stream)
+    assert (total, failed) == (4, 1)
+    with open(output) as in_file:
+        results = [json.loads(line) for line in in_file]
+    assert [result["file"] for result in results] == filenames
+    assert "error" in results[1]
+    assert [result["duration"] for result in results if "error"
+            not in result] == pytest.approx([20, 21, 22], abs=0.01)
+    assert results[0]["num_beats"] == 22
+
+
+def test_run_batch_bounded(tmp_path, monkeypatch):
+    import concurrent.futures
+    import ecg
+    counts = {"unread": 0, "peak": 0}
+
+    class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+        # Counts the tasks whose result was not read yet
+        def submit(self, fn, *args):
+            future = super().submit(fn, *args)
+            result = future.result
+            counts["unread"] += 1
+            counts["peak"] = max(counts["peak"], counts["unread"])
+
+            def read():
+                counts["unread"] -= 1
+                return result()
+            future.result = read
+            return future
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor",
+                        CountingExecutor)
+    monkeypatch.setattr(ecg, "analyze_file",
+                        lambda filename, stream: {"file": filename})
+    filenames = [str(i) for i in range(100)]
+    output = str(tmp_path / "metrics.jsonl")
+    assert ecg.run_batch(filenames, output, workers=2) == (100, 0)
+    # 12 files per task, at most 2 tasks per worker in flight
+    assert counts["peak"] == ecg.BATCH_TASKS_PER_WORKER * 2
+    with open(output) as in_file:
+        assert len(in_file.readlines()) == 100
+
+
+@pytest.mark.parametrize("argv, command, stream", [
+    [[], None, False],
+    [["--stream", "x.csv"], None, True],
+    [["batch", "data", "--workers", "3"], "batch", False]
+])
+def test_parse_args(argv, command, stream):
+    from ecg import parse_args
+    args = parse_args(argv)
+    assert args.command == command
+    assert args.stream == stream
+    if command == "batch":
+        assert args.inputs == ["data"]
+        assert args.workers == 3
+        assert args.output == "metrics.jsonl"
+
+
+def test_parse_args_convert():
+    from ecg import parse_args
+    args = parse_args(["convert", "x.csv", "--encoding", "float32"])
+    assert args.command == "convert"
+    assert args.filename == "x.csv"
+    assert args.output is None
+    assert args.encoding == "float32"
+
+
+@pytest.mark.parametrize("encoding", ["float32", "int16", "int16-delta"])
+def test_convert_recording(tmp_path, encoding):
+    import ecg
+    filename = str(tmp_path / "ecg.csv")
+    write_recording(filename, 30)
+    output = ecg.convert_recording(filename, encoding=encoding)
+    time, voltage, sampling_frequency = ecg.readFile(filename)
+    assert output == str(tmp_path / "ecg.ecgb")
+    converted = ecg.readFile(output)
+    assert converted[0] == pytest.approx(time, abs=1e-6)
+    assert converted[1] == pytest.approx(voltage, abs=1e-4)
+    assert converted[1].dtype == np.float64
+    assert converted[2] == pytest.approx(360)
+    expected = ecg.analyze_recording(filename)
+    metrics = ecg.analyze_recording(output)
+    assert metrics["beats"] == pytest.approx(expected["beats"], abs=0.01)
+    assert ecg.analyze_recording(output, stream=True)["beats"] == \
+        pytest.approx(metrics["beats"], abs=1e-9)
+
+
+def test_read_recording_mapped(tmp_path):
+    import ecg
+    import ecg_format
+    filename = str(tmp_path / "ecg.ecgb")
+    time, voltage = make_signal(10)
+    ecg_format.save_recording(filename, voltage, 360, encoding="float32")
+    time, voltage, sampling_frequency = ecg.read_recording(filename)
+    assert voltage.dtype == np.float32
+    assert not voltage.flags.writeable
+    assert sampling_frequency == 360
+    assert ecg.process_data(voltage, 360).dtype == np.float32
+
+
+def test_main_convert(tmp_path, capsys, monkeypatch):
+    import ecg
+    import ecg_format
+    monkeypatch.chdir(tmp_path)
+    write_recording("ecg.csv", 5)
+    ecg.main(["convert", "ecg.csv", "out.ecgb", "--encoding", "int16-delta"])
+    assert capsys.readouterr().out == "out.ecgb\n"
+    with ecg_format.open_recording("out.ecgb") as recording:
+        assert recording.encoding == "int16-delta"
+        assert recording.sample_count == 1800
+
+
+@pytest.mark.parametrize("sampling_frequency", [250, 360, 1000])
+def test_process_data_sos(sampling_frequency):
+    from ecg import process_data
+    time, voltage = make_signal(30, sampling_frequency)
+    expected = process_data(voltage, sampling_frequency, method='ba')
+    answer = process_data(voltage, sampling_frequency)
+    assert answer.dtype == np.float64
+    assert np.allclose(answer, expected, rtol=0, atol=1e-9)
+
+
+def test_process_data_float32():
+    from ecg import process_data
+    time, voltage = make_signal(30)
+    expected = process_data(voltage, 360, method='ba')
+    answer = process_data(voltage.astype(np.float32), 360)
+    assert answer.dtype == np.float32
+    assert np.allclose(answer, expected, rtol=0, atol=1e-4)
+
+
+def test_process_data_list():
+    from ecg import process_data
+    voltage = [0.0, 1.0, 0.5] * 100
+    assert np.allclose(process_data(voltage, 360),
+                       process_data(voltage, 360, method='ba'))
+
+
+def test_bandpass_design_cached():
+    from ecg import bandpass_coefficients, bandpass_sos
+    assert bandpass_sos(360) is bandpass_sos(360)
+    assert bandpass_coefficients(360) is bandpass_coefficients(360)
+    sos, zi = bandpass_sos(360, dtype=np.float32)
+    assert sos.dtype == np.float32
+    assert zi.dtype == np.float32
+
+
+@pytest.mark.parametrize("sampling_frequency, expected", [
+    [250, 62], [360, 90], [1000, 250]
+])
+def test_refractory_samples(sampling_frequency, expected):
+    from ecg import refractory_samples
+    assert refractory_samples(sampling_frequency) == expected
+
+
+def test_when_beats_sampling_frequencies():
+    from ecg import when_beats, process_data
+    results = []
+    for sampling_frequency in [250, 500, 1000]:
+        time, voltage = make_signal(30, sampling_frequency)
+        beats = when_beats(time, process_data(voltage, sampling_frequency))
+        assert isinstance(beats, np.ndarray)
+        results.append(beats)
+    assert len(results[0]) == len(results[1]) == len(results[2]) == 33
+    assert results[0] == pytest.approx(results[2], abs=0.01)
+    assert results[1] == pytest.approx(results[2], abs=0.01)
+
+
+@pytest.mark.parametrize("scale, expected", [[0.4, 33], [3, 33], [0, 0]])
+def test_when_beats_amplitude(scale, expected):
+    from ecg import when_beats, process_data
+    time, voltage = make_signal(30)
+    rng = np.random.default_rng(1)
+    voltage = scale * voltage + 0.02 * rng.standard_normal(len(time))
+    beats = when_beats(time, process_data(voltage, 360), 360)
+    assert len(beats) == expected
+
+
+@pytest.mark.parametrize("voltage, expected", [
+    [[0, 1, 0, 0, 0, 0, 0, 0.5], [1, 7]],
+    [[0, 1, 0, 0.5], [1]],
+    [[0, 1, 0, 0, 0, 0, 0, 0.1], [1]]
+])
+def test_find_beat_peaks_at_end(voltage, expected, monkeypatch):
+    import ecg
+    monkeypatch.setattr(ecg, "REFRACTORY_SECONDS", 0.5)
+    peaks = ecg.find_beat_peaks(voltage, 10, at_end=True)
+    assert peaks.tolist() == expected
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+import ecg
+from ecg_cache import ResultCache, signal_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"))
+
+
+def test_signal_key():
+    time = [0, 1 / 360, 2 / 360]
+    voltage = [0.5, 1.0, -0.25]
+    key = signal_key(time, voltage, "calc_hr")
+    assert key == signal_key(np.array(time), np.array(voltage), "calc_hr")
+    assert len(key) == 64
+    assert key != signal_key(time, voltage, "plot-jpg")
+    assert key != signal_key(time, [0.5, 1.0, -0.5], "calc_hr")
+    # The samples are not simply concatenated
+    assert key != signal_key(time + voltage[:1], voltage[1:], "calc_hr")
+
+
+def test_signal_key_parameters(monkeypatch):
+    key = signal_key([0, 1], [0, 1], "calc_hr")
+    monkeypatch.setattr(ecg, "REFRACTORY_SECONDS", 0.3)
+    assert signal_key([0, 1], [0, 1], "calc_hr") != key
+
+
+def test_get_or_compute(cache, tmp_path):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return b"plot"
+    assert cache.get_or_compute("a" * 64, compute) == b"plot"
+    assert cache.get_or_compute("a" * 64, compute) == b"plot"
+    # A new cache on the same directory reads the disk tier
+    restarted = ResultCache(str(tmp_path / "cache"))
+    assert restarted.get_or_compute("a" * 64, compute) == b"plot"
+    assert restarted.get("a" * 64) == b"plot"
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["compute_seconds"] > 0
+    restarted_stats = restarted.stats()
+    assert restarted_stats["disk_hits"] == 1
+    assert restarted_stats["memory_hits"] == 1
+    assert restarted_stats["hit_rate"] == 1
+    restarted.reset_stats()
+    assert restarted.stats()["memory_hits"] == 0
+
+
+def test_get_or_compute_json(cache):
+    assert cache.get_or_compute_json("a" * 64, lambda: 72) == 72
+    assert cache.get_or_compute_json("a" * 64, lambda: 0) == 72
+    assert cache.get("a" * 64) == b"72"
+
+
+def test_memory_tier_is_bounded(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), memory_entries=2)
+    for key in "abc":
+        cache.put(key, key.encode())
+    # "a" is read from disk and becomes the most recently used in memory
+    assert cache.get("a") == b"a"
+    assert cache.get("c") == b"c"
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["memory_hits"] == 1
+    assert stats["memory_entries"] == 2
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = ResultCache(directory, memory_entries=1, disk_bytes=250)
+    cache.put("a", b"a" * 100)
+    cache.put("b", b"b" * 100)
+    cache.get("a")
+    cache.put("c", b"c" * 100)
+    assert sorted(os.listdir(directory)) == ["a", "c"]
+    assert cache.get("b") is None
+    assert cache.stats()["disk_bytes"] == 200
+    # The newest result is kept even if it is larger than the limit
+    cache.put("d", b"d" * 300)
+    assert os.listdir(directory) == ["d"]
+
+
+def test_file_removed_by_another_program(cache, tmp_path):
+    cache.put("a", b"a")
+    cache.put("b", b"b")
+    os.remove(str(tmp_path / "cache" / "a"))
+    cache.memory_entries = 0
+    cache.put("c", b"c")
+    assert cache.get("a") is None
+    assert cache.stats()["disk_entries"] == 2
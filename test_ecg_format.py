@@ -0,0 +1,197 @@
+import io
+
+import numpy as np
+import pytest
+
+import ecg_format
+
+
+def make_samples(count=10000, leads=1):
+    t = np.arange(count) / 360
+    return np.stack([(lead + 1) * np.sin(2 * np.pi * 1.2 * t) ** 63
+                     + 0.3 * np.sin(2 * np.pi * 0.2 * t)
+                     for lead in range(leads)], axis=1)
+
+
+@pytest.mark.parametrize("encoding, size, tolerance", [
+    ["float32", 64 + 10000 * 4, 1e-7],
+    ["int16", 64 + 10000 * 2, 1.3 / 32767],
+    ["int16-delta", None, 1.3 / 32767]
+])
+def test_save_open_recording(tmp_path, encoding, size, tolerance):
+    filename = str(tmp_path / "ecg.ecgb")
+    voltage = make_samples()[:, 0]
+    written = ecg_format.save_recording(filename, voltage, 360,
+                                        start_time=2.5, encoding=encoding,
+                                        block_samples=1000)
+    with ecg_format.open_recording(filename) as recording:
+        samples = recording.samples()
+        assert recording.sampling_frequency == 360
+        assert recording.start_time == 2.5
+        assert recording.units == "mV"
+        assert recording.lead_count == 1
+        assert recording.sample_count == 10000
+        assert recording.encoding == encoding
+        assert recording.time()[[0, -1]].tolist() == [2.5, 2.5 + 9999 / 360]
+    assert samples.shape == (10000, 1)
+    assert samples.dtype == np.float32
+    assert np.abs(samples[:, 0] - voltage).max() < tolerance
+    if size is not None:
+        assert written == size
+    else:
+        assert written < 64 + 10000 * 2
+
+
+def test_samples_float32_are_mapped(tmp_path):
+    filename = str(tmp_path / "ecg.ecgb")
+    ecg_format.save_recording(filename, make_samples(), 360,
+                              encoding="float32")
+    with ecg_format.open_recording(filename) as recording:
+        samples = recording.samples(100, 200)
+    assert isinstance(samples.base, np.ndarray)
+    assert not samples.flags.writeable
+
+
+@pytest.mark.parametrize("encoding", ecg_format.ENCODINGS)
+@pytest.mark.parametrize("start, stop", [
+    [0, None], [999, 1001], [2500, 7300], [9999, None], [5000, 5000]
+])
+def test_samples_slices(tmp_path, encoding, start, stop):
+    filename = str(tmp_path / "ecg.ecgb")
+    ecg_format.save_recording(filename, make_samples(leads=3), 360,
+                              encoding=encoding, block_samples=1000)
+    with ecg_format.open_recording(filename) as recording:
+        expected = recording.samples()[start:stop]
+        assert np.array_equal(recording.samples(start, stop), expected)
+        assert np.array_equal(recording.time(start, stop),
+                              recording.time()[start:stop])
+
+
+@pytest.mark.parametrize("encoding", ecg_format.ENCODINGS)
+def test_open_recording_file_object(tmp_path, encoding):
+    filename = str(tmp_path / "ecg.ecgb")
+    ecg_format.save_recording(filename, make_samples(leads=2), 360,
+                              encoding=encoding, block_samples=1000)
+    with ecg_format.open_recording(filename) as recording:
+        expected = recording.samples(1500, 4200)
+    with open(filename, "rb") as in_file:
+        source = io.BytesIO(in_file.read())
+    with ecg_format.open_recording(source) as recording:
+        assert np.array_equal(recording.samples(1500, 4200), expected)
+    assert source.closed
+
+
+def test_delta_wraps_around(tmp_path):
+    filename = str(tmp_path / "ecg.ecgb")
+    voltage = np.tile([-1.0, 1.0], 100)
+    ecg_format.save_recording(filename, voltage, 360,
+                              encoding="int16-delta")
+    with ecg_format.open_recording(filename) as recording:
+        assert np.array_equal(recording.samples()[:, 0], voltage)
+
+
+@pytest.mark.parametrize("start_time, end_time, expected", [
+    [None, None, (0, 3600)],
+    [1, 2, (360, 721)],
+    [1.001, 1.999, (361, 720)],
+    [-5, 0, (0, 1)],
+    [9.5, 20, (3420, 3600)],
+    [20, 30, (3600, 3600)],
+    [2, 1, (720, 720)],
+    [1e308, None, (3600, 3600)],
+    [-1e308, 1e308, (0, 3600)],
+    [None, -1e308, (0, 0)]
+])
+def test_sample_range(tmp_path, start_time, end_time, expected):
+    filename = str(tmp_path / "ecg.ecgb")
+    ecg_format.save_recording(filename, np.zeros(3600), 360)
+    with ecg_format.open_recording(filename) as recording:
+        assert recording.sample_range(start_time, end_time) == expected
+
+
+def test_time_slice(tmp_path):
+    filename = str(tmp_path / "ecg.ecgb")
+    voltage = make_samples(3600)
+    ecg_format.save_recording(filename, voltage, 360, start_time=10,
+                              encoding="float32")
+    with ecg_format.open_recording(filename) as recording:
+        time, samples = recording.time_slice(11, 12)
+    assert time[[0, -1]].tolist() == [11, 12]
+    assert np.array_equal(samples, voltage[360:721].astype(np.float32))
+
+
+@pytest.mark.parametrize("voltage, kwargs, message", [
+    [[1.0, np.nan], {}, "finite"],
+    [[1.0, 2.0], {"scale": 1e-5}, "int16 range"],
+    [[1.0, 2.0], {"encoding": "int8"}, "Unknown encoding"],
+    [[1.0, 2.0], {"sampling_frequency": 0}, "positive"],
+    [[1.0, 2.0], {"units": "millivolts"}, "8 characters"],
+    [[[[1.0]]], {}, "1D or 2D"]
+])
+def test_save_recording_errors(tmp_path, voltage, kwargs, message):
+    arguments = {"sampling_frequency": 360}
+    arguments.update(kwargs)
+    with pytest.raises(ValueError, match=message):
+        ecg_format.save_recording(str(tmp_path / "ecg.ecgb"), voltage,
+                                  **arguments)
+
+
+@pytest.mark.parametrize("encoding", ecg_format.ENCODINGS)
+def test_open_recording_truncated(tmp_path, encoding):
+    filename = str(tmp_path / "ecg.ecgb")
+    ecg_format.save_recording(filename, make_samples(), 360,
+                              encoding=encoding, block_samples=1000)
+    with open(filename, "rb") as in_file:
+        data = in_file.read()
+    with open(filename, "wb") as out_file:
+        out_file.write(data[:len(data) - 100])
+    with ecg_format.open_recording(filename) as recording:
+        with pytest.raises(ValueError):
+            recording.samples()
+
+
+@pytest.mark.parametrize("data", [b"", b"time,voltage\n0,1\n",
+                                  b"ECGB" + b"\0" * 60])
+def test_open_recording_invalid(tmp_path, data):
+    filename = tmp_path / "ecg.ecgb"
+    filename.write_bytes(data)
+    with pytest.raises(ValueError):
+        ecg_format.open_recording(str(filename))
+
+
+@pytest.mark.parametrize("start_time, end_time", [
+    [float("inf"), None], [None, float("-inf")], [float("nan"), 1]
+])
+def test_sample_range_not_finite(tmp_path, start_time, end_time):
+    filename = str(tmp_path / "ecg.ecgb")
+    ecg_format.save_recording(filename, np.zeros(3600), 360)
+    with ecg_format.open_recording(filename) as recording:
+        with pytest.raises(ValueError, match="not finite"):
+            recording.sample_range(start_time, end_time)
+
+
+@pytest.mark.parametrize("lead_count, sampling_frequency, message", [
+    [0, 360, "no leads"],
+    [1, 0, "Sampling frequency"],
+    [1, -360, "Sampling frequency"],
+    [1, float("nan"), "Sampling frequency"]
+])
+def test_open_recording_invalid_header(tmp_path, lead_count,
+                                       sampling_frequency, message):
+    filename = tmp_path / "ecg.ecgb"
+    header = ecg_format.HEADER.pack(
+        ecg_format.MAGIC, ecg_format.VERSION, 0, lead_count,
+        sampling_frequency, 0.0, 1.0, 0, 0, 0, b"mV")
+    filename.write_bytes(header)
+    with pytest.raises(ValueError, match=message):
+        ecg_format.open_recording(str(filename))
+
+
+def test_is_recording(tmp_path):
+    filename = str(tmp_path / "ecg.ecgb")
+    ecg_format.save_recording(filename, [1.0, 2.0], 360)
+    csv_file = tmp_path / "ecg.csv"
+    csv_file.write_text("0,1\n")
+    assert ecg_format.is_recording(filename)
+    assert not ecg_format.is_recording(str(csv_file))
+    assert not ecg_format.is_recording(str(tmp_path / "missing.ecgb"))
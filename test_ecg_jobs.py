@@ -0,0 +1,134 @@
+import threading
+
+import numpy as np
+import pytest
+
+import ecg_format
+from ecg_jobs import JobQueue, JobWorkers, analyze_job
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "ecg_jobs.sqlite"))
+
+
+def write_recording(filename, seconds=30):
+    t = np.arange(seconds * 360) / 360
+    voltage = np.sin(2 * np.pi * 1.1 * t) ** 63 \
+        + 0.3 * np.sin(2 * np.pi * 0.2 * t)
+    ecg_format.save_recording(filename, voltage, 360)
+
+
+def test_job_queue_lifecycle(queue):
+    first = queue.enqueue(1, "a" * 64)
+    second = queue.enqueue(2, "b" * 64)
+    claimed = queue.claim()
+    queue.finish(claimed["job_id"], {"mean_hr_bpm": 66})
+    queue.fail(queue.claim()["job_id"], "ValueError()")
+    done = queue.get(first)
+    failed = queue.get(second)
+    assert claimed["job_id"] == first
+    assert claimed["state"] == "running"
+    assert done["patient_id"] == 1
+    assert done["recording"] == "a" * 64
+    assert done["state"] == "done"
+    assert done["result"] == {"mean_hr_bpm": 66}
+    assert done["queued_at"] <= done["started_at"] <= done["finished_at"]
+    assert failed["state"] == "failed"
+    assert failed["error"] == "ValueError()"
+    assert queue.claim() is None
+    assert queue.get(3) is None
+    assert queue.counts() == {"held": 0, "queued": 0, "running": 0,
+                              "done": 1, "failed": 1}
+
+
+def test_job_queue_held_jobs(queue):
+    released = queue.enqueue(1, "a" * 64, held=True)
+    discarded = queue.enqueue(2, "b" * 64, held=True)
+    assert queue.claim() is None
+    assert queue.counts()["held"] == 2
+    queue.release([released])
+    queue.discard([discarded])
+    assert queue.get(discarded) is None
+    assert queue.claim()["job_id"] == released
+    # Only held jobs are released or discarded
+    queue.discard([released])
+    assert queue.get(released)["state"] == "running"
+
+
+def test_job_queue_requeue_running(queue, tmp_path):
+    job_id = queue.enqueue(1, "a" * 64)
+    queue.claim()
+    # A new server process opens the same database
+    restarted = JobQueue(str(tmp_path / "ecg_jobs.sqlite"))
+    held = queue.enqueue(2, "b" * 64, held=True)
+    assert restarted.requeue_running() == 1
+    assert restarted.get(held) is None
+    assert restarted.get(job_id)["state"] == "queued"
+    assert restarted.get(job_id)["started_at"] is None
+    assert restarted.claim()["job_id"] == job_id
+
+
+def test_job_queue_claims_once(queue):
+    for i in range(50):
+        queue.enqueue(i, "a" * 64)
+    claimed = []
+
+    def claim_all():
+        while True:
+            job = queue.claim()
+            if job is None:
+                return
+            claimed.append(job["job_id"])
+    threads = [threading.Thread(target=claim_all) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == list(range(1, 51))
+
+
+def test_analyze_job(tmp_path):
+    filename = str(tmp_path / "ecg.ecgb")
+    write_recording(filename)
+    metrics = analyze_job(filename)
+    with open(filename, "rb") as in_file:
+        assert analyze_job(in_file.read()) == metrics
+    assert metrics["num_beats"] == 33
+    assert metrics["duration"] == pytest.approx(30, abs=0.01)
+
+
+def test_job_workers(queue, tmp_path):
+    filename = str(tmp_path / "ecg.ecgb")
+    write_recording(filename)
+    (tmp_path / "bad.ecgb").write_bytes(b"not a recording")
+    recordings = {"good": filename, "bad": str(tmp_path / "bad.ecgb")}
+    results = []
+    done = threading.Event()
+
+    def on_result(job, metrics):
+        results.append((job["patient_id"], metrics["num_beats"]))
+
+    def load_recording(recording_hash):
+        if recording_hash == "missing":
+            raise LookupError("missing")
+        return recordings[recording_hash]
+    good = queue.enqueue(1, "good")
+    bad = queue.enqueue(2, "bad")
+    missing = queue.enqueue(3, "missing")
+    workers = JobWorkers(queue, load_recording, on_result, workers=2)
+    workers.start()
+    workers.notify()
+    for _ in range(300):
+        if queue.counts()["queued"] + queue.counts()["running"] == 0:
+            done.set()
+            break
+        done.wait(0.1)
+    workers.stop()
+    assert done.is_set()
+    assert results == [(1, 33)]
+    assert queue.get(good)["state"] == "done"
+    assert queue.get(good)["result"]["num_beats"] == 33
+    assert queue.get(bad)["state"] == "failed"
+    assert "ValueError" in queue.get(bad)["error"]
+    assert queue.get(missing)["error"] == "LookupError('missing')"
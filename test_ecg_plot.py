@@ -0,0 +1,86 @@
+import io
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+from PIL import Image
+import pytest
+
+from ecg_plot import (PLOT_SIZE, minmax_envelope, render_ecg,
+                      render_ecg_image, thumbnail)
+
+
+def make_signal(seconds=60, sampling_frequency=360):
+    t = np.arange(seconds * sampling_frequency) / sampling_frequency
+    v = np.sin(2 * np.pi * 1.2 * t) ** 63 + 0.3 * np.sin(2 * np.pi * 0.2 * t)
+    return t, v
+
+
+def test_minmax_envelope_short_signal():
+    t, v = make_signal(1)
+    time, voltage = minmax_envelope(list(t), list(v), 500)
+    assert np.array_equal(time, t)
+    assert np.array_equal(voltage, v)
+
+
+@pytest.mark.parametrize("count", [403, 1003, 21600, 100000])
+def test_minmax_envelope(count):
+    t = np.arange(count) / 360.0
+    v = np.sin(t)
+    # A one-sample spike in the middle of a column
+    v[count // 2] = 5
+    v[count // 3] = -5
+    time, voltage = minmax_envelope(t, v, 200)
+    assert len(time) == len(voltage) <= 402
+    assert np.all(np.diff(time) >= 0)
+    assert time[[0, -1]].tolist() == [t[0], t[-1]]
+    assert voltage.max() == 5
+    assert voltage.min() == -5
+    assert np.isin(time, t).all()
+
+
+def test_minmax_envelope_keeps_column_extremes():
+    t, v = make_signal()
+    time, voltage = minmax_envelope(t, v, 100)
+    columns = v.reshape(100, 216)
+    pairs = np.sort(np.stack([voltage[1:-1:2], voltage[2:-1:2]]), axis=0)
+    assert np.array_equal(pairs[0], columns.min(axis=1))
+    assert np.array_equal(pairs[1], columns.max(axis=1))
+
+
+def render_all_samples(t, v):
+    figure = Figure(figsize=(6.4, 4.8), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.plot(t, v)
+    axes.set_xlabel('Time (s)')
+    axes.set_ylabel('Voltage (mV)')
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[:, :, :3]
+
+
+@pytest.mark.parametrize("seconds", [10, 60, 600])
+def test_render_ecg_image_matches_all_samples(seconds):
+    t, v = make_signal(seconds)
+    image = np.asarray(render_ecg_image(t, v))
+    expected = render_all_samples(t, v)
+    assert image.shape == expected.shape == (480, 640, 3)
+    difference = np.abs(image.astype(int) - expected)
+    assert (difference.max(axis=2) > 64).mean() < 0.001
+
+
+def test_render_ecg_reuses_figure():
+    t, v = make_signal(10)
+    first = render_ecg(t, v)
+    render_ecg(t, -v)
+    assert render_ecg(t, v) == first
+    image = Image.open(io.BytesIO(first))
+    assert image.format == "JPEG"
+    assert image.size == PLOT_SIZE
+
+
+def test_thumbnail():
+    t, v = make_signal(10)
+    image = thumbnail(render_ecg(t, v))
+    assert image.size == (200, 150)
+    assert image.mode == "RGB"
@@ -1,4 +1,6 @@
 import pytest
+import json
+import os
 
 
 def test_convert_b64_string_to_file():
@@ -18,3 +20,409 @@ def test_convert_file_to_b64_string():
     from gui_client import convert_file_to_b64_string
     b64str = convert_file_to_b64_string("test_image.jpg")
     assert b64str[0:20] == "/9j/4AAQSkZJRgABAQEA"
+
+
+@pytest.mark.parametrize("changes, expected", [
+    [{"Name": "Phil", "Rec_No": 1, "Revision": 5, "Since": 4,
+      "Med_Img": [], "ECG": ["ECG 3"], "Heart_Rate": [80],
+      "Timestamp": ["t3"]},
+     {"Name": "Phil", "Rec_No": 1, "Revision": 5, "Med_Img": [],
+      "ECG": ["ECG 1", "ECG 2", "ECG 3"], "Heart_Rate": [60, 70, 80],
+      "Timestamp": ["t1", "t2", "t3"]}],
+    [{"Name": "Diana", "Rec_No": 1, "Revision": 1, "Med_Img": [],
+      "ECG": [], "Heart_Rate": [], "Timestamp": []},
+     {"Name": "Diana", "Rec_No": 1, "Revision": 1, "Med_Img": [],
+      "ECG": [], "Heart_Rate": [], "Timestamp": []}]
+])
+def test_merge_patient_changes(changes, expected):
+    from gui_client import merge_patient_changes
+    patient = {"Name": "Phil", "Rec_No": 1, "Revision": 4, "Med_Img": [],
+               "ECG": ["ECG 1", "ECG 2"], "Heart_Rate": [60, 70],
+               "Timestamp": ["t1", "t2"]}
+    answer = merge_patient_changes(patient, changes)
+    assert answer == expected
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", etag=None):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+        self.headers = {}
+        if etag is not None:
+            self.headers["ETag"] = etag
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        import requests
+        if self.status_code >= 400:
+            raise requests.HTTPError(response=self)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import gui_client
+    client = gui_client.ServerClient("")
+    monkeypatch.setattr(gui_client, "client", client)
+    return client
+
+
+def test_get_with_validators(client, monkeypatch):
+    import gui_client
+    sent_headers = []
+    responses = [FakeResponse(200, b'{"ids": [1]}', '"abc"'),
+                 FakeResponse(304)]
+
+    def fake_get(url, headers, timeout):
+        sent_headers.append(headers)
+        return responses.pop(0)
+    monkeypatch.setattr(client.session, "get", fake_get)
+    monkeypatch.setattr(gui_client, "response_cache",
+                        gui_client.ResponseCache())
+    gui_client.reset_cache_stats()
+    first = gui_client.get_with_validators("/ids")
+    second = gui_client.get_with_validators("/ids")
+    assert sent_headers == [{}, {"If-None-Match": '"abc"'}]
+    assert first.text == second.text == '{"ids": [1]}'
+    assert gui_client.cache_stats == {"hits": 1, "misses": 1,
+                                      "bytes_saved": 12}
+
+
+def test_response_cache_bytes():
+    import gui_client
+    cache = gui_client.ResponseCache(max_bytes=10)
+    cache.put("/a", FakeResponse(200, b"aaaa"))
+    cache.put("/b", FakeResponse(200, b"bbbb"))
+    cache.get("/a")
+    cache.put("/c", FakeResponse(200, b"cccc"))
+    cache.put("/large", FakeResponse(200, b"x" * 11))
+    assert "/a" in cache and "/c" in cache
+    assert "/b" not in cache and "/large" not in cache
+    assert cache.size == 8
+    cache.put("/a", FakeResponse(200, b"a"))
+    assert (len(cache), cache.size) == (2, 5)
+
+
+def test_retrieve_image_from_server(client, monkeypatch):
+    import gui_client
+    monkeypatch.setattr(client.session, "get",
+                        lambda url, timeout: FakeResponse(200, b"jpeg", '"h"'))
+    monkeypatch.setattr(gui_client, "response_cache",
+                        gui_client.ResponseCache())
+    assert gui_client.retrieve_image_from_server("h") == b"jpeg"
+    assert len(gui_client.response_cache) == 0
+
+
+def test_retrieve_all_patients(monkeypatch):
+    import gui_client
+    pages = {"/get_all_patient_id?limit=2":
+             FakeResponse(200, b'{"ids": [1, 2], "next": 2}'),
+             "/get_all_patient_id?limit=2&after=2":
+             FakeResponse(200, b'{"ids": [3], "next": null}')}
+    monkeypatch.setattr(gui_client, "PATIENT_ID_PAGE_SIZE", 2)
+    monkeypatch.setattr(gui_client, "get_with_validators", pages.get)
+    answer = gui_client.retrieve_all_patients()
+    assert json.loads(answer) == {"ids": [1, 2, 3]}
+
+
+def test_retrieve_patient_summaries(monkeypatch):
+    import gui_client
+    pages = {"/get_patient_summaries?ids=1,2&fields=Heart_Rate":
+             FakeResponse(200, b'{"patients": [{"Rec_No": 1}], '
+                               b'"missing": [2]}'),
+             "/get_patient_summaries?ids=3&fields=Heart_Rate":
+             FakeResponse(200, b'{"patients": [{"Rec_No": 3}], '
+                               b'"missing": []}')}
+    monkeypatch.setattr(gui_client, "SUMMARY_BATCH_SIZE", 2)
+    monkeypatch.setattr(gui_client, "get_with_validators", pages.get)
+    answer = gui_client.retrieve_patient_summaries([1, 2, 3], ["Heart_Rate"])
+    assert json.loads(answer) == {"patients": [{"Rec_No": 1},
+                                               {"Rec_No": 3}],
+                                  "missing": [2]}
+
+
+def test_retrieve_heart_rate(monkeypatch):
+    import datetime
+    import gui_client
+    paths = []
+
+    def fake_get_with_validators(path):
+        paths.append(path)
+        return FakeResponse(200, b'{"buckets": []}')
+    monkeypatch.setattr(gui_client, "get_with_validators",
+                        fake_get_with_validators)
+    gui_client.retrieve_heart_rate(12)
+    answer = gui_client.retrieve_heart_rate(
+        12, datetime.datetime(2022, 4, 13, 15), bucket="5m")
+    assert json.loads(answer) == {"buckets": []}
+    assert paths == ["/heart_rate/12",
+                     "/heart_rate/12?start=2022-04-13T15%3A00%3A00&bucket=5m"]
+
+
+def test_upload_patient_data_to_server(client, monkeypatch):
+    import gui_client
+    posts = []
+
+    def fake_post(url, json=None, data=None, headers=None, timeout=None):
+        if data is not None:
+            posts.append((url, data.read()))
+            return FakeResponse(200, b'{"hash": "abc", "size": 10}')
+        posts.append((url, json))
+        return FakeResponse(200, b'"uploaded"')
+    monkeypatch.setattr(client.session, "post", fake_post)
+    patient_info = {"Rec_No": "1", "ECG": "test_image.jpg"}
+    answer = gui_client.upload_patient_data_to_server(patient_info)
+    with open("test_image.jpg", "rb") as image_file:
+        image_bytes = image_file.read()
+    assert posts == [("/image", image_bytes),
+                     ("/new_patient", {"Rec_No": "1",
+                                       "ECG": {"hash": "abc"}})]
+    assert patient_info["ECG"] == "test_image.jpg"
+    assert answer == '"uploaded"'
+
+
+def test_upload_patient_data_to_server_ecg_recording(tmp_path, client,
+                                                     monkeypatch):
+    import gui_client
+    posts = []
+    recording_file = tmp_path / "ecg.ecgb"
+    recording_file.write_bytes(b"ECGB samples")
+
+    def fake_post(url, json=None, data=None, headers=None, timeout=None):
+        if data is not None:
+            posts.append((url, data.read()))
+            return FakeResponse(200, '{{"hash": "hash{}"}}'.format(
+                len(posts)).encode())
+        posts.append((url, json))
+        return FakeResponse(200, b'"uploaded"')
+    monkeypatch.setattr(client.session, "post", fake_post)
+    patient_info = {"Rec_No": "1", "ECG": "test_image.jpg",
+                    "ECG_Data": str(recording_file)}
+    gui_client.upload_patient_data_to_server(patient_info)
+    assert posts[1] == ("/image", b"ECGB samples")
+    assert posts[2] == ("/new_patient",
+                        {"Rec_No": "1",
+                         "ECG": {"hash": "hash1",
+                                 "recording": {"hash": "hash2"}}})
+
+
+class FakeUploadServer:
+    def __init__(self, fail_at_put):
+        self.received = b""
+        self.offsets = []
+        self.posts = []
+        self.fail_at_put = fail_at_put
+
+    def get(self, url, timeout):
+        return FakeResponse(200, json.dumps(
+            {"offset": len(self.received)}).encode())
+
+    def put(self, url, params, data, headers, timeout):
+        import requests
+        self.offsets.append(params["offset"])
+        if len(self.offsets) == self.fail_at_put:
+            raise requests.ConnectionError()
+        self.received += data
+        return FakeResponse(200, json.dumps(
+            {"offset": len(self.received)}).encode())
+
+    def post(self, url, json=None, timeout=None):
+        if url == "/upload":
+            return FakeResponse(200, b'{"upload_id": "abc", "offset": 0}')
+        if url == "/upload/abc/finish":
+            return FakeResponse(200, b'{"hash": "123", "size": 11}')
+        self.posts.append(json)
+        return FakeResponse(200, b'"uploaded"')
+
+
+def test_upload_queue_resumes(tmp_path, client, monkeypatch):
+    import gui_client
+    fake_server = FakeUploadServer(fail_at_put=2)
+    for method in ["get", "put", "post"]:
+        monkeypatch.setattr(client.session, method,
+                            getattr(fake_server, method))
+    monkeypatch.setattr(gui_client, "UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(gui_client, "RETRY_BASE_DELAY", 0)
+    image_file = tmp_path / "image.jpg"
+    image_file.write_bytes(b"image bytes")
+    results = []
+    upload_queue = gui_client.UploadQueue(
+        str(tmp_path / "queue"),
+        on_result=lambda job_id, message: results.append(message))
+    upload_queue.add({"Rec_No": "1", "ECG": str(image_file)})
+    image_file.unlink()
+    upload_queue.drain()
+    pending = upload_queue.pending()
+    # A new queue on the same directory continues where the first stopped
+    upload_queue = gui_client.UploadQueue(
+        str(tmp_path / "queue"),
+        on_result=lambda job_id, message: results.append(message))
+    answer = upload_queue.drain()
+    assert pending == 1
+    assert fake_server.offsets == [0, 4, 4, 8]
+    assert fake_server.received == b"image bytes"
+    assert fake_server.posts == [{"Rec_No": "1", "ECG": {"hash": "123"}}]
+    assert results[-1] == '"uploaded"'
+    assert answer is None
+    assert upload_queue.pending() == 0
+    assert sorted(os.listdir(str(tmp_path / "queue"))) == ["queue.sqlite"]
+
+
+def test_upload_queue_drops_refused_upload(tmp_path, client, monkeypatch):
+    import gui_client
+    fake_server = FakeUploadServer(fail_at_put=None)
+    refused = []
+
+    def post(url, json=None, timeout=None):
+        if url == "/upload/abc/finish" and not refused:
+            refused.append(url)
+            return FakeResponse(400, b"No image was uploaded")
+        return fake_server.post(url, json, timeout)
+    monkeypatch.setattr(client.session, "get", fake_server.get)
+    monkeypatch.setattr(client.session, "put", fake_server.put)
+    monkeypatch.setattr(client.session, "post", post)
+    image_file = tmp_path / "image.jpg"
+    image_file.write_bytes(b"image bytes")
+    results = []
+    upload_queue = gui_client.UploadQueue(
+        str(tmp_path / "queue"),
+        on_result=lambda job_id, message: results.append(message))
+    upload_queue.add({"Rec_No": "1", "ECG": str(image_file)})
+    upload_queue.add({"Rec_No": "2"})
+    answer = upload_queue.drain()
+    assert results == ["Upload failed: 400 No image was uploaded",
+                       '"uploaded"']
+    assert fake_server.posts == [{"Rec_No": "2"}]
+    assert answer is None
+    assert upload_queue.pending() == 0
+
+
+def test_upload_queue_rejects_empty_file(tmp_path):
+    import gui_client
+    image_file = tmp_path / "image.jpg"
+    image_file.write_bytes(b"")
+    upload_queue = gui_client.UploadQueue(str(tmp_path / "queue"))
+    with pytest.raises(ValueError, match="is empty"):
+        upload_queue.add({"Rec_No": "1", "ECG": str(image_file)})
+    assert upload_queue.pending() == 0
+
+
+@pytest.mark.parametrize("status_code, expected", [
+    [400, True], [413, True], [404, False], [409, False], [503, False]
+])
+def test_is_permanent_error(status_code, expected):
+    from gui_client import is_permanent_error
+    assert is_permanent_error(FakeResponse(status_code)) is expected
+
+
+class FakeStream:
+    status_code = 200
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def raise_for_status(self):
+        return
+
+    def iter_lines(self, decode_unicode):
+        return iter(self.lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def test_listen_to_patient_events(client, monkeypatch):
+    import gui_client
+    lines = [": connected", "", 'data: {"Rec_No": 1, "Revision": 2}', "",
+             ": keep-alive", "", 'data: {"Rec_No": 3, "Revision": 1}', ""]
+    monkeypatch.setattr(client.session, "get",
+                        lambda url, stream, timeout: FakeStream(lines))
+    events = []
+    connected = []
+    gui_client.listen_to_patient_events(events.append,
+                                        lambda: connected.append(True))
+    assert connected == [True]
+    assert events == [{"Rec_No": 1, "Revision": 2},
+                      {"Rec_No": 3, "Revision": 1}]
+
+
+def test_server_client_retries_get(monkeypatch):
+    import requests
+    import gui_client
+    monkeypatch.setattr(gui_client, "GET_RETRY_BASE_DELAY", 0)
+    client = gui_client.ServerClient("http://server/", pool_size=2)
+    sent = []
+    responses = [requests.ConnectionError(), FakeResponse(503),
+                 FakeResponse(200, b'"ok"')]
+
+    def fake_get(url, **kwargs):
+        sent.append((url, kwargs))
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        response.close = lambda: None
+        return response
+    monkeypatch.setattr(client.session, "get", fake_get)
+    assert client.get("/ids", params={"a": 1}).text == '"ok"'
+    assert sent == [("http://server/ids",
+                     {"params": {"a": 1},
+                      "timeout": gui_client.REQUEST_TIMEOUT})] * 3
+    assert client.session.headers["Accept-Encoding"] == "gzip, deflate"
+    assert client.session.get_adapter("http://server")._pool_maxsize == 2
+
+
+@pytest.mark.parametrize("retries, responses, expected", [
+    [2, ["error", "error", "error"], "error"],
+    [1, [503, 503], 503],
+    [0, ["error"], "error"],
+    [0, [504], 504]
+])
+def test_server_client_gives_up(monkeypatch, retries, responses, expected):
+    import requests
+    import gui_client
+    monkeypatch.setattr(gui_client, "GET_RETRY_BASE_DELAY", 0)
+    client = gui_client.ServerClient("", get_retries=retries)
+
+    def fake_get(url, **kwargs):
+        response = responses.pop(0)
+        if response == "error":
+            raise requests.Timeout()
+        fake_response = FakeResponse(response)
+        fake_response.close = lambda: None
+        return fake_response
+    monkeypatch.setattr(client.session, "get", fake_get)
+    if expected == "error":
+        with pytest.raises(requests.Timeout):
+            client.get("/ids")
+    else:
+        assert client.get("/ids").status_code == expected
+    assert responses == []
+
+
+def test_server_client_does_not_retry_post(monkeypatch):
+    import requests
+    import gui_client
+    client = gui_client.ServerClient("")
+    posts = []
+
+    def fake_post(url, **kwargs):
+        posts.append(kwargs)
+        raise requests.ConnectionError()
+    monkeypatch.setattr(client.session, "post", fake_post)
+    with pytest.raises(requests.ConnectionError):
+        client.post("/new_patient", json={}, timeout=3)
+    assert posts == [{"json": {}, "timeout": 3}]
+
+
+def test_configure(monkeypatch):
+    import gui_client
+    monkeypatch.setattr(gui_client, "client", gui_client.client)
+    client = gui_client.configure("http://localhost:5000/", pool_size=3)
+    assert gui_client.client is client
+    assert client.url == "http://localhost:5000"
+    assert client.session.get_adapter(client.url)._pool_maxsize == 3
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from gui_io import IOExecutor
+
+
+@pytest.fixture
+def executor():
+    executor = IOExecutor(workers=2)
+    yield executor
+    executor.shutdown()
+
+
+def poll_until(executor, condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        executor.poll()
+        time.sleep(0.005)
+
+
+def test_submit_runs_callbacks_on_polling_thread(executor):
+    threads = []
+    results = []
+
+    def work(x):
+        threads.append(threading.current_thread())
+        return x * 2
+
+    def on_done(result):
+        threads.append(threading.current_thread())
+        results.append(result)
+    executor.submit(work, 21, on_done=on_done)
+    time.sleep(0.05)
+    # Nothing runs on this thread until it polls
+    assert results == []
+    poll_until(executor, lambda: results)
+    assert results == [42]
+    assert threads[0] is not threading.current_thread()
+    assert threads[1] is threading.current_thread()
+
+
+def test_submit_errors(executor, caplog):
+    errors = []
+
+    def fail():
+        raise ValueError("server down")
+    executor.submit(fail, on_error=errors.append)
+    executor.submit(fail)
+    with caplog.at_level(logging.ERROR):
+        poll_until(executor, lambda: errors and caplog.records)
+    assert repr(errors[0]) == "ValueError('server down')"
+    assert "server down" in caplog.records[0].getMessage()
+
+
+def test_newer_task_supersedes_running_task(executor):
+    release = threading.Event()
+    shown = []
+    executor.submit(lambda: release.wait(5) and "old",
+                    on_done=shown.append, key="patient")
+    executor.submit(lambda: "new", on_done=shown.append, key="patient")
+    poll_until(executor, lambda: shown)
+    release.set()
+    time.sleep(0.05)
+    executor.poll()
+    assert shown == ["new"]
+
+
+def test_superseded_task_does_not_run():
+    executor = IOExecutor(workers=1)
+    release = threading.Event()
+    ran = []
+    executor.submit(release.wait, 5)
+    executor.submit(ran.append, "first", key="image")
+    executor.submit(ran.append, "second", key="image")
+    release.set()
+    poll_until(executor, lambda: ran)
+    executor.shutdown()
+    assert ran == ["second"]
+
+
+def test_cancel(executor):
+    release = threading.Event()
+    shown = []
+    executor.submit(lambda: release.wait(5), on_done=shown.append,
+                    key="image")
+    executor.cancel("image")
+    executor.cancel("missing")
+    release.set()
+    time.sleep(0.05)
+    executor.poll()
+    assert shown == []
+
+
+def test_post_and_attach(executor):
+    class Root:
+        def __init__(self):
+            self.scheduled = []
+
+        def after(self, interval, callback):
+            self.scheduled.append((interval, callback))
+    root = Root()
+    shown = []
+    executor.attach(root, interval=20)
+    thread = threading.Thread(target=executor.post,
+                              args=(shown.append, "uploaded"))
+    thread.start()
+    thread.join()
+    interval, callback = root.scheduled.pop()
+    callback()
+    assert interval == 20
+    assert shown == ["uploaded"]
+    # Polling goes on
+    assert root.scheduled[0][0] == 20
+
+
+def test_same_request_is_coalesced(executor):
+    release = threading.Event()
+    calls = []
+    shown = []
+
+    def retrieve(patient_id):
+        calls.append(patient_id)
+        release.wait(5)
+        return patient_id
+    first = executor.submit(retrieve, "1", on_done=shown.append,
+                            key="patient")
+    assert executor.submit(retrieve, "1", on_done=shown.append,
+                           key="patient") is first
+    release.set()
+    poll_until(executor, lambda: shown)
+    # Once the first request is done, the next one is sent
+    executor.submit(retrieve, "1", on_done=shown.append, key="patient")
+    poll_until(executor, lambda: len(shown) == 2)
+    assert calls == ["1", "1"]
+    assert shown == ["1", "1"]
@@ -1,12 +1,88 @@
 import pytest
 
 
-def test_get_selected_ecg_64():
-    from monitoring_gui import get_selected_ecg_64
-    patient = {"Timestamp": ["2019-10-27 12:12:12",
-                             "2018-10-12 12:12:12"],
-               "ECG": ["ECG 1", "ECG 2"]}
-    ecg_of_interest_timestamp = "2019-10-27 12:12:12"
-    answer = get_selected_ecg_64(ecg_of_interest_timestamp, patient)
-    expected = "ECG 1"
+@pytest.mark.parametrize("latest, expected", [
+    [{"Rec_No": 1, "Revision": 4}, True],
+    [{"Rec_No": 1, "Revision": 5}, False],
+    [{"Rec_No": 2, "Revision": 4}, False]
+])
+def test_patient_is_current(latest, expected):
+    from monitoring_gui import patient_is_current
+    patient = {"Rec_No": 1, "Name": "Phil", "Heart_Rate": [60, 70],
+               "Revision": 4}
+    answer = patient_is_current(latest, patient)
     assert answer == expected
+
+
+@pytest.mark.parametrize("event, patient_ID, expected", [
+    [{"Rec_No": 12, "Revision": 3}, "12", True],
+    [{"Rec_No": 12, "Revision": 3}, "13", False],
+    [{"Rec_No": 12, "Revision": 3}, "", False]
+])
+def test_is_event_for_patient(event, patient_ID, expected):
+    from monitoring_gui import is_event_for_patient
+    assert is_event_for_patient(event, patient_ID) == expected
+
+
+def make_jpeg(color, size=(1600, 1200)):
+    import io
+    from PIL import Image
+    output = io.BytesIO()
+    Image.new("RGB", size, color).save(output, format="JPEG")
+    return output.getvalue()
+
+
+def test_thumbnail_cache():
+    from monitoring_gui import ThumbnailCache
+    from ecg_plot import thumbnail
+    images = {"a": make_jpeg("red"), "b": make_jpeg("blue"),
+              "c": make_jpeg("green")}
+    decodes = []
+
+    def show(image_ref):
+        # As show_image does: decode only the images that are not cached
+        cached = cache.cached(image_ref)
+        if cached is not None:
+            return cached
+        decodes.append(image_ref["hash"])
+        image = thumbnail(images[image_ref["hash"]])
+        cache.add(image_ref, image)
+        return image
+    cache = ThumbnailCache(size=2)
+    first = show({"hash": "a", "size": 10})
+    # Refreshes of an unchanged patient decode nothing
+    for _ in range(5):
+        assert show({"hash": "a"}) is first
+    show({"hash": "b"})
+    show({"hash": "a"})
+    show({"hash": "c"})
+    assert first.size == (200, 150)
+    assert first.getpixel((100, 75))[0] > 200
+    assert decodes == ["a", "b", "c"]
+    assert cache.stats == {"hits": 6, "misses": 3}
+    assert list(cache.thumbnails) == ["a", "c"]
+    assert cache.cached({"hash": "b"}) is None
+
+
+@pytest.mark.parametrize("summary, expected", [
+    [{"Rec_No": 12, "Name": "Phil", "Heart_Rate": [60, 72],
+      "Timestamp": ["t1", "t2"]}, ("12 Phil", "72 bpm at t2")],
+    [{"Rec_No": 12, "Name": None, "Heart_Rate": [72], "Timestamp": []},
+     ("12", "72 bpm")],
+    [{"Rec_No": 12, "Name": "", "Heart_Rate": [], "Timestamp": []},
+     ("12", "No heart rate")]
+])
+def test_make_tile_text(summary, expected):
+    from monitoring_gui import make_tile_text
+    assert make_tile_text(summary) == expected
+
+
+def test_select_changed_summaries():
+    from monitoring_gui import select_changed_summaries
+    shown_revisions = {1: 4, 2: 1}
+    summaries = [{"Rec_No": 1, "Revision": 4}, {"Rec_No": 2, "Revision": 2},
+                 {"Rec_No": 3, "Revision": 1}]
+    changed = select_changed_summaries(summaries, shown_revisions)
+    assert changed == summaries[1:]
+    assert shown_revisions == {1: 4, 2: 2, 3: 1}
+    assert select_changed_summaries(summaries, shown_revisions) == []
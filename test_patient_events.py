@@ -0,0 +1,43 @@
+import pytest
+
+
+def test_publish_to_subscribers():
+    from patient_events import EventBroadcaster
+    events = EventBroadcaster()
+    first = events.subscribe()
+    second = events.subscribe()
+    events.publish({"Rec_No": 1, "Revision": 2})
+    assert first.get_nowait() == {"Rec_No": 1, "Revision": 2}
+    assert second.get_nowait() == {"Rec_No": 1, "Revision": 2}
+
+
+def test_publish_skips_full_subscriber():
+    from patient_events import EventBroadcaster, SUBSCRIBER_QUEUE_SIZE
+    events = EventBroadcaster()
+    slow = events.subscribe()
+    for revision in range(SUBSCRIBER_QUEUE_SIZE + 1):
+        events.publish({"Rec_No": 1, "Revision": revision})
+    assert slow.qsize() == SUBSCRIBER_QUEUE_SIZE
+
+
+def test_stream():
+    from patient_events import EventBroadcaster
+    events = EventBroadcaster()
+    stream = events.stream(heartbeat=0.01)
+    assert next(stream) == ": connected\n\n"
+    assert events.subscriber_count() == 1
+    assert next(stream) == ": keep-alive\n\n"
+    events.publish({"Rec_No": 1, "Revision": 2})
+    assert next(stream) == 'data: {"Rec_No": 1, "Revision": 2}\n\n'
+    stream.close()
+    assert events.subscriber_count() == 0
+
+
+@pytest.mark.parametrize("line, expected", [
+    ['data: {"Rec_No": 1, "Revision": 2}', {"Rec_No": 1, "Revision": 2}],
+    [": keep-alive", None],
+    ["", None]
+])
+def test_parse_event_line(line, expected):
+    from patient_events import parse_event_line
+    assert parse_event_line(line) == expected
@@ -8,7 +8,7 @@ import pytest
     ["", "1992", True, True, "N/A", ["Rec_No"]],
     ["philjae", "122", True, False, "med.jpg", ["Rec_No", "Name", "Med_Img"]],
     ["Diana", "1234", False, True, "N/A",
-        ["Rec_No", "Name", "ECG", "Heart_Rate"]]
+        ["Rec_No", "Name", "ECG", "ECG_Data", "Heart_Rate"]]
 ])
 def test_create_info_dict(entered_name, entered_id,
                           ecg_is_uploaded, med_img_is_uploaded,
@@ -0,0 +1,228 @@
+import pytest
+import threading
+import mongomock
+
+
+@pytest.fixture(params=["memory", "sqlite", "mongo"])
+def store(request, tmp_path):
+    from record_store import MongoPatientStore, MemoryPatientStore
+    from record_store import SQLitePatientStore
+    if request.param == "memory":
+        return MemoryPatientStore()
+    if request.param == "sqlite":
+        return SQLitePatientStore(str(tmp_path / "patients.sqlite"))
+    return MongoPatientStore(mongomock.MongoClient().db.patient)
+
+
+def test_update_patient_creates_patient(store):
+    revision = store.update_patient(1, "Phil", {"heartrate": [72]},
+                                    {"Name": "Phil", "Heart_Rate": [72]})
+    assert revision == 1
+    assert store.get_patient(1) == {"_id": 1, "patient_name": "Phil",
+                                    "medical_images": [], "ecg_images": [],
+                                    "heartrate": [72], "timestamp": [],
+                                    "ecg_metrics": [], "revision": 1}
+
+
+def test_update_patient_appends_entries(store):
+    store.update_patient(1, "Phil", {"heartrate": [72]}, {})
+    revision = store.update_patient(1, None, {"heartrate": [80, 90],
+                                              "timestamp": ["t1", "t2"]}, {})
+    patient = store.get_patient(1)
+    assert revision == 2
+    assert patient["patient_name"] == "Phil"
+    assert patient["heartrate"] == [72, 80, 90]
+    assert patient["timestamp"] == ["t1", "t2"]
+
+
+def test_update_patient_without_create(store):
+    assert store.update_patient(1, None, {"heartrate": [72]}, {},
+                                create=False) is None
+    assert store.get_patient(1) is None
+    store.update_patient(1, "Phil", {}, {})
+    assert store.update_patient(1, None, {"heartrate": [72]}, {},
+                                create=False) == 2
+    assert store.get_patient(1)["heartrate"] == [72]
+
+
+def test_update_patient_keeps_image_references(store):
+    image = {"hash": "0" * 64, "size": 3, "timestamp": "t1"}
+    store.update_patient(1, None, {"ecg_images": [image]}, {})
+    assert store.get_patient(1)["ecg_images"] == [image]
+
+
+@pytest.mark.parametrize("fields, last, expected", [
+    [["patient_name", "heartrate"], None,
+     {"patient_name": "Phil", "heartrate": [1, 2, 3]}],
+    [["_id", "heartrate"], 2, {"_id": 1, "heartrate": [2, 3]}],
+    [["revision"], 1, {"revision": 3}]
+])
+def test_get_patient_fields(store, fields, last, expected):
+    for heartrate in [1, 2, 3]:
+        store.update_patient(1, "Phil", {"heartrate": [heartrate]}, {})
+    assert store.get_patient(1, fields, last) == expected
+
+
+@pytest.mark.parametrize("fields, last, expected", [
+    [None, None, {1: {"_id": 1, "patient_name": "Phil",
+                      "medical_images": [], "ecg_images": [],
+                      "heartrate": [1, 2], "timestamp": [],
+                      "ecg_metrics": [], "revision": 2},
+                  3: {"_id": 3, "patient_name": None,
+                      "medical_images": [], "ecg_images": [],
+                      "heartrate": [3], "timestamp": [],
+                      "ecg_metrics": [], "revision": 1}}],
+    [["patient_name", "heartrate"], 1,
+     {1: {"patient_name": "Phil", "heartrate": [2]},
+      3: {"patient_name": None, "heartrate": [3]}}]
+])
+def test_get_patients(store, fields, last, expected):
+    store.update_patient(1, "Phil", {"heartrate": [1]}, {})
+    store.update_patient(1, None, {"heartrate": [2]}, {})
+    store.update_patient(3, None, {"heartrate": [3]}, {})
+    store.update_patient(4, None, {"heartrate": [4]}, {})
+    assert store.get_patients([3, 2, 1], fields, last) == expected
+    assert store.get_patients([]) == {}
+
+
+def test_heart_rate_buckets(store):
+    from datetime import datetime, timedelta
+    start = datetime(2022, 4, 13, 15, 0, 0)
+    store.update_patient(1, None, {"heartrate": [60, 62]}, {},
+                         [(start, 60.0), (start, 62.0)])
+    store.update_patient(1, None, {"heartrate": [90]}, {},
+                         [(start + timedelta(minutes=10), 90.0)])
+    store.update_patient(2, None, {"heartrate": [50]}, {},
+                         [(start + timedelta(minutes=1), 50.0)])
+    # Measurements older than the series, added afterwards
+    store.add_heart_rates(1, [(start - timedelta(minutes=1), 70.0),
+                              (start + timedelta(minutes=4), 80.0)])
+    assert store.count_heart_rates(1) == 5
+    assert store.count_heart_rates(3) == 0
+    buckets = store.get_heart_rate_buckets(1, start,
+                                           start + timedelta(minutes=10),
+                                           300)
+    assert buckets == [{"bucket": 0, "min": 60.0, "mean": 202 / 3,
+                        "max": 80.0, "count": 3}]
+    buckets = store.get_heart_rate_buckets(
+        1, start - timedelta(minutes=5), start + timedelta(hours=1), 300)
+    assert [(bucket["bucket"], bucket["count"]) for bucket in buckets] == \
+        [(0, 1), (1, 3), (3, 1)]
+    assert buckets[2]["mean"] == 90.0
+    assert store.get_heart_rate_buckets(3, start, start + timedelta(1),
+                                        60) == []
+    store.delete_patient(1)
+    assert store.count_heart_rates(1) == 0
+
+
+def test_get_patient_not_found(store):
+    assert store.get_patient(1) is None
+
+
+def test_get_changes(store):
+    for heartrate in [1, 2, 3]:
+        store.update_patient(1, "Phil", {"heartrate": [heartrate]},
+                             {"Heart_Rate": [heartrate]})
+    assert store.get_changes(1, 1) == {"patient_name": "Phil",
+                                       "revision": 3,
+                                       "changes": [{"Heart_Rate": [2]},
+                                                   {"Heart_Rate": [3]}]}
+    assert store.get_changes(1, 3)["changes"] == []
+    assert store.get_changes(2, 0) is None
+
+
+def test_list_patient_ids(store):
+    for patient_id in [30, 10, 20]:
+        store.update_patient(patient_id, None, {}, {})
+    assert store.list_patient_ids() == [10, 20, 30]
+
+
+def test_delete_patient(store):
+    store.update_patient(1, None, {}, {})
+    store.delete_patient(1)
+    assert store.get_patient(1) is None
+    assert store.list_patient_ids() == []
+
+
+def test_find_and_replace_inline_images(store):
+    image = {"hash": "0" * 64, "size": 3, "timestamp": "t1"}
+    store.update_patient(1, None, {"ecg_images": ["aGk="],
+                                   "medical_images": [image]}, {})
+    store.update_patient(2, None, {"ecg_images": [image]}, {})
+    patients = list(store.find_inline_images())
+    assert [patient["_id"] for patient in patients] == [1]
+    assert patients[0]["ecg_images"] == ["aGk="]
+    store.replace_images(1, [image], [image])
+    assert list(store.find_inline_images()) == []
+    assert store.get_patient(1)["ecg_images"] == [image]
+
+
+def test_find_unmigrated_heart_rates(store):
+    from datetime import datetime
+    time = datetime(2022, 4, 13, 15)
+    store.update_patient(1, None, {"heartrate": [60], "timestamp": ["t1"]},
+                         {})
+    store.update_patient(2, None, {"heartrate": [70]}, {}, [(time, 70)])
+    store.update_patient(3, "Phil", {}, {})
+    assert store.find_unmigrated_heart_rates() == [
+        {"_id": 1, "heartrate": [60], "timestamp": ["t1"]}]
+    store.add_heart_rates(1, [(time, 60)])
+    assert store.find_unmigrated_heart_rates() == []
+
+
+def test_update_patient_concurrent(store):
+    def upload(heartrate):
+        store.update_patient(1, None, {"heartrate": [heartrate]}, {})
+    threads = [threading.Thread(target=upload, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    patient = store.get_patient(1)
+    assert patient["revision"] == 20
+    assert sorted(patient["heartrate"]) == list(range(20))
+
+
+def test_sqlite_store_persists(tmp_path):
+    from record_store import SQLitePatientStore
+    path = str(tmp_path / "patients.sqlite")
+    SQLitePatientStore(path).update_patient(1, "Phil", {"heartrate": [72]},
+                                            {})
+    assert SQLitePatientStore(path).get_patient(1, ["heartrate"]) == \
+        {"heartrate": [72]}
+
+
+def test_mongo_store_sets_document_class():
+    from record_store import MongoPatientStore
+    collection = mongomock.MongoClient().db.patient
+    MongoPatientStore(collection, "Patient").update_patient(1, None, {}, {})
+    assert collection.find_one({"_id": 1})["_cls"] == "Patient"
+
+
+@pytest.mark.parametrize("fields, last, expected", [
+    [None, None, {"changes": 0}],
+    [["patient_name", "heartrate"], None,
+     {"patient_name": 1, "heartrate": 1}],
+    [["_id", "heartrate"], 1, {"_id": 1, "heartrate": {"$slice": -1}}],
+    [None, 2, {"_id": 1, "patient_name": 1,
+               "medical_images": {"$slice": -2},
+               "ecg_images": {"$slice": -2},
+               "heartrate": {"$slice": -2},
+               "timestamp": {"$slice": -2},
+               "ecg_metrics": {"$slice": -2},
+               "revision": 1}]
+])
+def test_make_projection(fields, last, expected):
+    from record_store import make_projection
+    assert make_projection(fields, last) == expected
+
+
+@pytest.mark.parametrize("name, entries, expected", [
+    [None, {}, {"$inc": {"revision": 1}, "$push": {"changes": {}}}],
+    ["Phil", {"heartrate": [98, 99]},
+     {"$set": {"patient_name": "Phil"}, "$inc": {"revision": 1},
+      "$push": {"changes": {}, "heartrate": {"$each": [98, 99]}}}]
+])
+def test_make_update(name, entries, expected):
+    from record_store import make_update
+    assert make_update(name, entries, {}) == expected
@@ -0,0 +1,86 @@
+import io
+import os
+import threading
+import time
+import pytest
+
+
+@pytest.mark.parametrize("upload_id, expected", [
+    ["0123456789abcdef0123456789abcdef", True],
+    ["../../etc/passwd", False],
+    ["", False]
+])
+def test_is_valid_upload_id(upload_id, expected):
+    from upload_sessions import is_valid_upload_id
+    assert is_valid_upload_id(upload_id) == expected
+
+
+def test_upload_sessions_append(tmp_path):
+    from upload_sessions import UploadSessions
+    sessions = UploadSessions(str(tmp_path))
+    upload_id = sessions.create()
+    first = sessions.append(upload_id, 0, io.BytesIO(b"image "))
+    repeated = sessions.append(upload_id, 0, io.BytesIO(b"image "))
+    second = sessions.append(upload_id, 6, io.BytesIO(b"bytes"),
+                             chunk_size=2)
+    assert (first, repeated, second) == (6, 6, 11)
+    assert sessions.offset(upload_id) == 11
+
+
+class SlowStream(io.BytesIO):
+
+    def read(self, size=-1):
+        time.sleep(0.05)
+        return super().read(size)
+
+
+def test_upload_sessions_concurrent_append(tmp_path):
+    from upload_sessions import UploadSessions
+    sessions = UploadSessions(str(tmp_path))
+    upload_id = sessions.create()
+    answers = []
+
+    def append():
+        answers.append(sessions.append(upload_id, 0, SlowStream(b"image "),
+                                       chunk_size=2))
+    threads = [threading.Thread(target=append) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert answers == [6, 6, 6, 6]
+    with open(os.path.join(str(tmp_path), upload_id), "rb") as in_file:
+        assert in_file.read() == b"image "
+
+
+def test_upload_sessions_missing(tmp_path):
+    from upload_sessions import UploadSessions
+    sessions = UploadSessions(str(tmp_path))
+    upload_id = "0123456789abcdef0123456789abcdef"
+    assert sessions.offset(upload_id) is None
+    assert sessions.append(upload_id, 0, io.BytesIO(b"image")) is None
+    assert sessions.finish(upload_id, None) == (None, None)
+
+
+def test_upload_sessions_finish(tmp_path):
+    from blob_store import FileBlobStore, hash_bytes
+    from upload_sessions import UploadSessions
+    store = FileBlobStore(str(tmp_path / "store"))
+    sessions = UploadSessions(str(tmp_path / "sessions"))
+    upload_id = sessions.create()
+    sessions.append(upload_id, 0, io.BytesIO(b"image bytes"))
+    answer = sessions.finish(upload_id, store)
+    assert answer == (hash_bytes(b"image bytes"), 11)
+    assert store.size(hash_bytes(b"image bytes")) == 11
+    assert sessions.offset(upload_id) is None
+
+
+def test_upload_sessions_remove_stale(tmp_path):
+    from upload_sessions import UploadSessions
+    sessions = UploadSessions(str(tmp_path))
+    stale = sessions.create()
+    current = sessions.create()
+    os.utime(os.path.join(str(tmp_path), stale), (0, 0))
+    sessions.remove_stale(60)
+    assert sessions.offset(stale) is None
+    assert sessions.offset(current) == 0
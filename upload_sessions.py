@@ -0,0 +1,155 @@
+""" Resumable uploads of large images in chunks
+
+A client that cannot send a large image in one request opens an upload
+session and sends the image as a series of chunks, each one starting at
+the offset the server has acknowledged so far. If the connection drops,
+the client asks for the current offset and continues from there instead
+of starting over. Each session is a partial file in a local directory;
+once complete, it is moved to the image store.
+"""
+import os
+import re
+import threading
+import time
+import uuid
+
+from blob_store import CHUNK_SIZE
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def is_valid_upload_id(upload_id):
+    """ Checks that a string looks like an id returned by create
+
+    Args:
+        upload_id (str): the id to check
+
+    Returns:
+        bool: True if the id is 32 lowercase hex characters
+    """
+    return UPLOAD_ID_PATTERN.match(upload_id) is not None
+
+
+class UploadSessions:
+    """ Keeps the partial files of the open upload sessions
+
+    Every session has a lock, held while a chunk is checked and written
+    and while the session is finished, so that requests for the same
+    session from several server threads run one after the other.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _path(self, upload_id):
+        return os.path.join(self.directory, upload_id)
+
+    def _lock(self, upload_id):
+        with self._locks_lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _forget_lock(self, upload_id):
+        with self._locks_lock:
+            self._locks.pop(upload_id, None)
+
+    def create(self):
+        """ Opens a new upload session
+
+        Returns:
+            str: the id of the session
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        open(self._path(upload_id), "wb").close()
+        return upload_id
+
+    def offset(self, upload_id):
+        """ Reads the number of bytes received by a session
+
+        Args:
+            upload_id (str): the id of the session
+
+        Returns:
+            int or None: the offset the next chunk must start at, or None
+            if there is no such session
+        """
+        try:
+            return os.path.getsize(self._path(upload_id))
+        except FileNotFoundError:
+            return None
+
+    def append(self, upload_id, offset, stream, chunk_size=CHUNK_SIZE):
+        """ Adds a chunk to a session
+
+        The chunk is only written if it starts at the current offset of
+        the session, so a chunk sent twice after a lost acknowledgement
+        is not stored twice. The offset is checked and the chunk written
+        under the lock of the session, so of two requests sending the
+        same chunk at once, only the first one writes it. If the stream
+        ends early, the bytes received are kept and the client resumes
+        after them.
+
+        Args:
+            upload_id (str): the id of the session
+            offset (int): the position of the chunk in the image
+            stream (file object): a binary stream holding the chunk
+            chunk_size (int): the number of bytes read at a time
+
+        Returns:
+            int or None: the offset of the session after the chunk, or None
+            if there is no such session. The offset is unchanged if the
+            chunk did not start at it.
+        """
+        with self._lock(upload_id):
+            current = self.offset(upload_id)
+            if current is None or current != offset:
+                return current
+            with open(self._path(upload_id), "ab") as out_file:
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    out_file.write(chunk)
+            return self.offset(upload_id)
+
+    def finish(self, upload_id, store):
+        """ Moves the image of a complete session to an image store
+
+        Args:
+            upload_id (str): the id of the session
+            store (FileBlobStore or GridFSBlobStore): the image store
+
+        Returns:
+            str, int or None, None: the content hash and the size in bytes
+            of the image, or None, None if there is no such session
+
+        Raises:
+            ValueError: if the session received no bytes; it is kept open
+        """
+        path = self._path(upload_id)
+        with self._lock(upload_id):
+            try:
+                in_file = open(path, "rb")
+            except FileNotFoundError:
+                self._forget_lock(upload_id)
+                return None, None
+            with in_file:
+                image_hash, size = store.put_stream(in_file)
+            os.remove(path)
+        self._forget_lock(upload_id)
+        return image_hash, size
+
+    def remove_stale(self, max_age):
+        """ Removes the sessions that have not received a chunk in a while
+
+        Args:
+            max_age (float): the number of seconds after its last chunk
+                             that a session is kept
+        """
+        if not os.path.isdir(self.directory):
+            return
+        oldest = time.time() - max_age
+        for upload_id in os.listdir(self.directory):
+            path = self._path(upload_id)
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+                self._forget_lock(upload_id)